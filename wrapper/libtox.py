@@ -1,7 +1,9 @@
 # -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+import functools
 import os
 import sys
-from ctypes import CDLL
+from ctypes import (CDLL, POINTER, c_bool, c_char_p, c_int, c_size_t,
+                    c_uint8, c_uint16, c_uint32, c_uint64, c_void_p)
 
 # You need a libs directory beside this directory
 # and you need to link your libtoxcore.so and libtoxav.so
@@ -22,6 +24,246 @@ if d  and os.path.exists(d):
        print ('DBUG: Setting TOXCORE_LIBS to ' +d)
 del d
 
+# Prototypes (restype, argtypes) of every function the wrapper calls.
+# They are declared once when the library is loaded, and the bound
+# function objects are cached on the LibTox* instance, so calls no longer
+# go through __getattr__ and arguments can be passed as plain Python
+# ints and bytes instead of c_uint32(...) etc.
+# Opaque pointers (Tox *, ToxAV *, Tox_Options *, callbacks) are c_void_p;
+# byte arrays are c_char_p, which accepts bytes and create_string_buffer().
+c_err_p = POINTER(c_int)
+
+dTOXCORE_PROTOTYPES = {
+    # Startup options
+    'tox_options_default': (None, [c_void_p]),
+    'tox_options_new': (c_void_p, [c_err_p]),
+    'tox_options_free': (None, [c_void_p]),
+    'tox_options_set_log_callback': (None, [c_void_p, c_void_p]),
+    # Creation and destruction
+    'tox_new': (POINTER(c_void_p), [c_void_p, c_err_p]),
+    'tox_kill': (None, [c_void_p]),
+    'tox_get_savedata_size': (c_size_t, [c_void_p]),
+    'tox_get_savedata': (None, [c_void_p, c_char_p]),
+    # Connection lifecycle and event loop
+    'tox_bootstrap': (c_bool, [c_void_p, c_char_p, c_uint16, c_char_p, c_err_p]),
+    'tox_add_tcp_relay': (c_bool, [c_void_p, c_char_p, c_uint16, c_char_p, c_err_p]),
+    'tox_self_get_connection_status': (c_int, [c_void_p]),
+    'tox_callback_self_connection_status': (None, [c_void_p, c_void_p]),
+    'tox_iteration_interval': (c_uint32, [c_void_p]),
+    'tox_iterate': (None, [c_void_p, c_void_p]),
+    # Internal client information (Tox address/id)
+    'tox_self_get_address': (None, [c_void_p, c_char_p]),
+    'tox_self_set_nospam': (None, [c_void_p, c_uint32]),
+    'tox_self_get_nospam': (c_uint32, [c_void_p]),
+    'tox_self_get_public_key': (None, [c_void_p, c_char_p]),
+    'tox_self_get_secret_key': (None, [c_void_p, c_char_p]),
+    # User-visible client information (nickname/status)
+    'tox_self_set_name': (c_bool, [c_void_p, c_char_p, c_size_t, c_err_p]),
+    'tox_self_get_name_size': (c_size_t, [c_void_p]),
+    'tox_self_get_name': (None, [c_void_p, c_char_p]),
+    'tox_self_set_status_message': (c_bool, [c_void_p, c_char_p, c_size_t, c_err_p]),
+    'tox_self_get_status_message_size': (c_size_t, [c_void_p]),
+    'tox_self_get_status_message': (None, [c_void_p, c_char_p]),
+    'tox_self_set_status': (None, [c_void_p, c_int]),
+    'tox_self_get_status': (c_int, [c_void_p]),
+    # Friend list management
+    'tox_friend_add': (c_uint32, [c_void_p, c_char_p, c_char_p, c_size_t, c_err_p]),
+    'tox_friend_add_norequest': (c_uint32, [c_void_p, c_char_p, c_err_p]),
+    'tox_friend_delete': (c_bool, [c_void_p, c_uint32, c_err_p]),
+    # Friend list queries
+    'tox_friend_by_public_key': (c_uint32, [c_void_p, c_char_p, c_err_p]),
+    'tox_friend_exists': (c_bool, [c_void_p, c_uint32]),
+    'tox_self_get_friend_list_size': (c_size_t, [c_void_p]),
+    'tox_self_get_friend_list': (None, [c_void_p, POINTER(c_uint32)]),
+    'tox_friend_get_public_key': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    'tox_friend_get_last_online': (c_uint64, [c_void_p, c_uint32, c_err_p]),
+    # Friend-specific state queries
+    'tox_friend_get_name_size': (c_size_t, [c_void_p, c_uint32, c_err_p]),
+    'tox_friend_get_name': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    'tox_callback_friend_name': (None, [c_void_p, c_void_p]),
+    'tox_friend_get_status_message_size': (c_size_t, [c_void_p, c_uint32, c_err_p]),
+    'tox_friend_get_status_message': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    'tox_callback_friend_status_message': (None, [c_void_p, c_void_p]),
+    'tox_friend_get_status': (c_int, [c_void_p, c_uint32, c_err_p]),
+    'tox_callback_friend_status': (None, [c_void_p, c_void_p]),
+    'tox_friend_get_connection_status': (c_int, [c_void_p, c_uint32, c_err_p]),
+    'tox_callback_friend_connection_status': (None, [c_void_p, c_void_p]),
+    'tox_friend_get_typing': (c_bool, [c_void_p, c_uint32, c_err_p]),
+    'tox_callback_friend_typing': (None, [c_void_p, c_void_p]),
+    # Sending private messages
+    'tox_self_set_typing': (c_bool, [c_void_p, c_uint32, c_bool, c_err_p]),
+    'tox_friend_send_message': (c_uint32, [c_void_p, c_uint32, c_int, c_char_p, c_size_t, c_err_p]),
+    'tox_callback_friend_read_receipt': (None, [c_void_p, c_void_p]),
+    # Receiving private messages and friend requests
+    'tox_callback_friend_request': (None, [c_void_p, c_void_p]),
+    'tox_callback_friend_message': (None, [c_void_p, c_void_p]),
+    # File transmission
+    'tox_hash': (c_bool, [c_char_p, c_char_p, c_size_t]),
+    'tox_file_control': (c_bool, [c_void_p, c_uint32, c_uint32, c_int, c_err_p]),
+    'tox_callback_file_recv_control': (None, [c_void_p, c_void_p]),
+    'tox_file_seek': (c_bool, [c_void_p, c_uint32, c_uint32, c_uint64, c_err_p]),
+    'tox_file_get_file_id': (c_bool, [c_void_p, c_uint32, c_uint32, c_char_p, c_err_p]),
+    'tox_file_send': (c_uint32, [c_void_p, c_uint32, c_uint32, c_uint64, c_char_p,
+                                 c_char_p, c_size_t, c_err_p]),
+    'tox_file_send_chunk': (c_bool, [c_void_p, c_uint32, c_uint32, c_uint64, c_char_p,
+                                     c_size_t, c_err_p]),
+    'tox_callback_file_chunk_request': (None, [c_void_p, c_void_p]),
+    'tox_callback_file_recv': (None, [c_void_p, c_void_p]),
+    'tox_callback_file_recv_chunk': (None, [c_void_p, c_void_p]),
+    # Low-level custom packet sending and receiving
+    'tox_friend_send_lossy_packet': (c_bool, [c_void_p, c_uint32, c_char_p, c_size_t, c_err_p]),
+    'tox_friend_send_lossless_packet': (c_bool, [c_void_p, c_uint32, c_char_p, c_size_t, c_err_p]),
+    'tox_callback_friend_lossy_packet': (None, [c_void_p, c_void_p]),
+    'tox_callback_friend_lossless_packet': (None, [c_void_p, c_void_p]),
+    # Low-level network information
+    'tox_self_get_dht_id': (None, [c_void_p, c_char_p]),
+    'tox_self_get_udp_port': (c_uint16, [c_void_p, c_err_p]),
+    'tox_self_get_tcp_port': (c_uint16, [c_void_p, c_err_p]),
+    # Group chat instance management
+    'tox_group_new': (c_uint32, [c_void_p, c_int, c_char_p, c_size_t, c_char_p, c_size_t, c_err_p]),
+    'tox_group_join': (c_uint32, [c_void_p, c_char_p, c_char_p, c_size_t, c_char_p, c_size_t,
+                                  c_err_p]),
+    'tox_group_is_connected': (c_bool, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_disconnect': (c_bool, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_reconnect': (c_bool, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_leave': (c_bool, [c_void_p, c_uint32, c_char_p, c_size_t, c_err_p]),
+    # Group user-visible client information
+    'tox_group_self_set_name': (c_bool, [c_void_p, c_uint32, c_char_p, c_size_t, c_err_p]),
+    'tox_group_self_get_name_size': (c_size_t, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_self_get_name': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    'tox_group_self_set_status': (c_bool, [c_void_p, c_uint32, c_int, c_err_p]),
+    'tox_group_self_get_status': (c_int, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_self_get_role': (c_int, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_self_get_peer_id': (c_uint32, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_self_get_public_key': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    # Peer-specific group state queries
+    'tox_group_peer_get_name_size': (c_size_t, [c_void_p, c_uint32, c_uint32, c_err_p]),
+    'tox_group_peer_get_name': (c_bool, [c_void_p, c_uint32, c_uint32, c_char_p, c_err_p]),
+    'tox_group_peer_get_status': (c_int, [c_void_p, c_uint32, c_uint32, c_err_p]),
+    'tox_group_peer_get_role': (c_int, [c_void_p, c_uint32, c_uint32, c_err_p]),
+    'tox_group_peer_get_public_key': (c_bool, [c_void_p, c_uint32, c_uint32, c_char_p, c_err_p]),
+    'tox_callback_group_peer_name': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_peer_status': (None, [c_void_p, c_void_p]),
+    # Group chat state queries and events
+    'tox_group_set_topic': (c_bool, [c_void_p, c_uint32, c_char_p, c_size_t, c_err_p]),
+    'tox_group_get_topic_size': (c_size_t, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_get_topic': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    'tox_group_get_name_size': (c_size_t, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_get_name': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    'tox_group_get_chat_id': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    'tox_group_get_number_groups': (c_uint32, [c_void_p]),
+    'tox_group_get_privacy_state': (c_int, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_get_peer_limit': (c_uint16, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_get_password_size': (c_size_t, [c_void_p, c_uint32, c_err_p]),
+    'tox_group_get_password': (c_bool, [c_void_p, c_uint32, c_char_p, c_err_p]),
+    'tox_callback_group_topic': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_privacy_state': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_peer_limit': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_password': (None, [c_void_p, c_void_p]),
+    # Group message sending
+    'tox_group_send_custom_packet': (c_bool, [c_void_p, c_uint32, c_bool, c_char_p, c_size_t,
+                                              c_err_p]),
+    'tox_group_send_private_message': (c_bool, [c_void_p, c_uint32, c_uint32, c_int, c_char_p,
+                                                c_size_t, c_err_p]),
+    'tox_group_send_message': (c_bool, [c_void_p, c_uint32, c_int, c_char_p, c_size_t,
+                                        POINTER(c_uint32), c_err_p]),
+    # Group message receiving
+    'tox_callback_group_message': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_private_message': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_custom_packet': (None, [c_void_p, c_void_p]),
+    # Group chat inviting and join/part events
+    'tox_group_invite_friend': (c_bool, [c_void_p, c_uint32, c_uint32, c_err_p]),
+    'tox_group_invite_accept': (c_uint32, [c_void_p, c_uint32, c_char_p, c_size_t,
+                                           c_char_p, c_size_t, c_char_p, c_size_t, c_err_p]),
+    'tox_callback_group_invite': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_peer_join': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_peer_exit': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_self_join': (None, [c_void_p, c_void_p]),
+    'tox_callback_group_join_fail': (None, [c_void_p, c_void_p]),
+    # Group chat founder controls
+    'tox_group_founder_set_password': (c_bool, [c_void_p, c_uint32, c_char_p, c_size_t, c_err_p]),
+    'tox_group_founder_set_privacy_state': (c_bool, [c_void_p, c_uint32, c_int, c_err_p]),
+    'tox_group_founder_set_peer_limit': (c_bool, [c_void_p, c_uint32, c_uint16, c_err_p]),
+    # Group chat moderation
+    'tox_group_mod_set_role': (c_bool, [c_void_p, c_uint32, c_uint32, c_int, c_err_p]),
+    'tox_callback_group_moderation': (None, [c_void_p, c_void_p]),
+    'tox_group_set_ignore': (c_bool, [c_void_p, c_uint32, c_uint32, c_bool, c_err_p]),
+}
+
+dTOXAV_PROTOTYPES = {
+    'toxav_new': (POINTER(c_void_p), [c_void_p, c_err_p]),
+    'toxav_kill': (None, [c_void_p]),
+    'toxav_get_tox': (POINTER(c_void_p), [c_void_p]),
+    'toxav_iteration_interval': (c_uint32, [c_void_p]),
+    'toxav_iterate': (None, [c_void_p]),
+    'toxav_call': (c_bool, [c_void_p, c_uint32, c_uint32, c_uint32, c_err_p]),
+    'toxav_callback_call': (None, [c_void_p, c_void_p, c_void_p]),
+    'toxav_answer': (c_bool, [c_void_p, c_uint32, c_uint32, c_uint32, c_err_p]),
+    'toxav_callback_call_state': (None, [c_void_p, c_void_p, c_void_p]),
+    'toxav_call_control': (c_bool, [c_void_p, c_uint32, c_int, c_err_p]),
+    'toxav_audio_send_frame': (c_bool, [c_void_p, c_uint32, c_void_p, c_size_t, c_uint8,
+                                        c_uint32, c_err_p]),
+    'toxav_video_send_frame': (c_bool, [c_void_p, c_uint32, c_uint16, c_uint16,
+                                        c_char_p, c_char_p, c_char_p, c_err_p]),
+    'toxav_callback_audio_receive_frame': (None, [c_void_p, c_void_p, c_void_p]),
+    'toxav_callback_video_receive_frame': (None, [c_void_p, c_void_p, c_void_p]),
+}
+
+dTOXENCRYPTSAVE_PROTOTYPES = {
+    'tox_is_data_encrypted': (c_bool, [c_char_p]),
+    'tox_pass_encrypt': (c_bool, [c_char_p, c_size_t, c_char_p, c_size_t, c_char_p, c_err_p]),
+    'tox_pass_decrypt': (c_bool, [c_char_p, c_size_t, c_char_p, c_size_t, c_char_p, c_err_p]),
+}
+
+def vBindPrototypes(oWrapper, oLib, dPrototypes) -> None:
+    """Declare the prototypes on the functions of oLib and cache them
+    as attributes of oWrapper. Symbols missing from an older library are
+    skipped, so using them still raises AttributeError through __getattr__.
+    """
+    for sName, (restype, argtypes) in dPrototypes.items():
+        try:
+            f = getattr(oLib, sName)
+        except AttributeError:
+            continue
+        f.restype = restype
+        f.argtypes = argtypes
+        setattr(oWrapper, sName, f)
+
+def guarded(method):
+    """Run a method of Tox or ToxAV under the ._lock of the instance, when
+    it has one, which it does in the thread safe mode (see Tox.__init__).
+    Used on the callback_* methods, so that registering a CFUNCTYPE with
+    the library and keeping the reference to it that stops it being freed
+    are one step for other threads. When the instance has a dispatcher,
+    the event is then handed back to it when it has handlers or is deferred
+    or coalesced, see ToxDispatcher.vHandBack, so the callback and the
+    handlers of the event are all called whatever order they were set in,
+    and otherwise the callback stays registered directly; in the events mode the callback is only kept for
+    the events loop, see ToxDispatcher.vStoreCallback."""
+    sEvent = method.__name__[len('callback_'):]
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        oDispatcher = getattr(self, '_dispatcher', None)
+        if oDispatcher is not None and oDispatcher.events_mode:
+            callback = args[0] if args else kwargs.get('callback')
+            oLock = self._lock
+            if oLock is None:
+                oDispatcher.vStoreCallback(sEvent, callback)
+            else:
+                with oLock:
+                    oDispatcher.vStoreCallback(sEvent, callback)
+            return None
+        oLock = self._lock
+        if oLock is None:
+            result = method(self, *args, **kwargs)
+        else:
+            with oLock:
+                result = method(self, *args, **kwargs)
+        if oDispatcher is not None:
+            oDispatcher.vHandBack(sEvent)
+        return result
+    return wrapper
+
 class LibToxCore:
 
     def __init__(self):
@@ -40,6 +282,7 @@ class LibToxCore:
             self._libtoxcore = CDLL(libFile)
         else:
             self._libtoxcore = CDLL(libtoxcore)
+        vBindPrototypes(self, self._libtoxcore, dTOXCORE_PROTOTYPES)
 
     def __getattr__(self, item):
         return self._libtoxcore.__getattr__(item)
@@ -59,6 +302,7 @@ class LibToxAV:
                 self._libtoxav = CDLL(libFile)
             else:
                 self._libtoxav = CDLL('libtoxav.so')
+        vBindPrototypes(self, self._libtoxav, dTOXAV_PROTOTYPES)
 
     def __getattr__(self, item):
         return self._libtoxav.__getattr__(item)
@@ -80,6 +324,7 @@ class LibToxEncryptSave:
                 self._lib_tox_encrypt_save = CDLL(libFile)
             else:
                 self._lib_tox_encrypt_save = CDLL('libtoxencryptsave.so')
+        vBindPrototypes(self, self._lib_tox_encrypt_save, dTOXENCRYPTSAVE_PROTOTYPES)
 
     def __getattr__(self, item):
         return self._lib_tox_encrypt_save.__getattr__(item)
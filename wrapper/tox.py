@@ -1,56 +1,53 @@
 # -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+import mmap
+import os
+import threading
 from ctypes import *
-from datetime import datetime
 from typing import Union, Callable, Union
 
 try:
-    from wrapper.libtox import LibToxCore
+    from wrapper.libtox import LibToxCore, guarded
     from wrapper.toxav import ToxAV
     from wrapper.toxcore_enums_and_consts import *
     import wrapper.toxcore_enums_and_consts as enums
+    from wrapper.toxcore_errors import *
+    from wrapper import toxlog
+    from wrapper.toxcommands import ToxCommandQueue
+    from wrapper.toxdispatch import ToxDispatcher
+    from wrapper.toxevents import ToxEvents
+    from wrapper.toxfriends import FriendTable, FriendsSnapshot, oSnapshotLib, oSnapshotTable
+    from wrapper.toxlatency import LatencyTracker
+    from wrapper.toxmessages import bEncode, lFragments
+    from wrapper.toxoutbox import ToxOutbox
+    from wrapper.toxratelimit import bTooSoon
+    from wrapper.toxsaver import ProfileSaver
+    from wrapper.toxstore import MessageStore, dKINDS
 except:
-    from libtox import LibToxCore
+    from libtox import LibToxCore, guarded
     from toxav import ToxAV
     from toxcore_enums_and_consts import *
     import toxcore_enums_and_consts as enums
+    from toxcore_errors import *
+    import toxlog
+    from toxcommands import ToxCommandQueue
+    from toxdispatch import ToxDispatcher
+    from toxevents import ToxEvents
+    from toxfriends import FriendTable, FriendsSnapshot, oSnapshotLib, oSnapshotTable
+    from toxlatency import LatencyTracker
+    from toxmessages import bEncode, lFragments
+    from toxoutbox import ToxOutbox
+    from toxratelimit import bTooSoon
+    from toxsaver import ProfileSaver
+    from toxstore import MessageStore, dKINDS
 
 # callbacks can be called in any thread so were being careful
 # tox.py can be called by callbacks
-def LOG_ERROR(a) -> None:
-    print('EROR> '+a)
-def LOG_WARN(a) -> None:
-    print('WARN> '+a)
-def LOG_INFO(a) -> None:
-    bVERBOSE = hasattr(__builtins__, 'app') and app.oArgs.loglevel <= 20
-    if bVERBOSE: print('INFO> '+a)
-def LOG_DEBUG(a) -> None:
-    bVERBOSE = hasattr(__builtins__, 'app') and app.oArgs.loglevel <= 10
-    if bVERBOSE: print('DBUG> '+a)
-def LOG_TRACE(a) -> None:
-    bVERBOSE = hasattr(__builtins__, 'app') and app.oArgs.loglevel < 10
-    if bVERBOSE: print('TRAC> '+a)
+# binds LOG_ERROR LOG_WARN LOG_INFO LOG_DEBUG LOG_TRACE - see toxlog.py
+toxlog.vRegister(globals())
 
 UINT32_MAX = 2 ** 32 -1
-class ToxError(RuntimeError): pass
 TOX_MAX_STATUS_MESSAGE_LENGTH = 1007
 
-global aTIMES
-aTIMES=dict()
-def bTooSoon(key, sSlot, fSec=10.0) -> bool:
-    # rate limiting
-    global aTIMES
-    if sSlot not in aTIMES:
-        aTIMES[sSlot] = dict()
-    OTIME = aTIMES[sSlot]
-    now = datetime.now()
-    if key not in OTIME:
-        OTIME[key] = now
-        return False
-    delta = now - OTIME[key]
-    OTIME[key] = now
-    if delta.total_seconds() < fSec: return True
-    return False
-
 
 class ToxOptions(Structure):
     _fields_ = [
@@ -83,26 +80,67 @@ class GroupChatSelfPeerInfo(Structure):
     ]
 
 
+class ReadBuffers(threading.local):
+    """Per thread buffers for reading names, status messages and topics in
+    one call, without asking for the size first. Each is one byte longer
+    than the protocol maximum, so what is read is always NUL terminated,
+    and sReadBuffer() zeroes the buffer, so the next read starts clean.
+    """
+    def __init__(self):
+        self.name = create_string_buffer(TOX_MAX_NAME_LENGTH + 1)
+        self.status_message = create_string_buffer(TOX_MAX_STATUS_MESSAGE_LENGTH + 1)
+        self.topic = create_string_buffer(TOX_GROUP_MAX_TOPIC_LENGTH + 1)
+        self.group_name = create_string_buffer(TOX_GROUP_MAX_GROUP_NAME_LENGTH + 1)
+
+oBUFFERS = ReadBuffers()
+
+def sReadBuffer(buffer) -> str:
+    value = buffer.value
+    # all of it: a value with a NUL in it would leave the bytes after it
+    memset(buffer, 0, sizeof(buffer))
+    return str(value, 'utf-8', errors='ignore')
+
+
+class FriendInfo:
+    """What friend_get_info returns."""
+    __slots__ = ('friend_number', 'name', 'status_message', 'status',
+                 'connection_status', 'last_online')
+
+    def __init__(self, friend_number, name, status_message, status,
+                 connection_status, last_online):
+        self.friend_number = friend_number
+        self.name = name
+        self.status_message = status_message
+        self.status = status
+        self.connection_status = connection_status
+        self.last_online = last_online
+
+    def __repr__(self) -> str:
+        return f"FriendInfo({self.friend_number}, {self.name!r}, {self.status_message!r}, " \
+            f"{self.status}, {self.connection_status}, {self.last_online})"
+
+
 def string_to_bin_charp(tox_id):
     return c_char_p(bytes.fromhex(tox_id)) if tox_id is not None else None
 
 
+def bin_to_bytes(raw_id, length) -> bytes:
+    """The first length bytes of raw_id, which can be a ctypes char array
+    from create_string_buffer, bytes, or a str of chr()s of the bytes."""
+    if isinstance(raw_id, str):
+        return raw_id[:length].encode('latin-1')
+    return bytes(getattr(raw_id, 'raw', raw_id)[:length])
+
 def bin_to_string(raw_id, length) -> str:
-    res = ''.join('{:02x}'.format(ord(raw_id[i])) for i in range(length))
-    return res.upper()
+    return bin_to_bytes(raw_id, length).hex().upper()
 
 def sGetError(value, a) -> str:
-    # dict(enumerate(a))[value]
-    for k,v in a.items():
-        if v == value:
-            s = k
-            return s
-    return ''
+    return sErrorName(value, a)
 
 class Tox:
     libtoxcore = LibToxCore()
 
-    def __init__(self, tox_options=None, tox_pointer=None, app=None):
+    def __init__(self, tox_options=None, tox_pointer=None, app=None, thread_safe=None):
         """Creates and initialises a new Tox instance with the options passed.
 
         This function will bring the instance into a valid state.
@@ -110,43 +148,20 @@ class Tox:
 
         :param tox_options: An options object. If this parameter is None, the default options are used.
         :param tox_pointer: Tox instance pointer. If this parameter is not None, tox_options will be ignored.
+        :param thread_safe: Use the thread safe mode, see is_thread_safe. If this parameter is None, it is
+        the experimental_thread_safety of tox_options.
 
         """
         self._app = app # QtWidgets.QApplication.instance()
+        if thread_safe is None:
+            thread_safe = bool(tox_options and tox_options.contents.experimental_thread_safety)
+        self._lock = threading.RLock() if thread_safe else None
         if tox_pointer is not None:
             self._tox_pointer = tox_pointer
         else:
-            tox_err_new = c_int()
-            f = Tox.libtoxcore.tox_new
-            f.restype = POINTER(c_void_p)
-            self._tox_pointer = f(tox_options, byref(tox_err_new))
-            tox_err_new = tox_err_new.value
-            if tox_err_new == TOX_ERR_NEW['NULL']:
-                raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-            if tox_err_new == TOX_ERR_NEW['MALLOC']:
-                raise MemoryError('The function was unable to allocate enough '
-                                  'memory to store the internal structures for the Tox object.')
-            if tox_err_new == TOX_ERR_NEW['PORT_ALLOC']:
-                raise ToxError('The function was unable to bind to a port. This may mean that all ports have '
-                                   'already been bound, e.g. by other Tox instances, or it may mean a permission error.'
-                                   ' You may be able to gather more information from errno.')
-            if tox_err_new == TOX_ERR_NEW['TCP_SERVER_ALLOC']:
-                raise ToxError('The function was unable to bind the tcp server port.')
-            if tox_err_new == TOX_ERR_NEW['PROXY_BAD_TYPE']:
-                raise ArgumentError('proxy_type was invalid.')
-            if tox_err_new == TOX_ERR_NEW['PROXY_BAD_HOST']:
-                raise ArgumentError('proxy_type was valid but the proxy_host passed had an invalid format or was NULL.')
-            if tox_err_new == TOX_ERR_NEW['PROXY_BAD_PORT']:
-                raise ArgumentError('proxy_type was valid, but the proxy_port was invalid.')
-            if tox_err_new == TOX_ERR_NEW['PROXY_NOT_FOUND']:
-                raise ArgumentError('The proxy address passed could not be resolved.')
-            if tox_err_new == TOX_ERR_NEW['LOAD_ENCRYPTED']:
-                raise ArgumentError('The byte array to be loaded contained an encrypted save.')
-            if tox_err_new == TOX_ERR_NEW['LOAD_BAD_FORMAT']:
-                raise ArgumentError('The data format was invalid. This can happen when loading data that was saved by'
-                                    ' an older version of Tox, or when the data has been corrupted. When loading from'
-                                    ' badly formatted data, some data may have been loaded, and the rest is discarded.'
-                                    ' Passing an invalid length parameter also causes this error.')
+            perror = oERROR.pointer
+            self._tox_pointer = Tox.libtoxcore.tox_new(tox_options, perror)
+            vCheckError(perror[0], dNEW_ERRORS)
 
             self.self_connection_status_cb = None
             self.self_logger_cb = None
@@ -179,9 +194,172 @@ class Tox:
             self.group_peer_name_cb = None
             self.group_peer_exit_cb = None
             self.group_peer_join_cb = None
-            self.AV = ToxAV(self._tox_pointer)
+            self.AV = ToxAV(self._tox_pointer, lock=self._lock)
+        self._dispatcher = ToxDispatcher(Tox.libtoxcore, self._tox_pointer, self)
+        self._events = None
+        self._commands = None
+        self._friends = None
+        self._saver = None
+        self._outbox = None
+        self._latency = None
+        self._store = None
+
+    def get_dispatcher(self) -> ToxDispatcher:
+        """
+        The multi-subscriber callback dispatcher of this instance, to add
+        and remove any number of handlers per event, see toxdispatch.py:
+
+            tox.get_dispatcher().subscribe('friend_message', handler)
+        """
+        return self._dispatcher
+
+    def get_command_queue(self, max_batch: int=1024, wake=None) -> ToxCommandQueue:
+        """
+        The queue of calls that any thread can submit, to be run on the thread that iterates this instance,
+        at the start of each iterate or events_iterate, see toxcommands.py:
+
+            message_id = tox.get_command_queue().friend_send_message(0, TOX_MESSAGE_TYPE['NORMAL'], 'hi').result()
+
+        It is made on the first call, with max_batch and wake; call it before the iterate thread starts.
+        """
+        if self._commands is None:
+            self._commands = ToxCommandQueue(self, max_batch, wake)
+        return self._commands
+
+    def get_friend_table(self) -> FriendTable:
+        """
+        The friends of this instance kept in Python, filled from self_get_friend_list on the first call and then
+        kept current by the friend callbacks and by friend_add, friend_add_norequest and friend_delete, see
+        toxfriends.py. Reading it does not call libtoxcore:
+
+            friend_number = tox.get_friend_table().by_public_key(public_key)
+        """
+        if self._friends is None:
+            self._friends = FriendTable(self)
+        return self._friends
+
+    def get_profile_saver(self, filename: str=None, debounce: float=2.0, max_delay: float=30.0,
+                          password=None, fsync: bool=True) -> ProfileSaver:
+        """
+        The saver of the profile of this instance to filename when it changes, see toxsaver.py: the save is
+        debounced, written atomically off the iterate thread, optionally encrypted with password, and flushed
+        by kill. It is made on the first call, which needs filename; iterate copies the savedata for it.
+
+            tox.get_profile_saver('profile.tox', debounce=2.0)
+        """
+        if self._saver is None:
+            if filename is None:
+                raise ArgumentError('get_profile_saver needs the filename of the profile')
+            self._saver = ProfileSaver(self, filename, debounce, max_delay, password, fsync)
+        return self._saver
+
+    def get_outbox(self, max_messages: int=256, max_bytes: int=4 << 20, policy: str='drop_oldest',
+                   resend: bool=True, on_receipt: Callable=None, on_drop: Callable=None,
+                   wake: Callable=None) -> ToxOutbox:
+        """
+        The outbox of the messages to friends of this instance, see toxoutbox.py: a bounded queue per friend,
+        held while the friend is offline, sent when it connects, tried again after the next iterate on SENDQ,
+        and kept until the read receipt of each message. It is made on the first call, with the limits and
+        policy; call it before the iterate thread starts.
+
+            tox.get_outbox().send(friend_number, TOX_MESSAGE_TYPE['NORMAL'], 'hi')
+        """
+        if self._outbox is None:
+            self._outbox = ToxOutbox(self, max_messages, max_bytes, policy, resend,
+                                     on_receipt, on_drop, wake)
+        return self._outbox
+
+    def get_latency_tracker(self, capacity: int=4096, max_age: float=300.0) -> LatencyTracker:
+        """
+        The tracker of the delivery latency of the messages to friends, from friend_send_message,
+        friend_send_long_message or the outbox to the friend_read_receipt of their message ID, with a histogram
+        per friend and a global one, see toxlatency.py. It is made on the first call, keeping at most capacity
+        messages waiting for their receipt, for up to max_age seconds each:
+
+            tox.get_latency_tracker().histogram().percentile(0.99)
+        """
+        if self._latency is None:
+            self._latency = LatencyTracker(self, capacity, max_age)
+        return self._latency
+
+    def get_message_store(self, directory: str=None, segment_bytes: int=16 << 20,
+                          rotate_interval: float=3600.0, flush_interval: float=0.2,
+                          retention: float=None, fsync: bool=True) -> MessageStore:
+        """
+        The store of the messages this instance receives, from the friend_message, group_message and
+        group_private_message events, and sends, with the friend and group send methods, in append only
+        segments of directory with an mmap index by public key or chat ID and time, see toxstore.py. A
+        writer thread writes them in batches, seals and compacts the segments, so iterate only queues them.
+        It is made on the first call, which needs directory, and is closed by kill:
+
+            tox.get_message_store('history').history(public_key, since=time.time_ns() - 3600 * 10 ** 9)
+        """
+        if self._store is None:
+            if directory is None:
+                raise ArgumentError('get_message_store needs the directory of the store')
+            self._store = MessageStore(directory, segment_bytes, rotate_interval, flush_interval,
+                                       retention=retention, fsync=fsync)
+            self._store.subscribe(self)
+        return self._store
+
+    def _vChanged(self) -> None:
+        # the savedata has changed
+        if self._saver is not None:
+            self._saver.mark_dirty()
+
+    def is_thread_safe(self) -> bool:
+        """
+        In the thread safe mode, iterate() can run on one thread while other threads call the send, file and
+        group functions. It is on when the instance is made with experimental_thread_safety set in its options:
+
+            tox_options = Tox.options_new()
+            tox_options.contents.experimental_thread_safety = True
+            tox = Tox(tox_options)
+
+        libtoxcore then serialises the calls into the instance itself, and the wrapper guards its own state:
+        the callback_* methods of Tox and ToxAV and the start of events_iterate hold the lock of the instance,
+        and the dispatcher has its own. The per call buffers and error codes are per thread in any mode.
+        The callbacks still run on the thread calling iterate, and the instance must not be killed while
+        another thread is using it.
+
+        Without the flag, the instance must only be used from one thread at a time.
+        """
+        return self._lock is not None
 
     def kill(self) -> None:
+        if getattr(self, '_commands', None) is not None:
+            # nothing queued runs against a killed instance, or is left waiting
+            iCancelled = self._commands.close()
+            if iCancelled:
+                LOG_INFO(f"tox.kill cancelled {iCancelled} queued commands")
+        for sName in ('_outbox', '_latency', '_friends'):
+            # stop following the events, what they hold stays readable
+            oPart = getattr(self, sName, None)
+            if oPart is not None:
+                try:
+                    oPart.close()
+                except Exception as e:
+                    LOG_ERROR(f"tox.kill {sName[1:]} {e!s}")
+        if getattr(self, '_store', None) is not None:
+            try:
+                self._store.close()
+            except Exception as e:
+                LOG_ERROR(f"tox.kill store {e!s}")
+            self._store = None
+        if getattr(self, '_saver', None) is not None:
+            # write what is pending while the instance still exists
+            try:
+                self._saver.close()
+            except Exception as e:
+                LOG_ERROR(f"tox.kill saver {e!s}")
+            self._saver = None
+        if getattr(self, '_dispatcher', None) is not None:
+            # drain the workers and unregister the trampolines, so no
+            # deferred handler or callback runs after tox_kill
+            try:
+                self._dispatcher.close()
+            except Exception as e:
+                LOG_ERROR(f"tox.kill dispatcher {e!s}")
         if hasattr(self, 'AV'): del self.AV
         LOG_INFO(f"tox.kill")
         try:
@@ -222,17 +400,12 @@ class Tox:
 
         :return: A pointer to new ToxOptions object with default options or raise MemoryError.
         """
-        tox_err_options_new = c_int()
-        f = Tox.libtoxcore.tox_options_new
-        f.restype = POINTER(ToxOptions)
-        result = f(byref(tox_err_options_new))
+        perror = oERROR.pointer
+        result = cast(Tox.libtoxcore.tox_options_new(perror),
+                      POINTER(ToxOptions))
         result._options_pointer = result
-        tox_err_options_new = tox_err_options_new.value
-        if tox_err_options_new == TOX_ERR_OPTIONS_NEW['OK']:
-            return result
-        if tox_err_options_new == TOX_ERR_OPTIONS_NEW['MALLOC']:
-            raise MemoryError('The function failed to allocate enough memory for the options struct.')
-        raise ToxError('The function did not return OK for the options struct.')
+        vCheckError(perror[0], dOPTIONS_NEW_ERRORS)
+        return result
 
     @staticmethod
     def options_free(tox_options) -> None:
@@ -274,6 +447,61 @@ class Tox:
         Tox.libtoxcore.tox_get_savedata(self._tox_pointer, savedata)
         return savedata[:]
 
+    def get_savedata_into(self, buffer) -> int:
+        """
+        Store all information associated with the tox instance directly into buffer, without copying.
+
+        :param buffer: a writable buffer, such as a bytearray, mmap or memoryview, of at least
+        get_savedata_size() bytes.
+        :return: the number of bytes written, from the start of buffer
+        """
+        savedata_size = self.get_savedata_size()
+        with memoryview(buffer) as view:
+            if view.readonly:
+                raise ArgumentError('buffer is not writable')
+            if view.nbytes < savedata_size:
+                raise ArgumentError(f"buffer is {view.nbytes} bytes, the savedata is {savedata_size}")
+            savedata = (c_char * savedata_size).from_buffer(view)
+            LOG_DEBUG(f"tox.get_savedata_into")
+            Tox.libtoxcore.tox_get_savedata(self._tox_pointer, savedata)
+            del savedata
+        return savedata_size
+
+    def write_savedata(self, filename: str, fsync: bool=True) -> int:
+        """
+        Write the savedata to a file atomically: the library writes it into an mmap of a temporary
+        file next to filename, which is synced and renamed over filename. The file is created mode 0600.
+
+        :param filename: path of the profile to write
+        :param fsync: fsync the file before, and the directory after, the rename
+        :return: the number of bytes written
+        """
+        tmpname = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        savedata_size = self.get_savedata_size()
+        fd = os.open(tmpname, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, savedata_size)
+            with mmap.mmap(fd, savedata_size) as oMmap:
+                self.get_savedata_into(oMmap)
+                if fsync:
+                    oMmap.flush()
+            if fsync:
+                os.fsync(fd)
+        except:
+            os.close(fd)
+            os.unlink(tmpname)
+            raise
+        os.close(fd)
+        os.replace(tmpname, filename)
+        if fsync and hasattr(os, 'O_DIRECTORY'):
+            dirfd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
+        LOG_DEBUG("tox.write_savedata %s %s", filename, savedata_size)
+        return savedata_size
+
     # Connection lifecycle and event loop
 
     def bootstrap(self, address: str, port: int, public_key: str) -> bool:
@@ -289,33 +517,27 @@ class Tox:
         :return: True on success.
 
         """
-        LOG_TRACE(f"tox_bootstrap={address}")
+        LOG_TRACE("tox_bootstrap=%s", address)
         address = bytes(address, 'utf-8')
-        tox_err_bootstrap = c_int()
+        perror = oERROR.pointer
         try:
             result = Tox.libtoxcore.tox_bootstrap(self._tox_pointer,
-                                                  c_char_p(address),
-                                                  c_uint16(port),
+                                                  address,
+                                                  port,
                                                   string_to_bin_charp(public_key),
-                                                  byref(tox_err_bootstrap))
+                                                  perror)
         except Exception as e:
             # Fatal Python error: Segmentation fault
             LOG_ERROR(f"libtoxcore.tox_bootstrap {e}")
             # dunno
             raise
 
-        tox_err_bootstrap = tox_err_bootstrap.value
-        if tox_err_bootstrap == TOX_ERR_BOOTSTRAP['OK']:
-            return bool(result)
-        if tox_err_bootstrap == TOX_ERR_BOOTSTRAP['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        if tox_err_bootstrap == TOX_ERR_BOOTSTRAP['BAD_HOST']:
-            raise ArgumentError('The address could not be resolved to an IP '
-                                'address, or the address passed was invalid.')
-        if tox_err_bootstrap == TOX_ERR_BOOTSTRAP['BAD_PORT']:
-            raise ArgumentError('The port passed was invalid. The valid port range is (1, 65535).')
-        # me - this seems wrong - should be False
-        return False
+        iErr = perror[0]
+        if iErr and iErr not in dBOOTSTRAP_ERRORS:
+            # me - this seems wrong - should be False
+            return False
+        vCheckError(iErr, dBOOTSTRAP_ERRORS)
+        return bool(result)
 
     def add_tcp_relay(self, address: str, port: int, public_key: str) -> bool:
         """Adds additional host:port pair as TCP relay.
@@ -330,25 +552,16 @@ class Tox:
         :return: True on success.
 
         """
-        LOG_TRACE(f"tox_add_tcp_relay address={address}")
+        LOG_TRACE("tox_add_tcp_relay address=%s", address)
         address = bytes(address, 'utf-8')
-        tox_err_bootstrap = c_int()
+        perror = oERROR.pointer
         result = Tox.libtoxcore.tox_add_tcp_relay(self._tox_pointer,
-                                                  c_char_p(address),
-                                                  c_uint16(port),
+                                                  address,
+                                                  port,
                                                   string_to_bin_charp(public_key),
-                                                  byref(tox_err_bootstrap))
-        tox_err_bootstrap = tox_err_bootstrap.value
-        if tox_err_bootstrap == TOX_ERR_BOOTSTRAP['OK']:
-            return bool(result)
-        if tox_err_bootstrap == TOX_ERR_BOOTSTRAP['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        if tox_err_bootstrap == TOX_ERR_BOOTSTRAP['BAD_HOST']:
-            raise ArgumentError('The address could not be resolved to an IP '
-                                'address, or the IP address passed was invalid.')
-        if tox_err_bootstrap == TOX_ERR_BOOTSTRAP['BAD_PORT']:
-            raise ArgumentError('The port passed was invalid. The valid port range is (1, 65535).')
-        raise ToxError('The function did not return OK')
+                                                  perror)
+        vCheckError(perror[0], dBOOTSTRAP_ERRORS)
+        return bool(result)
 
     def self_get_connection_status(self) -> int:
         """
@@ -362,9 +575,10 @@ class Tox:
         if iRet > 2:
             LOG_ERROR(f"self_get_connection_status {iRet} > 2")
             return 0
-        LOG_TRACE(f"self_get_connection_status {iRet}")
+        LOG_TRACE("self_get_connection_status %s", iRet)
         return int(iRet)
 
+    @guarded
     def callback_self_connection_status(self, callback: Callable) -> None:
         """Set the callback for the `self_connection_status` event.
         Pass None to unset.
@@ -407,8 +621,8 @@ class Tox:
         """
         The main loop that needs to be run in intervals of tox_iteration_interval() milliseconds.
         """
-        if user_data is not None:
-            user_data = c_char_p(user_data)
+        if self._commands is not None:
+            self._commands.drain()
         try:
             LOG_TRACE(f"tox_iterate")
             Tox.libtoxcore.tox_iterate(self._tox_pointer, user_data)
@@ -417,8 +631,43 @@ class Tox:
             LOG_ERROR(f"iterate {e!s}")
         else:
             LOG_TRACE(f"iterate")
+        if self._dispatcher.coalescing:
+            self._dispatcher.flush_due()
+        if self._outbox is not None:
+            self._outbox.poll()
+        if self._store is not None:
+            self._store.poll()
+        if self._saver is not None:
+            self._saver.poll()
         return None
 
+    def events_iterate(self, user_data=None, deliver: bool=True) -> list:
+        """
+        The events loop mode: run in place of iterate, at the same intervals. libtoxcore collects
+        the events of the iteration and they are decoded in one pass into records, see toxevents.py.
+
+        :param user_data: passed to the handlers and callbacks in place of the libtoxcore user_data
+        :param deliver: deliver the records to the dispatcher handlers and the callback_* callbacks
+        :return: the records of the events, ('friend_message', friend_number, type, message, length)
+        """
+        if self._events is None:
+            if self._lock is None:
+                self._events = ToxEvents(self)
+            else:
+                with self._lock:
+                    if self._events is None:
+                        self._events = ToxEvents(self)
+        if self._commands is not None:
+            self._commands.drain()
+        lRecords = self._events.iterate(user_data, deliver)
+        if self._outbox is not None:
+            self._outbox.poll()
+        if self._store is not None:
+            self._store.poll()
+        if self._saver is not None:
+            self._saver.poll()
+        return lRecords
+
     # Internal client information (Tox address/id)
 
     def self_get_toxid(self, address: Union[bytes, None]=None) -> str:
@@ -433,11 +682,17 @@ class Tox:
         None, this function allocates memory for address.
         :return: Tox friend address
         """
+        return self.self_get_address_bytes(address).hex().upper()
+
+    def self_get_address_bytes(self, address: Union[bytes, None]=None) -> bytes:
+        """
+        As self_get_address, but returns the raw TOX_ADDRESS_SIZE bytes.
+        """
         if address is None:
             address = create_string_buffer(TOX_ADDRESS_SIZE)
         LOG_DEBUG(f"tox.self_get_address")
         Tox.libtoxcore.tox_self_get_address(self._tox_pointer, address)
-        return bin_to_string(address, TOX_ADDRESS_SIZE)
+        return bin_to_bytes(address, TOX_ADDRESS_SIZE)
 
     def self_set_nospam(self, nospam: int) -> None:
         """
@@ -446,7 +701,8 @@ class Tox:
         :param nospam: Any 32 bit unsigned integer.
         """
         LOG_DEBUG(f"tox.self_set_nospam")
-        Tox.libtoxcore.tox_self_set_nospam(self._tox_pointer, c_uint32(nospam))
+        Tox.libtoxcore.tox_self_set_nospam(self._tox_pointer, nospam)
+        self._vChanged()
         return None
 
     def self_get_nospam(self) -> int:
@@ -465,11 +721,17 @@ class Tox:
         function allocates memory for Tox Public Key.
         :return: Tox Public Key
         """
+        return self.self_get_public_key_bytes(public_key).hex().upper()
+
+    def self_get_public_key_bytes(self, public_key: Union[bytes, None] = None) -> bytes:
+        """
+        As self_get_public_key, but returns the raw TOX_PUBLIC_KEY_SIZE bytes.
+        """
         if public_key is None:
             public_key = create_string_buffer(TOX_PUBLIC_KEY_SIZE)
         LOG_DEBUG(f"tox.self_get_public_key")
         Tox.libtoxcore.tox_self_get_public_key(self._tox_pointer, public_key)
-        return bin_to_string(public_key, TOX_PUBLIC_KEY_SIZE)
+        return bin_to_bytes(public_key, TOX_PUBLIC_KEY_SIZE)
 
     def self_get_secret_key(self, secret_key: Union[bytes, None]=None) -> str:
         """
@@ -496,22 +758,17 @@ class Tox:
         :param name: New nickname.
         :return: True on success.
         """
-        tox_err_set_info = c_int()
+        perror = oERROR.pointer
         if type(name) != bytes:
             name = bytes(name, 'utf-8')
         LOG_DEBUG(f"tox.self_set_name")
         result = Tox.libtoxcore.tox_self_set_name(self._tox_pointer,
-                                                  c_char_p(name),
-                                                  c_size_t(len(name)),
-                                                  byref(tox_err_set_info))
-        tox_err_set_info = tox_err_set_info.value
-        if tox_err_set_info == TOX_ERR_SET_INFO['OK']:
-            return bool(result)
-        elif tox_err_set_info == TOX_ERR_SET_INFO['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        elif tox_err_set_info == TOX_ERR_SET_INFO['TOO_LONG']:
-            raise ArgumentError('Information length exceeded maximum permissible size.')
-        raise ToxError('The function did not return OK')
+                                                  name,
+                                                  len(name),
+                                                  perror)
+        vCheckError(perror[0], dSET_INFO_ERRORS)
+        self._vChanged()
+        return bool(result)
 
     def self_get_name_size(self) -> int:
         """
@@ -536,9 +793,11 @@ class Tox:
         is NULL, the function allocates memory for the nickname.
         :return: nickname
         """
-        if name is None:
-            name = create_string_buffer(self.self_get_name_size())
         LOG_DEBUG(f"tox.self_get_name")
+        if name is None:
+            name = oBUFFERS.name
+            Tox.libtoxcore.tox_self_get_name(self._tox_pointer, name)
+            return sReadBuffer(name)
         Tox.libtoxcore.tox_self_get_name(self._tox_pointer, name)
         return str(name.value, 'utf-8', errors='ignore')
 
@@ -552,24 +811,19 @@ class Tox:
         :param status_message: new status message
         :return: True on success.
         """
-        tox_err_set_info = c_int()
+        perror = oERROR.pointer
         if len(status_message) > TOX_MAX_STATUS_MESSAGE_LENGTH:
            status_message = status_message[:TOX_MAX_STATUS_MESSAGE_LENGTH]
         if type(status_message) != bytes:
             status_message = bytes(status_message, 'utf-8')
         LOG_DEBUG(f"tox.self_set_status_message")
         result = Tox.libtoxcore.tox_self_set_status_message(self._tox_pointer,
-                                                            c_char_p(status_message),
-                                                            c_size_t(len(status_message)),
-                                                            byref(tox_err_set_info))
-        tox_err_set_info = tox_err_set_info.value
-        if tox_err_set_info == TOX_ERR_SET_INFO['OK']:
-            return bool(result)
-        if tox_err_set_info == TOX_ERR_SET_INFO['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        if tox_err_set_info == TOX_ERR_SET_INFO['TOO_LONG']:
-            raise ArgumentError('Information length exceeded maximum permissible size.')
-        raise ToxError('The function did not return OK.')
+                                                            status_message,
+                                                            len(status_message),
+                                                            perror)
+        vCheckError(perror[0], dSET_INFO_ERRORS)
+        self._vChanged()
+        return bool(result)
 
     def self_get_status_message_size(self) -> int:
         """
@@ -593,9 +847,11 @@ class Tox:
         If this parameter is None, the function allocates memory for the status message.
         :return: status message
         """
-        if status_message is None:
-            status_message = create_string_buffer(self.self_get_status_message_size())
         LOG_DEBUG(f"tox.self_get_status_message")
+        if status_message is None:
+            status_message = oBUFFERS.status_message
+            Tox.libtoxcore.tox_self_get_status_message(self._tox_pointer, status_message)
+            return sReadBuffer(status_message)
         Tox.libtoxcore.tox_self_get_status_message(self._tox_pointer, status_message)
         return str(status_message.value, 'utf-8', errors='ignore')
 
@@ -606,8 +862,9 @@ class Tox:
         :param status: One of the user statuses listed in the enumeration TOX_USER_STATUS.
         """
         if bTooSoon('self', 'tox_self_set_status', 5.0): return None
-        LOG_DEBUG(f"tox.self_set_status {status}")
-        Tox.libtoxcore.tox_self_set_status(self._tox_pointer, c_uint32(status))
+        LOG_DEBUG("tox.self_set_status %s", status)
+        Tox.libtoxcore.tox_self_set_status(self._tox_pointer, status)
+        self._vChanged()
         return None
 
     def self_get_status(self) -> int:
@@ -645,38 +902,20 @@ class Tox:
         :return: the friend number on success, UINT32_MAX on failure.
 
         """
-        tox_err_friend_add = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_add")
         if type(message) != bytes:
             message = bytes(message, 'utf-8')
         result = Tox.libtoxcore.tox_friend_add(self._tox_pointer,
                                                string_to_bin_charp(address),
-                                               c_char_p(message),
-                                               c_size_t(len(message)),
-                                               byref(tox_err_friend_add))
-        tox_err_friend_add = tox_err_friend_add.value
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['OK']:
-            return int(result)
-
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['TOO_LONG']:
-            raise ArgumentError('The length of the friend request message exceeded TOX_MAX_FRIEND_REQUEST_LENGTH.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['NO_MESSAGE']:
-            raise ArgumentError('The friend request message was empty. This, and the TOO_LONG code will never be'
-                                ' returned from tox_friend_add_norequest.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['OWN_KEY']:
-            raise ArgumentError('The friend address belongs to the sending client.')
-        elif tox_err_friend_add == TOX_ERR_FRIEND_ADD['ALREADY_SENT']:
-            raise ArgumentError('A friend request has already been sent, or the address belongs to a friend that is'
-                                ' already on the friend list.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['BAD_CHECKSUM']:
-            raise ArgumentError('The friend address checksum failed.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['SET_NEW_NOSPAM']:
-            raise ArgumentError('The friend was already there, but the nospam value was different.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['MALLOC']:
-            raise MemoryError('A memory allocation failed when trying to increase the friend list size.')
-        raise ToxError('The function did not return OK for the friend add.')
+                                               message,
+                                               len(message),
+                                               perror)
+        vCheckError(perror[0], dFRIEND_ADD_ERRORS)
+        if self._friends is not None:
+            self._friends.vAdd(int(result), address[:TOX_PUBLIC_KEY_SIZE * 2])
+        self._vChanged()
+        return int(result)
 
     def friend_add_norequest(self, public_key: str) -> int:
         """Add a friend without sending a friend request.
@@ -696,33 +935,75 @@ class Tox:
         :return: the friend number on success, UINT32_MAX on failure.
 
         """
-        tox_err_friend_add = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_add_norequest")
         result = Tox.libtoxcore.tox_friend_add_norequest(self._tox_pointer,
                                                          string_to_bin_charp(public_key),
-                                                         byref(tox_err_friend_add))
-        tox_err_friend_add = tox_err_friend_add.value
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['OK']:
-            return int(result)
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['TOO_LONG']:
-            raise ArgumentError('The length of the friend request message exceeded TOX_MAX_FRIEND_REQUEST_LENGTH.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['NO_MESSAGE']:
-            raise ArgumentError('The friend request message was empty. This, and the TOO_LONG code will never be'
-                                ' returned from tox_friend_add_norequest.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['OWN_KEY']:
-            raise ArgumentError('The friend address belongs to the sending client.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['ALREADY_SENT']:
-            raise ArgumentError('A friend request has already been sent, or the address belongs to a friend that is'
-                                ' already on the friend list.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['BAD_CHECKSUM']:
-            raise ArgumentError('The friend address checksum failed.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['SET_NEW_NOSPAM']:
-            raise ArgumentError('The friend was already there, but the nospam value was different.')
-        if tox_err_friend_add == TOX_ERR_FRIEND_ADD['MALLOC']:
-            raise MemoryError('A memory allocation failed when trying to increase the friend list size.')
-        raise ToxError('The function did not return OK for the friend add.')
+                                                         perror)
+        vCheckError(perror[0], dFRIEND_ADD_ERRORS)
+        if self._friends is not None:
+            self._friends.vAdd(int(result), public_key)
+        self._vChanged()
+        return int(result)
+
+    def friends_add_norequest(self, public_keys, save: Callable=None) -> list:
+        """
+        Add many friends without sending friend requests, as friend_add_norequest, in one pass.
+
+        All the keys are checked first, and if any is not exactly TOX_PUBLIC_KEY_SIZE or TOX_ADDRESS_SIZE bytes, or
+        the hex of that, ArgumentError is raised and none is added; of an address, the public key it starts with is
+        added. The errors of libtoxcore do not stop the others.
+
+        :param public_keys: the Public Keys or addresses, as bytes or hex
+        :param save: called once at the end if any friend was added, e.g. to write the savedata once
+        :return: for each key, (friend number, TOX_ERR_FRIEND_ADD['OK']) on success, or (None, the error code)
+        """
+        lKeys = []
+        lBad = []
+        for i, public_key in enumerate(public_keys):
+            try:
+                if isinstance(public_key, str):
+                    public_key = bytes.fromhex(public_key)
+                else:
+                    public_key = bytes(public_key)
+            except (ValueError, TypeError):
+                lBad.append(i)
+                continue
+            # a key, or an address, whose key is its start
+            if len(public_key) in (TOX_PUBLIC_KEY_SIZE, TOX_ADDRESS_SIZE):
+                lKeys.append(public_key[:TOX_PUBLIC_KEY_SIZE])
+            else:
+                lBad.append(i)
+        if lBad:
+            raise ArgumentError(f"friends_add_norequest: bad public keys at {lBad[:10]}")
+        LOG_DEBUG("tox.friends_add_norequest %d", len(lKeys))
+        add = Tox.libtoxcore.tox_friend_add_norequest
+        pTox = self._tox_pointer
+        perror = oERROR.pointer
+        oFriends = self._friends
+        lResults = []
+        if self._lock is not None:
+            self._lock.acquire()
+        try:
+            for public_key in lKeys:
+                perror[0] = 0
+                result = add(pTox, public_key, perror)
+                if perror[0]:
+                    lResults.append((None, perror[0]))
+                    continue
+                lResults.append((int(result), TOX_ERR_FRIEND_ADD['OK']))
+                if oFriends is not None:
+                    oFriends.vAdd(int(result), public_key)
+        finally:
+            if self._lock is not None:
+                self._lock.release()
+        iAdded = sum(1 for friend_number, iError in lResults if friend_number is not None)
+        LOG_INFO("tox.friends_add_norequest added %d of %d", iAdded, len(lKeys))
+        if iAdded:
+            self._vChanged()
+            if save is not None:
+                save()
+        return lResults
 
     def friend_delete(self, friend_number: int) -> bool:
         """
@@ -734,17 +1015,22 @@ class Tox:
         :param friend_number: Friend number for the friend to be deleted.
         :return: True on success.
         """
-        tox_err_friend_delete = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_delete")
         result = Tox.libtoxcore.tox_friend_delete(self._tox_pointer,
-                                                  c_uint32(friend_number),
-                                                  byref(tox_err_friend_delete))
-        tox_err_friend_delete = tox_err_friend_delete.value
-        if tox_err_friend_delete == TOX_ERR_FRIEND_DELETE['OK']:
-            return bool(result)
-        elif tox_err_friend_delete == TOX_ERR_FRIEND_DELETE['FRIEND_NOT_FOUND']:
-            raise ArgumentError('There was no friend with the given friend number. No friends were deleted.')
-        raise ToxError('The function did not return OK for the friend add.')
+                                                  friend_number,
+                                                  perror)
+        vCheckError(perror[0], dFRIEND_DELETE_ERRORS)
+        if self._friends is not None:
+            self._friends.vDelete(friend_number)
+        if self._outbox is not None:
+            self._outbox.vDelete(friend_number)
+        if self._latency is not None:
+            self._latency.vDelete(friend_number)
+        if self._store is not None:
+            self._store.vForgetFriend(friend_number)
+        self._vChanged()
+        return bool(result)
 
     # Friend list queries
 
@@ -755,19 +1041,13 @@ class Tox:
         :param public_key: A byte array containing the Public Key.
         :return: friend number
         """
-        tox_err_friend_by_public_key = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_by_public_key")
         result = Tox.libtoxcore.tox_friend_by_public_key(self._tox_pointer,
                                                          string_to_bin_charp(public_key),
-                                                         byref(tox_err_friend_by_public_key))
-        tox_err_friend_by_public_key = tox_err_friend_by_public_key.value
-        if tox_err_friend_by_public_key == TOX_ERR_FRIEND_BY_PUBLIC_KEY['OK']:
-            return int(result)
-        if tox_err_friend_by_public_key == TOX_ERR_FRIEND_BY_PUBLIC_KEY['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        if tox_err_friend_by_public_key == TOX_ERR_FRIEND_BY_PUBLIC_KEY['NOT_FOUND']:
-            raise ArgumentError('No friend with the given Public Key exists on the friend list.')
-        raise ToxError('The function did not return OK for the friend by public key.')
+                                                         perror)
+        vCheckError(perror[0], dFRIEND_BY_PUBLIC_KEY_ERRORS)
+        return int(result)
 
     def friend_exists(self, friend_number: int) -> bool:
         """
@@ -775,7 +1055,7 @@ class Tox:
         """
         assert type(friend_number) == int
         # bool() -> TypeError: 'str' object cannot be interpreted as an integer
-        return bool(Tox.libtoxcore.tox_friend_exists(self._tox_pointer, c_uint32(friend_number)))
+        return bool(Tox.libtoxcore.tox_friend_exists(self._tox_pointer, friend_number))
 
     def self_get_friend_list_size(self) -> int:
         """
@@ -805,6 +1085,21 @@ class Tox:
         Tox.libtoxcore.tox_self_get_friend_list(self._tox_pointer, friend_list)
         return friend_list[0:friend_list_size]
 
+    def friends_snapshot(self) -> FriendsSnapshot:
+        """
+        All the friends as columns, see toxfriends.py: array('I') friend numbers, connection status and user
+        status, array('Q') last online times, and the public keys as one bytes, in friend number order from the
+        FriendTable when get_friend_table has been called, otherwise in the order of self_get_friend_list.
+
+        :return: FriendsSnapshot
+        """
+        if self._friends is not None:
+            return oSnapshotTable(self._friends)
+        if self._lock is None:
+            return oSnapshotLib(Tox.libtoxcore, self._tox_pointer)
+        with self._lock:
+            return oSnapshotLib(Tox.libtoxcore, self._tox_pointer)
+
     def friend_get_public_key(self, friend_number: int, public_key: str=None) -> str:
         """
         Copies the Public Key associated with a given friend number to a byte array.
@@ -814,18 +1109,21 @@ class Tox:
         parameter is None, this function allocates memory for Tox Public Key.
         :return: Tox Public Key
         """
+        return self.friend_get_public_key_bytes(friend_number, public_key).hex().upper()
+
+    def friend_get_public_key_bytes(self, friend_number: int, public_key=None) -> bytes:
+        """
+        As friend_get_public_key, but returns the raw TOX_PUBLIC_KEY_SIZE bytes.
+        """
         if public_key is None:
             public_key = create_string_buffer(TOX_PUBLIC_KEY_SIZE)
-        tox_err_friend_get_public_key = c_int()
+        perror = oERROR.pointer
         LOG_TRACE(f"tox_friend_get_public_key")
         Tox.libtoxcore.tox_friend_get_public_key(self._tox_pointer,
-                                                 c_uint32(friend_number), public_key,
-                                                 byref(tox_err_friend_get_public_key))
-        tox_err_friend_get_public_key = tox_err_friend_get_public_key.value
-        if tox_err_friend_get_public_key == TOX_ERR_FRIEND_GET_PUBLIC_KEY['OK']:
-            return bin_to_string(public_key, TOX_PUBLIC_KEY_SIZE)
-        elif tox_err_friend_get_public_key == TOX_ERR_FRIEND_GET_PUBLIC_KEY['FRIEND_NOT_FOUND']:
-            raise ArgumentError('No friend with the given number exists on the friend list.')
+                                                 friend_number, public_key,
+                                                 perror)
+        vCheckError(perror[0], dFRIEND_GET_PUBLIC_KEY_ERRORS)
+        return bin_to_bytes(public_key, TOX_PUBLIC_KEY_SIZE)
 
     def friend_get_last_online(self, friend_number: int) -> int:
         """
@@ -835,17 +1133,13 @@ class Tox:
         :param friend_number: The friend number you want to query.
         :return: unix-time timestamp
         """
-        tox_err_last_online = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_get_last_online")
         result = Tox.libtoxcore.tox_friend_get_last_online(self._tox_pointer,
-                                                           c_uint32(friend_number),
-                                                           byref(tox_err_last_online))
-        tox_err_last_online = tox_err_last_online.value
-        if tox_err_last_online == TOX_ERR_FRIEND_GET_LAST_ONLINE['OK']:
-            return int(result)
-        elif tox_err_last_online == TOX_ERR_FRIEND_GET_LAST_ONLINE['FRIEND_NOT_FOUND']:
-            raise ArgumentError('No friend with the given number exists on the friend list.')
-        raise ToxError('The function did not return OK')
+                                                           friend_number,
+                                                           perror)
+        vCheckError(perror[0], dFRIEND_GET_LAST_ONLINE_ERRORS)
+        return int(result)
 
     # Friend-specific state queries (can also be received through callbacks)
 
@@ -855,21 +1149,13 @@ class Tox:
 
         The return value is equal to the `length` argument received by the last `friend_name` callback.
         """
-        tox_err_friend_query = c_int()
+        perror = oERROR.pointer
         LOG_TRACE(f"tox_friend_get_name_size")
         result = Tox.libtoxcore.tox_friend_get_name_size(self._tox_pointer,
-                                                         c_uint32(friend_number),
-                                                         byref(tox_err_friend_query))
-        tox_err_friend_query = tox_err_friend_query.value
-        if tox_err_friend_query == TOX_ERR_FRIEND_QUERY['OK']:
-            return int(result)
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['NULL']:
-            raise ArgumentError('The pointer parameter for storing the query result (name, message) was NULL. Unlike'
-                                ' the `_self_` variants of these functions, which have no effect when a parameter is'
-                                ' NULL, these functions return an error in that case.')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number did not designate a valid friend.')
-        raise ToxError('The function did not return OK')
+                                                         friend_number,
+                                                         perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        return int(result)
 
     def friend_get_name(self, friend_number: int, name=None) -> str:
         """
@@ -883,24 +1169,20 @@ class Tox:
         :param name: pointer (c_char_p) to a valid memory region large enough to store the friend's name.
         :return: name of the friend
         """
-        if name is None:
-            name = create_string_buffer(self.friend_get_name_size(friend_number))
-        tox_err_friend_query = c_int()
+        bReuse = name is None
+        if bReuse:
+            name = oBUFFERS.name
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_get_name")
         Tox.libtoxcore.tox_friend_get_name(self._tox_pointer,
-                                           c_uint32(friend_number), name,
-                                           byref(tox_err_friend_query))
-        tox_err_friend_query = tox_err_friend_query.value
-        if tox_err_friend_query == TOX_ERR_FRIEND_QUERY['OK']:
-            return str(name.value, 'utf-8', errors='ignore')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['NULL']:
-            raise ArgumentError('The pointer parameter for storing the query result (name, message) was NULL. Unlike'
-                                ' the `_self_` variants of these functions, which have no effect when a parameter is'
-                                ' NULL, these functions return an error in that case.')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number did not designate a valid friend.')
-        raise ToxError('The function did not return OK')
+                                           friend_number, name,
+                                           perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        if bReuse:
+            return sReadBuffer(name)
+        return str(name.value, 'utf-8', errors='ignore')
 
+    @guarded
     def callback_friend_name(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_name` event. Pass None to unset.
@@ -931,19 +1213,12 @@ class Tox:
 
         :return: length of the friend's status message
         """
-        tox_err_friend_query = c_int()
+        perror = oERROR.pointer
         LOG_TRACE(f"tox_friend_get_status_message_size")
-        result = Tox.libtoxcore.tox_friend_get_status_message_size(self._tox_pointer, c_uint32(friend_number),
-                                                                   byref(tox_err_friend_query))
-        tox_err_friend_query = tox_err_friend_query.value
-        if tox_err_friend_query == TOX_ERR_FRIEND_QUERY['OK']:
-            return int(result)
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['NULL']:
-            raise ArgumentError('The pointer parameter for storing the query result (name, message) was NULL. Unlike'
-                                ' the `_self_` variants of these functions, which have no effect when a parameter is'
-                                ' NULL, these functions return an error in that case.')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number did not designate a valid friend.')
+        result = Tox.libtoxcore.tox_friend_get_status_message_size(self._tox_pointer, friend_number,
+                                                                   perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        return int(result)
 
     def friend_get_status_message(self, friend_number: int, status_message=None) -> str:
         """
@@ -958,26 +1233,50 @@ class Tox:
         message.
         :return: status message of the friend
         """
-        if status_message is None:
-            status_message = create_string_buffer(self.friend_get_status_message_size(friend_number))
-        tox_err_friend_query = c_int()
+        bReuse = status_message is None
+        if bReuse:
+            status_message = oBUFFERS.status_message
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_get_status_message")
         Tox.libtoxcore.tox_friend_get_status_message(self._tox_pointer,
-                                                     c_uint32(friend_number),
+                                                     friend_number,
                                                      status_message,
-                                                     byref(tox_err_friend_query))
-        tox_err_friend_query = tox_err_friend_query.value
-        if tox_err_friend_query == TOX_ERR_FRIEND_QUERY['OK']:
-            # 'utf-8' codec can't decode byte 0xb7 in position 2: invalid start byte
-            return str(status_message.value, 'utf-8', errors='ignore')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['NULL']:
-            raise ArgumentError('The pointer parameter for storing the query result (name, message) was NULL. Unlike'
-                                ' the `_self_` variants of these functions, which have no effect when a parameter is'
-                                ' NULL, these functions return an error in that case.')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number did not designate a valid friend.')
-        raise ToxError('The function did not return OK')
+                                                     perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        if bReuse:
+            return sReadBuffer(status_message)
+        # 'utf-8' codec can't decode byte 0xb7 in position 2: invalid start byte
+        return str(status_message.value, 'utf-8', errors='ignore')
 
+    def friend_get_info(self, friend_number: int) -> FriendInfo:
+        """
+        Read the name, status message, user status, connection status and
+        last online time of a friend at once, one library call for each.
+
+        :param friend_number: number of friend
+        :return: FriendInfo
+        """
+        oLib = Tox.libtoxcore
+        pTox = self._tox_pointer
+        perror = oERROR.pointer
+        name = oBUFFERS.name
+        status_message = oBUFFERS.status_message
+        oLib.tox_friend_get_name(pTox, friend_number, name, perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        sName = sReadBuffer(name)
+        oLib.tox_friend_get_status_message(pTox, friend_number, status_message, perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        sStatusMessage = sReadBuffer(status_message)
+        iStatus = oLib.tox_friend_get_status(pTox, friend_number, perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        iConnectionStatus = oLib.tox_friend_get_connection_status(pTox, friend_number, perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        iLastOnline = oLib.tox_friend_get_last_online(pTox, friend_number, perror)
+        vCheckError(perror[0], dFRIEND_GET_LAST_ONLINE_ERRORS)
+        return FriendInfo(friend_number, sName, sStatusMessage, iStatus,
+                          iConnectionStatus, iLastOnline)
+
+    @guarded
     def callback_friend_status_message(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_status_message` event. Pass NULL to unset.
@@ -1012,22 +1311,15 @@ class Tox:
 
         :return: TOX_USER_STATUS
         """
-        tox_err_friend_query = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_get_status")
         result = Tox.libtoxcore.tox_friend_get_status(self._tox_pointer,
-                                                      c_uint32(friend_number),
-                                                      byref(tox_err_friend_query))
-        tox_err_friend_query = tox_err_friend_query.value
-        if tox_err_friend_query == TOX_ERR_FRIEND_QUERY['OK']:
-            return int(result)
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['NULL']:
-            raise ArgumentError('The pointer parameter for storing the query result (name, message) was NULL. Unlike'
-                                ' the `_self_` variants of these functions, which have no effect when a parameter is'
-                                ' NULL, these functions return an error in that case.')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number did not designate a valid friend.')
-        raise ToxError('The function did not return OK.')
+                                                      friend_number,
+                                                      perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        return int(result)
 
+    @guarded
     def callback_friend_status(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_status` event. Pass None to unset.
@@ -1061,22 +1353,15 @@ class Tox:
         :return: the friend's connection status (TOX_CONNECTION) as it was received through the
         `friend_connection_status` event.
         """
-        tox_err_friend_query = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_get_connection_status")
         result = Tox.libtoxcore.tox_friend_get_connection_status(self._tox_pointer,
-                                                                 c_uint32(friend_number),
-                                                                 byref(tox_err_friend_query))
-        tox_err_friend_query = tox_err_friend_query.value
-        if tox_err_friend_query == TOX_ERR_FRIEND_QUERY['OK']:
-            return int(result)
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['NULL']:
-            raise ArgumentError('The pointer parameter for storing the query result (name, message) was NULL. Unlike'
-                                ' the `_self_` variants of these functions, which have no effect when a parameter is'
-                                ' NULL, these functions return an error in that case.')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number did not designate a valid friend.')
-        raise ToxError('The function did not return OK for friend get connection status.')
+                                                                 friend_number,
+                                                                 perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        return int(result)
 
+    @guarded
     def callback_friend_connection_status(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_connection_status` event. Pass NULL to unset.
@@ -1111,22 +1396,15 @@ class Tox:
         :param friend_number: The friend number for which to query the typing status.
         :return: true if the friend is typing.
         """
-        tox_err_friend_query = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_get_typing")
         result = Tox.libtoxcore.tox_friend_get_typing(self._tox_pointer,
-                                                      c_uint32(friend_number),
-                                                      byref(tox_err_friend_query))
-        tox_err_friend_query = tox_err_friend_query.value
-        if tox_err_friend_query == TOX_ERR_FRIEND_QUERY['OK']:
-            return bool(result)
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['NULL']:
-            raise ArgumentError('The pointer parameter for storing the query result (name, message) was NULL. Unlike'
-                                ' the `_self_` variants of these functions, which have no effect when a parameter is'
-                                ' NULL, these functions return an error in that case.')
-        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number did not designate a valid friend.')
-        raise ToxError('The function did not return OK')
+                                                      friend_number,
+                                                      perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        return bool(result)
 
+    @guarded
     def callback_friend_typing(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_typing` event. Pass NULL to unset.
@@ -1161,16 +1439,12 @@ class Tox:
         :param typing: The typing status. True means the client is typing.
         :return: True on success.
         """
-        tox_err_set_typing = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.self_set_typing")
-        result = Tox.libtoxcore.tox_self_set_typing(self._tox_pointer, c_uint32(friend_number),
-                                                    c_bool(typing), byref(tox_err_set_typing))
-        tox_err_set_typing = tox_err_set_typing.value
-        if tox_err_set_typing == TOX_ERR_SET_TYPING['OK']:
-            return bool(result)
-        if tox_err_set_typing == TOX_ERR_SET_TYPING['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend number did not designate a valid friend.')
-        raise ToxError('The function did not return OK for set typing.')
+        result = Tox.libtoxcore.tox_self_set_typing(self._tox_pointer, friend_number,
+                                                    typing, perror)
+        vCheckError(perror[0], dSET_TYPING_ERRORS)
+        return bool(result)
 
     def friend_send_message(self, friend_number: int, message_type: int, message: str) -> int:
         """Send a text chat message to an online friend.
@@ -1198,28 +1472,81 @@ class Tox:
         """
         if message and type(message) != bytes:
             message = bytes(message, 'utf-8')
-        tox_err_friend_send_message = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.friend_send_message")
-        result = Tox.libtoxcore.tox_friend_send_message(self._tox_pointer, c_uint32(friend_number),
-                                                        c_int(message_type), c_char_p(message), c_size_t(len(message)),
-                                                        byref(tox_err_friend_send_message))
-        tox_err_friend_send_message = tox_err_friend_send_message.value
-        if tox_err_friend_send_message == TOX_ERR_FRIEND_SEND_MESSAGE['OK']:
-            return int(result)
-        elif tox_err_friend_send_message == TOX_ERR_FRIEND_SEND_MESSAGE['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        elif tox_err_friend_send_message == TOX_ERR_FRIEND_SEND_MESSAGE['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend number did not designate a valid friend.')
-        elif tox_err_friend_send_message == TOX_ERR_FRIEND_SEND_MESSAGE['FRIEND_NOT_CONNECTED']:
-            raise ArgumentError('This client is currently not connected to the friend.')
-        elif tox_err_friend_send_message == TOX_ERR_FRIEND_SEND_MESSAGE['SENDQ']:
-            raise MemoryError('An allocation error occurred while increasing the send queue size.')
-        elif tox_err_friend_send_message == TOX_ERR_FRIEND_SEND_MESSAGE['TOO_LONG']:
-            raise ArgumentError('Message length exceeded TOX_MAX_MESSAGE_LENGTH.')
-        elif tox_err_friend_send_message == TOX_ERR_FRIEND_SEND_MESSAGE['EMPTY']:
-            raise ArgumentError('Attempted to send a zero-length message.')
-        raise ToxError('The function did not return OK for friend send message.')
+        result = Tox.libtoxcore.tox_friend_send_message(self._tox_pointer, friend_number,
+                                                        message_type, message, len(message),
+                                                        perror)
+        vCheckError(perror[0], dFRIEND_SEND_MESSAGE_ERRORS)
+        if self._latency is not None:
+            self._latency.sent(friend_number, result)
+        if self._store is not None:
+            self._store.vSent(dKINDS['friend'], friend_number, 0, message_type, message)
+        return int(result)
 
+    def _lSendFragments(self, message, send, dErrors: dict, record) -> list:
+        # encode message once, and call send(fragment, perror) for each
+        # fragment of at most TOX_MAX_MESSAGE_LENGTH bytes, see toxmessages.py;
+        # then record(results, data) with what was queued, even when a later
+        # fragment failed, as that much is on its way
+        data = bEncode(message)
+        if not data:
+            raise ArgumentError('The message is empty.')
+        perror = oERROR.pointer
+        lResults = []
+        iSent = 0
+        try:
+            if self._lock is not None:
+                self._lock.acquire()
+            try:
+                for iStart, iEnd in lFragments(data):
+                    perror[0] = 0
+                    result = send(data[iStart:iEnd], perror)
+                    if perror[0]:
+                        try:
+                            vCheckError(perror[0], dErrors)
+                        except Exception as e:
+                            # the fragments before are queued: say which
+                            e.results = lResults
+                            raise
+                    lResults.append(result)
+                    iSent = iEnd
+            finally:
+                if self._lock is not None:
+                    self._lock.release()
+        finally:
+            if lResults:
+                record(lResults, data if iSent == len(data) else data[:iSent])
+        return lResults
+
+    def friend_send_long_message(self, friend_number: int, message_type: int, message) -> list:
+        """
+        Send a text message of any length to an online friend, as friend_send_message, in fragments of at most
+        TOX_MAX_MESSAGE_LENGTH bytes cut between characters, see toxmessages.py.
+
+        If a fragment fails, its error is raised with the message IDs of the fragments before it, which are
+        queued, and tracked and stored as sent, as its results attribute.
+
+        :param friend_number: The friend number of the friend to send the message to.
+        :param message_type: Message type (TOX_MESSAGE_TYPE).
+        :param message: A non-empty message, str or UTF-8 bytes.
+        :return: the message IDs of the fragments
+        """
+        LOG_DEBUG(f"tox.friend_send_long_message")
+        send = Tox.libtoxcore.tox_friend_send_message
+        pTox = self._tox_pointer
+        def vRecord(lMessageIds, data) -> None:
+            if self._latency is not None:
+                for message_id in lMessageIds:
+                    self._latency.sent(friend_number, message_id)
+            if self._store is not None:
+                self._store.vSent(dKINDS['friend'], friend_number, 0, message_type, data)
+        return self._lSendFragments(
+            message, lambda fragment, perror: int(send(pTox, friend_number, message_type,
+                                                       fragment, len(fragment), perror)),
+            dFRIEND_SEND_MESSAGE_ERRORS, vRecord)
+
+    @guarded
     def callback_friend_read_receipt(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_read_receipt` event. Pass None to unset.
@@ -1248,6 +1575,7 @@ class Tox:
 
     # Receiving private messages and friend requests
 
+    @guarded
     def callback_friend_request(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_request` event. Pass None to unset.
@@ -1272,6 +1600,7 @@ class Tox:
         LOG_DEBUG(f"tox.callback_friend_request")
         Tox.libtoxcore.tox_callback_friend_request(self._tox_pointer, self.friend_request_cb)
 
+    @guarded
     def callback_friend_message(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_message` event. Pass None to unset.
@@ -1316,11 +1645,18 @@ class Tox:
 #?        :return: true if hash was not NULL.
         :return: the hash as a string.
         """
+        return Tox.hash_bytes(data, hash).hex().upper()
+
+    @staticmethod
+    def hash_bytes(data, hash=None) -> bytes:
+        """
+        As hash, but returns the raw TOX_HASH_LENGTH bytes.
+        """
         if hash is None:
             hash = create_string_buffer(TOX_HASH_LENGTH)
         LOG_DEBUG(f"tox.hash")
-        Tox.libtoxcore.tox_hash(hash, c_char_p(data), c_size_t(len(data)))
-        return bin_to_string(hash, TOX_HASH_LENGTH)
+        Tox.libtoxcore.tox_hash(hash, data, len(data))
+        return bin_to_bytes(hash, TOX_HASH_LENGTH)
 
     def file_control(self, friend_number: int, file_number: int, control: int) -> bool:
         """
@@ -1331,32 +1667,16 @@ class Tox:
         :param control: The control (TOX_FILE_CONTROL) command to send.
         :return: True on success.
         """
-        tox_err_file_control = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.file_control")
         result = Tox.libtoxcore.tox_file_control(self._tox_pointer,
-                                                 c_uint32(friend_number),
-                                                 c_uint32(file_number),
-                                                 c_int(control), byref(tox_err_file_control))
-        tox_err_file_control = tox_err_file_control.value
-        if tox_err_file_control == TOX_ERR_FILE_CONTROL['OK']:
-            return bool(result)
-        elif tox_err_file_control == TOX_ERR_FILE_CONTROL['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number passed did not designate a valid friend.')
-        elif tox_err_file_control == TOX_ERR_FILE_CONTROL['FRIEND_NOT_CONNECTED']:
-            raise ArgumentError('This client is currently not connected to the friend.')
-        elif tox_err_file_control == TOX_ERR_FILE_CONTROL['NOT_FOUND']:
-            raise ArgumentError('No file transfer with the given file number was found for the given friend.')
-        elif tox_err_file_control == TOX_ERR_FILE_CONTROL['NOT_PAUSED']:
-            raise ToxError('A RESUME control was sent, but the file transfer is running normally.')
-        elif tox_err_file_control == TOX_ERR_FILE_CONTROL['DENIED']:
-            raise ToxError('A RESUME control was sent, but the file transfer was paused by the other party. Only '
-                               'the party that paused the transfer can resume it.')
-        elif tox_err_file_control == TOX_ERR_FILE_CONTROL['ALREADY_PAUSED']:
-            raise ToxError('A PAUSE control was sent, but the file transfer was already paused.')
-        elif tox_err_file_control == TOX_ERR_FILE_CONTROL['SENDQ']:
-            raise ToxError('Packet queue is full.')
-        raise ToxError('The function did not return OK for file control.')
+                                                 friend_number,
+                                                 file_number,
+                                                 control, perror)
+        vCheckError(perror[0], dFILE_CONTROL_ERRORS)
+        return bool(result)
 
+    @guarded
     def callback_file_recv_control(self, callback: Callable) -> None:
         """
         Set the callback for the `file_recv_control` event. Pass NULL to unset.
@@ -1397,29 +1717,15 @@ class Tox:
         :param position: The position that the file should be seeked to.
         :return: True on success.
         """
-        tox_err_file_seek = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.file_control")
-        result = Tox.libtoxcore.tox_file_control(self._tox_pointer,
-                                                 c_uint32(friend_number),
-                                                 c_uint32(file_number),
-                                                 c_uint64(position),
-                                                 byref(tox_err_file_seek))
-        tox_err_file_seek = tox_err_file_seek.value
-        if tox_err_file_seek == TOX_ERR_FILE_SEEK['OK']:
-            return bool(result)
-        elif tox_err_file_seek == TOX_ERR_FILE_SEEK['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number passed did not designate a valid friend.')
-        elif tox_err_file_seek == TOX_ERR_FILE_SEEK['FRIEND_NOT_CONNECTED']:
-            raise ArgumentError('This client is currently not connected to the friend.')
-        elif tox_err_file_seek == TOX_ERR_FILE_SEEK['NOT_FOUND']:
-            raise ArgumentError('No file transfer with the given file number was found for the given friend.')
-        elif tox_err_file_seek == TOX_ERR_FILE_SEEK['SEEK_DENIED']:
-            raise IOError('File was not in a state where it could be seeked.')
-        elif tox_err_file_seek == TOX_ERR_FILE_SEEK['INVALID_POSITION']:
-            raise ArgumentError('Seek position was invalid')
-        elif tox_err_file_seek == TOX_ERR_FILE_SEEK['SENDQ']:
-            raise ToxError('Packet queue is full.')
-        raise ToxError('The function did not return OK')
+        result = Tox.libtoxcore.tox_file_seek(self._tox_pointer,
+                                              friend_number,
+                                              file_number,
+                                              position,
+                                              perror)
+        vCheckError(perror[0], dFILE_SEEK_ERRORS)
+        return bool(result)
 
     def file_get_file_id(self, friend_number: int, file_number: int, file_id=None) -> str:
         """
@@ -1433,19 +1739,15 @@ class Tox:
         """
         if file_id is None:
             file_id = create_string_buffer(TOX_FILE_ID_LENGTH)
-        tox_err_file_get = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.file_get_file_id")
         Tox.libtoxcore.tox_file_get_file_id(self._tox_pointer,
-                                            c_uint32(friend_number),
-                                            c_uint32(file_number),
+                                            friend_number,
+                                            file_number,
                                             file_id,
-                                            byref(tox_err_file_get))
-        error = tox_err_file_get
-        if error.value == TOX_ERR_FILE_GET['OK']:
-            return bin_to_string(file_id, TOX_FILE_ID_LENGTH)
-        s = sGetError(error.value, TOX_ERR_FILE_GET)
-        LOG_ERROR(f"group_new {error.value} {s}")
-        raise ArgumentError(f"group_new {error.value} {s}")
+                                            perror)
+        vCheckError(perror[0], dFILE_GET_ERRORS)
+        return bin_to_string(file_id, TOX_FILE_ID_LENGTH)
 
     # File transmission: sending
 
@@ -1500,31 +1802,18 @@ class Tox:
 
         """
         LOG_DEBUG(f"tox.file_send")
-        tox_err_file_send = c_int()
+        perror = oERROR.pointer
         result = self.libtoxcore.tox_file_send(self._tox_pointer,
-                                               c_uint32(friend_number),
-                                               c_uint32(kind),
-                                               c_uint64(file_size),
+                                               friend_number,
+                                               kind,
+                                               file_size,
                                                string_to_bin_charp(file_id),
-                                               c_char_p(filename),
-                                               c_size_t(len(filename)),
-                                               byref(tox_err_file_send))
-        err_file = tox_err_file_send.value
-        if err_file == TOX_ERR_FILE_SEND['OK']:
-            # UINT32_MAX
-            return int(result)
-        if err_file == TOX_ERR_FILE_SEND['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        if err_file == TOX_ERR_FILE_SEND['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend_number passed did not designate a valid friend.')
-        if err_file == TOX_ERR_FILE_SEND['FRIEND_NOT_CONNECTED']:
-            raise ArgumentError('This client is currently not connected to the friend.')
-        if err_file == TOX_ERR_FILE_SEND['NAME_TOO_LONG']:
-            raise ArgumentError('Filename length exceeded TOX_MAX_FILENAME_LENGTH bytes.')
-        if err_file == TOX_ERR_FILE_SEND['TOO_MANY']:
-            raise ToxError('Too many ongoing transfers. The maximum number of concurrent file transfers is 256 per'
-                               'friend per direction (sending and receiving).')
-        raise ToxError('The function did not return OK')
+                                               filename,
+                                               len(filename),
+                                               perror)
+        vCheckError(perror[0], dFILE_SEND_ERRORS)
+        # UINT32_MAX
+        return int(result)
 
     def file_send_chunk(self, friend_number: int, file_number: int, position, data: str) -> int:
         """
@@ -1543,35 +1832,15 @@ class Tox:
         :return: true on success.
         """
         LOG_DEBUG(f"tox.file_send_chunk")
-        tox_err_file_send_chunk = c_int()
+        perror = oERROR.pointer
         result = self.libtoxcore.tox_file_send_chunk(self._tox_pointer,
-                                                     c_uint32(friend_number), c_uint32(file_number),
-                                                     c_uint64(position), c_char_p(data), c_size_t(len(data)),
-                                                     byref(tox_err_file_send_chunk))
-        tox_err_file_send_chunk = tox_err_file_send_chunk.value
-        if tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['OK']:
-            return bool(result)
-        elif tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['NULL']:
-            raise ArgumentError('The length parameter was non-zero, but data was NULL.')
-        elif tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['FRIEND_NOT_FOUND']:
-            ArgumentError('The friend_number passed did not designate a valid friend.')
-        elif tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['FRIEND_NOT_CONNECTED']:
-            raise ArgumentError('This client is currently not connected to the friend.')
-        elif tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['NOT_FOUND']:
-            raise ArgumentError('No file transfer with the given file number was found for the given friend.')
-        elif tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['NOT_TRANSFERRING']:
-            raise ArgumentError('File transfer was found but isn\'t in a transferring state: (paused, done, broken, '
-                                'etc...) (happens only when not called from the request chunk callback).')
-        elif tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['INVALID_LENGTH']:
-            raise ArgumentError('Attempted to send more or less data than requested. The requested data size is '
-                                'adjusted according to maximum transmission unit and the expected end of the file. '
-                                'Trying to send less or more than requested will return this error.')
-        elif tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['SENDQ']:
-            raise ToxError('Packet queue is full.')
-        elif tox_err_file_send_chunk == TOX_ERR_FILE_SEND_CHUNK['WRONG_POSITION']:
-            raise ArgumentError('Position parameter was wrong.')
-        raise ToxError('The function did not return OK')
+                                                     friend_number, file_number,
+                                                     position, data, len(data),
+                                                     perror)
+        vCheckError(perror[0], dFILE_SEND_CHUNK_ERRORS)
+        return bool(result)
 
+    @guarded
     def callback_file_chunk_request(self, callback: Callable) -> None:
         """
         Set the callback for the `file_chunk_request` event. Pass None to unset.
@@ -1611,6 +1880,7 @@ class Tox:
 
     # File transmission: receiving
 
+    @guarded
     def callback_file_recv(self, callback: Callable) -> None:
         """
         Set the callback for the `file_recv` event. Pass None to unset.
@@ -1643,6 +1913,7 @@ class Tox:
         self.file_recv_cb = c_callback(callback)
         self.libtoxcore.tox_callback_file_recv(self._tox_pointer, self.file_recv_cb)
 
+    @guarded
     def callback_file_recv_chunk(self, callback: Callable) -> None:
         """
         Set the callback for the `file_recv_chunk` event. Pass NULL to unset.
@@ -1695,29 +1966,12 @@ class Tox:
         :return: True on success.
         """
         LOG_DEBUG(f"friend_send_lossy_packet")
-        tox_err_friend_custom_packet = c_int()
-        result = self.libtoxcore.tox_friend_send_lossy_packet(self._tox_pointer, c_uint32(friend_number),
-                                                              c_char_p(data), c_size_t(len(data)),
-                                                              byref(tox_err_friend_custom_packet))
-        tox_err_friend_custom_packet = tox_err_friend_custom_packet.value
-        if tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['OK']:
-            return bool(result)
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend number did not designate a valid friend.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['FRIEND_NOT_CONNECTED']:
-            raise ArgumentError('This client is currently not connected to the friend.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['INVALID']:
-            raise ArgumentError('The first byte of data was not in the specified range for the packet type.'
-                                'This range is 200-254 for lossy, and 160-191 for lossless packets.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['EMPTY']:
-            raise ArgumentError('Attempted to send an empty packet.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['TOO_LONG']:
-            raise ArgumentError('Packet data length exceeded TOX_MAX_CUSTOM_PACKET_SIZE.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['SENDQ']:
-            raise ToxError('Packet queue is full.')
-        raise ToxError('The function did not return OK')
+        perror = oERROR.pointer
+        result = self.libtoxcore.tox_friend_send_lossy_packet(self._tox_pointer, friend_number,
+                                                              data, len(data),
+                                                              perror)
+        vCheckError(perror[0], dFRIEND_CUSTOM_PACKET_ERRORS)
+        return bool(result)
 
     def friend_send_lossless_packet(self, friend_number: int, data: str) -> int:
         """
@@ -1733,29 +1987,14 @@ class Tox:
         :return: True on success.
         """
         LOG_DEBUG(f"friend_send_lossless_packet")
-        tox_err_friend_custom_packet = c_int()
-        result = self.libtoxcore.tox_friend_send_lossless_packet(self._tox_pointer, c_uint32(friend_number),
-                                                                 c_char_p(data), c_size_t(len(data)),
-                                                                 byref(tox_err_friend_custom_packet))
-        tox_err_friend_custom_packet = tox_err_friend_custom_packet.value
-        if tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['OK']:
-            return bool(result)
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['NULL']:
-            raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['FRIEND_NOT_FOUND']:
-            raise ArgumentError('The friend number did not designate a valid friend.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['FRIEND_NOT_CONNECTED']:
-            raise ArgumentError('This client is currently not connected to the friend.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['INVALID']:
-            raise ArgumentError('The first byte of data was not in the specified range for the packet type.'
-                                'This range is 200-254 for lossy, and 160-191 for lossless packets.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['EMPTY']:
-            raise ArgumentError('Attempted to send an empty packet.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['TOO_LONG']:
-            raise ArgumentError('Packet data length exceeded TOX_MAX_CUSTOM_PACKET_SIZE.')
-        elif tox_err_friend_custom_packet == TOX_ERR_FRIEND_CUSTOM_PACKET['SENDQ']:
-            raise ToxError('Packet queue is full.')
+        perror = oERROR.pointer
+        result = self.libtoxcore.tox_friend_send_lossless_packet(self._tox_pointer, friend_number,
+                                                                 data, len(data),
+                                                                 perror)
+        vCheckError(perror[0], dFRIEND_CUSTOM_PACKET_ERRORS)
+        return bool(result)
 
+    @guarded
     def callback_friend_lossy_packet(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_lossy_packet` event. Pass NULL to unset.
@@ -1777,6 +2016,7 @@ class Tox:
         self.friend_lossy_packet_cb = c_callback(callback)
         self.libtoxcore.tox_callback_friend_lossy_packet(self._tox_pointer, self.friend_lossy_packet_cb)
 
+    @guarded
     def callback_friend_lossless_packet(self, callback: Callable) -> None:
         """
         Set the callback for the `friend_lossless_packet` event. Pass NULL to unset.
@@ -1816,41 +2056,39 @@ class Tox:
         None, this function allocates memory for dht_id.
         :return: dht_id
 
+        """
+        return self.self_get_dht_id_bytes(dht_id).hex().upper()
+
+    def self_get_dht_id_bytes(self, dht_id=None) -> bytes:
+        """
+        As self_get_dht_id, but returns the raw TOX_PUBLIC_KEY_SIZE bytes.
         """
         if dht_id is None:
             dht_id = create_string_buffer(TOX_PUBLIC_KEY_SIZE)
         LOG_DEBUG(f"tox.self_get_dht_id")
         Tox.libtoxcore.tox_self_get_dht_id(self._tox_pointer, dht_id)
-        return bin_to_string(dht_id, TOX_PUBLIC_KEY_SIZE)
+        return bin_to_bytes(dht_id, TOX_PUBLIC_KEY_SIZE)
 
     def self_get_udp_port(self) -> int:
         """
         Return the UDP port this Tox instance is bound to.
         """
-        tox_err_get_port = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.self_get_udp_port")
-        result = Tox.libtoxcore.tox_self_get_udp_port(self._tox_pointer, byref(tox_err_get_port))
-        tox_err_get_port = tox_err_get_port.value
-        if tox_err_get_port == TOX_ERR_GET_PORT['OK']:
-            return int(result)
-        if tox_err_get_port == TOX_ERR_GET_PORT['NOT_BOUND']:
-            raise ToxError('The instance was not bound to any port.')
-        raise ToxError('The function did not return OK')
+        result = Tox.libtoxcore.tox_self_get_udp_port(self._tox_pointer, perror)
+        vCheckError(perror[0], dGET_PORT_ERRORS)
+        return int(result)
 
     def self_get_tcp_port(self) -> int:
         """
         Return the TCP port this Tox instance is bound to. This is only relevant if the instance is acting as a TCP
         relay.
         """
-        tox_err_get_port = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.self_get_tcp_port")
-        result = Tox.libtoxcore.tox_self_get_tcp_port(self._tox_pointer, byref(tox_err_get_port))
-        tox_err_get_port = tox_err_get_port.value
-        if tox_err_get_port == TOX_ERR_GET_PORT['OK']:
-            return int(result)
-        if tox_err_get_port == TOX_ERR_GET_PORT['NOT_BOUND']:
-            raise ToxError('The instance was not bound to any port.')
-        raise ToxError('The function did not return OK')
+        result = Tox.libtoxcore.tox_self_get_tcp_port(self._tox_pointer, perror)
+        vCheckError(perror[0], dGET_PORT_ERRORS)
+        return int(result)
 
     # Group chat instance management
 
@@ -1873,7 +2111,7 @@ class Tox:
         """
 
         LOG_DEBUG(f"tox.group_new")
-        error = c_int()
+        perror = oERROR.pointer
         if type(nick) != bytes:
             nick = bytes(nick, 'utf-8')
         if type(group_name) != bytes:
@@ -1883,15 +2121,13 @@ class Tox:
             result = Tox.libtoxcore.tox_group_new(self._tox_pointer,
                                                   privacy_state,
                                                   cgroup_name,
-                                                  c_size_t(len(group_name)),
-                                                  c_char_p(nick),
-                                                  c_size_t(len(nick)),
-                                                  byref(error))
+                                                  len(group_name),
+                                                  nick,
+                                                  len(nick),
+                                                  perror)
 
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_NEW)
-            LOG_ERROR(f"group_new {error.value} {s}")
-            raise ToxError(f"group_new {s} err={error.value}")
+        vCheckError(perror[0], dGROUP_NEW_ERRORS)
+        self._vChanged()
 
         # TypeError: '<' not supported between instances of 'c_uint' and 'int'
         return int(result)
@@ -1914,11 +2150,11 @@ class Tox:
         LOG_DEBUG(f"tox.group_join")
         assert chat_id, chat_id
         assert nick, nick
-        error = c_int()
+        perror = oERROR.pointer
         if type(nick) != bytes:
             nick = bytes(nick, 'utf-8')
         if password and type(password) != bytes:
-            nick = bytes(password, 'utf-8')
+            password = bytes(password, 'utf-8')
         if False: # API change
             peer_info = self.group_self_peer_info_new()
             peer_info.contents.nick = c_char_p(nick)
@@ -1929,7 +2165,7 @@ class Tox:
                                                    password,
                                                    len(password) if password else 0,
                                                    peer_info,
-                                                   byref(error))
+                                                   perror)
         else:
             if not password:
                 cpassword = None
@@ -1937,17 +2173,15 @@ class Tox:
                 cpassword = c_char_p(password)
             result = Tox.libtoxcore.tox_group_join(self._tox_pointer,
                                                    string_to_bin_charp(chat_id),
-                                                   c_char_p(nick),
-                                                   c_size_t(len(nick)),
+                                                   nick,
+                                                   len(nick),
                                                    cpassword,
-                                                   c_size_t(len(password)) if password else 0,
+                                                   len(password) if password else 0,
 
-                                                   byref(error))
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_JOIN)
-            LOG_ERROR(f"group_new err={error.value} {s}")
-            raise ToxError(f"group_new {s} err={error.value}")
-        LOG_INFO(f"group_new result={result} chat_id={chat_id}")
+                                                   perror)
+        vCheckError(perror[0], dGROUP_JOIN_ERRORS)
+        LOG_INFO("group_new result=%s chat_id=%s", result, chat_id)
+        self._vChanged()
 
         return int(result)
 
@@ -1964,41 +2198,31 @@ class Tox:
 
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_reconnect")
         result = Tox.libtoxcore.tox_group_reconnect(self._tox_pointer,
-                                                    c_uint32(group_number),
-                                                    byref(error))
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_RECONNECT)
-            LOG_ERROR(f"group_new {error.value} {s}")
-            raise ToxError(f"group_new {s} err={error.value}")
+                                                    group_number,
+                                                    perror)
+        vCheckError(perror[0], dGROUP_RECONNECT_ERRORS)
         return bool(result)
 
     def group_is_connected(self, group_number) -> bool:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_is_connected")
-        result = Tox.libtoxcore.tox_group_is_connected(self._tox_pointer, c_uint32(group_number), byref(error))
-        if error.value:
-            # TOX_ERR_GROUP_IS_CONNECTED_GROUP_NOT_FOUND
-            s = sGetError(error.value, TOX_ERR_GROUP_IS_CONNECTED)
-            LOG_ERROR(f"group_new err={error.value} {s}")
-            raise ToxError("group_is_connected err={error.value} {s}")
+        result = Tox.libtoxcore.tox_group_is_connected(self._tox_pointer, group_number, perror)
+        vCheckError(perror[0], dGROUP_IS_CONNECTED_ERRORS)
         return bool(result)
 
     def group_disconnect(self, group_number: int) -> bool:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_disconnect")
-        result = Tox.libtoxcore.tox_group_disconnect(self._tox_pointer, c_uint32(group_number), byref(error))
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_DISCONNECT)
-            LOG_ERROR(f"group_disconnect {error.value} {s}")
-            raise ToxError(f"group_disconnect {s} err={error.value}")
+        result = Tox.libtoxcore.tox_group_disconnect(self._tox_pointer, group_number, perror)
+        vCheckError(perror[0], dGROUP_DISCONNECT_ERRORS)
         return bool(result)
 
     def group_leave(self, group_number: int, message: str=None) -> bool:
@@ -2020,16 +2244,16 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
         LOG_DEBUG(f"tox.leave")
-        error = c_int()
+        perror = oERROR.pointer
         f = Tox.libtoxcore.tox_group_leave
-        f.restype = c_bool
         if message is not None and type(message) != bytes:
             message = bytes(message, 'utf-8')
-        result = f(self._tox_pointer, c_uint32(group_number), message,
-                   c_size_t(len(message)) if message else 0, byref(error))
-        if error.value:
-            LOG_ERROR(f"group_leave err={error.value}")
-            raise ToxError("group_leave err={error.value}")
+        result = f(self._tox_pointer, group_number, message,
+                   len(message) if message else 0, perror)
+        vCheckError(perror[0], dGROUP_LEAVE_ERRORS)
+        if self._store is not None:
+            self._store.vForgetGroup(group_number)
+        self._vChanged()
         return bool(result)
 
     # Group user-visible client information (nickname/status/role/public key)
@@ -2049,14 +2273,12 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         if type(name) != bytes:
-            topic = bytes(name, 'utf-8')
+            name = bytes(name, 'utf-8')
         LOG_DEBUG(f"tox.group_self_set_name")
-        result = Tox.libtoxcore.tox_group_self_set_name(self._tox_pointer, c_uint32(group_number), name, c_size_t(len(name)), byref(error))
-        if error.value:
-            LOG_ERROR(f"group_self_set_name err={error.value}")
-            raise ToxError("group_self_set_name err={error.value}")
+        result = Tox.libtoxcore.tox_group_self_set_name(self._tox_pointer, group_number, name, len(name), perror)
+        vCheckError(perror[0], dGROUP_SELF_NAME_SET_ERRORS)
         return bool(result)
 
     def group_self_get_name_size(self, group_number: int) -> int:
@@ -2070,14 +2292,12 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_TRACE(f"tox_group_self_get_name_size")
         result = Tox.libtoxcore.tox_group_self_get_name_size(self._tox_pointer,
-                                                             c_uint32(group_number),
-                                                             byref(error))
-        if error.value:
-            LOG_ERROR(f"group_self_get_name_size err={error.value}")
-            raise ToxError("group_self_get_name_size err={error.value}")
+                                                             group_number,
+                                                             perror)
+        vCheckError(perror[0], dGROUP_SELF_QUERY_ERRORS)
         return int(result)
 
     def group_self_get_name(self, group_number: int) -> str:
@@ -2095,17 +2315,15 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         size = self.group_self_get_name_size(group_number)
         name = create_string_buffer(size)
         LOG_DEBUG(f"tox.group_self_get_name")
         result = Tox.libtoxcore.tox_group_self_get_name(self._tox_pointer,
-                                                        c_uint32(group_number),
+                                                        group_number,
                                                         name,
-                                                        byref(error))
-        if error.value:
-            LOG_ERROR(f"group_self_get_name err={error.value}")
-            raise ToxError("group_self_get_name err={error.value}")
+                                                        perror)
+        vCheckError(perror[0], dGROUP_SELF_QUERY_ERRORS)
         return str(name[:size], 'utf-8', errors='ignore')
 
     def group_self_set_status(self, group_number: int, status: int) -> bool:
@@ -2117,15 +2335,13 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_self_set_status")
         result = Tox.libtoxcore.tox_group_self_set_status(self._tox_pointer,
-                                                          c_uint32(group_number),
-                                                          c_uint32(status),
-                                                          byref(error))
-        if error.value:
-            LOG_ERROR(f"group_self_set_status err={error.value}")
-            raise ToxError("group_self_set_status err={error.value}")
+                                                          group_number,
+                                                          status,
+                                                          perror)
+        vCheckError(perror[0], dGROUP_SELF_STATUS_SET_ERRORS)
         return bool(result)
 
     def group_self_get_status(self, group_number: int) -> int:
@@ -2136,12 +2352,10 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_self_get_status")
-        result = Tox.libtoxcore.tox_group_self_get_status(self._tox_pointer, c_uint32(group_number), byref(error))
-        if error.value:
-            LOG_ERROR(f"group_self_get_status err={error.value}")
-            raise ToxError("group_self_get_status err={error.value}")
+        result = Tox.libtoxcore.tox_group_self_get_status(self._tox_pointer, group_number, perror)
+        vCheckError(perror[0], dGROUP_SELF_QUERY_ERRORS)
         return int(result)
 
     def group_self_get_role(self, group_number: int) -> int:
@@ -2152,12 +2366,10 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_self_get_role")
-        result = Tox.libtoxcore.tox_group_self_get_role(self._tox_pointer, c_uint32(group_number), byref(error))
-        if error.value:
-            LOG_ERROR(f"group_self_get_role err={error.value}")
-            raise ToxError(f"group_self_get_role err={error.value}")
+        result = Tox.libtoxcore.tox_group_self_get_role(self._tox_pointer, group_number, perror)
+        vCheckError(perror[0], dGROUP_SELF_QUERY_ERRORS)
         return int(result)
 
     def group_self_get_peer_id(self, group_number: int) -> int:
@@ -2168,12 +2380,10 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_self_get_peer_id")
-        result = Tox.libtoxcore.tox_group_self_get_peer_id(self._tox_pointer, c_uint32(group_number), byref(error))
-        if error.value:
-            LOG_ERROR(f"tox.group_self_get_peer_id err={error.value}")
-            raise ToxError("tox_group_self_get_peer_id err={error.value}")
+        result = Tox.libtoxcore.tox_group_self_get_peer_id(self._tox_pointer, group_number, perror)
+        vCheckError(perror[0], dGROUP_SELF_QUERY_ERRORS)
         return int(result)
 
     def group_self_get_public_key(self, group_number: int) -> str:
@@ -2188,19 +2398,24 @@ class Tox:
 
         :return public key
         """
+        return self.group_self_get_public_key_bytes(group_number).hex().upper()
+
+    def group_self_get_public_key_bytes(self, group_number: int) -> bytes:
+        """
+        As group_self_get_public_key, but returns the raw
+        TOX_GROUP_PEER_PUBLIC_KEY_SIZE bytes.
+        """
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         key = create_string_buffer(TOX_GROUP_PEER_PUBLIC_KEY_SIZE)
         LOG_DEBUG(f"tox.group_self_get_public_key")
         result = Tox.libtoxcore.tox_group_self_get_public_key(self._tox_pointer,
-                                                              c_uint32(group_number),
-                                                              key, byref(error))
-        if error.value:
-            LOG_ERROR(f"tox.group_self_get_public_key {TOX_ERR_FRIEND_GET_PUBLIC_KEY[error.value]}")
-            raise ToxError(f"tox.group_self_get_public_key {TOX_ERR_FRIEND_GET_PUBLIC_KEY[error.value]}")
-        return bin_to_string(key, TOX_GROUP_PEER_PUBLIC_KEY_SIZE)
+                                                              group_number,
+                                                              key, perror)
+        vCheckError(perror[0], dGROUP_SELF_QUERY_ERRORS)
+        return bin_to_bytes(key, TOX_GROUP_PEER_PUBLIC_KEY_SIZE)
 
     # Peer-specific group state queries.
 
@@ -2215,11 +2430,9 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
-        result = Tox.libtoxcore.tox_group_peer_get_name_size(self._tox_pointer, c_uint32(group_number), c_uint32(peer_id), byref(error))
-        if error.value:
-            LOG_ERROR(f" err={error.value}")
-            raise ToxError(f" err={error.value}")
+        perror = oERROR.pointer
+        result = Tox.libtoxcore.tox_group_peer_get_name_size(self._tox_pointer, group_number, peer_id, perror)
+        vCheckError(perror[0], dGROUP_PEER_QUERY_ERRORS)
         LOG_TRACE(f"tox_group_peer_get_name_size")
         return int(result)
 
@@ -2241,19 +2454,15 @@ class Tox:
         """
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
-        error = c_int()
-        size = self.group_peer_get_name_size(group_number, peer_id)
-        name = create_string_buffer(size)
+        perror = oERROR.pointer
+        name = oBUFFERS.name
         LOG_DEBUG(f"tox.group_peer_get_name")
         result = Tox.libtoxcore.tox_group_peer_get_name(self._tox_pointer,
-                                                        c_uint32(group_number),
-                                                        c_uint32(peer_id),
-                                                        name, byref(error))
-        if error.value:
-            LOG_ERROR(f"tox.group_peer_get_name err={error.value}")
-            raise ToxError(f"tox_group_peer_get_name err={error.value}")
-        sRet = str(name[:], 'utf-8', errors='ignore')
-        return sRet
+                                                        group_number,
+                                                        peer_id,
+                                                        name, perror)
+        vCheckError(perror[0], dGROUP_PEER_QUERY_ERRORS)
+        return sReadBuffer(name)
 
     def group_peer_get_status(self, group_number: int, peer_id: int) -> int:
         """
@@ -2266,16 +2475,13 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 group_number={group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_peer_get_status")
         result = Tox.libtoxcore.tox_group_peer_get_status(self._tox_pointer,
-                                                          c_uint32(group_number),
-                                                          c_uint32(peer_id),
-                                                          byref(error))
-        if error.value:
-            # unwrapped
-            LOG_ERROR(f"tox.group_peer_get_status err={error.value}")
-            raise ToxError(f"tox.group_peer_get_status err={error.value}")
+                                                          group_number,
+                                                          peer_id,
+                                                          perror)
+        vCheckError(perror[0], dGROUP_PEER_QUERY_ERRORS)
         return int(result)
 
     def group_peer_get_role(self, group_number: int, peer_id: int) -> int:
@@ -2289,15 +2495,13 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_peer_get_role")
         result = Tox.libtoxcore.tox_group_peer_get_role(self._tox_pointer,
-                                                        c_uint32(group_number),
-                                                        c_uint32(peer_id),
-                                                        byref(error))
-        if error.value:
-            LOG_ERROR(f"tox.group_peer_get_role err={error.value}")
-            raise ToxError(f"tox.group_peer_get_role err={error.value}")
+                                                        group_number,
+                                                        peer_id,
+                                                        perror)
+        vCheckError(perror[0], dGROUP_PEER_QUERY_ERRORS)
         return int(result)
 
     def group_peer_get_public_key(self, group_number: int, peer_id: int) -> str:
@@ -2312,22 +2516,28 @@ class Tox:
 
         :return public key
 
+        """
+        return self.group_peer_get_public_key_bytes(group_number, peer_id).hex().upper()
+
+    def group_peer_get_public_key_bytes(self, group_number: int, peer_id: int) -> bytes:
+        """
+        As group_peer_get_public_key, but returns the raw
+        TOX_GROUP_PEER_PUBLIC_KEY_SIZE bytes.
         """
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         key = create_string_buffer(TOX_GROUP_PEER_PUBLIC_KEY_SIZE)
         LOG_DEBUG(f"tox.group_peer_get_public_key")
         result = Tox.libtoxcore.tox_group_peer_get_public_key(self._tox_pointer,
-                                                              c_uint32(group_number),
-                                                              c_uint32(peer_id),
-                                                              key, byref(error))
-        if error.value:
-            LOG_ERROR(f"tox.group_peer_get_public_key err={error.value}")
-            raise ToxError(f"tox.group_peer_get_public_key err={error.value}")
-        return bin_to_string(key, TOX_GROUP_PEER_PUBLIC_KEY_SIZE)
+                                                              group_number,
+                                                              peer_id,
+                                                              key, perror)
+        vCheckError(perror[0], dGROUP_PEER_QUERY_ERRORS)
+        return bin_to_bytes(key, TOX_GROUP_PEER_PUBLIC_KEY_SIZE)
 
+    @guarded
     def callback_group_peer_name(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_peer_name` event. Pass NULL to unset.
@@ -2335,7 +2545,7 @@ class Tox:
         """
         if callback is None:
             Tox.libtoxcore.tox_callback_group_peer_name(self._tox_pointer,
-                                                        POINTER(None)(), user_data)
+                                                        POINTER(None)())
             self.group_peer_name_cb = None
             return
 
@@ -2348,6 +2558,7 @@ class Tox:
             LOG_ERROR(f"tox.callback_conference_peer_name")
         return None
 
+    @guarded
     def callback_group_peer_status(self, callback: Callable, user_data) -> int:
         """
         Set the callback for the `group_peer_status` event. Pass NULL to unset.
@@ -2385,22 +2596,20 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         if type(topic) != bytes:
             topic = bytes(topic, 'utf-8')
         try:
             LOG_DEBUG(f"tox.group_set_topic")
             result = Tox.libtoxcore.tox_group_set_topic(self._tox_pointer,
-                                                        c_uint32(group_number),
-                                                        c_char_p(topic),
-                                                        c_size_t(len(topic)),
-                                                        byref(error))
+                                                        group_number,
+                                                        topic,
+                                                        len(topic),
+                                                        perror)
         except Exception as e:
             LOG_WARN(f" Exception {e}")
             return None
-        if error.value:
-            LOG_ERROR(f"group_set_topic err={error.value}")
-            raise ToxError("group_set_topic err={error.value}")
+        vCheckError(perror[0], dGROUP_TOPIC_SET_ERRORS)
         return bool(result)
 
     def group_get_topic_size(self, group_number: int) -> int:
@@ -2414,18 +2623,16 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_TRACE(f"tox_group_get_topic_size")
         try:
             result = Tox.libtoxcore.tox_group_get_topic_size(self._tox_pointer,
-                                                             c_uint32(group_number),
-                                                             byref(error))
+                                                             group_number,
+                                                             perror)
         except Exception as e:
             LOG_WARN(f" Exception {e}")
             return None
-        if error.value:
-            LOG_ERROR(f"tox_group_get_topic_size err={error.value}")
-            raise ToxError(f"tox_group_get_topic_size err={error.value}")
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
         return int(result)
 
     def group_get_topic(self, group_number: int) -> str:
@@ -2440,17 +2647,14 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
-        size = self.group_get_topic_size(group_number)
-        topic = create_string_buffer(size)
+        perror = oERROR.pointer
+        topic = oBUFFERS.topic
         LOG_DEBUG(f"tox.group_get_topic")
         result = Tox.libtoxcore.tox_group_get_topic(self._tox_pointer,
-                                                    c_uint32(group_number),
-                                                    topic, byref(error))
-        if error.value:
-            LOG_ERROR(f" err={error.value}")
-            raise ToxError(f" err={error.value}")
-        return str(topic[:size], 'utf-8', errors='ignore')
+                                                    group_number,
+                                                    topic, perror)
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
+        return sReadBuffer(topic)
 
     def group_get_name_size(self, group_number: int) -> int:
         """
@@ -2459,13 +2663,11 @@ class Tox:
         """
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
-        error = c_int()
+        perror = oERROR.pointer
         result = Tox.libtoxcore.tox_group_get_name_size(self._tox_pointer,
-                                                        c_uint32(group_number),
-                                                        byref(error))
-        if error.value:
-            LOG_ERROR(f" err={error.value}")
-            raise ToxError(f" err={error.value}")
+                                                        group_number,
+                                                        perror)
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
         LOG_TRACE(f"tox_group_get_name_size")
         return int(result)
 
@@ -2478,17 +2680,14 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
-        size = self.group_get_name_size(group_number)
-        name = create_string_buffer(size)
+        perror = oERROR.pointer
+        name = oBUFFERS.group_name
         LOG_DEBUG(f"tox.group_get_name")
         result = Tox.libtoxcore.tox_group_get_name(self._tox_pointer,
-                                                   c_uint32(group_number),
-                                                   name, byref(error))
-        if error.value:
-            LOG_ERROR(f"group_get_name err={error.value}")
-            raise ToxError(f"group_get_name err={error.value}")
-        return str(name[:size], 'utf-8', errors='ignore')
+                                                   group_number,
+                                                   name, perror)
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
+        return sReadBuffer(name)
 
     def group_get_chat_id(self, group_number: int) -> str:
         """
@@ -2496,28 +2695,23 @@ class Tox:
         `chat_id` should have room for at least TOX_GROUP_CHAT_ID_SIZE bytes.
         :return chat id. or None if not found.
         """
-        LOG_INFO(f"tox.group_get_chat_id group_number={group_number}")
+        LOG_INFO("tox.group_get_chat_id group_number=%s", group_number)
         if group_number < 0:
             LOG_ERROR(f"group_get_chat_id group_number < 0 group_number={group_number}")
             raise ToxError(f"group_get_chat_id group_number < 0 group_number={group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         buff = create_string_buffer(TOX_GROUP_CHAT_ID_SIZE)
         result = Tox.libtoxcore.tox_group_get_chat_id(self._tox_pointer,
-                                                      c_uint32(group_number),
-                                                      buff, byref(error))
-        if error.value:
-            if error.value == 1:
-                LOG_ERROR(f"tox.group_get_chat_id ERROR GROUP_STATE_QUERIES_GROUP_NOT_FOUND group_number={group_number}")
-            else:
-                LOG_ERROR(f"tox.group_get_chat_id group_number={group_number} err={error.value}")
-            raise ToxError(f"tox_group_get_chat_id err={error.value} group_number={group_number}")
+                                                      group_number,
+                                                      buff, perror)
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
 #
 # QObject::setParent: Cannot set parent, new parent is in a different thread
 # QObject::installEventFilter(): Cannot filter events for objects in a different thread.
 # QBasicTimer::start: Timers cannot be started from another thread
         result = bin_to_string(buff, TOX_GROUP_CHAT_ID_SIZE)
-        LOG_DEBUG(f"tox.group_get_chat_id group_number={group_number} result={result}")
+        LOG_DEBUG("tox.group_get_chat_id group_number=%s result=%s", group_number, result)
 
         return result
 
@@ -2531,7 +2725,7 @@ class Tox:
         except Exception as e:
             LOG_WARN(f"tox.group_get_number_groups EXCEPTION {e}")
             result = 0
-        LOG_INFO(f"tox.group_get_number_groups returning {result}")
+        LOG_INFO("tox.group_get_number_groups returning %s", result)
         return int(result)
 
     def groups_get_list(self):
@@ -2556,14 +2750,12 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"group_get_privacy_state group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_get_privacy_state")
         result = Tox.libtoxcore.tox_group_get_privacy_state(self._tox_pointer,
-                                                            c_uint32(group_number),
-                                                            byref(error))
-        if error.value:
-            LOG_ERROR(f"tox.group_get_privacy_state err={error.value}")
-            raise ToxError(f"tox.group_get_privacy_state err={error.value}")
+                                                            group_number,
+                                                            perror)
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
         return int(result)
 
     def group_get_peer_limit(self, group_number: int) -> int:
@@ -2579,14 +2771,12 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_get_peer_limit")
         result = Tox.libtoxcore.tox_group_get_peer_limit(self._tox_pointer,
-                                                         c_uint(group_number),
-                                                         byref(error))
-        if error.value:
-            LOG_ERROR(f"tox.group_get_peer_limit err={error.value}")
-            raise ToxError(f"tox.group_get_peer_limit err={error.value}")
+                                                         group_number,
+                                                         perror)
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
         return int(result)
 
     def group_get_password_size(self, group_number: int) -> int:
@@ -2597,13 +2787,11 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_TRACE(f"tox_group_get_password_size")
         result = Tox.libtoxcore.tox_group_get_password_size(self._tox_pointer,
-                                                            c_uint(group_number), byref(error))
-        if error.value:
-            LOG_ERROR(f"group_get_password_size err={error.value}")
-            raise ToxError(f"group_get_password_size err={error.value}")
+                                                            group_number, perror)
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
         return result
 
     def group_get_password(self, group_number: int) -> str:
@@ -2622,18 +2810,17 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         size = self.group_get_password_size(group_number)
         password = create_string_buffer(size)
         LOG_DEBUG(f"tox.group_get_password")
         result = Tox.libtoxcore.tox_group_get_password(self._tox_pointer,
-                                                       c_uint(group_number),
-                                                       password, byref(error))
-        if error.value:
-            LOG_ERROR(f"group_get_password err={error.value}")
-            raise ToxError(f"group_get_password err={error.value}")
+                                                       group_number,
+                                                       password, perror)
+        vCheckError(perror[0], dGROUP_STATE_QUERIES_ERRORS)
         return str(password[:size], 'utf-8', errors='ignore')
 
+    @guarded
     def callback_group_topic(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_topic` event. Pass NULL to unset.
@@ -2653,6 +2840,7 @@ class Tox:
         except Exception as e:
             LOG_WARN(f" Exception {e}")
 
+    @guarded
     def callback_group_privacy_state(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_privacy_state` event. Pass NULL to unset.
@@ -2672,6 +2860,7 @@ class Tox:
         except Exception as e:
             LOG_WARN(f" Exception {e}")
 
+    @guarded
     def callback_group_peer_limit(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_peer_limit` event. Pass NULL to unset.
@@ -2691,6 +2880,7 @@ class Tox:
         except Exception as e:
             LOG_WARN(f" Exception {e}")
 
+    @guarded
     def callback_group_password(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_password` event. Pass NULL to unset.
@@ -2740,17 +2930,15 @@ class Tox:
         if type(data) != bytes:
             data = bytes(data, 'utf-8')
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_send_custom_packet")
         result = Tox.libtoxcore.tox_group_send_custom_packet(self._tox_pointer,
-                                                             c_uint(group_number),
+                                                             group_number,
                                                              lossless,
                                                              data,
-                                                             c_size_t(len(data)),
-                                                             byref(error))
-        if error.value:
-            LOG_ERROR(f"group_send_custom_packet err={error.value}")
-            raise ToxError(f"group_send_custom_packet err={error.value}")
+                                                             len(data),
+                                                             perror)
+        vCheckError(perror[0], dGROUP_SEND_CUSTOM_PACKET_ERRORS)
         return bool(result)
 
     def group_send_private_message(self, group_number: int, peer_id: int, message_type: int, message: str) -> bool:
@@ -2775,22 +2963,42 @@ class Tox:
 
         if type(message) != bytes:
             message = bytes(message, 'utf-8')
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"group_send_private_message")
         result = Tox.libtoxcore.tox_group_send_private_message(self._tox_pointer,
-                                                               c_uint(group_number),
-                                                               c_uint32(peer_id),
-                                                               c_uint32(message_type),
+                                                               group_number,
+                                                               peer_id,
+                                                               message_type,
                                                                message,
-                                                               c_size_t(len(message)),
-                                                               byref(error))
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_SEND_PRIVATE_MESSAGE)
-            LOG_ERROR(f"group_send_private_message {error.value} {s}")
-            raise ToxError(f"group_send_private_message {error.value} {s}")
+                                                               len(message),
+                                                               perror)
+        vCheckError(perror[0], dGROUP_SEND_PRIVATE_MESSAGE_ERRORS)
+        if self._store is not None:
+            self._store.vSent(dKINDS['group_private'], group_number, peer_id, message_type, message)
 
         return bool(result)
 
+    def group_send_private_long_message(self, group_number: int, peer_id: int, message_type: int,
+                                        message) -> list:
+        """
+        Send a text message of any length to a peer in a group, as group_send_private_message, in fragments of
+        at most TOX_MAX_MESSAGE_LENGTH bytes cut between characters, see toxmessages.py.
+
+        :return: the results of the fragments, True for each
+        """
+        if group_number < 0:
+            raise ToxError(f"tox_group_ group_number < 0 {group_number}")
+        LOG_DEBUG(f"tox.group_send_private_long_message")
+        send = Tox.libtoxcore.tox_group_send_private_message
+        pTox = self._tox_pointer
+        def vRecord(lResults, data) -> None:
+            if self._store is not None:
+                self._store.vSent(dKINDS['group_private'], group_number, peer_id, message_type, data)
+        return self._lSendFragments(
+            message, lambda fragment, perror: bool(send(pTox, group_number, peer_id, message_type,
+                                                        fragment, len(fragment), perror)),
+            dGROUP_SEND_PRIVATE_MESSAGE_ERRORS, vRecord)
+
     def group_send_message(self, group_number: int, message_type: int, message: str) -> bool:
         """
         Send a text chat message to the group.
@@ -2811,31 +3019,52 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         # uint32_t message_id = 0;
-        message_id = c_int() # or POINTER(None)()
+        message_id = c_uint32()
         if type(message) != bytes:
             message = bytes(message, 'utf-8')
         LOG_DEBUG(f"tox.group_send_message")
         # bool tox_group_send_message(const Tox *tox, uint32_t group_number, Tox_Message_Type type, const uint8_t *message, size_t length, uint32_t *message_id, Tox_Err_Group_Send_Message *error)
         result = Tox.libtoxcore.tox_group_send_message(self._tox_pointer,
-                                                       c_uint(group_number),
-                                                       c_uint32(message_type),
-                                                       c_char_p(message),
-                                                       c_size_t(len(message)),
+                                                       group_number,
+                                                       message_type,
+                                                       message,
+                                                       len(message),
                                                        # dunno
                                                        byref(message_id),
-                                                       byref(error))
+                                                       perror)
 
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_SEND_MESSAGE)
-            LOG_ERROR(f"group_send_message {error.value} {s}")
-            raise ToxError(f"group_send_message {error.value} {s}")
+        vCheckError(perror[0], dGROUP_SEND_MESSAGE_ERRORS)
+        if self._store is not None:
+            self._store.vSent(dKINDS['group'], group_number, 0, message_type, message)
 
         return bool(result)
 
+    def group_send_long_message(self, group_number: int, message_type: int, message) -> list:
+        """
+        Send a text message of any length to a group, as group_send_message, in fragments of at most
+        TOX_MAX_MESSAGE_LENGTH bytes cut between characters, see toxmessages.py.
+
+        :return: the message IDs of the fragments
+        """
+        if group_number < 0:
+            raise ToxError(f"tox_group_ group_number < 0 {group_number}")
+        LOG_DEBUG(f"tox.group_send_long_message")
+        send = Tox.libtoxcore.tox_group_send_message
+        pTox = self._tox_pointer
+        message_id = c_uint32()
+        def iSend(fragment, perror) -> int:
+            send(pTox, group_number, message_type, fragment, len(fragment), byref(message_id), perror)
+            return message_id.value
+        def vRecord(lMessageIds, data) -> None:
+            if self._store is not None:
+                self._store.vSent(dKINDS['group'], group_number, 0, message_type, data)
+        return self._lSendFragments(message, iSend, dGROUP_SEND_MESSAGE_ERRORS, vRecord)
+
     # Group message receiving
 
+    @guarded
     def callback_group_message(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_message` event. Pass NULL to unset.
@@ -2863,6 +3092,7 @@ class Tox:
         except Exception as e:
             LOG_ERROR(f"tox.callback_group_message {e}")
 
+    @guarded
     def callback_group_private_message(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_private_message` event. Pass NULL to unset.
@@ -2877,6 +3107,7 @@ class Tox:
         except Exception as e:
             LOG_ERROR(f"tox.callback_group_private_message {e}") # req
 
+    @guarded
     def callback_group_custom_packet(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_custom_packet` event. Pass NULL to unset.
@@ -2910,13 +3141,10 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_invite_friend")
-        result = Tox.libtoxcore.tox_group_invite_friend(self._tox_pointer, c_uint(group_number), c_uint32(friend_number), byref(error))
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_INVITE_FRIEND)
-            LOG_ERROR(f"group_invite_friend {error.value} {s}")
-            raise ToxError(f"group_invite_friend {error.value} {s}")
+        result = Tox.libtoxcore.tox_group_invite_friend(self._tox_pointer, group_number, friend_number, perror)
+        vCheckError(perror[0], dGROUP_INVITE_FRIEND_ERRORS)
         return bool(result)
 
     # API change - this no longer exists
@@ -2939,9 +3167,8 @@ class Tox:
         :return the group_number on success, UINT32_MAX on failure.
         """
 
-        error = c_int()
+        perror = oERROR.pointer
         f = Tox.libtoxcore.tox_group_invite_accept
-        f.restype = c_uint32
         if nick and type(nick) == str:
             nick = bytes(nick, 'utf-8')
         else:
@@ -2960,26 +3187,25 @@ class Tox:
             peer_info.contents.nick = c_char_p(nick)
             peer_info.contents.nick_length = len(nick)
             peer_info.contents.user_status = status
-        LOG_INFO(f"group_invite_accept friend_number={friend_number} nick={nick} {invite_data}")
+        LOG_INFO("group_invite_accept friend_number=%s nick=%s %s", friend_number, nick, invite_data)
         try:
             assert type(invite_data) == bytes
             result = f(self._tox_pointer,
-                       c_uint32(friend_number),
+                       friend_number,
                        invite_data,
-                       c_size_t(len(invite_data)),
-                       c_char_p(nick),
-                       c_size_t(len(nick)),
-                       c_char_p(password), len(password) if password is not None else 0,
-                       byref(error))
+                       len(invite_data),
+                       nick,
+                       len(nick),
+                       password, len(password) if password is not None else 0,
+                       perror)
         except Exception as e:
             LOG_ERROR(f"group_invite_accept ERROR {e}")
             raise ToxError(f"group_invite_accept ERROR {e}")
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_INVITE_ACCEPT)
-            LOG_ERROR(f"group_invite_friend {error.value} {s}")
-            raise ToxError(f"group_invite_accept {s} err={error.value}")
+        vCheckError(perror[0], dGROUP_INVITE_ACCEPT_ERRORS)
+        self._vChanged()
         return result
 
+    @guarded
     def callback_group_invite(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_invite` event. Pass NULL to unset.
@@ -3007,6 +3233,7 @@ class Tox:
         except Exception as e:
             LOG_DEBUG(f"tox.callback_conference_invite")
 
+    @guarded
     def callback_group_peer_join(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_peer_join` event. Pass NULL to unset.
@@ -3032,6 +3259,7 @@ class Tox:
         except Exception as e:
             LOG_ERROR(f"callback_group_peer_join {e}") # req
 
+    @guarded
     def callback_group_peer_exit(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_peer_exit` event. Pass NULL to unset.
@@ -3063,6 +3291,7 @@ class Tox:
         else:
             LOG_DEBUG(f"tox.callback_group_peer_exit")
 
+    @guarded
     def callback_group_self_join(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_self_join` event. Pass NULL to unset.
@@ -3091,6 +3320,7 @@ class Tox:
         else:
             LOG_DEBUG(f"tox.callback_group_self_join")
 
+    @guarded
     def callback_group_join_fail(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_join_fail` event. Pass NULL to unset.
@@ -3129,15 +3359,15 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_founder_set_password")
-        result = Tox.libtoxcore.tox_group_founder_set_password(self._tox_pointer, c_uint(group_number), password,
-                                                               c_size_t(len(password)),
-                                                               byref(error))
-        if error.value:
-            s = sGetError(error.value, TOX_ERR_GROUP_FOUNDER_SET_PASSWORD)
-            LOG_ERROR(f"group_founder_set_password {error.value} {s}")
-            raise ToxError(f"group_founder_set_password {s} err={error.value}")
+        if password is not None and type(password) != bytes:
+            password = bytes(password, 'utf-8')
+        result = Tox.libtoxcore.tox_group_founder_set_password(self._tox_pointer, group_number, password,
+                                                               len(password) if password else 0,
+                                                               perror)
+        vCheckError(perror[0], dGROUP_FOUNDER_SET_PASSWORD_ERRORS)
+        self._vChanged()
         return bool(result)
 
     def group_founder_set_privacy_state(self, group_number: int, privacy_state: int) -> bool:
@@ -3158,13 +3388,12 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_founder_set_privacy_state")
-        result = Tox.libtoxcore.tox_group_founder_set_privacy_state(self._tox_pointer, c_uint(group_number), privacy_state,
-                                                                    byref(error))
-        if error.value:
-            LOG_ERROR(f"group_founder_set_privacy_state err={error.value}")
-            raise ToxError(f"group_founder_set_privacy_state err={error.value}")
+        result = Tox.libtoxcore.tox_group_founder_set_privacy_state(self._tox_pointer, group_number, privacy_state,
+                                                                    perror)
+        vCheckError(perror[0], dGROUP_FOUNDER_SET_PRIVACY_STATE_ERRORS)
+        self._vChanged()
         return bool(result)
 
     def group_founder_set_peer_limit(self, group_number: int, max_peers: int) -> bool:
@@ -3182,15 +3411,14 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_founder_set_peer_limit")
         result = Tox.libtoxcore.tox_group_founder_set_peer_limit(self._tox_pointer,
-                                                                 c_uint(group_number),
+                                                                 group_number,
                                                                  max_peers,
-                                                                 byref(error))
-        if error.value:
-            LOG_ERROR(f"group_founder_set_peer_limit err={error.value}")
-            raise ToxError(f"group_founder_set_peer_limit err={error.value}")
+                                                                 perror)
+        vCheckError(perror[0], dGROUP_FOUNDER_SET_PEER_LIMIT_ERRORS)
+        self._vChanged()
         return bool(result)
 
     # Group chat moderation
@@ -3212,17 +3440,16 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_mod_set_role")
         result = Tox.libtoxcore.tox_group_mod_set_role(self._tox_pointer,
-                                                       c_uint(group_number),
-                                                       c_uint32(peer_id),
-                                                       c_uint32(role), byref(error))
-        if error.value:
-            LOG_ERROR(f"group_mod_set_role err={error.value}")
-            raise ToxError(f"group_mod_set_role err={error.value}")
+                                                       group_number,
+                                                       peer_id,
+                                                       role, perror)
+        vCheckError(perror[0], dGROUP_MOD_SET_ROLE_ERRORS)
         return bool(result)
 
+    @guarded
     def callback_group_moderation(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `group_moderation` event. Pass NULL to unset.
@@ -3265,14 +3492,12 @@ class Tox:
         if group_number < 0:
             raise ToxError(f"tox_group_ group_number < 0 {group_number}")
 
-        error = c_int()
+        perror = oERROR.pointer
         LOG_DEBUG(f"tox.group_set_ignore")
         result = Tox.libtoxcore.tox_group_set_ignore(self._tox_pointer,
-                                                     c_uint32(group_number),
-                                                     c_uint32(peer_id),
-                                                     c_bool(ignore),
-                                                     byref(error))
-        if error.value:
-            LOG_ERROR(f"tox.group_set_ignore err={error.value}")
-            raise ToxError("tox_group_set_ignore err={error.value}")
+                                                     group_number,
+                                                     peer_id,
+                                                     ignore,
+                                                     perror)
+        vCheckError(perror[0], dGROUP_TOGGLE_IGNORE_ERRORS)
         return bool(result)
@@ -0,0 +1,274 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# An asyncio driver for Tox and ToxAV, in place of an iterate thread per
+# instance like the ToxIterateThread of toxygen_echo.py.
+#
+# AsyncTox schedules Tox.iterate on the event loop with call_later, every
+# iteration_interval() milliseconds, and ToxAV.iterate on its own timer.
+# The callbacks run during iterate on the loop thread, so they put the
+# events straight on asyncio queues, and any number of instances can share
+# one loop:
+#
+#   oAsync = AsyncTox(tox)
+#   oAsync.start()
+#   async for tRecord in oAsync.messages():
+#       sEvent, friend_number, message_type, message, length = tRecord
+#       await oAsync.send_message(friend_number, message)
+#
+# The records are those of toxevents.py: a tuple of the event name and the
+# callback arguments without the tox pointer and user_data, with byte
+# arrays as bytes. Each stream has its own bounded queue; when a consumer
+# falls behind, newer events for it are dropped and counted, as iterate
+# cannot wait.
+#
+# The send methods await the next iterate and retry while the send queue
+# of libtoxcore is full (SENDQ), which is the backpressure on a sender.
+# Everything here must be called on the thread running the loop.
+
+import asyncio
+try:
+    from wrapper import toxlog
+    from wrapper.toxcore_enums_and_consts import (TOX_ERR_FILE_SEND_CHUNK,
+                                                  TOX_ERR_FRIEND_CUSTOM_PACKET,
+                                                  TOX_ERR_FRIEND_SEND_MESSAGE,
+                                                  TOX_MESSAGE_TYPE)
+    from wrapper.toxcore_errors import oERROR
+    from wrapper.toxdispatch import dCALLBACK_ARGTYPES, tCopyArgs
+except:
+    import toxlog
+    from toxcore_enums_and_consts import (TOX_ERR_FILE_SEND_CHUNK,
+                                          TOX_ERR_FRIEND_CUSTOM_PACKET,
+                                          TOX_ERR_FRIEND_SEND_MESSAGE,
+                                          TOX_MESSAGE_TYPE)
+    from toxcore_errors import oERROR
+    from toxdispatch import dCALLBACK_ARGTYPES, tCopyArgs
+
+toxlog.vRegister(globals())
+
+lGROUP_EVENTS = [sEvent for sEvent in dCALLBACK_ARGTYPES if sEvent.startswith('group_')]
+
+class EventStream:
+    """An async iterator over the records of some events of an AsyncTox.
+    Close it with aclose(), or leave the async for with break."""
+
+    def __init__(self, oAsync, lEvents: list, maxsize: int):
+        self._oAsync = oAsync
+        self._lEvents = lEvents
+        self._queue = asyncio.Queue(maxsize)
+        self._bClosed = False
+        self.dropped = 0
+        dispatcher = oAsync.tox.get_dispatcher()
+        self._lHandlers = []
+        for sEvent in lEvents:
+            handler = self._oHandler(sEvent)
+            dispatcher.subscribe(sEvent, handler)
+            self._lHandlers.append((sEvent, handler))
+
+    def _oHandler(self, sEvent: str):
+        put = self._queue.put_nowait
+        def vHandler(pTox, *args) -> None:
+            # the pointers are only valid during the callback: copy now
+            try:
+                put((sEvent,) + tCopyArgs(sEvent, args[:-1]))
+            except asyncio.QueueFull:
+                self.dropped += 1
+                LOG_DEBUG("async %s stream full, dropped %d", sEvent, self.dropped)
+        return vHandler
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> tuple:
+        if self._bClosed and self._queue.empty():
+            raise StopAsyncIteration
+        tRecord = await self._queue.get()
+        if tRecord is None:
+            raise StopAsyncIteration
+        return tRecord
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def close(self) -> None:
+        """Stop receiving; the records already queued can still be read."""
+        if self._bClosed:
+            return
+        self._bClosed = True
+        dispatcher = self._oAsync.tox.get_dispatcher()
+        for sEvent, handler in self._lHandlers:
+            dispatcher.unsubscribe(sEvent, handler)
+        self._lHandlers = []
+        self._oAsync._lStreams.remove(self)
+        try:
+            self._queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def aclose(self) -> None:
+        self.close()
+
+class AsyncTox:
+    """Drives a Tox instance, and optionally its ToxAV, on an asyncio loop."""
+
+    def __init__(self, tox, toxav=None, events: bool=False, maxsize: int=4096, user_data=None):
+        """
+        :param tox: the Tox instance
+        :param toxav: a ToxAV instance of tox to iterate as well, or None
+        :param events: iterate with Tox.events_iterate instead of Tox.iterate
+        :param maxsize: the default size of the queue of each stream
+        """
+        self.tox = tox
+        self.toxav = toxav
+        self._bEvents = events
+        self._iMaxsize = maxsize
+        self._user_data = user_data
+        self._loop = None
+        self._oTimer = None
+        self._oAVTimer = None
+        self._oIterated = None
+        self._lStreams = []
+        self.iterations = 0
+
+    # Scheduling
+
+    def start(self, loop=None) -> None:
+        """Start iterating on loop, by default the running loop."""
+        if self._loop is not None:
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._oIterated = self._loop.create_future()
+        self._oTimer = self._loop.call_soon(self._vIterate)
+        if self.toxav is not None:
+            self._oAVTimer = self._loop.call_soon(self._vIterateAV)
+
+    def stop(self) -> None:
+        """Stop iterating and end all the streams. The instances are not killed."""
+        for oTimer in (self._oTimer, self._oAVTimer):
+            if oTimer is not None:
+                oTimer.cancel()
+        self._oTimer = self._oAVTimer = None
+        for oStream in list(self._lStreams):
+            oStream.close()
+        if self._oIterated is not None and not self._oIterated.done():
+            self._oIterated.cancel()
+        self._loop = None
+
+    def is_running(self) -> bool:
+        return self._loop is not None
+
+    def _vIterate(self) -> None:
+        try:
+            if self._bEvents:
+                self.tox.events_iterate(self._user_data)
+            else:
+                self.tox.iterate(self._user_data)
+        except Exception as e:
+            LOG_ERROR(f"async iterate {e}")
+        self.iterations += 1
+        if self._loop is None:
+            return
+        # wake the senders waiting for the send queue to drain
+        oIterated = self._oIterated
+        self._oIterated = self._loop.create_future()
+        if not oIterated.done():
+            oIterated.set_result(None)
+        self._oTimer = self._loop.call_later(self.tox.iteration_interval() / 1000.0,
+                                             self._vIterate)
+
+    def _vIterateAV(self) -> None:
+        try:
+            self.toxav.iterate()
+        except Exception as e:
+            LOG_ERROR(f"async toxav iterate {e}")
+        if self._loop is None:
+            return
+        self._oAVTimer = self._loop.call_later(self.toxav.iteration_interval() / 1000.0,
+                                               self._vIterateAV)
+
+    async def wait_iterate(self) -> None:
+        """Wait until the next iterate has run."""
+        if self._oIterated is None:
+            raise RuntimeError('AsyncTox is not started')
+        await asyncio.shield(self._oIterated)
+
+    async def run(self) -> None:
+        """Start on the running loop and iterate until cancelled."""
+        self.start()
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            self.stop()
+
+    # Incoming
+
+    def events(self, *lEvents: str, maxsize: int=None) -> EventStream:
+        """A stream of the records of the callback events lEvents."""
+        for sEvent in lEvents:
+            if sEvent not in dCALLBACK_ARGTYPES:
+                raise ValueError(f"unknown callback event {sEvent}")
+        oStream = EventStream(self, list(lEvents), self._iMaxsize if maxsize is None else maxsize)
+        self._lStreams.append(oStream)
+        return oStream
+
+    def messages(self, maxsize: int=None) -> EventStream:
+        """('friend_message', friend_number, message_type, message, length)"""
+        return self.events('friend_message', maxsize=maxsize)
+
+    def friend_requests(self, maxsize: int=None) -> EventStream:
+        """('friend_request', public_key, message, length)"""
+        return self.events('friend_request', maxsize=maxsize)
+
+    def file_chunks(self, maxsize: int=None) -> EventStream:
+        """('file_recv_chunk', friend_number, file_number, position, data, length)"""
+        return self.events('file_recv_chunk', maxsize=maxsize)
+
+    def group_events(self, maxsize: int=None) -> EventStream:
+        """The records of all the group_* events."""
+        return self.events(*lGROUP_EVENTS, maxsize=maxsize)
+
+    # Outgoing
+
+    async def _aSend(self, iSendq: int, timeout, func, *args):
+        # call func until it does not fail with the error code iSendq,
+        # waiting for an iterate to flush the send queue between tries
+        fEnd = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        perror = oERROR.pointer
+        while True:
+            # a ctypes ArgumentError is raised before the call sets the code
+            perror[0] = 0
+            try:
+                return func(*args)
+            except Exception:
+                if perror[0] != iSendq:
+                    raise
+            LOG_TRACE("async %s SENDQ", func.__name__)
+            if fEnd is None:
+                await self.wait_iterate()
+            else:
+                fLeft = fEnd - asyncio.get_running_loop().time()
+                if fLeft <= 0:
+                    raise asyncio.TimeoutError(f"{func.__name__} send queue full")
+                await asyncio.wait_for(self.wait_iterate(), fLeft)
+
+    async def send_message(self, friend_number: int, message, message_type: int=TOX_MESSAGE_TYPE['NORMAL'],
+                           timeout: float=None) -> int:
+        """Tox.friend_send_message, waiting while the send queue is full.
+        Returns the message ID; raises asyncio.TimeoutError after timeout seconds."""
+        return await self._aSend(TOX_ERR_FRIEND_SEND_MESSAGE['SENDQ'], timeout,
+                                 self.tox.friend_send_message, friend_number, message_type, message)
+
+    async def send_file_chunk(self, friend_number: int, file_number: int, position: int, data,
+                              timeout: float=None) -> bool:
+        """Tox.file_send_chunk, waiting while the send queue is full."""
+        return await self._aSend(TOX_ERR_FILE_SEND_CHUNK['SENDQ'], timeout,
+                                 self.tox.file_send_chunk, friend_number, file_number, position, data)
+
+    async def send_lossless_packet(self, friend_number: int, data, timeout: float=None) -> bool:
+        """Tox.friend_send_lossless_packet, waiting while the send queue is full."""
+        return await self._aSend(TOX_ERR_FRIEND_CUSTOM_PACKET['SENDQ'], timeout,
+                                 self.tox.friend_send_lossless_packet, friend_number, data)
+
+    async def send_lossy_packet(self, friend_number: int, data, timeout: float=None) -> bool:
+        """Tox.friend_send_lossy_packet, waiting while the send queue is full."""
+        return await self._aSend(TOX_ERR_FRIEND_CUSTOM_PACKET['SENDQ'], timeout,
+                                 self.tox.friend_send_lossy_packet, friend_number, data)
@@ -6,17 +6,16 @@ from ctypes import (CFUNCTYPE, POINTER, ArgumentError, byref, c_bool, c_char_p,
 from typing import Union, Callable
 
 try:
-    from wrapper.libtox import LibToxAV
+    from wrapper.libtox import LibToxAV, guarded
     import wrapper.toxav_enums as enum
+    from wrapper import toxlog
 except:
-    from libtox import LibToxAV
+    from libtox import LibToxAV, guarded
     import toxav_enums as enum
+    import toxlog
 
-def LOG_ERROR(a: str) -> None: print('EROR> '+a)
-def LOG_WARN(a: str) -> None: print('WARN> '+a)
-def LOG_INFO(a: str) -> None: print('INFO> '+a)
-def LOG_DEBUG(a: str) -> None: print('DBUG> '+a)
-def LOG_TRACE(a: str) -> None: pass # print('DEBUGx: '+a)
+# binds LOG_ERROR LOG_WARN LOG_INFO LOG_DEBUG LOG_TRACE - see toxlog.py
+toxlog.vRegister(globals())
 
 class ToxAV:
     """
@@ -28,17 +27,17 @@ class ToxAV:
 
     # Creation and destruction
 
-    def __init__(self, tox_pointer):
+    def __init__(self, tox_pointer, lock=None):
         """
         Start new A/V session. There can only be only one session per Tox instance.
 
         :param tox_pointer: pointer to Tox instance
+        :param lock: the lock of a thread safe Tox instance, see Tox.is_thread_safe
         """
+        self._lock = lock
         self.libtoxav = LibToxAV()
         toxav_err_new = c_int()
-        f = self.libtoxav.toxav_new
-        f.restype = POINTER(c_void_p)
-        self._toxav_pointer = f(tox_pointer, byref(toxav_err_new))
+        self._toxav_pointer = self.libtoxav.toxav_new(tox_pointer, byref(toxav_err_new))
         toxav_err_new = toxav_err_new.value
         if toxav_err_new == enum.TOXAV_ERR_NEW['NULL']:
             raise ArgumentError('One of the arguments to the function was NULL when it was not expected.')
@@ -68,7 +67,6 @@ class ToxAV:
 
         :return: pointer to the Tox instance
         """
-        self.libtoxav.toxav_get_tox.restype = POINTER(c_void_p)
         return self.libtoxav.toxav_get_tox(self._toxav_pointer)
 
     # A/V event loop
@@ -106,8 +104,8 @@ class ToxAV:
         """
         toxav_err_call = c_int()
         LOG_DEBUG(f"toxav_call")
-        result = self.libtoxav.toxav_call(self._toxav_pointer, c_uint32(friend_number), c_uint32(audio_bit_rate),
-                                           c_uint32(video_bit_rate), byref(toxav_err_call))
+        result = self.libtoxav.toxav_call(self._toxav_pointer, friend_number, audio_bit_rate,
+                                           video_bit_rate, byref(toxav_err_call))
         toxav_err_call = toxav_err_call.value
         if toxav_err_call == enum.TOXAV_ERR_CALL['OK']:
             return bool(result)
@@ -125,6 +123,7 @@ class ToxAV:
         elif toxav_err_call == enum.TOXAV_ERR_CALL['INVALID_BIT_RATE']:
             raise ArgumentError('Audio or video bit rate is invalid.')
 
+    @guarded
     def callback_call(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `call` event. Pass None to unset.
@@ -162,9 +161,9 @@ class ToxAV:
         toxav_err_answer = c_int()
         LOG_DEBUG(f"toxav_answer")
         result = self.libtoxav.toxav_answer(self._toxav_pointer,
-                                            c_uint32(friend_number),
-                                            c_uint32(audio_bit_rate),
-                                            c_uint32(video_bit_rate),
+                                            friend_number,
+                                            audio_bit_rate,
+                                            video_bit_rate,
                                             byref(toxav_err_answer))
         toxav_err_answer = toxav_err_answer.value
         if toxav_err_answer == enum.TOXAV_ERR_ANSWER['OK']:
@@ -184,6 +183,7 @@ class ToxAV:
 
     # Call state graph
 
+    @guarded
     def callback_call_state(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `call_state` event. Pass None to unset.
@@ -219,7 +219,7 @@ class ToxAV:
         """
         toxav_err_call_control = c_int()
         LOG_DEBUG(f"call_control")
-        result = self.libtoxav.toxav_call_control(self._toxav_pointer, c_uint32(friend_number), c_int(control),
+        result = self.libtoxav.toxav_call_control(self._toxav_pointer, friend_number, control,
                                                    byref(toxav_err_call_control))
         toxav_err_call_control = toxav_err_call_control.value
         if toxav_err_call_control == enum.TOXAV_ERR_CALL_CONTROL['OK']:
@@ -260,10 +260,10 @@ class ToxAV:
         LOG_TRACE(f"toxav_audio_send_frame")
         assert sampling_rate in [8000, 12000, 16000, 24000, 48000]
         result = self.libtoxav.toxav_audio_send_frame(self._toxav_pointer,
-                                                       c_uint32(friend_number),
+                                                       friend_number,
                                                        cast(pcm, c_void_p),
-                                                       c_size_t(sample_count), c_uint8(channels),
-                                                       c_uint32(sampling_rate), byref(toxav_err_send_frame))
+                                                       sample_count, channels,
+                                                       sampling_rate, byref(toxav_err_send_frame))
         toxav_err_send_frame = toxav_err_send_frame.value
         if toxav_err_send_frame == enum.TOXAV_ERR_SEND_FRAME['OK']:
             return bool(result)
@@ -302,12 +302,12 @@ class ToxAV:
         toxav_err_send_frame = c_int()
         LOG_TRACE(f"toxav_video_send_frame")
         result = self.libtoxav.toxav_video_send_frame(self._toxav_pointer,
-                                                      c_uint32(friend_number),
-                                                      c_uint16(width),
-                                                      c_uint16(height),
-                                                      c_char_p(y),
-                                                      c_char_p(u),
-                                                      c_char_p(v),
+                                                      friend_number,
+                                                      width,
+                                                      height,
+                                                      y,
+                                                      u,
+                                                      v,
                                                       byref(toxav_err_send_frame))
         toxav_err_send_frame = toxav_err_send_frame.value
         if toxav_err_send_frame == enum.TOXAV_ERR_SEND_FRAME['OK']:
@@ -331,6 +331,7 @@ class ToxAV:
 
     # A/V receiving
 
+    @guarded
     def callback_audio_receive_frame(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `audio_receive_frame` event. Pass None to unset.
@@ -360,6 +361,7 @@ class ToxAV:
         self.audio_receive_frame_cb = c_callback(callback)
         self.libtoxav.toxav_callback_audio_receive_frame(self._toxav_pointer, self.audio_receive_frame_cb, user_data)
 
+    @guarded
     def callback_video_receive_frame(self, callback: Callable, user_data) -> None:
         """
         Set the callback for the `video_receive_frame` event. Pass None to unset.
@@ -0,0 +1,198 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# A command queue owned by the iterate thread of a Tox instance, so that
+# application threads can send without the thread safe mode and without
+# locks of their own.
+#
+# Any thread submits a call of a Tox method and gets a
+# concurrent.futures.Future; the thread that iterates runs the queued
+# calls in a batch at the start of each Tox.iterate, or events_iterate,
+# before tox_iterate, so what they queue in libtoxcore is flushed by that
+# same iteration. A future gets the result of the call, or the ToxError or
+# ctypes ArgumentError it raised:
+#
+#   oQueue = tox.get_command_queue()
+#   oFuture = oQueue.friend_send_message(friend_number, TOX_MESSAGE_TYPE['NORMAL'], 'hi')
+#   message_id = oFuture.result(timeout=5)
+#
+# A call waits up to an iteration_interval() for the next iterate; give
+# wake, e.g. the set of the event a pacer sleeps on, to cut that short.
+# A callback, which runs on the iterate thread, must not wait on a future,
+# as the queue is only run between iterations: use call(), which runs at
+# once on the iterate thread.
+#
+# Tox.kill closes the queue: the calls still queued are cancelled, and
+# submit raises RuntimeError from then on.
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+try:
+    from wrapper import toxlog
+except:
+    import toxlog
+
+toxlog.vRegister(globals())
+
+class CommandStats:
+    """The counters of a ToxCommandQueue; latencies in seconds."""
+    __slots__ = ('submitted', 'executed', 'errors', 'cancelled', 'batches', 'batch_max',
+                 'latency_total', 'latency_max')
+
+    def __init__(self):
+        self.submitted = 0
+        self.executed = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.batches = 0
+        self.batch_max = 0
+        # from the submit to the start of the call
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def batch_mean(self) -> float:
+        return self.executed / self.batches if self.batches else 0.0
+
+    @property
+    def latency_mean(self) -> float:
+        return self.latency_total / self.executed if self.executed else 0.0
+
+    def __repr__(self) -> str:
+        return f"CommandStats(submitted={self.submitted}, executed={self.executed}, " \
+            f"errors={self.errors}, cancelled={self.cancelled}, batches={self.batches}, " \
+            f"batch_mean={self.batch_mean:.2f}, batch_max={self.batch_max}, " \
+            f"latency_mean={self.latency_mean:.6f}, latency_max={self.latency_max:.6f})"
+
+class ToxCommandQueue:
+    """The queue of calls to run on the iterate thread of a Tox, see
+    Tox.get_command_queue."""
+
+    def __init__(self, tox, max_batch: int=1024, wake=None):
+        """
+        :param tox: the Tox instance
+        :param max_batch: the most calls run before one iterate; the rest wait for the next
+        :param wake: called with no arguments after each submit, to wake the iterate thread
+        """
+        self.tox = tox
+        self.max_batch = max_batch
+        self.wake = wake
+        # (future, func, args, perf_counter() of the submit); deque appends
+        # and pops are atomic, so submit takes no lock
+        self._queue = deque()
+        self._iThread = None
+        self._stats = CommandStats()
+        self._bClosed = False
+
+    def submit(self, func, *args) -> Future:
+        """Queue func(*args), a method of the Tox, to run on the iterate
+        thread, and return the Future of its result. Any thread. Raises
+        RuntimeError once the queue is closed."""
+        if self._bClosed:
+            raise RuntimeError('cannot submit to the command queue of a killed Tox')
+        oFuture = Future()
+        self._queue.append((oFuture, func, args, time.perf_counter()))
+        if self._bClosed:
+            # closed while appending: cancel it, not leave it queued for ever
+            self.cancel_all()
+        if self.wake is not None:
+            self.wake()
+        return oFuture
+
+    def call(self, func, *args, timeout: float=None):
+        """func(*args) now when on the iterate thread, otherwise through
+        submit, waiting up to timeout seconds for the result."""
+        if threading.get_ident() == self._iThread:
+            return func(*args)
+        return self.submit(func, *args).result(timeout)
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def drain(self) -> int:
+        """Run the queued calls, up to max_batch of them, and resolve their
+        futures. Called by Tox.iterate; returns the number run."""
+        self._iThread = threading.get_ident()
+        queue = self._queue
+        if not queue:
+            return 0
+        oStats = self._stats
+        iDone = 0
+        while queue and iDone < self.max_batch:
+            oFuture, func, args, fSubmitted = queue.popleft()
+            if not oFuture.set_running_or_notify_cancel():
+                oStats.cancelled += 1
+                continue
+            fLatency = time.perf_counter() - fSubmitted
+            oStats.latency_total += fLatency
+            if fLatency > oStats.latency_max:
+                oStats.latency_max = fLatency
+            iDone += 1
+            try:
+                result = func(*args)
+            except Exception as e:
+                oStats.errors += 1
+                LOG_DEBUG("commands %s %s", getattr(func, '__name__', func), e)
+                oFuture.set_exception(e)
+            else:
+                oFuture.set_result(result)
+        if iDone:
+            oStats.executed += iDone
+            oStats.batches += 1
+            if iDone > oStats.batch_max:
+                oStats.batch_max = iDone
+        if queue and self.wake is not None:
+            # more than max_batch: come back without sleeping the interval
+            self.wake()
+        return iDone
+
+    def cancel_all(self) -> int:
+        """Cancel the calls still queued; returns how many."""
+        iCount = 0
+        while self._queue:
+            oFuture, func, args, fSubmitted = self._queue.popleft()
+            if oFuture.cancel():
+                iCount += 1
+        self._stats.cancelled += iCount
+        return iCount
+
+    def close(self) -> int:
+        """Refuse any more submit and cancel the calls still queued;
+        returns how many. Called by Tox.kill."""
+        self._bClosed = True
+        return self.cancel_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._bClosed
+
+    def stats(self) -> CommandStats:
+        # submit counts nothing, as += is not atomic between threads:
+        # every call submitted has run, been cancelled, or is queued
+        oStats = self._stats
+        oStats.submitted = oStats.executed + oStats.cancelled + len(self._queue)
+        return oStats
+
+    # Sends
+
+    def friend_send_message(self, friend_number: int, message_type: int, message) -> Future:
+        return self.submit(self.tox.friend_send_message, friend_number, message_type, message)
+
+    def friend_send_lossless_packet(self, friend_number: int, data) -> Future:
+        return self.submit(self.tox.friend_send_lossless_packet, friend_number, data)
+
+    def friend_send_lossy_packet(self, friend_number: int, data) -> Future:
+        return self.submit(self.tox.friend_send_lossy_packet, friend_number, data)
+
+    def group_send_message(self, group_number: int, message_type: int, message) -> Future:
+        return self.submit(self.tox.group_send_message, group_number, message_type, message)
+
+    def group_send_private_message(self, group_number: int, peer_id: int, message_type: int,
+                                   message) -> Future:
+        return self.submit(self.tox.group_send_private_message, group_number, peer_id,
+                           message_type, message)
+
+    def file_send_chunk(self, friend_number: int, file_number: int, position: int, data) -> Future:
+        return self.submit(self.tox.file_send_chunk, friend_number, file_number, position, data)
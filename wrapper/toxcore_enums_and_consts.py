@@ -949,6 +949,58 @@ TOX_GROUP_BAN_TYPE = {
     'NICK': 2
 }
 
+# tox_events.h of c-toxcore 0.2.19
+TOX_EVENT_TYPE = {
+
+    'TOX_EVENT_SELF_CONNECTION_STATUS': 0,
+    'TOX_EVENT_FRIEND_REQUEST': 1,
+    'TOX_EVENT_FRIEND_CONNECTION_STATUS': 2,
+    'TOX_EVENT_FRIEND_LOSSY_PACKET': 3,
+    'TOX_EVENT_FRIEND_LOSSLESS_PACKET': 4,
+    'TOX_EVENT_FRIEND_NAME': 5,
+    'TOX_EVENT_FRIEND_STATUS': 6,
+    'TOX_EVENT_FRIEND_STATUS_MESSAGE': 7,
+    'TOX_EVENT_FRIEND_MESSAGE': 8,
+    'TOX_EVENT_FRIEND_READ_RECEIPT': 9,
+    'TOX_EVENT_FRIEND_TYPING': 10,
+    'TOX_EVENT_FILE_CHUNK_REQUEST': 11,
+    'TOX_EVENT_FILE_RECV': 12,
+    'TOX_EVENT_FILE_RECV_CHUNK': 13,
+    'TOX_EVENT_FILE_RECV_CONTROL': 14,
+    'TOX_EVENT_CONFERENCE_INVITE': 15,
+    'TOX_EVENT_CONFERENCE_CONNECTED': 16,
+    'TOX_EVENT_CONFERENCE_PEER_LIST_CHANGED': 17,
+    'TOX_EVENT_CONFERENCE_PEER_NAME': 18,
+    'TOX_EVENT_CONFERENCE_TITLE': 19,
+    'TOX_EVENT_CONFERENCE_MESSAGE': 20,
+    'TOX_EVENT_GROUP_PEER_NAME': 21,
+    'TOX_EVENT_GROUP_PEER_STATUS': 22,
+    'TOX_EVENT_GROUP_TOPIC': 23,
+    'TOX_EVENT_GROUP_PRIVACY_STATE': 24,
+    'TOX_EVENT_GROUP_VOICE_STATE': 25,
+    'TOX_EVENT_GROUP_TOPIC_LOCK': 26,
+    'TOX_EVENT_GROUP_PEER_LIMIT': 27,
+    'TOX_EVENT_GROUP_PASSWORD': 28,
+    'TOX_EVENT_GROUP_MESSAGE': 29,
+    'TOX_EVENT_GROUP_PRIVATE_MESSAGE': 30,
+    'TOX_EVENT_GROUP_CUSTOM_PACKET': 31,
+    'TOX_EVENT_GROUP_CUSTOM_PRIVATE_PACKET': 32,
+    'TOX_EVENT_GROUP_INVITE': 33,
+    'TOX_EVENT_GROUP_PEER_JOIN': 34,
+    'TOX_EVENT_GROUP_PEER_EXIT': 35,
+    'TOX_EVENT_GROUP_SELF_JOIN': 36,
+    'TOX_EVENT_GROUP_JOIN_FAIL': 37,
+    'TOX_EVENT_GROUP_MODERATION': 38,
+    'TOX_EVENT_DHT_GET_NODES_RESPONSE': 39,
+    'TOX_EVENT_INVALID': 255
+}
+
+TOX_ERR_EVENTS_ITERATE = {
+    'OK': 0,
+    'MALLOC': 1,
+    'DEBUG': 2,
+}
+
 TOX_PUBLIC_KEY_SIZE = 32
 
 TOX_ADDRESS_SIZE = TOX_PUBLIC_KEY_SIZE + 6
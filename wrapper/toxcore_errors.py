@@ -0,0 +1,268 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# Table driven decoding of the TOX_ERR_* error out-parameters.
+# The tables are compiled once at import from toxcore_enums_and_consts,
+# so a failing call costs one dict lookup instead of an if/elif chain,
+# and a successful call costs one comparison against 0.
+#
+# A code that a table does not list raises ToxError with the default of
+# the table, where the if/elif chains fell through and returned None or
+# the result of the call. Tox.bootstrap keeps returning False on a code
+# it does not know, as its callers go by the result.
+
+import threading
+from ctypes import ArgumentError, c_int, pointer
+
+try:
+    import wrapper.toxcore_enums_and_consts as enums
+    from wrapper import toxlog
+except:
+    import toxcore_enums_and_consts as enums
+    import toxlog
+
+toxlog.vRegister(globals())
+
+class ToxError(RuntimeError): pass
+
+# int -> name for every TOX_ERR_* dict, keyed by id() of the dict so that
+# the dict itself can be passed around as before. The first name wins, so
+# TOX_ERR_SET_INFO decodes to the short names.
+dERROR_NAMES = {}
+for _sName, _dEnum in vars(enums).items():
+    if _sName.startswith('TOX_ERR_') and isinstance(_dEnum, dict):
+        _dNames = {}
+        for _k, _v in _dEnum.items():
+            _dNames.setdefault(_v, _k)
+        dERROR_NAMES[id(_dEnum)] = _dNames
+del _sName, _dEnum, _dNames, _k, _v
+
+def sErrorName(value: int, dEnum: dict) -> str:
+    """Return the name of the code value in the TOX_ERR_* dict dEnum, or ''."""
+    dNames = dERROR_NAMES.get(id(dEnum))
+    if dNames is None:
+        dNames = dERROR_NAMES[id(dEnum)] = {v: k for k, v in reversed(dEnum.items())}
+    return dNames.get(value, '')
+
+sNULL = 'One of the arguments to the function was NULL when it was not expected.'
+sNOT_OK = 'The function did not return OK'
+
+def dErrorTable(dEnum: dict, dErrors: dict, sDefault: str=sNOT_OK, bLog: bool=False) -> dict:
+    """Compile {code name: (exception class, message)} against the
+    TOX_ERR_* dict dEnum into {code: (exception class, message)}.
+    Codes that are not listed raise ToxError(sDefault). The key None
+    holds the default, and the key 'log' whether to LOG_ERROR on raise.
+    """
+    dTable = {None: (ToxError, sDefault), 'log': bLog}
+    for sName, tError in dErrors.items():
+        dTable[dEnum[sName]] = tError
+    return dTable
+
+def dGroupErrorTable(sFunc: str, dEnum: dict, oException=ToxError) -> dict:
+    """A table for a group function: every error code raises
+    oException(f"{sFunc} {name} err={code}") and is logged."""
+    dTable = {None: (oException, f"{sFunc} err"), 'log': True}
+    for sName, iCode in dEnum.items():
+        if iCode and iCode not in dTable:
+            dTable[iCode] = (oException, f"{sFunc} {sName} err={iCode}")
+    return dTable
+
+def vCheckError(iErr: int, dTable: dict) -> None:
+    """Raise the exception for the error code iErr from dTable; 0 is OK."""
+    if not iErr:
+        return
+    oException, sMsg = dTable.get(iErr) or dTable[None]
+    if dTable['log']:
+        LOG_ERROR(sMsg)
+    raise oException(sMsg)
+
+class ErrorCell(threading.local):
+    """The error out-parameter, one per thread, reused across calls.
+    Pass .pointer to the library and read the code back with .pointer[0].
+    Callbacks run on the thread calling iterate and never during another
+    library call on that thread, so a cell is never in use twice.
+    """
+    def __init__(self):
+        self.cell = c_int()
+        self.pointer = pointer(self.cell)
+
+oERROR = ErrorCell()
+
+# Per function tables
+
+dOPTIONS_NEW_ERRORS = dErrorTable(enums.TOX_ERR_OPTIONS_NEW, {
+    'MALLOC': (MemoryError, 'The function failed to allocate enough memory for the options struct.'),
+    }, 'The function did not return OK for the options struct.')
+
+dNEW_ERRORS = dErrorTable(enums.TOX_ERR_NEW, {
+    'NULL': (ArgumentError, sNULL),
+    'MALLOC': (MemoryError, 'The function was unable to allocate enough '
+               'memory to store the internal structures for the Tox object.'),
+    'PORT_ALLOC': (ToxError, 'The function was unable to bind to a port. This may mean that all ports have '
+                   'already been bound, e.g. by other Tox instances, or it may mean a permission error.'
+                   ' You may be able to gather more information from errno.'),
+    'TCP_SERVER_ALLOC': (ToxError, 'The function was unable to bind the tcp server port.'),
+    'PROXY_BAD_TYPE': (ArgumentError, 'proxy_type was invalid.'),
+    'PROXY_BAD_HOST': (ArgumentError, 'proxy_type was valid but the proxy_host passed had an invalid format or was NULL.'),
+    'PROXY_BAD_PORT': (ArgumentError, 'proxy_type was valid, but the proxy_port was invalid.'),
+    'PROXY_NOT_FOUND': (ArgumentError, 'The proxy address passed could not be resolved.'),
+    'LOAD_ENCRYPTED': (ArgumentError, 'The byte array to be loaded contained an encrypted save.'),
+    'LOAD_BAD_FORMAT': (ArgumentError, 'The data format was invalid. This can happen when loading data that was saved by'
+                        ' an older version of Tox, or when the data has been corrupted. When loading from'
+                        ' badly formatted data, some data may have been loaded, and the rest is discarded.'
+                        ' Passing an invalid length parameter also causes this error.'),
+    })
+
+dBOOTSTRAP_ERRORS = dErrorTable(enums.TOX_ERR_BOOTSTRAP, {
+    'NULL': (ArgumentError, sNULL),
+    'BAD_HOST': (ArgumentError, 'The address could not be resolved to an IP '
+                 'address, or the address passed was invalid.'),
+    'BAD_PORT': (ArgumentError, 'The port passed was invalid. The valid port range is (1, 65535).'),
+    })
+
+dSET_INFO_ERRORS = dErrorTable(enums.TOX_ERR_SET_INFO, {
+    'NULL': (ArgumentError, sNULL),
+    'TOO_LONG': (ArgumentError, 'Information length exceeded maximum permissible size.'),
+    })
+
+dFRIEND_ADD_ERRORS = dErrorTable(enums.TOX_ERR_FRIEND_ADD, {
+    'NULL': (ArgumentError, sNULL),
+    'TOO_LONG': (ArgumentError, 'The length of the friend request message exceeded TOX_MAX_FRIEND_REQUEST_LENGTH.'),
+    'NO_MESSAGE': (ArgumentError, 'The friend request message was empty. This, and the TOO_LONG code will never be'
+                   ' returned from tox_friend_add_norequest.'),
+    'OWN_KEY': (ArgumentError, 'The friend address belongs to the sending client.'),
+    'ALREADY_SENT': (ArgumentError, 'A friend request has already been sent, or the address belongs to a friend that is'
+                     ' already on the friend list.'),
+    'BAD_CHECKSUM': (ArgumentError, 'The friend address checksum failed.'),
+    'SET_NEW_NOSPAM': (ArgumentError, 'The friend was already there, but the nospam value was different.'),
+    'MALLOC': (MemoryError, 'A memory allocation failed when trying to increase the friend list size.'),
+    }, 'The function did not return OK for the friend add.')
+
+dFRIEND_DELETE_ERRORS = dErrorTable(enums.TOX_ERR_FRIEND_DELETE, {
+    'FRIEND_NOT_FOUND': (ArgumentError, 'There was no friend with the given friend number. No friends were deleted.'),
+    }, 'The function did not return OK for the friend delete.')
+
+dFRIEND_BY_PUBLIC_KEY_ERRORS = dErrorTable(enums.TOX_ERR_FRIEND_BY_PUBLIC_KEY, {
+    'NULL': (ArgumentError, sNULL),
+    'NOT_FOUND': (ArgumentError, 'No friend with the given Public Key exists on the friend list.'),
+    }, 'The function did not return OK for the friend by public key.')
+
+dFRIEND_GET_PUBLIC_KEY_ERRORS = dErrorTable(enums.TOX_ERR_FRIEND_GET_PUBLIC_KEY, {
+    'FRIEND_NOT_FOUND': (ArgumentError, 'No friend with the given number exists on the friend list.'),
+    })
+
+dFRIEND_GET_LAST_ONLINE_ERRORS = dErrorTable(enums.TOX_ERR_FRIEND_GET_LAST_ONLINE, {
+    'FRIEND_NOT_FOUND': (ArgumentError, 'No friend with the given number exists on the friend list.'),
+    })
+
+dFRIEND_QUERY_ERRORS = dErrorTable(enums.TOX_ERR_FRIEND_QUERY, {
+    'NULL': (ArgumentError, 'The pointer parameter for storing the query result (name, message) was NULL. Unlike'
+             ' the `_self_` variants of these functions, which have no effect when a parameter is'
+             ' NULL, these functions return an error in that case.'),
+    'FRIEND_NOT_FOUND': (ArgumentError, 'The friend_number did not designate a valid friend.'),
+    })
+
+dSET_TYPING_ERRORS = dErrorTable(enums.TOX_ERR_SET_TYPING, {
+    'FRIEND_NOT_FOUND': (ArgumentError, 'The friend number did not designate a valid friend.'),
+    }, 'The function did not return OK for set typing.')
+
+dFRIEND_SEND_MESSAGE_ERRORS = dErrorTable(enums.TOX_ERR_FRIEND_SEND_MESSAGE, {
+    'NULL': (ArgumentError, sNULL),
+    'FRIEND_NOT_FOUND': (ArgumentError, 'The friend number did not designate a valid friend.'),
+    'FRIEND_NOT_CONNECTED': (ArgumentError, 'This client is currently not connected to the friend.'),
+    'SENDQ': (MemoryError, 'An allocation error occurred while increasing the send queue size.'),
+    'TOO_LONG': (ArgumentError, 'Message length exceeded TOX_MAX_MESSAGE_LENGTH.'),
+    'EMPTY': (ArgumentError, 'Attempted to send a zero-length message.'),
+    }, 'The function did not return OK for friend send message.')
+
+dFILE_CONTROL_ERRORS = dErrorTable(enums.TOX_ERR_FILE_CONTROL, {
+    'FRIEND_NOT_FOUND': (ArgumentError, 'The friend_number passed did not designate a valid friend.'),
+    'FRIEND_NOT_CONNECTED': (ArgumentError, 'This client is currently not connected to the friend.'),
+    'NOT_FOUND': (ArgumentError, 'No file transfer with the given file number was found for the given friend.'),
+    'NOT_PAUSED': (ToxError, 'A RESUME control was sent, but the file transfer is running normally.'),
+    'DENIED': (ToxError, 'A RESUME control was sent, but the file transfer was paused by the other party. Only '
+               'the party that paused the transfer can resume it.'),
+    'ALREADY_PAUSED': (ToxError, 'A PAUSE control was sent, but the file transfer was already paused.'),
+    'SENDQ': (ToxError, 'Packet queue is full.'),
+    }, 'The function did not return OK for file control.')
+
+dFILE_SEEK_ERRORS = dErrorTable(enums.TOX_ERR_FILE_SEEK, {
+    'FRIEND_NOT_FOUND': (ArgumentError, 'The friend_number passed did not designate a valid friend.'),
+    'FRIEND_NOT_CONNECTED': (ArgumentError, 'This client is currently not connected to the friend.'),
+    'NOT_FOUND': (ArgumentError, 'No file transfer with the given file number was found for the given friend.'),
+    'DENIED': (IOError, 'File was not in a state where it could be seeked.'),
+    'INVALID_POSITION': (ArgumentError, 'Seek position was invalid'),
+    'SENDQ': (ToxError, 'Packet queue is full.'),
+    })
+
+dFILE_GET_ERRORS = dGroupErrorTable('file_get_file_id', enums.TOX_ERR_FILE_GET, ArgumentError)
+
+dFILE_SEND_ERRORS = dErrorTable(enums.TOX_ERR_FILE_SEND, {
+    'NULL': (ArgumentError, sNULL),
+    'FRIEND_NOT_FOUND': (ArgumentError, 'The friend_number passed did not designate a valid friend.'),
+    'FRIEND_NOT_CONNECTED': (ArgumentError, 'This client is currently not connected to the friend.'),
+    'NAME_TOO_LONG': (ArgumentError, 'Filename length exceeded TOX_MAX_FILENAME_LENGTH bytes.'),
+    'TOO_MANY': (ToxError, 'Too many ongoing transfers. The maximum number of concurrent file transfers is 256 per'
+                 'friend per direction (sending and receiving).'),
+    })
+
+dFILE_SEND_CHUNK_ERRORS = dErrorTable(enums.TOX_ERR_FILE_SEND_CHUNK, {
+    'NULL': (ArgumentError, 'The length parameter was non-zero, but data was NULL.'),
+    'FRIEND_NOT_FOUND': (ArgumentError, 'The friend_number passed did not designate a valid friend.'),
+    'FRIEND_NOT_CONNECTED': (ArgumentError, 'This client is currently not connected to the friend.'),
+    'NOT_FOUND': (ArgumentError, 'No file transfer with the given file number was found for the given friend.'),
+    'NOT_TRANSFERRING': (ArgumentError, 'File transfer was found but isn\'t in a transferring state: (paused, done, broken, '
+                         'etc...) (happens only when not called from the request chunk callback).'),
+    'INVALID_LENGTH': (ArgumentError, 'Attempted to send more or less data than requested. The requested data size is '
+                       'adjusted according to maximum transmission unit and the expected end of the file. '
+                       'Trying to send less or more than requested will return this error.'),
+    'SENDQ': (ToxError, 'Packet queue is full.'),
+    'WRONG_POSITION': (ArgumentError, 'Position parameter was wrong.'),
+    })
+
+dFRIEND_CUSTOM_PACKET_ERRORS = dErrorTable(enums.TOX_ERR_FRIEND_CUSTOM_PACKET, {
+    'NULL': (ArgumentError, sNULL),
+    'FRIEND_NOT_FOUND': (ArgumentError, 'The friend number did not designate a valid friend.'),
+    'FRIEND_NOT_CONNECTED': (ArgumentError, 'This client is currently not connected to the friend.'),
+    'INVALID': (ArgumentError, 'The first byte of data was not in the specified range for the packet type.'
+                'This range is 200-254 for lossy, and 160-191 for lossless packets.'),
+    'EMPTY': (ArgumentError, 'Attempted to send an empty packet.'),
+    'TOO_LONG': (ArgumentError, 'Packet data length exceeded TOX_MAX_CUSTOM_PACKET_SIZE.'),
+    'SENDQ': (ToxError, 'Packet queue is full.'),
+    })
+
+dGET_PORT_ERRORS = dErrorTable(enums.TOX_ERR_GET_PORT, {
+    'NOT_BOUND': (ToxError, 'The instance was not bound to any port.'),
+    })
+
+dEVENTS_ITERATE_ERRORS = dErrorTable(enums.TOX_ERR_EVENTS_ITERATE, {
+    'MALLOC': (MemoryError, 'The function failed to allocate enough memory for the events.'),
+    'DEBUG': (ToxError, 'The events could not be serialised.'),
+    }, bLog=True)
+
+dGROUP_NEW_ERRORS = dGroupErrorTable('group_new', enums.TOX_ERR_GROUP_NEW)
+dGROUP_JOIN_ERRORS = dGroupErrorTable('group_join', enums.TOX_ERR_GROUP_JOIN)
+dGROUP_RECONNECT_ERRORS = dGroupErrorTable('group_reconnect', enums.TOX_ERR_GROUP_RECONNECT)
+dGROUP_IS_CONNECTED_ERRORS = dGroupErrorTable('group_is_connected', enums.TOX_ERR_GROUP_IS_CONNECTED)
+dGROUP_DISCONNECT_ERRORS = dGroupErrorTable('group_disconnect', enums.TOX_ERR_GROUP_DISCONNECT)
+dGROUP_LEAVE_ERRORS = dGroupErrorTable('group_leave', enums.TOX_ERR_GROUP_LEAVE)
+dGROUP_SELF_NAME_SET_ERRORS = dGroupErrorTable('group_self_set_name', enums.TOX_ERR_GROUP_SELF_NAME_SET)
+dGROUP_SELF_QUERY_ERRORS = dGroupErrorTable('group_self_query', enums.TOX_ERR_GROUP_SELF_QUERY)
+dGROUP_SELF_STATUS_SET_ERRORS = dGroupErrorTable('group_self_set_status', enums.TOX_ERR_GROUP_SELF_STATUS_SET)
+dGROUP_PEER_QUERY_ERRORS = dGroupErrorTable('group_peer_query', enums.TOX_ERR_GROUP_PEER_QUERY)
+dGROUP_TOPIC_SET_ERRORS = dGroupErrorTable('group_set_topic', enums.TOX_ERR_GROUP_TOPIC_SET)
+dGROUP_STATE_QUERIES_ERRORS = dGroupErrorTable('group_state_query', enums.TOX_ERR_GROUP_STATE_QUERIES)
+dGROUP_SEND_CUSTOM_PACKET_ERRORS = dGroupErrorTable('group_send_custom_packet',
+                                                    enums.TOX_ERR_GROUP_SEND_CUSTOM_PACKET)
+dGROUP_SEND_PRIVATE_MESSAGE_ERRORS = dGroupErrorTable('group_send_private_message',
+                                                      enums.TOX_ERR_GROUP_SEND_PRIVATE_MESSAGE)
+dGROUP_SEND_MESSAGE_ERRORS = dGroupErrorTable('group_send_message', enums.TOX_ERR_GROUP_SEND_MESSAGE)
+dGROUP_INVITE_FRIEND_ERRORS = dGroupErrorTable('group_invite_friend', enums.TOX_ERR_GROUP_INVITE_FRIEND)
+dGROUP_INVITE_ACCEPT_ERRORS = dGroupErrorTable('group_invite_accept', enums.TOX_ERR_GROUP_INVITE_ACCEPT)
+dGROUP_FOUNDER_SET_PASSWORD_ERRORS = dGroupErrorTable('group_founder_set_password',
+                                                      enums.TOX_ERR_GROUP_FOUNDER_SET_PASSWORD)
+dGROUP_FOUNDER_SET_PRIVACY_STATE_ERRORS = dGroupErrorTable('group_founder_set_privacy_state',
+                                                           enums.TOX_ERR_GROUP_FOUNDER_SET_PRIVACY_STATE)
+dGROUP_FOUNDER_SET_PEER_LIMIT_ERRORS = dGroupErrorTable('group_founder_set_peer_limit',
+                                                        enums.TOX_ERR_GROUP_FOUNDER_SET_PEER_LIMIT)
+dGROUP_MOD_SET_ROLE_ERRORS = dGroupErrorTable('group_mod_set_role', enums.TOX_ERR_GROUP_MOD_SET_ROLE)
+dGROUP_TOGGLE_IGNORE_ERRORS = dGroupErrorTable('group_set_ignore', enums.TOX_ERR_GROUP_TOGGLE_IGNORE)
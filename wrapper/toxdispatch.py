@@ -0,0 +1,708 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# Multi-subscriber callback dispatch for a Tox instance.
+#
+# The first subscribe() to an event registers one C trampoline for it with
+# libtoxcore, and the trampoline stays registered until close(). After
+# that, subscribe() and unsubscribe() only swap the tuple of handlers the
+# trampoline loops over, without calling into C. The swap is a single
+# assignment, so a callback running on the iterate thread sees either the
+# old or the new tuple, never a partial one.
+#
+# The handlers are called with the same arguments as the callback_*
+# methods pass. Calling callback_<event> on the Tox instance registers its
+# own CFUNCTYPE with libtoxcore. When the event has handlers, or is deferred
+# or coalesced, it then hands the event back to the dispatcher, which
+# registers the trampoline again and has it call that callback after the
+# handlers; otherwise the callback stays registered directly, with nothing
+# in between, until the first subscribe to the event hands it back. So the
+# callback and the handlers of an event are all called whichever was set first.
+#
+# In the events mode of toxevents.py nothing is registered with libtoxcore,
+# the callback_* methods only keep their callback, and the events loop
+# calls the handlers and the callback itself.
+#
+# In the deferred mode, defer(), the trampolines only copy the arguments
+# into a slot of a preallocated ring and return, and worker threads call
+# the handlers, and the callback set with the callback_* method of the
+# event, so a slow handler does not hold up tox_iterate. The events of a
+# friend, or of a group, always go to the same worker, in order; the ring
+# of each worker is bounded, and when it is full the trampoline either
+# blocks, holding up tox_iterate, or drops the event, by policy.
+#
+# In the coalescing mode, coalesce(), the events that only report a new
+# state, like friend_connection_status or group_peer_name, are held for a
+# window, keeping only the latest of each event for each friend or peer,
+# and the survivors are delivered as one batch, at the end of the iterate
+# in which the window closes. Message, file, request and packet events are
+# never coalesced.
+
+import threading
+import time
+from ctypes import (CFUNCTYPE, POINTER, _Pointer, c_bool, c_char_p, c_int,
+                    c_size_t, c_uint8, c_uint32, c_uint64, c_void_p, cast,
+                    string_at)
+from typing import Callable
+
+try:
+    from wrapper import toxlog
+except:
+    import toxlog
+
+toxlog.vRegister(globals())
+
+# event -> the argument types of its callback, tox pointer first, user_data last
+dCALLBACK_ARGTYPES = {
+    'self_connection_status': (c_void_p, c_int, c_void_p),
+    'friend_name': (c_void_p, c_uint32, c_char_p, c_size_t, c_void_p),
+    'friend_status_message': (c_void_p, c_uint32, c_char_p, c_size_t, c_void_p),
+    'friend_status': (c_void_p, c_uint32, c_int, c_void_p),
+    'friend_connection_status': (c_void_p, c_uint32, c_int, c_void_p),
+    'friend_typing': (c_void_p, c_uint32, c_bool, c_void_p),
+    'friend_read_receipt': (c_void_p, c_uint32, c_uint32, c_void_p),
+    'friend_request': (c_void_p, POINTER(c_uint8), c_char_p, c_size_t, c_void_p),
+    'friend_message': (c_void_p, c_uint32, c_int, c_char_p, c_size_t, c_void_p),
+    'file_recv_control': (c_void_p, c_uint32, c_uint32, c_int, c_void_p),
+    'file_chunk_request': (c_void_p, c_uint32, c_uint32, c_uint64, c_size_t, c_void_p),
+    'file_recv': (c_void_p, c_uint32, c_uint32, c_uint32, c_uint64, c_char_p, c_size_t, c_void_p),
+    'file_recv_chunk': (c_void_p, c_uint32, c_uint32, c_uint64, POINTER(c_uint8), c_size_t, c_void_p),
+    'friend_lossy_packet': (c_void_p, c_uint32, POINTER(c_uint8), c_size_t, c_void_p),
+    'friend_lossless_packet': (c_void_p, c_uint32, POINTER(c_uint8), c_size_t, c_void_p),
+    'group_peer_name': (c_void_p, c_uint32, c_uint32, c_char_p, c_size_t, c_void_p),
+    'group_peer_status': (c_void_p, c_uint32, c_uint32, c_int, c_void_p),
+    'group_topic': (c_void_p, c_uint32, c_uint32, c_char_p, c_size_t, c_void_p),
+    'group_privacy_state': (c_void_p, c_uint32, c_int, c_void_p),
+    'group_peer_limit': (c_void_p, c_uint32, c_uint32, c_void_p),
+    'group_password': (c_void_p, c_uint32, c_char_p, c_size_t, c_void_p),
+    'group_message': (c_void_p, c_uint32, c_uint32, c_int, c_char_p, c_size_t, c_void_p),
+    'group_private_message': (c_void_p, c_uint32, c_uint32, c_uint8, c_char_p, c_size_t, c_void_p),
+    'group_custom_packet': (c_void_p, c_uint32, c_uint32, POINTER(c_uint8), c_size_t, c_void_p),
+    'group_invite': (c_void_p, c_uint32, POINTER(c_uint8), c_size_t, POINTER(c_uint8), c_size_t, c_void_p),
+    'group_peer_join': (c_void_p, c_uint32, c_uint32, c_void_p),
+    'group_peer_exit': (c_void_p, c_uint32, c_uint32, c_int, c_char_p, c_size_t, c_char_p, c_size_t, c_void_p),
+    'group_self_join': (c_void_p, c_uint32, c_void_p),
+    'group_join_fail': (c_void_p, c_uint32, c_int, c_void_p),
+    'group_moderation': (c_void_p, c_uint32, c_uint32, c_uint32, c_int, c_void_p),
+    }
+
+# event -> the argument types of the CFUNCTYPE of its callback_* method,
+# where they differ from the C API
+dCALLBACK_METHOD_ARGTYPES = {
+    'group_custom_packet': (c_void_p, c_uint32, c_uint32, POINTER(c_uint8), c_void_p),
+    'group_join_fail': (c_void_p, c_uint32, c_int, c_uint32, c_void_p),
+    }
+
+TOX_PUBLIC_KEY_SIZE = 32
+
+def dPointerLengths() -> dict:
+    """event -> [(position of a pointer argument, position of its length
+    argument or None for a public key)], positions without the tox pointer."""
+    dLengths = {}
+    for sEvent, lArgtypes in dCALLBACK_ARGTYPES.items():
+        lArgtypes = lArgtypes[1:-1]
+        lPointers = []
+        for i, oType in enumerate(lArgtypes):
+            if isinstance(oType, type) and issubclass(oType, _Pointer):
+                if i + 1 < len(lArgtypes) and lArgtypes[i + 1] is c_size_t:
+                    lPointers.append((i, i + 1))
+                else:
+                    lPointers.append((i, None))
+        dLengths[sEvent] = lPointers
+    return dLengths
+
+dPOINTER_LENGTHS = dPointerLengths()
+
+def tCopyArgs(sEvent: str, args: tuple) -> tuple:
+    """The callback arguments args of sEvent, without the tox pointer and
+    user_data, with the byte arrays the pointers point to copied to bytes,
+    so they can be kept after the callback returns."""
+    lPointers = dPOINTER_LENGTHS[sEvent]
+    if lPointers and not isinstance(args[lPointers[0][0]], bytes):
+        args = list(args)
+        for i, iLength in lPointers:
+            args[i] = string_at(args[i], args[iLength] if iLength is not None
+                                else TOX_PUBLIC_KEY_SIZE)
+        args = tuple(args)
+    return args
+
+# argtypes of a CFUNCTYPE -> positions of its pointer arguments, for vCallCallback
+dCALL_POINTERS = {}
+
+def vCallCallback(oCallback, pTox, args: tuple, user_data) -> None:
+    """Call the CFUNCTYPE oCallback, set by a callback_* method, from Python
+    with the arguments of a callback copied by tCopyArgs, so that it gets
+    the same types as from libtoxcore. The argtypes of a few of the
+    callback_* methods differ from the C API in count, so fit the args."""
+    lArgtypes = oCallback.argtypes[1:-1]
+    iArgs = len(lArgtypes)
+    if len(args) != iArgs:
+        args = (args + (0,) * iArgs)[:iArgs]
+    lPointers = dCALL_POINTERS.get(lArgtypes)
+    if lPointers is None:
+        lPointers = dCALL_POINTERS[lArgtypes] = [i for i, oType in enumerate(lArgtypes)
+                                                 if issubclass(oType, _Pointer)]
+    if lPointers:
+        args = list(args)
+        for i in lPointers:
+            args[i] = cast(args[i], lArgtypes[i])
+    oCallback(pTox, *args, user_data)
+
+class EventSlot:
+    """The registered trampoline of one event and the handlers it calls."""
+    __slots__ = ('handlers', 'trampoline')
+
+    def __init__(self):
+        self.handlers = ()
+        self.trampoline = None
+
+# event -> 'f' if its first argument is a friend number, 'g' if a group
+# number, or None: the events of one friend or group keep their order
+dORDER_KEYS = {sEvent: ('g' if sEvent.startswith('group_') and sEvent != 'group_invite' else 'f')
+               if lArgtypes[1] is c_uint32 else None
+               for sEvent, lArgtypes in dCALLBACK_ARGTYPES.items()}
+
+# event -> the positions, without the tox pointer, of the arguments that
+# make the key under which only the latest event is kept when coalescing
+dCOALESCE_KEYS = {
+    'self_connection_status': (),
+    'friend_connection_status': (0,),
+    'friend_status': (0,),
+    'friend_typing': (0,),
+    'friend_name': (0,),
+    'friend_status_message': (0,),
+    'group_peer_status': (0, 1),
+    'group_peer_name': (0, 1),
+    'group_topic': (0,),
+    'group_privacy_state': (0,),
+    'group_peer_limit': (0,),
+    'group_password': (0,),
+    }
+
+class CoalesceStats:
+    """The counters of the coalescing mode."""
+    __slots__ = ('received', 'delivered', 'batches')
+
+    def __init__(self):
+        self.received = 0
+        self.delivered = 0
+        self.batches = 0
+
+    @property
+    def ratio(self) -> float:
+        """How many events were received for each one delivered."""
+        return self.received / self.delivered if self.delivered else 0.0
+
+    def __repr__(self) -> str:
+        return f"CoalesceStats(received={self.received}, delivered={self.delivered}, " \
+            f"batches={self.batches}, ratio={self.ratio:.2f})"
+
+class DispatchSlot:
+    """One preallocated record of a DispatchRing."""
+    __slots__ = ('event', 'tox_pointer', 'args', 'user_data', 'enqueued')
+
+    def __init__(self):
+        self.event = None
+        self.tox_pointer = None
+        self.args = None
+        self.user_data = None
+        self.enqueued = 0.0
+
+class DispatchStats:
+    """The counters of the deferred mode; latencies in seconds."""
+    __slots__ = ('enqueued', 'dropped', 'handled', 'errors', 'depth', 'depth_max',
+                 'wait_total', 'wait_max', 'latency_total', 'latency_max')
+
+    def __init__(self):
+        self.enqueued = 0
+        self.dropped = 0
+        self.handled = 0
+        self.errors = 0
+        self.depth = 0
+        self.depth_max = 0
+        # from the trampoline to the start of the handlers
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # from the trampoline to the end of the handlers
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def latency_mean(self) -> float:
+        return self.latency_total / self.handled if self.handled else 0.0
+
+    @property
+    def wait_mean(self) -> float:
+        return self.wait_total / self.handled if self.handled else 0.0
+
+    def vAdd(self, oOther) -> None:
+        for sName in ('enqueued', 'dropped', 'handled', 'errors', 'depth',
+                      'wait_total', 'latency_total'):
+            setattr(self, sName, getattr(self, sName) + getattr(oOther, sName))
+        for sName in ('depth_max', 'wait_max', 'latency_max'):
+            setattr(self, sName, max(getattr(self, sName), getattr(oOther, sName)))
+
+    def __repr__(self) -> str:
+        return f"DispatchStats(enqueued={self.enqueued}, dropped={self.dropped}, " \
+            f"handled={self.handled}, errors={self.errors}, depth={self.depth}, " \
+            f"depth_max={self.depth_max}, wait_mean={self.wait_mean:.6f}, " \
+            f"latency_mean={self.latency_mean:.6f}, latency_max={self.latency_max:.6f})"
+
+class DispatchRing:
+    """The bounded ring of preallocated slots of one deferred worker."""
+
+    def __init__(self, size: int):
+        self._lSlots = [DispatchSlot() for i in range(size)]
+        self._iSize = size
+        self._iHead = 0
+        self._iCount = 0
+        self._oCondition = threading.Condition(threading.Lock())
+        self.stats = DispatchStats()
+
+    def bPut(self, sEvent: str, pTox, args: tuple, user_data, bBlock: bool) -> bool:
+        oCondition = self._oCondition
+        with oCondition:
+            while self._iCount == self._iSize:
+                if not bBlock:
+                    self.stats.dropped += 1
+                    return False
+                oCondition.wait()
+            oSlot = self._lSlots[(self._iHead + self._iCount) % self._iSize]
+            oSlot.event = sEvent
+            oSlot.tox_pointer = pTox
+            oSlot.args = args
+            oSlot.user_data = user_data
+            oSlot.enqueued = time.perf_counter()
+            self._iCount += 1
+            oStats = self.stats
+            oStats.enqueued += 1
+            oStats.depth = self._iCount
+            if self._iCount > oStats.depth_max:
+                oStats.depth_max = self._iCount
+            oCondition.notify_all()
+        return True
+
+    def tGet(self, bStop) -> tuple:
+        """The (event, tox pointer, args, user_data, enqueued) of the oldest
+        slot, waiting for one, or None once bStop() and the ring is empty."""
+        oCondition = self._oCondition
+        with oCondition:
+            while not self._iCount:
+                if bStop():
+                    return None
+                oCondition.wait(0.5)
+            oSlot = self._lSlots[self._iHead]
+            tRecord = (oSlot.event, oSlot.tox_pointer, oSlot.args, oSlot.user_data, oSlot.enqueued)
+            oSlot.args = oSlot.user_data = None
+            self._iHead = (self._iHead + 1) % self._iSize
+            self._iCount -= 1
+            self.stats.depth = self._iCount
+            oCondition.notify_all()
+        return tRecord
+
+    def vDone(self, fEnqueued: float, fStart: float, bError: bool) -> None:
+        fNow = time.perf_counter()
+        with self._oCondition:
+            oStats = self.stats
+            oStats.handled += 1
+            if bError:
+                oStats.errors += 1
+            fWait = fStart - fEnqueued
+            oStats.wait_total += fWait
+            if fWait > oStats.wait_max:
+                oStats.wait_max = fWait
+            fLatency = fNow - fEnqueued
+            oStats.latency_total += fLatency
+            if fLatency > oStats.latency_max:
+                oStats.latency_max = fLatency
+
+    def vWake(self) -> None:
+        with self._oCondition:
+            self._oCondition.notify_all()
+
+class ToxDispatcher:
+    """Fans each libtoxcore callback out to any number of Python handlers.
+
+    Get the one for a Tox instance with Tox.get_dispatcher().
+    """
+
+    def __init__(self, libtoxcore, tox_pointer, tox=None):
+        self._libtoxcore = libtoxcore
+        self._tox_pointer = tox_pointer
+        self._tox = tox
+        self._lock = threading.Lock()
+        self._slots = {}
+        self.events_mode = False
+        # the deferred mode: a DispatchRing and a thread per worker
+        self._lRings = None
+        self._lThreads = []
+        self._bBlock = True
+        self._bStop = False
+        # events whose trampoline is registered with libtoxcore, and calls
+        # the callback_* callback as well as the handlers
+        self._registered = set()
+        # the rings of the last deferred mode, for stats()
+        self._lDone = []
+        # the coalescing mode: the events coalesced, and the held events,
+        # key -> (event, tox pointer, args, user_data)
+        self._dCoalesce = None
+        self._dHeld = {}
+        self._fHeldSince = 0.0
+        self._fWindow = 0.0
+        self._batch_handlers = ()
+        self.coalesce_stats = CoalesceStats()
+
+    @property
+    def deferred(self) -> bool:
+        return self._lRings is not None
+
+    @property
+    def coalescing(self) -> bool:
+        return self._dCoalesce is not None
+
+    @property
+    def in_worker(self) -> bool:
+        """True on a worker thread of the deferred mode, which must not call
+        libtoxcore, also while undefer lets the workers finish."""
+        return threading.current_thread() in self._lThreads
+
+    def _oTrampoline(self, sEvent: str, oSlot: EventSlot):
+        sKey = dORDER_KEYS[sEvent]
+        def vTrampoline(*args) -> None:
+            dCoalesce = self._dCoalesce
+            if dCoalesce is not None and sEvent in dCoalesce:
+                self.vHold(sEvent, args[0], tCopyArgs(sEvent, args[1:-1]), args[-1])
+                return
+            lRings = self._lRings
+            if lRings is not None:
+                # copy what the pointers point to, before they go away
+                if sKey is None or len(lRings) == 1:
+                    oRing = lRings[0]
+                else:
+                    oRing = lRings[hash((sKey, args[1])) % len(lRings)]
+                oRing.bPut(sEvent, args[0], tCopyArgs(sEvent, args[1:-1]), args[-1], self._bBlock)
+                return
+            for handler in oSlot.handlers:
+                try:
+                    handler(*args)
+                except Exception as e:
+                    LOG_ERROR(f"dispatch {sEvent} {handler!r} {e}")
+            if sEvent in self._registered:
+                oCallback = getattr(self._tox, sEvent + '_cb', None)
+                if oCallback is not None:
+                    try:
+                        vCallCallback(oCallback, args[0], args[1:-1], args[-1])
+                    except Exception as e:
+                        LOG_ERROR(f"dispatch {sEvent} callback {e}")
+        return CFUNCTYPE(None, *dCALLBACK_ARGTYPES[sEvent])(vTrampoline)
+
+    def _vRegister(self, event: str, oSlot: EventSlot) -> None:
+        # with self._lock held
+        if oSlot.trampoline is None:
+            oSlot.trampoline = self._oTrampoline(event, oSlot)
+        LOG_DEBUG("dispatch registering %s", event)
+        getattr(self._libtoxcore, 'tox_callback_' + event)(self._tox_pointer,
+                                                            oSlot.trampoline)
+        self._registered.add(event)
+
+    def subscribe(self, event: str, handler: Callable) -> Callable:
+        """Add handler for event, e.g. 'friend_message'. The handlers of an
+        event are called in the order they subscribed, with the arguments
+        of its callback, tox pointer first and user_data last. Returns handler.
+
+        A c_char_p argument is always bytes. A POINTER(c_uint8) argument,
+        the data of file_recv_chunk and of the packets, and the keys of
+        friend_request and group_invite, is the ctypes pointer, only valid
+        during the call, when the trampoline calls the handlers, and the
+        bytes it points to when the event was copied, in the deferred,
+        coalescing and events modes. ctypes.string_at(data, length) reads
+        either."""
+        if event not in dCALLBACK_ARGTYPES:
+            raise ValueError(f"unknown callback event {event}")
+        with self._lock:
+            oSlot = self._slots.get(event)
+            if oSlot is None:
+                oSlot = self._slots[event] = EventSlot()
+            if event not in self._registered and not self.events_mode:
+                self._vRegister(event, oSlot)
+            oSlot.handlers = oSlot.handlers + (handler,)
+        return handler
+    def unsubscribe(self, event: str, handler: Callable) -> bool:
+        """Remove the first subscription of handler to event.
+        Returns False if it was not subscribed."""
+        with self._lock:
+            oSlot = self._slots.get(event)
+            if oSlot is None or handler not in oSlot.handlers:
+                return False
+            lHandlers = list(oSlot.handlers)
+            lHandlers.remove(handler)
+            oSlot.handlers = tuple(lHandlers)
+        return True
+
+    def handlers(self, event: str) -> tuple:
+        """The handlers subscribed to event."""
+        oSlot = self._slots.get(event)
+        return oSlot.handlers if oSlot is not None else ()
+
+    def registered(self, event: str) -> bool:
+        """Whether the trampoline of event is registered with libtoxcore, in
+        place of the callback of the callback_* method, see vHandBack."""
+        return event in self._registered
+
+    def fire(self, event: str, *args) -> None:
+        """Call the trampoline of event with args, the arguments of its
+        callback, tox pointer first and user_data last, as libtoxcore does:
+        the handlers, the deferred and coalescing modes and the callback_*
+        callback all apply. For tests, and to replay events; the trampoline
+        is made if need be, but not registered. In the events mode, which has
+        no trampolines, the handlers and the callback are called directly."""
+        if event not in dCALLBACK_ARGTYPES:
+            raise ValueError(f"unknown callback event {event}")
+        if self.events_mode:
+            self._vDeliver(event, args[0], args[1:-1], args[-1])
+            return
+        with self._lock:
+            oSlot = self._slots.get(event)
+            if oSlot is None:
+                oSlot = self._slots[event] = EventSlot()
+            if oSlot.trampoline is None:
+                oSlot.trampoline = self._oTrampoline(event, oSlot)
+            trampoline = oSlot.trampoline
+        trampoline(*args)
+
+    def reclaim(self, event: str) -> None:
+        """Register the trampoline of event with libtoxcore again, after the
+        callback_* method of the event replaced it, and have the trampoline
+        call the callback set by that method as well as the handlers. The
+        callback_* methods have this done when it is needed, see vHandBack."""
+        if event not in dCALLBACK_ARGTYPES or self.events_mode:
+            return
+        with self._lock:
+            oSlot = self._slots.get(event)
+            if oSlot is None:
+                oSlot = self._slots[event] = EventSlot()
+            self._vRegister(event, oSlot)
+
+    def vHandBack(self, event: str) -> None:
+        """Called by the callback_* method of event, after it registered its
+        callback with libtoxcore in place of the trampoline. The event is
+        only reclaimed when the dispatcher has something to do with it, a
+        handler, the deferred mode or the coalescing of the event; otherwise
+        the callback is left registered directly, and the first subscribe
+        to the event hands it back."""
+        if event not in dCALLBACK_ARGTYPES or self.events_mode:
+            return
+        if self._lRings is not None or self.handlers(event) or \
+           (self._dCoalesce is not None and event in self._dCoalesce):
+            self.reclaim(event)
+        else:
+            with self._lock:
+                self._registered.discard(event)
+
+    def vStoreCallback(self, event: str, callback) -> None:
+        """In the events mode, keep callback as the callback_* callback of
+        event, for ToxEvents.vDeliver to call, without registering anything
+        with libtoxcore, which would take the event from the events loop.
+        None only forgets the callback."""
+        if event not in dCALLBACK_ARGTYPES:
+            raise ValueError(f"unknown callback event {event}")
+        oCallback = None
+        if callback is not None:
+            lArgtypes = dCALLBACK_METHOD_ARGTYPES.get(event, dCALLBACK_ARGTYPES[event])
+            oCallback = CFUNCTYPE(None, *lArgtypes)(callback)
+        setattr(self._tox, event + '_cb', oCallback)
+
+    # Deferred mode
+
+    def defer(self, workers: int=1, size: int=4096, policy: str='block') -> None:
+        """Start the deferred mode, see the top of toxdispatch.py.
+
+        :param workers: the number of threads calling the handlers
+        :param size: the number of slots, shared out between the workers
+        :param policy: 'block' to hold up tox_iterate while the ring of a worker
+        is full, or 'drop' to drop the event and count it
+        """
+        if policy not in ('block', 'drop'):
+            raise ValueError(f"unknown dispatch policy {policy}")
+        if self.events_mode:
+            raise RuntimeError('the events mode of toxevents.py delivers on the iterate thread')
+        if self._lRings is not None:
+            raise RuntimeError('the dispatcher is already deferred')
+        self._bBlock = policy == 'block'
+        self._bStop = False
+        lRings = [DispatchRing(max(size // workers, 1)) for i in range(workers)]
+        self._lThreads = [threading.Thread(target=self._vWork, args=(oRing,),
+                                           name=f"ToxDispatch-{i}", daemon=True)
+                          for i, oRing in enumerate(lRings)]
+        for oThread in self._lThreads:
+            oThread.start()
+        self._lRings = lRings
+        if self._tox is not None:
+            for sEvent in dCALLBACK_ARGTYPES:
+                if getattr(self._tox, sEvent + '_cb', None) is not None:
+                    self.reclaim(sEvent)
+
+    def undefer(self, timeout: float=None) -> None:
+        """Go back to calling the handlers in the trampolines, once the
+        workers have handled what is queued."""
+        lRings = self._lRings
+        if lRings is None:
+            return
+        self._lRings = None
+        self._bStop = True
+        for oRing in lRings:
+            oRing.vWake()
+        for oThread in self._lThreads:
+            if oThread is not threading.current_thread():
+                oThread.join(timeout)
+        self._lThreads = []
+        self._lDone = lRings
+
+    def _vWork(self, oRing: DispatchRing) -> None:
+        bStop = lambda: self._bStop
+        while True:
+            tRecord = oRing.tGet(bStop)
+            if tRecord is None:
+                return
+            sEvent, pTox, args, user_data, fEnqueued = tRecord
+            fStart = time.perf_counter()
+            bError = False
+            oSlot = self._slots.get(sEvent)
+            for handler in (oSlot.handlers if oSlot is not None else ()):
+                try:
+                    handler(pTox, *args, user_data)
+                except Exception as e:
+                    bError = True
+                    LOG_ERROR(f"dispatch {sEvent} {handler!r} {e}")
+            if sEvent in self._registered:
+                oCallback = getattr(self._tox, sEvent + '_cb', None)
+                if oCallback is not None:
+                    try:
+                        vCallCallback(oCallback, pTox, args, user_data)
+                    except Exception as e:
+                        bError = True
+                        LOG_ERROR(f"dispatch {sEvent} callback {e}")
+            oRing.vDone(fEnqueued, fStart, bError)
+
+    def stats(self) -> DispatchStats:
+        """The counters of the deferred mode, summed over the workers;
+        depth is the number of events queued now."""
+        oStats = DispatchStats()
+        for oRing in self._lRings or self._lDone:
+            oStats.vAdd(oRing.stats)
+        return oStats
+
+    def _vDeliver(self, sEvent: str, pTox, args: tuple, user_data) -> None:
+        # deliver an event with copied args, to the workers if deferred
+        lRings = self._lRings
+        if lRings is not None:
+            sKey = dORDER_KEYS[sEvent]
+            if sKey is None or len(lRings) == 1:
+                oRing = lRings[0]
+            else:
+                oRing = lRings[hash((sKey, args[0])) % len(lRings)]
+            oRing.bPut(sEvent, pTox, args, user_data, self._bBlock)
+            return
+        oSlot = self._slots.get(sEvent)
+        for handler in (oSlot.handlers if oSlot is not None else ()):
+            try:
+                handler(pTox, *args, user_data)
+            except Exception as e:
+                LOG_ERROR(f"dispatch {sEvent} {handler!r} {e}")
+        # in the events mode ToxEvents.vDeliver calls every callback_* callback
+        if self.events_mode or sEvent in self._registered:
+            oCallback = getattr(self._tox, sEvent + '_cb', None)
+            if oCallback is not None:
+                try:
+                    vCallCallback(oCallback, pTox, args, user_data)
+                except Exception as e:
+                    LOG_ERROR(f"dispatch {sEvent} callback {e}")
+
+    # Coalescing mode
+
+    def coalesce(self, window: float=0.05, events=None) -> None:
+        """Start the coalescing mode, see the top of toxdispatch.py.
+
+        :param window: the seconds to hold the events for, from the first held
+        :param events: the events to coalesce, by default all of dCOALESCE_KEYS
+        """
+        lEvents = list(dCOALESCE_KEYS) if events is None else list(events)
+        for sEvent in lEvents:
+            if sEvent not in dCOALESCE_KEYS:
+                raise ValueError(f"{sEvent} events are never coalesced")
+        self._fWindow = window
+        self._dCoalesce = {sEvent: dCOALESCE_KEYS[sEvent] for sEvent in lEvents}
+        if self._tox is not None:
+            for sEvent in lEvents:
+                if getattr(self._tox, sEvent + '_cb', None) is not None:
+                    self.reclaim(sEvent)
+
+    def uncoalesce(self) -> None:
+        """Deliver what is held and stop coalescing."""
+        self.flush()
+        self._dCoalesce = None
+
+    def subscribe_batch(self, handler: Callable) -> Callable:
+        """Add handler(records) to be called with each batch of coalesced
+        events, after the handlers of the events; the records are those of
+        toxevents.py, (event, args...). Returns handler."""
+        with self._lock:
+            self._batch_handlers = self._batch_handlers + (handler,)
+        return handler
+
+    def unsubscribe_batch(self, handler: Callable) -> bool:
+        with self._lock:
+            if handler not in self._batch_handlers:
+                return False
+            lHandlers = list(self._batch_handlers)
+            lHandlers.remove(handler)
+            self._batch_handlers = tuple(lHandlers)
+        return True
+
+    def vHold(self, sEvent: str, pTox, args: tuple, user_data) -> None:
+        """Hold an event, with copied args, in place of any held with its key."""
+        dHeld = self._dHeld
+        if not dHeld:
+            self._fHeldSince = time.monotonic()
+        tKey = (sEvent,) + tuple(args[i] for i in self._dCoalesce[sEvent])
+        # the latest goes last, so the batch keeps the order of the latest events
+        dHeld.pop(tKey, None)
+        dHeld[tKey] = (sEvent, pTox, args, user_data)
+        self.coalesce_stats.received += 1
+
+    def flush_due(self) -> None:
+        """Deliver the held events if the window has closed; called after each iterate."""
+        if self._dHeld and time.monotonic() - self._fHeldSince >= self._fWindow:
+            self.flush()
+
+    def flush(self) -> None:
+        """Deliver the held events now, as one batch."""
+        dHeld = self._dHeld
+        if not dHeld:
+            return
+        self._dHeld = {}
+        oStats = self.coalesce_stats
+        oStats.delivered += len(dHeld)
+        oStats.batches += 1
+        for sEvent, pTox, args, user_data in dHeld.values():
+            self._vDeliver(sEvent, pTox, args, user_data)
+        if self._batch_handlers:
+            lRecords = [(sEvent,) + args for sEvent, pTox, args, user_data in dHeld.values()]
+            for handler in self._batch_handlers:
+                try:
+                    handler(lRecords)
+                except Exception as e:
+                    LOG_ERROR(f"dispatch batch {handler!r} {e}")
+
+    def close(self) -> None:
+        """Unregister every trampoline from libtoxcore and drop all the handlers."""
+        self.undefer()
+        self._dCoalesce = None
+        self._dHeld = {}
+        with self._lock:
+            for sEvent, oSlot in self._slots.items():
+                oSlot.handlers = ()
+                if sEvent in self._registered:
+                    getattr(self._libtoxcore, 'tox_callback_' + sEvent)(self._tox_pointer,
+                                                                        POINTER(None)())
+                    oSlot.trampoline = None
+            self._registered = set()
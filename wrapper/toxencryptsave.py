@@ -4,10 +4,15 @@ try:
     from wrapper import libtox
 #?    from wrapper.toxencryptsave_enums_and_consts import *
     import wrapper.toxencryptsave_enums_and_consts as enum
+    from wrapper import toxlog
 except:
     import libtox
 #?    from toxencryptsave_enums_and_consts import *
     import toxencryptsave_enums_and_consts as enum
+    import toxlog
+
+# binds LOG_ERROR LOG_WARN LOG_INFO LOG_DEBUG LOG_TRACE - see toxlog.py
+toxlog.vRegister(globals())
 
 from ctypes import (ArgumentError, byref, c_bool, c_char_p, c_int, c_size_t,
                     create_string_buffer)
@@ -22,9 +27,7 @@ class ToxEncryptSave:
         """
         Checks if given data is encrypted
         """
-        func = self.libtoxencryptsave.tox_is_data_encrypted
-        func.restype = c_bool
-        result = func(c_char_p(bytes(data)))
+        result = self.libtoxencryptsave.tox_is_data_encrypted(bytes(data))
         return bool(result)
 
     def pass_encrypt(self, data: bytes, password: str) -> bytes:
@@ -35,12 +38,13 @@ class ToxEncryptSave:
         """
         out = create_string_buffer(len(data) + enum.TOX_PASS_ENCRYPTION_EXTRA_LENGTH)
         tox_err_encryption = c_int()
+        LOG_DEBUG("toxencryptsave.pass_encrypt")
         if type(password) != bytes:
             password = bytes(password, 'utf-8')
-        self.libtoxencryptsave.tox_pass_encrypt(c_char_p(data),
-                                                c_size_t(len(data)),
-                                                c_char_p(password),
-                                                c_size_t(len(password)),
+        self.libtoxencryptsave.tox_pass_encrypt(data,
+                                                len(data),
+                                                password,
+                                                len(password),
                                                 out,
                                                 byref(tox_err_encryption))
         tox_err_encryption = tox_err_encryption.value
@@ -62,12 +66,13 @@ class ToxEncryptSave:
         """
         out = create_string_buffer(len(data) - enum.TOX_PASS_ENCRYPTION_EXTRA_LENGTH)
         tox_err_decryption = c_int()
+        LOG_DEBUG("toxencryptsave.pass_decrypt")
         if type(password) != bytes:
             password = bytes(password, 'utf-8')
-        self.libtoxencryptsave.tox_pass_decrypt(c_char_p(bytes(data)),
-                                                c_size_t(len(data)),
-                                                c_char_p(password),
-                                                c_size_t(len(password)),
+        self.libtoxencryptsave.tox_pass_decrypt(bytes(data),
+                                                len(data),
+                                                password,
+                                                len(password),
                                                 out,
                                                 byref(tox_err_decryption))
         tox_err_decryption = tox_err_decryption.value
@@ -0,0 +1,222 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# Batched event loop mode on the tox_events API of c-toxcore (0.2.19).
+#
+# Instead of tox_iterate calling a CFUNCTYPE trampoline into Python for
+# every event, tox_events_iterate collects all the events of an iteration
+# in C, and they are decoded here in one pass into records:
+#
+#   ('friend_message', friend_number, message_type, message, length)
+#
+# a tuple of the event name and the same arguments the callback_* method
+# of that event passes, less the tox pointer and user_data. Byte array
+# arguments are bytes, and keep their length argument after them.
+#
+# Tox.events_iterate() returns the records, and delivers each to the
+# handlers of the ToxDispatcher of the instance and to the callback set
+# with the callback_* method of the event, so existing code keeps working.
+#
+# Use either Tox.iterate or Tox.events_iterate on an instance, not both.
+
+from ctypes import c_bool, c_int, c_uint16, c_uint32, c_uint64, c_void_p, string_at
+
+try:
+    from wrapper import toxlog
+    from wrapper.libtox import c_err_p, vBindPrototypes
+    from wrapper.toxcore_enums_and_consts import TOX_EVENT_TYPE, TOX_PUBLIC_KEY_SIZE
+    from wrapper.toxcore_errors import ToxError, dEVENTS_ITERATE_ERRORS, oERROR, vCheckError
+    from wrapper.toxdispatch import vCallCallback
+except:
+    import toxlog
+    from libtox import c_err_p, vBindPrototypes
+    from toxcore_enums_and_consts import TOX_EVENT_TYPE, TOX_PUBLIC_KEY_SIZE
+    from toxcore_errors import ToxError, dEVENTS_ITERATE_ERRORS, oERROR, vCheckError
+    from toxdispatch import vCallCallback
+
+toxlog.vRegister(globals())
+
+# kinds of field other than integers
+BYTES = 'bytes' # const uint8_t * with a _length getter: the record gets (bytes, length)
+KEY = 'key'     # a TOX_PUBLIC_KEY_SIZE key: the record gets bytes
+
+# event -> [(field, restype or BYTES or KEY)], in the order of the callback
+# arguments; the getter of a field is tox_event_<event>_get_<field>
+dEVENT_FIELDS = {
+    'self_connection_status': [('connection_status', c_int)],
+    'friend_request': [('public_key', KEY), ('message', BYTES)],
+    'friend_connection_status': [('friend_number', c_uint32), ('connection_status', c_int)],
+    'friend_lossy_packet': [('friend_number', c_uint32), ('data', BYTES)],
+    'friend_lossless_packet': [('friend_number', c_uint32), ('data', BYTES)],
+    'friend_name': [('friend_number', c_uint32), ('name', BYTES)],
+    'friend_status': [('friend_number', c_uint32), ('status', c_int)],
+    'friend_status_message': [('friend_number', c_uint32), ('message', BYTES)],
+    'friend_message': [('friend_number', c_uint32), ('type', c_int), ('message', BYTES)],
+    'friend_read_receipt': [('friend_number', c_uint32), ('message_id', c_uint32)],
+    'friend_typing': [('friend_number', c_uint32), ('typing', c_bool)],
+    'file_chunk_request': [('friend_number', c_uint32), ('file_number', c_uint32),
+                           ('position', c_uint64), ('length', c_uint16)],
+    'file_recv': [('friend_number', c_uint32), ('file_number', c_uint32), ('kind', c_uint32),
+                  ('file_size', c_uint64), ('filename', BYTES)],
+    'file_recv_chunk': [('friend_number', c_uint32), ('file_number', c_uint32),
+                        ('position', c_uint64), ('data', BYTES)],
+    'file_recv_control': [('friend_number', c_uint32), ('file_number', c_uint32), ('control', c_int)],
+    'group_peer_name': [('group_number', c_uint32), ('peer_id', c_uint32), ('name', BYTES)],
+    'group_peer_status': [('group_number', c_uint32), ('peer_id', c_uint32), ('status', c_int)],
+    'group_topic': [('group_number', c_uint32), ('peer_id', c_uint32), ('topic', BYTES)],
+    'group_privacy_state': [('group_number', c_uint32), ('privacy_state', c_int)],
+    'group_peer_limit': [('group_number', c_uint32), ('peer_limit', c_uint32)],
+    'group_password': [('group_number', c_uint32), ('password', BYTES)],
+    'group_message': [('group_number', c_uint32), ('peer_id', c_uint32),
+                      ('message_type', c_int), ('message', BYTES)],
+    'group_private_message': [('group_number', c_uint32), ('peer_id', c_uint32),
+                              ('message_type', c_int), ('message', BYTES)],
+    'group_custom_packet': [('group_number', c_uint32), ('peer_id', c_uint32), ('data', BYTES)],
+    'group_invite': [('friend_number', c_uint32), ('invite_data', BYTES), ('group_name', BYTES)],
+    'group_peer_join': [('group_number', c_uint32), ('peer_id', c_uint32)],
+    'group_peer_exit': [('group_number', c_uint32), ('peer_id', c_uint32), ('exit_type', c_int),
+                        ('name', BYTES), ('part_message', BYTES)],
+    'group_self_join': [('group_number', c_uint32)],
+    'group_join_fail': [('group_number', c_uint32), ('fail_type', c_int)],
+    'group_moderation': [('group_number', c_uint32), ('source_peer_id', c_uint32),
+                         ('target_peer_id', c_uint32), ('mod_type', c_int)],
+    }
+
+def dEventPrototypes() -> dict:
+    dPrototypes = {
+        'tox_events_init': (None, [c_void_p]),
+        'tox_events_iterate': (c_void_p, [c_void_p, c_bool, c_err_p]),
+        'tox_events_free': (None, [c_void_p]),
+        'tox_events_get_size': (c_uint32, [c_void_p]),
+        'tox_events_get': (c_void_p, [c_void_p, c_uint32]),
+        'tox_event_get_type': (c_int, [c_void_p]),
+        }
+    for sEvent, lFields in dEVENT_FIELDS.items():
+        dPrototypes[f"tox_event_get_{sEvent}"] = (c_void_p, [c_void_p])
+        for sField, oType in lFields:
+            sGetter = f"tox_event_{sEvent}_get_{sField}"
+            if oType is BYTES:
+                dPrototypes[sGetter] = (c_void_p, [c_void_p])
+                dPrototypes[sGetter + '_length'] = (c_uint32, [c_void_p])
+            elif oType is KEY:
+                dPrototypes[sGetter] = (c_void_p, [c_void_p])
+            else:
+                dPrototypes[sGetter] = (oType, [c_void_p])
+    return dPrototypes
+
+dTOXEVENTS_PROTOTYPES = dEventPrototypes()
+
+INT, DATA, PUBLIC_KEY = 0, 1, 2
+
+class ToxEvents:
+    """The events loop of one Tox instance, see Tox.events_iterate."""
+
+    def __init__(self, tox):
+        self._tox = tox
+        self._tox_pointer = tox._tox_pointer
+        oLib = self._libtoxcore = type(tox).libtoxcore
+        vBindPrototypes(oLib, oLib._libtoxcore, dTOXEVENTS_PROTOTYPES)
+        if not hasattr(oLib, 'tox_events_iterate'):
+            raise ToxError('libtoxcore has no tox_events_iterate')
+        # type -> (event, typed getter, [(getter, kind, length getter)])
+        self._decoders = {}
+        lMissing = []
+        for sEvent, lFields in dEVENT_FIELDS.items():
+            try:
+                self._decoders[TOX_EVENT_TYPE['TOX_EVENT_' + sEvent.upper()]] = (
+                    sEvent, getattr(oLib, f"tox_event_get_{sEvent}"), self._lGetters(sEvent, lFields))
+            except AttributeError:
+                lMissing.append(sEvent)
+        if lMissing:
+            LOG_WARN(f"events: this libtoxcore has no getters for {' '.join(lMissing)}")
+        if hasattr(oLib, 'tox_events_init'):
+            oLib.tox_events_init(self._tox_pointer)
+        tox.get_dispatcher().events_mode = True
+
+    def _lGetters(self, sEvent: str, lFields: list) -> list:
+        oLib = self._libtoxcore
+        lGetters = []
+        for sField, oType in lFields:
+            sGetter = f"tox_event_{sEvent}_get_{sField}"
+            if oType is BYTES:
+                lGetters.append((getattr(oLib, sGetter), DATA, getattr(oLib, sGetter + '_length')))
+            elif oType is KEY:
+                lGetters.append((getattr(oLib, sGetter), PUBLIC_KEY, None))
+            else:
+                lGetters.append((getattr(oLib, sGetter), INT, None))
+        return lGetters
+
+    def lDecode(self, pEvents) -> list:
+        """Decode the Tox_Events pEvents into a list of records."""
+        oLib = self._libtoxcore
+        get = oLib.tox_events_get
+        get_type = oLib.tox_event_get_type
+        dDecoders = self._decoders
+        lRecords = []
+        for i in range(oLib.tox_events_get_size(pEvents)):
+            pEvent = get(pEvents, i)
+            oDecoder = dDecoders.get(get_type(pEvent))
+            if oDecoder is None:
+                continue
+            sEvent, fTyped, lGetters = oDecoder
+            p = fTyped(pEvent)
+            lRecord = [sEvent]
+            for fGet, iKind, fLength in lGetters:
+                if iKind == INT:
+                    lRecord.append(fGet(p))
+                elif iKind == DATA:
+                    iLength = fLength(p)
+                    lRecord.append(string_at(fGet(p), iLength) if iLength else b'')
+                    lRecord.append(iLength)
+                else:
+                    lRecord.append(string_at(fGet(p), TOX_PUBLIC_KEY_SIZE))
+            lRecords.append(tuple(lRecord))
+        return lRecords
+
+    def iterate(self, user_data=None, deliver: bool=True) -> list:
+        """Run one iteration, and return the records of its events,
+        after delivering them to the handlers and callbacks if deliver."""
+        oLib = self._libtoxcore
+        perror = oERROR.pointer
+        pEvents = oLib.tox_events_iterate(self._tox_pointer, False, perror)
+        try:
+            vCheckError(perror[0], dEVENTS_ITERATE_ERRORS)
+            lRecords = self.lDecode(pEvents) if pEvents else []
+        finally:
+            if pEvents:
+                oLib.tox_events_free(pEvents)
+        if deliver and lRecords:
+            self.vDeliver(lRecords, user_data)
+        elif deliver and self._tox.get_dispatcher().coalescing:
+            # the window of the held events may close in an iteration without events
+            self._tox.get_dispatcher().flush_due()
+        return lRecords
+
+    def vDeliver(self, lRecords: list, user_data=None) -> None:
+        """Call the dispatcher handlers and the callback_* callback of each record.
+        When the dispatcher is coalescing, the records of the coalesced events
+        are held by it instead, see ToxDispatcher.coalesce."""
+        tox = self._tox
+        pTox = self._tox_pointer
+        oDispatcher = tox.get_dispatcher()
+        handlers = oDispatcher.handlers
+        dCoalesce = oDispatcher._dCoalesce
+        for tRecord in lRecords:
+            sEvent = tRecord[0]
+            if dCoalesce is not None and sEvent in dCoalesce:
+                oDispatcher.vHold(sEvent, pTox, tRecord[1:], user_data)
+                continue
+            for handler in handlers(sEvent):
+                try:
+                    handler(pTox, *tRecord[1:], user_data)
+                except Exception as e:
+                    LOG_ERROR(f"events {sEvent} {handler!r} {e}")
+            oCallback = getattr(tox, sEvent + '_cb', None)
+            if oCallback is not None:
+                # the CFUNCTYPE set by callback_*, called through ctypes so
+                # the callback gets the same types as from libtoxcore
+                try:
+                    vCallCallback(oCallback, pTox, tRecord[1:], user_data)
+                except Exception as e:
+                    LOG_ERROR(f"events {sEvent} callback {e}")
+        if dCoalesce is not None:
+            oDispatcher.flush_due()
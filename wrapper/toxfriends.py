@@ -0,0 +1,278 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# A table of the friends of a Tox instance kept in Python, so that reading
+# a friend's name, status or connection status, or finding a friend by
+# public key, does not call into libtoxcore.
+#
+# The table is filled from self_get_friend_list when it is made, by
+# Tox.get_friend_table, and then kept current by handlers on the
+# dispatcher of the instance for the friend_name, friend_status_message,
+# friend_status, friend_connection_status and friend_typing events, and by
+# Tox.friend_add, friend_add_norequest and friend_delete:
+#
+#   oTable = tox.get_friend_table()
+#   friend_number = oTable.by_public_key(public_key)
+#   if friend_number is not None and oTable[friend_number].connection_status:
+#       ...
+#
+# The records are updated on the thread running the handlers, the iterate
+# thread or a deferred worker, one field at a time, and can be read from
+# any thread. Friends added by loading savedata into another instance, or
+# by calling libtoxcore directly, are not seen until refresh().
+#
+# Tox.friends_snapshot() returns the friends as columns instead, a
+# FriendsSnapshot of arrays of numbers and one block of the public keys,
+# for sorting, filtering or handing to numpy without a Python object per
+# friend. It is read from the FriendTable when there is one, and otherwise
+# from libtoxcore, straight into the arrays.
+
+import time
+from array import array
+from ctypes import c_char, c_uint32, string_at
+
+try:
+    from wrapper import toxlog
+    from wrapper.toxcore_enums_and_consts import TOX_CONNECTION, TOX_PUBLIC_KEY_SIZE
+    from wrapper.toxcore_errors import (dFRIEND_GET_LAST_ONLINE_ERRORS,
+                                        dFRIEND_GET_PUBLIC_KEY_ERRORS,
+                                        dFRIEND_QUERY_ERRORS, oERROR, vCheckError)
+except:
+    import toxlog
+    from toxcore_enums_and_consts import TOX_CONNECTION, TOX_PUBLIC_KEY_SIZE
+    from toxcore_errors import (dFRIEND_GET_LAST_ONLINE_ERRORS,
+                                dFRIEND_GET_PUBLIC_KEY_ERRORS,
+                                dFRIEND_QUERY_ERRORS, oERROR, vCheckError)
+
+toxlog.vRegister(globals())
+
+class FriendRecord:
+    """A friend in a FriendTable; public_key is the raw bytes and
+    last_online a unix time."""
+    __slots__ = ('friend_number', 'public_key', 'name', 'status_message',
+                 'status', 'connection_status', 'typing', 'last_online')
+
+    def __init__(self, friend_number, public_key, name='', status_message='',
+                 status=0, connection_status=0, typing=False, last_online=0):
+        self.friend_number = friend_number
+        self.public_key = public_key
+        self.name = name
+        self.status_message = status_message
+        self.status = status
+        self.connection_status = connection_status
+        self.typing = typing
+        self.last_online = last_online
+
+    def __repr__(self) -> str:
+        return f"FriendRecord({self.friend_number}, {self.public_key.hex().upper()}, " \
+            f"{self.name!r}, {self.status_message!r}, {self.status}, " \
+            f"{self.connection_status}, {self.typing}, {self.last_online})"
+
+def sText(data, length: int) -> str:
+    # a c_char_p argument arrives as bytes, a copied one as bytes too, and
+    # a pointer from elsewhere as an int or a ctypes pointer
+    if not isinstance(data, bytes):
+        data = string_at(data, length) if length else b''
+    return str(data[:length], 'utf-8', errors='ignore')
+
+def bKey(public_key) -> bytes:
+    """The raw bytes of a public key given as bytes or as hex."""
+    if isinstance(public_key, str):
+        public_key = bytes.fromhex(public_key)
+    return bytes(public_key[:TOX_PUBLIC_KEY_SIZE])
+
+class FriendTable:
+    """The friends of a Tox instance, see Tox.get_friend_table."""
+
+    def __init__(self, tox):
+        self._tox = tox
+        # friend number -> FriendRecord
+        self._dFriends = {}
+        # raw public key -> friend number
+        self._dByKey = {}
+        self.refresh()
+        self._lHandlers = [
+            ('friend_name', self._vOnName),
+            ('friend_status_message', self._vOnStatusMessage),
+            ('friend_status', self._vOnStatus),
+            ('friend_connection_status', self._vOnConnectionStatus),
+            ('friend_typing', self._vOnTyping),
+            ]
+        oDispatcher = tox.get_dispatcher()
+        for sEvent, handler in self._lHandlers:
+            oDispatcher.subscribe(sEvent, handler)
+
+    def close(self) -> None:
+        """Stop following the events; the table keeps what it has."""
+        oDispatcher = self._tox.get_dispatcher()
+        for sEvent, handler in self._lHandlers:
+            oDispatcher.unsubscribe(sEvent, handler)
+        self._lHandlers = []
+
+    def refresh(self) -> None:
+        """Read every friend from libtoxcore again."""
+        tox = self._tox
+        dFriends = {}
+        dByKey = {}
+        for friend_number in tox.self_get_friend_list():
+            oRecord = self._oRead(friend_number)
+            dFriends[friend_number] = oRecord
+            dByKey[oRecord.public_key] = friend_number
+        self._dFriends = dFriends
+        self._dByKey = dByKey
+
+    def _oRead(self, friend_number: int, public_key: bytes=None) -> FriendRecord:
+        tox = self._tox
+        oInfo = tox.friend_get_info(friend_number)
+        if public_key is None:
+            public_key = tox.friend_get_public_key_bytes(friend_number)
+        return FriendRecord(friend_number, public_key,
+                            oInfo.name, oInfo.status_message, oInfo.status,
+                            oInfo.connection_status, tox.friend_get_typing(friend_number),
+                            oInfo.last_online)
+
+    # Reads
+
+    def __len__(self) -> int:
+        return len(self._dFriends)
+
+    def __contains__(self, friend_number: int) -> bool:
+        return friend_number in self._dFriends
+
+    def __getitem__(self, friend_number: int) -> FriendRecord:
+        return self._dFriends[friend_number]
+
+    def __iter__(self):
+        return iter(list(self._dFriends.values()))
+
+    def get(self, friend_number: int, default=None):
+        return self._dFriends.get(friend_number, default)
+
+    def by_public_key(self, public_key, default=None):
+        """The friend number of public_key, raw bytes or hex, or default."""
+        if not isinstance(public_key, bytes) or len(public_key) != TOX_PUBLIC_KEY_SIZE:
+            public_key = bKey(public_key)
+        return self._dByKey.get(public_key, default)
+
+    def online(self) -> list:
+        """The friend numbers of the friends connected now."""
+        return [oRecord.friend_number for oRecord in list(self._dFriends.values())
+                if oRecord.connection_status != TOX_CONNECTION['NONE']]
+
+    # Changes from Tox
+
+    def vAdd(self, friend_number: int, public_key=None) -> None:
+        """A friend was added with friend_number, and public_key if known."""
+        try:
+            oRecord = self._oRead(friend_number, None if public_key is None else bKey(public_key))
+        except Exception as e:
+            LOG_WARN(f"friend table add {friend_number} {e}")
+            return
+        self.vDelete(friend_number)
+        self._dFriends[friend_number] = oRecord
+        self._dByKey[oRecord.public_key] = friend_number
+
+    def vDelete(self, friend_number: int) -> None:
+        """The friend friend_number was deleted."""
+        oRecord = self._dFriends.pop(friend_number, None)
+        if oRecord is not None and self._dByKey.get(oRecord.public_key) == friend_number:
+            del self._dByKey[oRecord.public_key]
+
+    # Handlers, (tox pointer, callback args..., user_data)
+
+    def _vOnName(self, pTox, friend_number, name, length, user_data) -> None:
+        oRecord = self._dFriends.get(friend_number)
+        if oRecord is not None:
+            oRecord.name = sText(name, length)
+
+    def _vOnStatusMessage(self, pTox, friend_number, message, length, user_data) -> None:
+        oRecord = self._dFriends.get(friend_number)
+        if oRecord is not None:
+            oRecord.status_message = sText(message, length)
+
+    def _vOnStatus(self, pTox, friend_number, status, user_data) -> None:
+        oRecord = self._dFriends.get(friend_number)
+        if oRecord is not None:
+            oRecord.status = status
+
+    def _vOnConnectionStatus(self, pTox, friend_number, connection_status, user_data) -> None:
+        oRecord = self._dFriends.get(friend_number)
+        if oRecord is not None:
+            oRecord.connection_status = connection_status
+            # libtoxcore sets its last seen time on both going online and offline
+            oRecord.last_online = int(time.time())
+
+    def _vOnTyping(self, pTox, friend_number, typing, user_data) -> None:
+        oRecord = self._dFriends.get(friend_number)
+        if oRecord is not None:
+            oRecord.typing = bool(typing)
+
+class FriendsSnapshot:
+    """The friends of a Tox at one time, as columns: friend_numbers,
+    connection_status and status are array('I'), last_online array('Q'),
+    all in the same order, and public_keys the keys of the friends in
+    that order, TOX_PUBLIC_KEY_SIZE bytes each, as one bytes."""
+    __slots__ = ('friend_numbers', 'connection_status', 'status', 'last_online', 'public_keys')
+
+    def __init__(self, friend_numbers, connection_status, status, last_online, public_keys):
+        self.friend_numbers = friend_numbers
+        self.connection_status = connection_status
+        self.status = status
+        self.last_online = last_online
+        self.public_keys = public_keys
+
+    def __len__(self) -> int:
+        return len(self.friend_numbers)
+
+    def public_key(self, i: int) -> bytes:
+        """The public key of the i-th friend of the snapshot."""
+        return self.public_keys[i * TOX_PUBLIC_KEY_SIZE:(i + 1) * TOX_PUBLIC_KEY_SIZE]
+
+    def online(self) -> array:
+        """The friend numbers of the friends that were connected."""
+        iNone = TOX_CONNECTION['NONE']
+        return array('I', [friend_number for friend_number, connection_status
+                           in zip(self.friend_numbers, self.connection_status)
+                           if connection_status != iNone])
+
+    def __repr__(self) -> str:
+        return f"FriendsSnapshot({len(self)} friends, {len(self.online())} online)"
+
+def oSnapshotTable(oTable: FriendTable) -> FriendsSnapshot:
+    """A FriendsSnapshot of the records of a FriendTable, without libtoxcore."""
+    lRecords = sorted(oTable, key=lambda oRecord: oRecord.friend_number)
+    return FriendsSnapshot(array('I', [oRecord.friend_number for oRecord in lRecords]),
+                           array('I', [oRecord.connection_status for oRecord in lRecords]),
+                           array('I', [oRecord.status for oRecord in lRecords]),
+                           array('Q', [oRecord.last_online for oRecord in lRecords]),
+                           b''.join([oRecord.public_key for oRecord in lRecords]))
+
+def oSnapshotLib(oLib, pTox) -> FriendsSnapshot:
+    """A FriendsSnapshot read from libtoxcore into the arrays, four calls
+    for each friend and no Python object for any."""
+    iSize = oLib.tox_self_get_friend_list_size(pTox)
+    aNumbers = array('I', bytes(4 * iSize))
+    if iSize:
+        oLib.tox_self_get_friend_list(pTox, (c_uint32 * iSize).from_buffer(aNumbers))
+    aConnection = array('I', bytes(4 * iSize))
+    aStatus = array('I', bytes(4 * iSize))
+    aLastOnline = array('Q', bytes(8 * iSize))
+    baKeys = bytearray(TOX_PUBLIC_KEY_SIZE * iSize)
+    tKey = c_char * TOX_PUBLIC_KEY_SIZE
+    get_connection_status = oLib.tox_friend_get_connection_status
+    get_status = oLib.tox_friend_get_status
+    get_last_online = oLib.tox_friend_get_last_online
+    get_public_key = oLib.tox_friend_get_public_key
+    perror = oERROR.pointer
+    perror[0] = 0
+    for i, friend_number in enumerate(aNumbers):
+        aConnection[i] = get_connection_status(pTox, friend_number, perror)
+        aStatus[i] = get_status(pTox, friend_number, perror)
+        if perror[0]:
+            vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        aLastOnline[i] = get_last_online(pTox, friend_number, perror)
+        if perror[0]:
+            vCheckError(perror[0], dFRIEND_GET_LAST_ONLINE_ERRORS)
+        get_public_key(pTox, friend_number, tKey.from_buffer(baKeys, i * TOX_PUBLIC_KEY_SIZE), perror)
+        if perror[0]:
+            vCheckError(perror[0], dFRIEND_GET_PUBLIC_KEY_ERRORS)
+    return FriendsSnapshot(aNumbers, aConnection, aStatus, aLastOnline, bytes(baKeys))
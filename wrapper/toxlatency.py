@@ -0,0 +1,245 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# The delivery latency of messages to friends, from the send to the read
+# receipt, to spot slow relays and to judge a change of proxy or of TCP
+# relays.
+#
+# Tox.friend_send_message, friend_send_long_message and the ToxOutbox note
+# the monotonic_ns() of each message sent, by friend number and message
+# ID, and the friend_read_receipt of that ID gives its latency, which goes
+# into the histogram of the friend and into the global one:
+#
+#   oTracker = tox.get_latency_tracker(capacity=4096, max_age=300.0)
+#   ...
+#   oTracker.histogram().percentile(0.99)  # seconds
+#   oTracker.histogram(friend_number).mean
+#
+# The times are kept in a ring of capacity entries, three arrays and a
+# dict from the key, friend_number << 32 | message_id, to the position in
+# the ring, so a pending message costs two ints and a dict entry. A message
+# without a receipt goes when it is max_age seconds old, or when the ring
+# wraps round onto it, and is counted as expired. Message IDs are
+# per friend and wrap from UINT32_MAX to 0: a key seen again replaces the
+# entry it had, which can only be that old if it never had its receipt.
+#
+# A histogram has a bucket per power of two of milliseconds, up to 2 ** 19 ms,
+# about 9 minutes, which is more than max_age should be.
+
+import threading
+import time
+from array import array
+
+try:
+    from wrapper import toxlog
+except:
+    import toxlog
+
+toxlog.vRegister(globals())
+
+UINT32_MAX = 2 ** 32 - 1
+iBUCKETS = 21
+iMS = 1000000
+
+class LatencyHistogram:
+    """The delivery latencies of a friend, or of all of them: counts[i] is
+    how many took from 2 ** (i - 1) up to 2 ** i milliseconds, counts[0]
+    under one; total_ns and max_ns in nanoseconds."""
+    __slots__ = ('counts', 'count', 'total_ns', 'max_ns')
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * iBUCKETS))
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def vAdd(self, iLatency: int) -> None:
+        """Add a latency of iLatency nanoseconds."""
+        iBucket = (iLatency // iMS).bit_length()
+        self.counts[iBucket if iBucket < iBUCKETS else iBUCKETS - 1] += 1
+        self.count += 1
+        self.total_ns += iLatency
+        if iLatency > self.max_ns:
+            self.max_ns = iLatency
+
+    @property
+    def mean(self) -> float:
+        """The mean latency in seconds."""
+        return self.total_ns / self.count / 1e9 if self.count else 0.0
+
+    @property
+    def max(self) -> float:
+        """The longest latency in seconds."""
+        return self.max_ns / 1e9
+
+    def percentile(self, fFraction: float) -> float:
+        """The seconds within which fFraction of the latencies fall, to the
+        power of two of milliseconds above; 0.0 with none."""
+        if not self.count:
+            return 0.0
+        iWanted = fFraction * self.count
+        iSeen = 0
+        for iBucket, iCount in enumerate(self.counts):
+            iSeen += iCount
+            if iSeen >= iWanted:
+                return min((1 << iBucket) / 1000.0, self.max)
+        return self.max
+
+    def __repr__(self) -> str:
+        return f"LatencyHistogram(count={self.count}, mean={self.mean:.3f}, " \
+            f"p50={self.percentile(0.5):.3f}, p99={self.percentile(0.99):.3f}, max={self.max:.3f})"
+
+class LatencyStats:
+    """The counters of a LatencyTracker; pending is how many wait now."""
+    __slots__ = ('sent', 'acked', 'expired', 'unknown', 'pending')
+
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        # without a receipt within max_age, or pushed out of the ring
+        self.expired = 0
+        # receipts of messages not noted, or already expired
+        self.unknown = 0
+        self.pending = 0
+
+    def __repr__(self) -> str:
+        return f"LatencyStats(sent={self.sent}, acked={self.acked}, expired={self.expired}, " \
+            f"unknown={self.unknown}, pending={self.pending})"
+
+class LatencyTracker:
+    """The delivery latencies of the messages to the friends of a Tox, see
+    Tox.get_latency_tracker."""
+
+    def __init__(self, tox, capacity: int=4096, max_age: float=300.0):
+        """
+        :param tox: the Tox instance
+        :param capacity: the most messages waiting for their receipt
+        :param max_age: the seconds after which a message without its receipt is expired
+        """
+        self.tox = tox
+        self.capacity = capacity
+        self.max_age = max_age
+        self._iMaxAge = int(max_age * 1e9)
+        self._oLock = threading.Lock()
+        # the ring: key and monotonic_ns() of the send, 0 once acked or expired
+        self._aKeys = array('Q', bytes(8 * capacity))
+        self._aSent = array('q', bytes(8 * capacity))
+        # the next entry to write, and the oldest that may still be pending
+        self._iHead = 0
+        self._iTail = 0
+        # key -> position in the ring
+        self._dPending = {}
+        self._oGlobal = LatencyHistogram()
+        # friend number -> LatencyHistogram
+        self._dFriends = {}
+        self._stats = LatencyStats()
+        self._handler = self._vOnReadReceipt
+        tox.get_dispatcher().subscribe('friend_read_receipt', self._handler)
+
+    def close(self) -> None:
+        """Stop following the receipts; the histograms stay."""
+        if self._handler is not None:
+            self.tox.get_dispatcher().unsubscribe('friend_read_receipt', self._handler)
+            self._handler = None
+
+    def sent(self, friend_number: int, message_id: int, now: int=None) -> None:
+        """Note that message_id was sent to friend_number. Any thread."""
+        iNow = time.monotonic_ns() if now is None else now
+        iKey = friend_number << 32 | (message_id & UINT32_MAX)
+        dPending = self._dPending
+        with self._oLock:
+            iOld = dPending.pop(iKey, None)
+            if iOld is not None:
+                # the IDs wrapped round onto one without its receipt
+                self._aSent[iOld] = 0
+                self._stats.expired += 1
+            iHead = self._iHead
+            if iHead - self._iTail >= self.capacity or not iHead & 63:
+                # when the ring is full, and every 64 sends
+                self._vExpire(iNow - self._iMaxAge)
+            i = iHead % self.capacity
+            if iHead - self._iTail == self.capacity:
+                # full: the oldest goes
+                if self._aSent[i]:
+                    del dPending[self._aKeys[i]]
+                    self._stats.expired += 1
+                self._iTail += 1
+            self._aKeys[i] = iKey
+            self._aSent[i] = iNow
+            dPending[iKey] = i
+            self._iHead = iHead + 1
+            self._stats.sent += 1
+
+    def _vExpire(self, iBefore: int) -> None:
+        # under _oLock: move the tail past what is acked, and what was sent before iBefore
+        aSent = self._aSent
+        iCapacity = self.capacity
+        iTail = self._iTail
+        while iTail < self._iHead:
+            i = iTail % iCapacity
+            iSent = aSent[i]
+            if iSent:
+                if iSent >= iBefore:
+                    break
+                del self._dPending[self._aKeys[i]]
+                aSent[i] = 0
+                self._stats.expired += 1
+            iTail += 1
+        self._iTail = iTail
+
+    def expire(self, now: int=None) -> None:
+        """Expire the messages older than max_age; sent does it every 64
+        sends, and when the ring is full."""
+        iNow = time.monotonic_ns() if now is None else now
+        with self._oLock:
+            self._vExpire(iNow - self._iMaxAge)
+
+    def acked(self, friend_number: int, message_id: int, now: int=None):
+        """The receipt of message_id from friend_number: returns its latency
+        in seconds, or None if it was not noted or has expired."""
+        iNow = time.monotonic_ns() if now is None else now
+        with self._oLock:
+            i = self._dPending.pop(friend_number << 32 | (message_id & UINT32_MAX), None)
+            if i is None:
+                self._stats.unknown += 1
+                return None
+            iLatency = iNow - self._aSent[i]
+            self._aSent[i] = 0
+            self._stats.acked += 1
+            self._oGlobal.vAdd(iLatency)
+            oHistogram = self._dFriends.get(friend_number)
+            if oHistogram is None:
+                oHistogram = self._dFriends[friend_number] = LatencyHistogram()
+            oHistogram.vAdd(iLatency)
+        return iLatency / 1e9
+
+    def vDelete(self, friend_number: int) -> None:
+        """The friend friend_number was deleted: forget its messages and histogram."""
+        with self._oLock:
+            for iKey in [iKey for iKey in self._dPending if iKey >> 32 == friend_number]:
+                self._aSent[self._dPending.pop(iKey)] = 0
+            self._dFriends.pop(friend_number, None)
+
+    # Reads
+
+    def histogram(self, friend_number: int=None) -> LatencyHistogram:
+        """The histogram of friend_number, or the global one for None."""
+        if friend_number is None:
+            return self._oGlobal
+        return self._dFriends.get(friend_number) or LatencyHistogram()
+
+    def friends(self) -> list:
+        """The friend numbers with a histogram."""
+        return list(self._dFriends)
+
+    def __len__(self) -> int:
+        return len(self._dPending)
+
+    def stats(self) -> LatencyStats:
+        oStats = self._stats
+        oStats.pending = len(self._dPending)
+        return oStats
+
+    # Handlers, (tox pointer, callback args..., user_data)
+
+    def _vOnReadReceipt(self, pTox, friend_number, message_id, user_data) -> None:
+        self.acked(friend_number, message_id)
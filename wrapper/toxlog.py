@@ -0,0 +1,100 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# One logging backend shared by tox.py, toxav.py and toxencryptsave.py.
+#
+# Each module registers its globals() and gets LOG_ERROR, LOG_WARN,
+# LOG_INFO, LOG_DEBUG and LOG_TRACE bound into it. The level is resolved
+# once, and a level that is off is bound to a function that does nothing,
+# so a disabled call costs one global lookup and one call: no test of the
+# level and no formatting. Pass the values as arguments, %-style,
+# LOG_DEBUG("group_number=%s", group_number), rather than in an f-string,
+# so that they are only formatted when the level is on.
+#
+# The callers can be C callbacks, on any thread, so emitting never raises.
+#
+# Levels are the logging module numbers, plus TRACE below DEBUG, as used
+# by the app.oArgs.loglevel of toxygen. The default is WARN, as before.
+#
+#   toxlog.vSetLevel(10)
+#   toxlog.vSetBackend(toxlog.oLoggingBackend(logging.getLogger('tox')))
+
+import builtins
+import threading
+
+ERROR = 40
+WARN = 30
+INFO = 20
+DEBUG = 10
+TRACE = 5
+
+dPREFIXES = {ERROR: 'EROR> ', WARN: 'WARN> ', INFO: 'INFO> ',
+             DEBUG: 'DBUG> ', TRACE: 'TRAC> '}
+dNAMES = {ERROR: 'LOG_ERROR', WARN: 'LOG_WARN', INFO: 'LOG_INFO',
+          DEBUG: 'LOG_DEBUG', TRACE: 'LOG_TRACE'}
+
+def vPrintBackend(iLevel: int, sMsg: str) -> None:
+    """The default backend: print with the level prefix."""
+    print(dPREFIXES.get(iLevel, '') + sMsg)
+
+def oLoggingBackend(oLogger):
+    """A backend that sends to a logging.Logger; TRACE goes to its level 5."""
+    def vLoggingBackend(iLevel: int, sMsg: str) -> None:
+        oLogger.log(iLevel, sMsg)
+    return vLoggingBackend
+
+def iResolveLevel() -> int:
+    """The level of a running toxygen, from app.oArgs.loglevel, or WARN."""
+    app = getattr(builtins, 'app', None)
+    oArgs = getattr(app, 'oArgs', None)
+    return getattr(oArgs, 'loglevel', WARN)
+
+oBACKEND = vPrintBackend
+iLEVEL = iResolveLevel()
+lMODULES = []
+oLOCK = threading.Lock()
+
+def vNoLog(sMsg: str, *args) -> None:
+    pass
+
+def oEmitter(iLevel: int):
+    def vEmit(sMsg: str, *args) -> None:
+        try:
+            if args:
+                sMsg = sMsg % args
+            oBACKEND(iLevel, sMsg)
+        except Exception:
+            # never raise into a ctypes callback
+            pass
+    vEmit.__name__ = dNAMES[iLevel]
+    return vEmit
+
+dEMITTERS = {iLevel: oEmitter(iLevel) for iLevel in dNAMES}
+
+def vBind(dGlobals: dict) -> None:
+    for iLevel, sName in dNAMES.items():
+        dGlobals[sName] = dEMITTERS[iLevel] if iLevel >= iLEVEL else vNoLog
+
+def vRegister(dGlobals: dict) -> None:
+    """Bind the LOG_* functions into a module's globals(), and rebind them
+    there whenever the level changes."""
+    with oLOCK:
+        if not any(d is dGlobals for d in lMODULES):
+            lMODULES.append(dGlobals)
+        vBind(dGlobals)
+
+def vSetLevel(iLevel: int) -> None:
+    """Set the level for all the registered modules."""
+    global iLEVEL
+    with oLOCK:
+        iLEVEL = iLevel
+        for dGlobals in lMODULES:
+            vBind(dGlobals)
+
+def iGetLevel() -> int:
+    return iLEVEL
+
+def vSetBackend(oBackend) -> None:
+    """Set the backend, a callable (iLevel: int, sMsg: str); None restores
+    printing. It may be called from any thread, including C callbacks."""
+    global oBACKEND
+    oBACKEND = oBackend if oBackend is not None else vPrintBackend
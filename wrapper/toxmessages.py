@@ -0,0 +1,176 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# Messages longer than TOX_MAX_MESSAGE_LENGTH bytes.
+#
+# libtoxcore refuses a message over TOX_MAX_MESSAGE_LENGTH bytes of UTF-8,
+# so Tox.friend_send_long_message, group_send_long_message and
+# group_send_private_long_message encode the text once and send it as
+# fragments. lFragments finds where to cut in one pass over the encoded
+# bytes: each fragment is as long as it can be, less the continuation
+# bytes of a character that would not fit, so no character is cut in two
+# and every fragment but the last is within 3 bytes of the limit.
+#
+# That is what MessageReassembler goes by on the receiving side: a
+# message of at least TOX_MAX_MESSAGE_LENGTH - 3 bytes is taken as a
+# fragment with more to come, and is held until a shorter one from the
+# same friend or peer ends it, or until nothing more has come for window
+# seconds:
+#
+#   oReassembler = MessageReassembler()
+#   def on_message(friend_number, message_type, message):
+#       ...
+#   oReassembler.subscribe(tox, on_message)
+#
+# A message that happens to be that long on its own is delivered window
+# seconds late, and one sent by a client splitting some other way is
+# delivered in pieces. One reassembler can follow several Tox instances:
+# their fragments are held by (tox, friend_number), so friend 0 of one is
+# never joined to friend 0 of another, and each expired message goes to
+# the callback of its own instance.
+
+import threading
+import time
+
+try:
+    from wrapper import toxlog
+    from wrapper.toxcore_enums_and_consts import TOX_MAX_MESSAGE_LENGTH
+except:
+    import toxlog
+    from toxcore_enums_and_consts import TOX_MAX_MESSAGE_LENGTH
+
+toxlog.vRegister(globals())
+
+# the longest UTF-8 sequence is 4 bytes, so a cut backs off at most 3
+iMAX_BACKOFF = 3
+
+def lFragments(data, iMax: int=TOX_MAX_MESSAGE_LENGTH) -> list:
+    """The (start, end) offsets of the fragments of the UTF-8 data, none
+    longer than iMax bytes and none cutting a character."""
+    with memoryview(data) as view:
+        iLength = view.nbytes
+        lOffsets = []
+        iStart = 0
+        while iLength - iStart > iMax:
+            iEnd = iStart + iMax
+            # back off over continuation bytes, 10xxxxxx, to a lead byte
+            iStop = iEnd - iMAX_BACKOFF
+            while iEnd > iStop and view[iEnd] & 0xC0 == 0x80:
+                iEnd -= 1
+            lOffsets.append((iStart, iEnd))
+            iStart = iEnd
+        if iStart < iLength:
+            lOffsets.append((iStart, iLength))
+    return lOffsets
+
+def bEncode(message) -> bytes:
+    if isinstance(message, str):
+        return message.encode('utf-8')
+    return bytes(message)
+
+class MessageReassembler:
+    """Joins the fragments of long messages, see the top of toxmessages.py."""
+
+    def __init__(self, window: float=2.0, max_length: int=TOX_MAX_MESSAGE_LENGTH):
+        """
+        :param window: the seconds to wait for the next fragment
+        :param max_length: the fragment size of the sender, TOX_MAX_MESSAGE_LENGTH
+        """
+        self.window = window
+        self._iFull = max_length - iMAX_BACKOFF
+        self._oLock = threading.Lock()
+        # key -> [message_type, [fragments], monotonic() of the last]
+        self._dPending = {}
+        # [(key, message_type, message)] ended by something that did not continue them
+        self._lReady = []
+        # tox -> (the friend_message handler, callback) of subscribe
+        self._dSubscribed = {}
+
+    def feed(self, key, message_type: int, message: bytes, now: float=None):
+        """Take a message from key, a friend number or (group, peer), or
+        (tox, friend_number) for the messages of subscribe. Returns
+        (message_type, the whole message as bytes) when it ends a message,
+        or None when it is held as a fragment."""
+        fNow = time.monotonic() if now is None else now
+        with self._oLock:
+            lPending = self._dPending.get(key)
+            if lPending is not None and (lPending[0] != message_type or
+                                         fNow - lPending[2] > self.window):
+                # not a continuation of what is held: that ends on its own
+                del self._dPending[key]
+                self._lReady.append((key, lPending[0], b''.join(lPending[1])))
+                lPending = None
+            if len(message) >= self._iFull:
+                if lPending is None:
+                    self._dPending[key] = [message_type, [message], fNow]
+                else:
+                    lPending[1].append(message)
+                    lPending[2] = fNow
+                return None
+            if lPending is None:
+                return (message_type, message)
+            del self._dPending[key]
+        lPending[1].append(message)
+        return (message_type, b''.join(lPending[1]))
+
+    def expired(self, now: float=None) -> list:
+        """Remove and return [(key, message_type, message)] of the messages
+        held longer than window seconds since their last fragment, or ended
+        by a message that did not continue them."""
+        fNow = time.monotonic() if now is None else now
+        with self._oLock:
+            lExpired, self._lReady = self._lReady, []
+            for key, lPending in list(self._dPending.items()):
+                if fNow - lPending[2] > self.window:
+                    del self._dPending[key]
+                    lExpired.append((key, lPending[0], b''.join(lPending[1])))
+        return lExpired
+
+    def __len__(self) -> int:
+        return len(self._dPending)
+
+    def subscribe(self, tox, callback) -> None:
+        """Reassemble the friend_message events of tox and call
+        callback(friend_number, message_type, message) with the whole messages,
+        message a str. Expired messages are delivered at the next event;
+        call deliver_expired to deliver them sooner. Once per tox."""
+        if tox in self._dSubscribed:
+            raise ValueError('the Tox instance is already subscribed')
+        def vOnMessage(pTox, friend_number, message_type, message, length, user_data) -> None:
+            if not isinstance(message, bytes):
+                message = bytes(message[:length])
+            tMessage = self.feed((tox, friend_number), message_type, message[:length])
+            # what this ended or outlived goes first
+            self.deliver_expired()
+            if tMessage is not None:
+                self._vCall(callback, friend_number, *tMessage)
+        tox.get_dispatcher().subscribe('friend_message', vOnMessage)
+        self._dSubscribed[tox] = (vOnMessage, callback)
+
+    def unsubscribe(self, tox) -> None:
+        tSubscribed = self._dSubscribed.pop(tox, None)
+        if tSubscribed is not None:
+            tox.get_dispatcher().unsubscribe('friend_message', tSubscribed[0])
+
+    def deliver_expired(self) -> None:
+        """Deliver the expired messages of the instances of subscribe, each
+        to the callback of its own instance."""
+        if not self._dPending and not self._lReady:
+            return
+        dSubscribed = self._dSubscribed
+        lOthers = []
+        for key, message_type, message in self.expired():
+            tSubscribed = dSubscribed.get(key[0]) if type(key) is tuple else None
+            if tSubscribed is None:
+                # fed directly, not through subscribe: left for expired()
+                lOthers.append((key, message_type, message))
+                continue
+            self._vCall(tSubscribed[1], key[1], message_type, message)
+        if lOthers:
+            with self._oLock:
+                self._lReady[:0] = lOthers
+
+    def _vCall(self, callback, key, message_type: int, message: bytes) -> None:
+        try:
+            callback(key, message_type, str(message, 'utf-8', errors='replace'))
+        except Exception as e:
+            LOG_ERROR(f"reassembler callback {e}")
@@ -0,0 +1,363 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# An outbox of the messages to friends of a Tox instance, so that a sender
+# does not have to catch the ArgumentError of a friend that is offline or
+# the MemoryError of a full send queue, sleep and try again.
+#
+# ToxOutbox.send queues the message in a bounded queue of the friend and
+# sends what it can at once. The queue is sent in order:
+#
+#  - while the friend is offline the messages are held, and sent after the
+#    iterate in which the friend_connection_status event says it is back;
+#  - on SENDQ the rest wait, and are tried again after the next iterate;
+#  - a sent message is kept, by its message ID, until the friend_read_receipt
+#    of that ID; if the friend goes offline before that, it is queued again,
+#    at the front, as libtoxcore drops what it had not delivered.
+#
+#   oOutbox = tox.get_outbox(max_messages=256, policy='drop_oldest')
+#   oMessage = oOutbox.send(friend_number, TOX_MESSAGE_TYPE['NORMAL'], 'hi')
+#   ...
+#   oMessage.state  # 'queued', 'sent', 'acked' or 'dropped'
+#
+# Each message sent is noted in the LatencyTracker and the MessageStore of
+# the Tox, if it has them, see toxlatency.py and toxstore.py.
+#
+# The library is called with the error code out-parameter read back
+# directly, so the outbox raises nothing on the way. It is only called from
+# the thread that iterates, in ToxOutbox.send there and in ToxOutbox.poll at
+# the end of Tox.iterate: a send from another thread is queued and goes out
+# after the next iterate, or sooner if wake wakes the iterate thread, as
+# with toxcommands.py. The handlers of the events, which may run on the
+# workers of a deferred dispatcher, only mark the friend due for the poll.
+#
+# Each friend holds at most max_messages, queued or waiting for their
+# receipt, and all the friends at most max_bytes of messages. Past that,
+# policy says what goes: 'drop_oldest' drops the oldest message of the
+# friend, 'drop_newest' refuses the new one, and send returns None, and
+# 'raise' raises MemoryError.
+
+import threading
+import time
+from collections import deque
+
+try:
+    from wrapper import toxlog
+    from wrapper.toxcore_enums_and_consts import (TOX_CONNECTION, TOX_ERR_FRIEND_SEND_MESSAGE,
+                                                  TOX_MAX_MESSAGE_LENGTH)
+    from wrapper.toxcore_errors import ArgumentError, oERROR
+    from wrapper.toxstore import dKINDS
+except:
+    import toxlog
+    from toxcore_enums_and_consts import (TOX_CONNECTION, TOX_ERR_FRIEND_SEND_MESSAGE,
+                                          TOX_MAX_MESSAGE_LENGTH)
+    from toxcore_errors import ArgumentError, oERROR
+    from toxstore import dKINDS
+
+toxlog.vRegister(globals())
+
+lPOLICIES = ['drop_oldest', 'drop_newest', 'raise']
+
+iOK = TOX_ERR_FRIEND_SEND_MESSAGE['OK']
+iNOT_FOUND = TOX_ERR_FRIEND_SEND_MESSAGE['FRIEND_NOT_FOUND']
+iNOT_CONNECTED = TOX_ERR_FRIEND_SEND_MESSAGE['FRIEND_NOT_CONNECTED']
+iSENDQ = TOX_ERR_FRIEND_SEND_MESSAGE['SENDQ']
+
+class OutboxMessage:
+    """A message in a ToxOutbox: message is the UTF-8 bytes, message_id
+    that of the last send or None, queued the monotonic() of the send call,
+    and state 'queued', 'sent', 'acked' or 'dropped'."""
+    __slots__ = ('friend_number', 'message_type', 'message', 'message_id', 'queued', 'state')
+
+    def __init__(self, friend_number, message_type, message, queued):
+        self.friend_number = friend_number
+        self.message_type = message_type
+        self.message = message
+        self.message_id = None
+        self.queued = queued
+        self.state = 'queued'
+
+    def __repr__(self) -> str:
+        return f"OutboxMessage({self.friend_number}, {self.message_type}, " \
+            f"{len(self.message)} bytes, {self.message_id}, {self.state})"
+
+class OutboxStats:
+    """The counters of a ToxOutbox; held and bytes are what it holds now."""
+    __slots__ = ('queued', 'sent', 'acked', 'retries', 'resent', 'dropped', 'errors',
+                 'held', 'bytes')
+
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.acked = 0
+        # sends stopped by a full send queue
+        self.retries = 0
+        # sent, and queued again as the friend went offline first
+        self.resent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.held = 0
+        self.bytes = 0
+
+    def __repr__(self) -> str:
+        return f"OutboxStats(queued={self.queued}, sent={self.sent}, acked={self.acked}, " \
+            f"retries={self.retries}, resent={self.resent}, dropped={self.dropped}, " \
+            f"errors={self.errors}, held={self.held}, bytes={self.bytes})"
+
+class ToxOutbox:
+    """The queues of the messages to the friends of a Tox, see Tox.get_outbox."""
+
+    def __init__(self, tox, max_messages: int=256, max_bytes: int=4 << 20,
+                 policy: str='drop_oldest', resend: bool=True,
+                 on_receipt=None, on_drop=None, wake=None):
+        """
+        :param tox: the Tox instance
+        :param max_messages: the most messages held for one friend, queued or waiting for their receipt
+        :param max_bytes: the most bytes of messages held for all the friends
+        :param policy: what goes when a limit is reached, one of lPOLICIES
+        :param resend: queue again the messages without a receipt when their friend goes offline
+        :param on_receipt: called with the OutboxMessage when its receipt comes
+        :param on_drop: called with the OutboxMessage when it is dropped
+        :param wake: called with no arguments after a send from another thread
+        """
+        if policy not in lPOLICIES:
+            raise ArgumentError(f"policy must be one of {lPOLICIES}")
+        self.tox = tox
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.resend = resend
+        self.on_receipt = on_receipt
+        self.on_drop = on_drop
+        self.wake = wake
+        self._oLock = threading.RLock()
+        # friend number -> deque of OutboxMessage not sent yet
+        self._dQueues = {}
+        # friend number -> {message ID: OutboxMessage} waiting for the receipt, in send order
+        self._dUnacked = {}
+        # the friends known to be offline, and those to send to at the next poll
+        self._setOffline = set()
+        self._setDue = set()
+        self._iBytes = 0
+        self._iThread = None
+        self._stats = OutboxStats()
+        self._lHandlers = [
+            ('friend_connection_status', self._vOnConnectionStatus),
+            ('friend_read_receipt', self._vOnReadReceipt),
+            ]
+        oDispatcher = tox.get_dispatcher()
+        for sEvent, handler in self._lHandlers:
+            oDispatcher.subscribe(sEvent, handler)
+
+    def close(self) -> None:
+        """Stop following the events; what is held stays held."""
+        oDispatcher = self.tox.get_dispatcher()
+        for sEvent, handler in self._lHandlers:
+            oDispatcher.unsubscribe(sEvent, handler)
+        self._lHandlers = []
+
+    def send(self, friend_number: int, message_type: int, message):
+        """Queue message, str or UTF-8 bytes of at most TOX_MAX_MESSAGE_LENGTH,
+        for friend_number, and send it now if on the iterate thread. Returns
+        its OutboxMessage, or None if the drop_newest policy refused it. Any
+        thread."""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if not message:
+            raise ArgumentError('Attempted to send a zero-length message.')
+        if len(message) > TOX_MAX_MESSAGE_LENGTH:
+            raise ArgumentError('Message length exceeded TOX_MAX_MESSAGE_LENGTH.')
+        oMessage = OutboxMessage(friend_number, message_type, message, time.monotonic())
+        with self._oLock:
+            if not self._bMakeRoom(friend_number, len(message)):
+                self._stats.dropped += 1
+                oMessage.state = 'dropped'
+                return None
+            queue = self._dQueues.get(friend_number)
+            if queue is None:
+                queue = self._dQueues[friend_number] = deque()
+            queue.append(oMessage)
+            self._iBytes += len(message)
+            self._stats.queued += 1
+            if friend_number in self._setOffline:
+                return oMessage
+            if threading.get_ident() == self._iThread:
+                self._vFlush(friend_number)
+                return oMessage
+            self._setDue.add(friend_number)
+        if self.wake is not None:
+            self.wake()
+        return oMessage
+
+    def _bMakeRoom(self, friend_number: int, iLength: int) -> bool:
+        # under _oLock: apply the policy until the new message fits
+        while self._iHeld(friend_number) >= self.max_messages or \
+              self._iBytes + iLength > self.max_bytes:
+            if self.policy == 'drop_newest':
+                return False
+            if self.policy == 'raise':
+                raise MemoryError(f"the outbox of friend {friend_number} is full")
+            if not self._bDropOldest(friend_number):
+                # what is over max_bytes is held for other friends
+                return False
+        return True
+
+    def _iHeld(self, friend_number: int) -> int:
+        return len(self._dQueues.get(friend_number, ())) + len(self._dUnacked.get(friend_number, ()))
+
+    def _bDropOldest(self, friend_number: int) -> bool:
+        # the oldest is waiting for its receipt if anything is
+        dUnacked = self._dUnacked.get(friend_number)
+        if dUnacked:
+            oMessage = dUnacked.pop(next(iter(dUnacked)))
+        else:
+            queue = self._dQueues.get(friend_number)
+            if not queue:
+                return False
+            oMessage = queue.popleft()
+        self._vDropped(oMessage)
+        return True
+
+    def _vDropped(self, oMessage: OutboxMessage) -> None:
+        self._iBytes -= len(oMessage.message)
+        oMessage.state = 'dropped'
+        self._stats.dropped += 1
+        if self.on_drop is not None:
+            self._vCall(self.on_drop, oMessage)
+
+    def _vFlush(self, friend_number: int) -> None:
+        # on the iterate thread, under _oLock: send the queue in order until
+        # it is empty or libtoxcore says to stop
+        queue = self._dQueues.get(friend_number)
+        if not queue:
+            return
+        oStats = self._stats
+        send = self.tox.libtoxcore.tox_friend_send_message
+        pTox = self.tox._tox_pointer
+        oLatency = self.tox._latency
+        oStore = self.tox._store
+        perror = oERROR.pointer
+        while queue:
+            oMessage = queue[0]
+            perror[0] = 0
+            message_id = send(pTox, friend_number, oMessage.message_type,
+                              oMessage.message, len(oMessage.message), perror)
+            iError = perror[0]
+            if iError == iOK:
+                queue.popleft()
+                oMessage.message_id = message_id
+                oMessage.state = 'sent'
+                dUnacked = self._dUnacked.get(friend_number)
+                if dUnacked is None:
+                    dUnacked = self._dUnacked[friend_number] = {}
+                oOld = dUnacked.pop(message_id, None)
+                if oOld is not None:
+                    # the IDs wrapped round past one still waiting
+                    self._vDropped(oOld)
+                dUnacked[message_id] = oMessage
+                oStats.sent += 1
+                if oLatency is not None:
+                    oLatency.sent(friend_number, message_id)
+                if oStore is not None:
+                    oStore.vSent(dKINDS['friend'], friend_number, 0, oMessage.message_type, oMessage.message)
+            elif iError == iSENDQ:
+                oStats.retries += 1
+                self._setDue.add(friend_number)
+                return
+            elif iError == iNOT_CONNECTED:
+                self._setOffline.add(friend_number)
+                return
+            elif iError == iNOT_FOUND:
+                self.vDelete(friend_number)
+                return
+            else:
+                oStats.errors += 1
+                LOG_WARN(f"outbox friend {friend_number} error {iError}")
+                queue.popleft()
+                self._vDropped(oMessage)
+        del self._dQueues[friend_number]
+
+    def poll(self) -> None:
+        """Send to the friends due, after a SENDQ or a send from another
+        thread. Called at the end of Tox.iterate, on the iterate thread."""
+        self._iThread = threading.get_ident()
+        if not self._setDue:
+            return
+        with self._oLock:
+            setDue, self._setDue = self._setDue, set()
+            for friend_number in setDue:
+                if friend_number not in self._setOffline:
+                    self._vFlush(friend_number)
+
+    def vDelete(self, friend_number: int) -> None:
+        """The friend friend_number was deleted: drop what it had."""
+        with self._oLock:
+            for oMessage in list(self._dUnacked.pop(friend_number, {}).values()) + \
+                list(self._dQueues.pop(friend_number, ())):
+                self._vDropped(oMessage)
+            self._setOffline.discard(friend_number)
+            self._setDue.discard(friend_number)
+
+    # Reads
+
+    def __len__(self) -> int:
+        """The messages held, queued or waiting for their receipt."""
+        return sum(len(queue) for queue in list(self._dQueues.values())) + \
+            sum(len(dUnacked) for dUnacked in list(self._dUnacked.values()))
+
+    def queued(self, friend_number: int) -> list:
+        """The messages of friend_number not sent yet, in order."""
+        return list(self._dQueues.get(friend_number, ()))
+
+    def unacked(self, friend_number: int) -> list:
+        """The messages of friend_number sent and waiting for their receipt."""
+        return list(self._dUnacked.get(friend_number, {}).values())
+
+    def stats(self) -> OutboxStats:
+        oStats = self._stats
+        oStats.held = len(self)
+        oStats.bytes = self._iBytes
+        return oStats
+
+    # Handlers, (tox pointer, callback args..., user_data)
+
+    def _vOnConnectionStatus(self, pTox, friend_number, connection_status, user_data) -> None:
+        # maybe on a worker of a deferred dispatcher: poll sends
+        with self._oLock:
+            if connection_status != TOX_CONNECTION['NONE']:
+                self._setOffline.discard(friend_number)
+                self._setDue.add(friend_number)
+                return
+            self._setOffline.add(friend_number)
+            dUnacked = self._dUnacked.pop(friend_number, None)
+            if not dUnacked or not self.resend:
+                if dUnacked:
+                    for oMessage in dUnacked.values():
+                        self._vDropped(oMessage)
+                return
+            # before what was queued after them, in the order they were sent
+            queue = self._dQueues.get(friend_number)
+            if queue is None:
+                queue = self._dQueues[friend_number] = deque()
+            for oMessage in reversed(list(dUnacked.values())):
+                oMessage.state = 'queued'
+                queue.appendleft(oMessage)
+            self._stats.resent += len(dUnacked)
+
+    def _vOnReadReceipt(self, pTox, friend_number, message_id, user_data) -> None:
+        with self._oLock:
+            dUnacked = self._dUnacked.get(friend_number)
+            oMessage = dUnacked.pop(message_id, None) if dUnacked else None
+            if oMessage is None:
+                # sent around the outbox, or dropped
+                return
+            self._iBytes -= len(oMessage.message)
+            oMessage.state = 'acked'
+            self._stats.acked += 1
+        if self.on_receipt is not None:
+            self._vCall(self.on_receipt, oMessage)
+
+    def _vCall(self, callback, oMessage: OutboxMessage) -> None:
+        try:
+            callback(oMessage)
+        except Exception as e:
+            LOG_ERROR(f"outbox callback {e}")
@@ -0,0 +1,251 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# Adaptive pacing of Tox.iterate and ToxAV.iterate on one thread.
+#
+# A ToxIterateThread sleeps the whole iteration_interval() after each
+# iterate, so a message sent just after an iterate waits up to an interval
+# in the send queue before libtoxcore flushes it. ToxPacer instead:
+#
+# - wakes as soon as something is sent through it, to flush it at once,
+#   but no sooner than min_interval after the last iterate;
+# - runs at fast_interval while a file transfer is active, which is for
+#   hold seconds after the last file chunk sent or received through it,
+#   or noted with note_transfer() from a callback;
+# - backs off, up to max_interval, when nothing has been sent or noted
+#   for idle seconds, stretching the sleep by backoff each iteration;
+# - otherwise sleeps iteration_interval(), like before;
+# - iterates the ToxAV at its own iteration_interval() on the same thread,
+#   waking for whichever of the two is due first.
+#
+# It reports the send-to-flush latency, from a send through the pacer to
+# the end of the iterate after it, and the CPU time of the iterations:
+#
+#   oPacer = ToxPacer(tox, tox.AV)
+#   oPacer.start()
+#   oPacer.friend_send_message(friend_number, TOX_MESSAGE_TYPE['NORMAL'], 'hi')
+#   oPacer.stats().send_p99
+#
+# Sends from threads other than the pacer thread need a thread safe Tox,
+# see Tox.is_thread_safe; sends from the callbacks run on the pacer thread.
+
+import threading
+import time
+from collections import deque
+
+try:
+    from wrapper import toxlog
+except:
+    import toxlog
+
+toxlog.vRegister(globals())
+
+class PacerStats:
+    """What ToxPacer.stats returns; times in seconds."""
+    __slots__ = ('iterations', 'av_iterations', 'early', 'sends',
+                 'send_p50', 'send_p99', 'cpu', 'cpu_share', 'interval')
+
+    def __init__(self, iterations, av_iterations, early, sends,
+                 send_p50, send_p99, cpu, cpu_share, interval):
+        self.iterations = iterations
+        self.av_iterations = av_iterations
+        self.early = early
+        self.sends = sends
+        self.send_p50 = send_p50
+        self.send_p99 = send_p99
+        self.cpu = cpu
+        self.cpu_share = cpu_share
+        self.interval = interval
+
+    def __repr__(self) -> str:
+        return f"PacerStats(iterations={self.iterations}, av_iterations={self.av_iterations}, " \
+            f"early={self.early}, sends={self.sends}, send_p50={self.send_p50:.6f}, " \
+            f"send_p99={self.send_p99:.6f}, cpu={self.cpu:.3f}, cpu_share={self.cpu_share:.4f}, " \
+            f"interval={self.interval:.4f})"
+
+def fPercentile(lSorted: list, fFraction: float) -> float:
+    if not lSorted:
+        return 0.0
+    return lSorted[min(int(len(lSorted) * fFraction), len(lSorted) - 1)]
+
+class ToxPacer:
+    """Runs Tox.iterate, and ToxAV.iterate, paced by the outbound work."""
+
+    def __init__(self, tox, toxav=None, user_data=None,
+                 min_interval: float=0.001, fast_interval: float=0.005,
+                 max_interval: float=0.5, idle: float=2.0, hold: float=1.0,
+                 backoff: float=1.5, adaptive: bool=True, samples: int=4096):
+        """
+        :param tox: the Tox instance
+        :param toxav: its ToxAV instance, or None
+        :param min_interval: the least seconds between two iterations when woken by sends
+        :param fast_interval: the most seconds between iterations during a file transfer
+        :param max_interval: the most seconds between iterations when idle
+        :param idle: the seconds without sends or transfers after which to back off
+        :param hold: the seconds a file transfer counts as active after its last chunk
+        :param backoff: how much longer each idle sleep is than the one before
+        :param adaptive: False sleeps iteration_interval() always, to compare with
+        :param samples: how many of the last send-to-flush latencies to keep
+        """
+        self.tox = tox
+        self.toxav = toxav
+        self._user_data = user_data
+        self.min_interval = min_interval
+        self.fast_interval = fast_interval
+        self.max_interval = max_interval
+        self.idle = idle
+        self.hold = hold
+        self.backoff = backoff
+        self.adaptive = adaptive
+        self._oWake = threading.Event()
+        self._oLock = threading.Lock()
+        # perf_counter() of each send since the last iterate
+        self._lPending = []
+        self._dLatencies = deque(maxlen=samples)
+        self._fLastWork = time.perf_counter()
+        self._fTransferUntil = 0.0
+        self._fInterval = 0.0
+        self._bStop = False
+        self._thread = None
+        self._iIterations = 0
+        self._iAVIterations = 0
+        self._iEarly = 0
+        self._iSends = 0
+        self._fCpu = 0.0
+        self._fStarted = None
+
+    # Outbound
+
+    def send(self, func, *args):
+        """Call func(*args), a Tox send function, and wake the pacer to
+        flush what it queued. Returns what func returns."""
+        result = func(*args)
+        fNow = time.perf_counter()
+        with self._oLock:
+            self._lPending.append(fNow)
+            self._iSends += 1
+        self._fLastWork = fNow
+        if self.adaptive:
+            self._oWake.set()
+        return result
+
+    def note_transfer(self) -> None:
+        """Note a file transfer as active, e.g. from a file_recv_chunk or
+        file_chunk_request callback, to iterate at fast_interval."""
+        fNow = time.perf_counter()
+        self._fLastWork = fNow
+        bWake = fNow >= self._fTransferUntil
+        self._fTransferUntil = fNow + self.hold
+        if bWake and self.adaptive:
+            self._oWake.set()
+
+    def friend_send_message(self, friend_number: int, message_type: int, message) -> int:
+        return self.send(self.tox.friend_send_message, friend_number, message_type, message)
+
+    def friend_send_lossless_packet(self, friend_number: int, data) -> bool:
+        return self.send(self.tox.friend_send_lossless_packet, friend_number, data)
+
+    def friend_send_lossy_packet(self, friend_number: int, data) -> bool:
+        return self.send(self.tox.friend_send_lossy_packet, friend_number, data)
+
+    def group_send_message(self, group_number: int, message_type: int, message) -> bool:
+        return self.send(self.tox.group_send_message, group_number, message_type, message)
+
+    def file_send_chunk(self, friend_number: int, file_number: int, position: int, data) -> bool:
+        self.note_transfer()
+        return self.send(self.tox.file_send_chunk, friend_number, file_number, position, data)
+
+    # Loop
+
+    def _fSleep(self, fNow: float, fInterval: float) -> float:
+        # seconds to sleep after an iterate at fNow, with fInterval from libtoxcore
+        if not self.adaptive:
+            return fInterval
+        if fNow < self._fTransferUntil:
+            return min(fInterval, self.fast_interval)
+        if fNow - self._fLastWork > self.idle:
+            return min(max(self._fInterval, fInterval) * self.backoff,
+                       max(self.max_interval, fInterval))
+        return fInterval
+
+    def _vIterate(self) -> None:
+        fCpu = time.thread_time()
+        try:
+            self.tox.iterate(self._user_data)
+        except Exception as e:
+            LOG_ERROR(f"pacer iterate {e}")
+        self._fCpu += time.thread_time() - fCpu
+        self._iIterations += 1
+        fNow = time.perf_counter()
+        with self._oLock:
+            lPending, self._lPending = self._lPending, []
+        for fSent in lPending:
+            self._dLatencies.append(fNow - fSent)
+
+    def _vIterateAV(self) -> None:
+        fCpu = time.thread_time()
+        try:
+            self.toxav.iterate()
+        except Exception as e:
+            LOG_ERROR(f"pacer toxav iterate {e}")
+        self._fCpu += time.thread_time() - fCpu
+        self._iAVIterations += 1
+
+    def run(self) -> None:
+        """Iterate on this thread until stop()."""
+        self._bStop = False
+        self._vRun()
+
+    def _vRun(self) -> None:
+        self._fStarted = time.perf_counter()
+        fAVDue = self._fStarted
+        fToxDue = self._fStarted
+        while not self._bStop:
+            fNow = time.perf_counter()
+            if fNow >= fToxDue:
+                self._vIterate()
+                fNow = time.perf_counter()
+                self._fInterval = self._fSleep(fNow, self.tox.iteration_interval() / 1000.0)
+                fToxDue = fNow + self._fInterval
+            if self.toxav is not None and fNow >= fAVDue:
+                self._vIterateAV()
+                fNow = time.perf_counter()
+                fAVDue = fNow + max(self.toxav.iteration_interval() / 1000.0, self.min_interval)
+            fDue = fToxDue if self.toxav is None else min(fToxDue, fAVDue)
+            if fDue > fNow and self._oWake.wait(fDue - fNow):
+                self._oWake.clear()
+                # flush the sends now, but not more often than min_interval
+                fNow = time.perf_counter()
+                fEarly = max(fNow, fToxDue - self._fInterval + self.min_interval)
+                if fEarly < fToxDue:
+                    fToxDue = fEarly
+                    self._iEarly += 1
+                if fEarly > fNow:
+                    time.sleep(fEarly - fNow)
+
+    def start(self) -> threading.Thread:
+        """Run on a new daemon thread."""
+        if self._thread is not None:
+            raise RuntimeError('the pacer is already started')
+        self._bStop = False
+        self._thread = threading.Thread(target=self._vRun, name='ToxPacer', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: float=None) -> None:
+        """Stop after the current iteration; join the thread of start()."""
+        self._bStop = True
+        self._oWake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+            self._thread = None
+
+    # Statistics
+
+    def stats(self) -> PacerStats:
+        """The counters, the p50 and p99 of the recent send-to-flush latencies,
+        and the CPU seconds of the iterations and their share of the time run."""
+        lSorted = sorted(self._dLatencies)
+        fRun = time.perf_counter() - self._fStarted if self._fStarted else 0.0
+        return PacerStats(self._iIterations, self._iAVIterations, self._iEarly, self._iSends,
+                          fPercentile(lSorted, 0.50), fPercentile(lSorted, 0.99),
+                          self._fCpu, self._fCpu / fRun if fRun else 0.0, self._fInterval)
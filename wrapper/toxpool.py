@@ -0,0 +1,698 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# A pool of worker processes, each hosting a shard of the Tox profiles,
+# so the Python callback work of many instances can use many cores.
+#
+#   oPool = ToxPool(workers=4, options={'udp_enabled': True})
+#   oPool.start()
+#   tox = oPool.open('bot1', '/var/lib/bots/bot1.tox')
+#   tox.callback_friend_message(on_message)
+#   tox.self_set_name('bot1')
+#   ...
+#   oPool.shutdown()            # saves every profile
+#
+# open() returns a ToxProxy, which takes the same method calls as a
+# wrapper.tox.Tox and forwards them to the worker of the profile, where a
+# ToxReactor iterates all the instances of that worker. Results and events
+# come back to the parent, where the callbacks set with callback_* on the
+# proxy run, in order, on the one callback thread of the pool, with None in
+# place of the tox pointer and of user_data. Byte array arguments arrive as
+# bytes. The pump thread that reads the rings only hands the events to the
+# callback thread, so it goes on reading the replies while a callback
+# calls a proxy, e.g. to answer a friend_message.
+#
+# Commands and events cross the processes as records packed by bPack, a
+# tagged encoding of ints, floats, bytes, str, bool, None and lists, over
+# a pair of ShmRing per worker: single producer, single consumer rings in
+# multiprocessing.shared_memory, polled by both sides. Methods whose
+# results are objects, like friend_get_info, cannot be called through a
+# proxy.
+#
+# A profile is placed on the worker with the fewest profiles, unless a
+# worker is given. rebalance() moves profiles from the most to the least
+# loaded workers, by saving and killing them on one and loading them on
+# the other; calls for a profile wait while it moves.
+
+import itertools
+import multiprocessing
+import os
+import queue
+import struct
+import threading
+import time
+from ctypes import ArgumentError, c_char_p, c_uint64
+from multiprocessing import shared_memory
+
+try:
+    from wrapper import toxlog
+    from wrapper.toxcore_errors import ToxError
+except:
+    import toxlog
+    from toxcore_errors import ToxError
+
+toxlog.vRegister(globals())
+
+# Records
+
+iTAG_NONE = ord('n')
+iTAG_TRUE = ord('t')
+iTAG_FALSE = ord('f')
+iTAG_INT = ord('i')
+iTAG_UINT = ord('u')
+iTAG_FLOAT = ord('d')
+iTAG_BYTES = ord('b')
+iTAG_STR = ord('s')
+iTAG_LIST = ord('l')
+
+oINT = struct.Struct('<q')
+oUINT = struct.Struct('<Q')
+oFLOAT = struct.Struct('<d')
+oLENGTH = struct.Struct('<I')
+
+def _vPack(value, lParts: list) -> None:
+    if value is None:
+        lParts.append(b'n')
+    elif value is True:
+        lParts.append(b't')
+    elif value is False:
+        lParts.append(b'f')
+    elif isinstance(value, int):
+        if value < 0x8000000000000000:
+            lParts.append(b'i' + oINT.pack(value))
+        else:
+            lParts.append(b'u' + oUINT.pack(value))
+    elif isinstance(value, float):
+        lParts.append(b'd' + oFLOAT.pack(value))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        lParts.append(b'b' + oLENGTH.pack(len(value)))
+        lParts.append(bytes(value))
+    elif isinstance(value, str):
+        value = value.encode('utf-8')
+        lParts.append(b's' + oLENGTH.pack(len(value)))
+        lParts.append(value)
+    elif isinstance(value, (list, tuple)):
+        lParts.append(b'l' + oLENGTH.pack(len(value)))
+        for item in value:
+            _vPack(item, lParts)
+    else:
+        raise TypeError(f"cannot pack a {type(value).__name__} into a pool record")
+
+def bPack(tValues) -> bytes:
+    """Pack a tuple of ints, floats, bytes, str, bool, None and lists of them."""
+    lParts = []
+    for value in tValues:
+        _vPack(value, lParts)
+    return b''.join(lParts)
+
+def _tUnpackOne(data, i: int) -> tuple:
+    iTag = data[i]
+    i += 1
+    if iTag == iTAG_INT:
+        return oINT.unpack_from(data, i)[0], i + 8
+    if iTag == iTAG_BYTES or iTag == iTAG_STR:
+        iLength = oLENGTH.unpack_from(data, i)[0]
+        i += 4
+        value = bytes(data[i:i + iLength])
+        if iTag == iTAG_STR:
+            value = str(value, 'utf-8')
+        return value, i + iLength
+    if iTag == iTAG_NONE:
+        return None, i
+    if iTag == iTAG_TRUE:
+        return True, i
+    if iTag == iTAG_FALSE:
+        return False, i
+    if iTag == iTAG_UINT:
+        return oUINT.unpack_from(data, i)[0], i + 8
+    if iTag == iTAG_FLOAT:
+        return oFLOAT.unpack_from(data, i)[0], i + 8
+    if iTag == iTAG_LIST:
+        iCount = oLENGTH.unpack_from(data, i)[0]
+        i += 4
+        lValues = []
+        for j in range(iCount):
+            value, i = _tUnpackOne(data, i)
+            lValues.append(value)
+        return lValues, i
+    raise ValueError(f"bad pool record tag {iTag}")
+
+def tUnpack(data) -> tuple:
+    """The tuple that bPack packed into data."""
+    lValues = []
+    i = 0
+    while i < len(data):
+        value, i = _tUnpackOne(data, i)
+        lValues.append(value)
+    return tuple(lValues)
+
+# Rings
+
+class ShmRing:
+    """A single producer, single consumer ring of byte records in shared
+    memory. The header holds the total bytes written (head), read (tail),
+    and the capacity, in the byte order of the host; each record is its 32 bit length and its bytes. A
+    record that does not fit before the end of the ring goes at the start,
+    after a length of 0xFFFFFFFF, or less than 4 bytes, that mean skip."""
+
+    HEADER = 24
+    SKIP = 0xFFFFFFFF
+
+    def __init__(self, name: str=None, capacity: int=1 << 22):
+        """Create a ring of capacity bytes, or attach to the ring called name."""
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=self.HEADER + capacity)
+            self._bOwner = True
+            struct.pack_into('=QQQ', self._shm.buf, 0, 0, 0, capacity)
+        else:
+            # the workers share the resource tracker of the pool process,
+            # which unlinks the ring if the pool dies without shutdown()
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._bOwner = False
+        self._buf = self._shm.buf
+        # the head and the tail are read and written as ctypes, in one
+        # aligned 8 byte access: struct may go a byte at a time, and the
+        # other process then reads a count that is half written
+        self._head = c_uint64.from_buffer(self._buf, 0)
+        self._tail = c_uint64.from_buffer(self._buf, 8)
+        self.capacity = c_uint64.from_buffer(self._buf, 16).value
+        self.name = self._shm.name
+
+    def bPut(self, data) -> bool:
+        """Write the record data, or return False if the ring is too full."""
+        buf = self._buf
+        iCapacity = self.capacity
+        iNeed = 4 + len(data)
+        if iNeed > iCapacity:
+            raise ValueError(f"pool record of {len(data)} bytes is larger than the ring")
+        iHead = self._head.value
+        iTail = self._tail.value
+        iPos = iHead % iCapacity
+        iSkip = iCapacity - iPos if iCapacity - iPos < iNeed else 0
+        if iCapacity - (iHead - iTail) < iSkip + iNeed:
+            return False
+        if iSkip:
+            if iSkip >= 4:
+                oLENGTH.pack_into(buf, self.HEADER + iPos, self.SKIP)
+            iHead += iSkip
+            iPos = 0
+        iStart = self.HEADER + iPos
+        oLENGTH.pack_into(buf, iStart, len(data))
+        buf[iStart + 4:iStart + iNeed] = data
+        # publish the record only once it is all written
+        self._head.value = iHead + iNeed
+        return True
+
+    def vPut(self, data, timeout: float=None) -> None:
+        """Write the record data, waiting while the ring is full."""
+        if self.bPut(data):
+            return
+        fEnd = None if timeout is None else time.monotonic() + timeout
+        fSleep = 0.0001
+        while not self.bPut(data):
+            if fEnd is not None and time.monotonic() > fEnd:
+                raise TimeoutError('pool ring full')
+            time.sleep(fSleep)
+            fSleep = min(fSleep * 2, 0.005)
+
+    def oGet(self):
+        """Read the next record as bytes, or None if there is none."""
+        buf = self._buf
+        iCapacity = self.capacity
+        iTail = self._tail.value
+        if iTail == self._head.value:
+            return None
+        iPos = iTail % iCapacity
+        if iCapacity - iPos < 4 or oLENGTH.unpack_from(buf, self.HEADER + iPos)[0] == self.SKIP:
+            iTail += iCapacity - iPos
+            iPos = 0
+        iStart = self.HEADER + iPos
+        iLength = oLENGTH.unpack_from(buf, iStart)[0]
+        data = bytes(buf[iStart + 4:iStart + 4 + iLength])
+        self._tail.value = iTail + 4 + iLength
+        return data
+
+    def close(self) -> None:
+        # the ctypes hold the buffer, which cannot close under them
+        self._head = self._tail = None
+        self._buf = None
+        self._shm.close()
+        if self._bOwner:
+            self._shm.unlink()
+
+# Worker process
+
+def oOptions(dOptions: dict, sPath: str):
+    """Tox options from a dict of ToxOptions fields, loading the profile at sPath if it exists."""
+    try:
+        from wrapper.tox import Tox
+        from wrapper.toxcore_enums_and_consts import TOX_SAVEDATA_TYPE
+    except:
+        from tox import Tox
+        from toxcore_enums_and_consts import TOX_SAVEDATA_TYPE
+    tox_options = Tox.options_new()
+    for sField, value in dOptions.items():
+        if isinstance(value, str):
+            value = bytes(value, 'utf-8')
+        setattr(tox_options.contents, sField, value)
+    if sPath and os.path.exists(sPath):
+        with open(sPath, 'rb') as f:
+            data = f.read()
+        tox_options.contents.savedata_type = TOX_SAVEDATA_TYPE['TOX_SAVE']
+        tox_options.contents.savedata_data = c_char_p(data)
+        tox_options.contents.savedata_length = len(data)
+        # keep data alive as long as the options
+        tox_options._savedata = data
+    return tox_options
+
+class PoolWorker:
+    """The profiles of one worker process, iterated by a ToxReactor."""
+
+    def __init__(self, oCommands: ShmRing, oEvents: ShmRing, dOptions: dict):
+        try:
+            from wrapper.tox import Tox
+            from wrapper.toxdispatch import tCopyArgs
+            from wrapper.toxreactor import ToxReactor
+        except:
+            from tox import Tox
+            from toxdispatch import tCopyArgs
+            from toxreactor import ToxReactor
+        self._Tox = Tox
+        self._tCopyArgs = tCopyArgs
+        self._oCommands = oCommands
+        self._oEvents = oEvents
+        self._dOptions = dOptions
+        self._oReactor = ToxReactor()
+        # profile -> [tox, path, {event: handler}]
+        self._dProfiles = {}
+        self._bStop = False
+        self.dropped = 0
+
+    def _vSend(self, tValues: tuple) -> None:
+        self._oEvents.vPut(bPack(tValues))
+
+    def _oHandler(self, sProfile: str, sEvent: str):
+        tCopyArgs = self._tCopyArgs
+        oEvents = self._oEvents
+        def vHandler(pTox, *args) -> None:
+            data = bPack(('e', sProfile, sEvent) + tCopyArgs(sEvent, args[:-1]))
+            # never hold up the iterate of every profile: drop, and count
+            if not oEvents.bPut(data):
+                self.dropped += 1
+                LOG_WARN("pool worker dropped %s of %s: the ring is full", sEvent, sProfile)
+        return vHandler
+
+    def open(self, sProfile: str, sPath: str, dOptions: dict) -> str:
+        if sProfile in self._dProfiles:
+            raise ValueError(f"profile {sProfile} is already open")
+        dAll = dict(self._dOptions)
+        dAll.update(dOptions)
+        tox = self._Tox(oOptions(dAll, sPath))
+        self._dProfiles[sProfile] = [tox, sPath, {}]
+        self._oReactor.add(tox)
+        return tox.self_get_address()
+
+    def subscribe(self, sProfile: str, sEvent: str) -> bool:
+        tox, sPath, dHandlers = self._dProfiles[sProfile]
+        if sEvent in dHandlers:
+            return False
+        dHandlers[sEvent] = tox.get_dispatcher().subscribe(sEvent, self._oHandler(sProfile, sEvent))
+        return True
+
+    def unsubscribe(self, sProfile: str, sEvent: str) -> bool:
+        tox, sPath, dHandlers = self._dProfiles[sProfile]
+        handler = dHandlers.pop(sEvent, None)
+        return handler is not None and tox.get_dispatcher().unsubscribe(sEvent, handler)
+
+    def save(self, sProfile: str) -> int:
+        tox, sPath, dHandlers = self._dProfiles[sProfile]
+        return tox.write_savedata(sPath) if sPath else 0
+
+    def close(self, sProfile: str, bSave: bool) -> int:
+        iSize = self.save(sProfile) if bSave else 0
+        tox = self._dProfiles.pop(sProfile)[0]
+        self._oReactor.remove(tox)
+        tox.kill()
+        return iSize
+
+    def shutdown(self) -> int:
+        iSaved = 0
+        for sProfile in list(self._dProfiles):
+            try:
+                self.close(sProfile, True)
+                iSaved += 1
+            except Exception as e:
+                LOG_ERROR(f"pool worker saving {sProfile} {e}")
+        self._bStop = True
+        return iSaved
+
+    def call(self, sProfile: str, sMethod: str, *args):
+        if sMethod.startswith('_') or sMethod.startswith('callback_'):
+            raise AttributeError(f"{sMethod} cannot be called through the pool")
+        return getattr(self._dProfiles[sProfile][0], sMethod)(*args)
+
+    def _vCommand(self, data) -> None:
+        tCommand = tUnpack(data)
+        sCommand, iSeq = tCommand[0], tCommand[1]
+        try:
+            if sCommand == 'call':
+                result = self.call(*tCommand[2:])
+            elif sCommand == 'open':
+                sProfile, sPath, lOptions = tCommand[2:]
+                result = self.open(sProfile, sPath, dict(lOptions))
+            elif sCommand in ('subscribe', 'unsubscribe', 'save', 'close', 'shutdown'):
+                result = getattr(self, sCommand)(*tCommand[2:])
+            else:
+                raise ValueError(f"unknown pool command {sCommand}")
+            data = bPack(('r', iSeq, True, result))
+        except Exception as e:
+            data = bPack(('r', iSeq, False, type(e).__name__, str(e)))
+        self._oEvents.vPut(data)
+
+    def vRun(self) -> None:
+        oCommands = self._oCommands
+        # poll the commands often while they come, less when they stop
+        fWait = 0.0001
+        while not self._bStop:
+            iCommands = 0
+            while iCommands < 256:
+                data = oCommands.oGet()
+                if data is None:
+                    break
+                self._vCommand(data)
+                iCommands += 1
+            if iCommands:
+                fWait = 0.0001
+                self._oReactor.run_once(0)
+            else:
+                self._oReactor.run_once(fWait)
+                fWait = min(fWait * 2, 0.002)
+
+def _vWorkerMain(sCommands: str, sEvents: str, dOptions: dict, iLevel: int) -> None:
+    toxlog.vSetLevel(iLevel)
+    oCommands = ShmRing(sCommands)
+    oEvents = ShmRing(sEvents)
+    try:
+        PoolWorker(oCommands, oEvents, dOptions).vRun()
+    finally:
+        oCommands.close()
+        oEvents.close()
+
+# Front end
+
+dEXCEPTIONS = {oClass.__name__: oClass for oClass in
+               (ArgumentError, ToxError, MemoryError, ValueError, TypeError, KeyError,
+                AttributeError, OSError, TimeoutError, RuntimeError)}
+
+class PendingReply:
+    __slots__ = ('event', 'ok', 'value')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.ok = False
+        self.value = None
+
+class WorkerHandle:
+    """The parent side of one worker process."""
+    __slots__ = ('index', 'process', 'commands', 'events', 'lock', 'profiles')
+
+    def __init__(self, index: int, process, commands: ShmRing, events: ShmRing):
+        self.index = index
+        self.process = process
+        self.commands = commands
+        self.events = events
+        # the parent threads calling share the single producer side of commands
+        self.lock = threading.Lock()
+        self.profiles = set()
+
+class ToxProxy:
+    """Stands in for the wrapper.tox.Tox of a profile in a ToxPool."""
+
+    def __init__(self, pool, profile: str):
+        self._pool = pool
+        self.profile = profile
+        # event -> the callback set with callback_<event>
+        self._callbacks = {}
+
+    def __getattr__(self, name: str):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name.startswith('callback_'):
+            sEvent = name[len('callback_'):]
+            def callback(callback, *largs) -> None:
+                self._pool._vSetCallback(self, sEvent, callback)
+            return callback
+        pool = self._pool
+        profile = self.profile
+        def method(*args):
+            return pool._call(profile, 'call', profile, name, *args)
+        method.__name__ = name
+        setattr(self, name, method)
+        return method
+
+    def __repr__(self) -> str:
+        return f"ToxProxy({self.profile!r})"
+
+class ToxPool:
+    """Hosts Tox profiles in worker processes, see the top of toxpool.py."""
+
+    def __init__(self, workers: int=None, options: dict=None, ring_size: int=1 << 22,
+                 timeout: float=30.0):
+        """
+        :param workers: the number of worker processes, by default one per CPU
+        :param options: ToxOptions fields for every profile, like {'udp_enabled': False}
+        :param ring_size: the bytes of each of the two rings of a worker
+        :param timeout: the seconds to wait for a worker to answer a call
+        """
+        self._iWorkers = workers or os.cpu_count() or 1
+        self._dOptions = dict(options or {})
+        self._iRingSize = ring_size
+        self.timeout = timeout
+        self._lWorkers = []
+        # profile -> WorkerHandle
+        self._dPlacement = {}
+        self._dProxies = {}
+        self._dPending = {}
+        self._seq = itertools.count(1)
+        self._oCondition = threading.Condition()
+        self._lMoving = set()
+        self._oPump = None
+        # (profile, event, args) for the callback thread, None to stop it
+        self._oEvents = None
+        self._oCallbacks = None
+        self._bStop = False
+
+    # Lifecycle
+
+    def start(self) -> None:
+        """Spawn the workers and the pump thread."""
+        if self._lWorkers:
+            raise RuntimeError('the pool is already started')
+        oContext = multiprocessing.get_context('spawn')
+        for i in range(self._iWorkers):
+            oCommands = ShmRing(capacity=self._iRingSize)
+            oEvents = ShmRing(capacity=self._iRingSize)
+            oProcess = oContext.Process(target=_vWorkerMain, name=f"ToxPoolWorker-{i}",
+                                        args=(oCommands.name, oEvents.name, self._dOptions,
+                                              toxlog.iGetLevel()),
+                                        daemon=True)
+            oProcess.start()
+            self._lWorkers.append(WorkerHandle(i, oProcess, oCommands, oEvents))
+        self._bStop = False
+        self._oEvents = queue.SimpleQueue()
+        self._oCallbacks = threading.Thread(target=self._vCallbacks, args=(self._oEvents,),
+                                            name='ToxPoolCallbacks', daemon=True)
+        self._oCallbacks.start()
+        self._oPump = threading.Thread(target=self._vPump, name='ToxPoolPump', daemon=True)
+        self._oPump.start()
+
+    def shutdown(self, timeout: float=None) -> int:
+        """Save and kill every profile, stop the workers and free the rings.
+        Returns the number of profiles saved."""
+        iSaved = 0
+        for oWorker in self._lWorkers:
+            if not oWorker.process.is_alive():
+                LOG_ERROR(f"pool worker {oWorker.index} died, its profiles were not saved")
+                continue
+            try:
+                iSaved += self._call_worker(oWorker, 'shutdown', timeout=timeout or self.timeout)
+            except Exception as e:
+                LOG_ERROR(f"pool worker {oWorker.index} shutdown {e}")
+        for oWorker in self._lWorkers:
+            oWorker.process.join(timeout or self.timeout)
+            if oWorker.process.is_alive():
+                oWorker.process.terminate()
+        self._bStop = True
+        if self._oPump is not None:
+            self._oPump.join()
+            self._oPump = None
+        if self._oCallbacks is not None:
+            self._oEvents.put(None)
+            if self._oCallbacks is not threading.current_thread():
+                self._oCallbacks.join(timeout or self.timeout)
+            self._oCallbacks = None
+        for oWorker in self._lWorkers:
+            oWorker.commands.close()
+            oWorker.events.close()
+        self._lWorkers = []
+        self._dPlacement.clear()
+        self._dProxies.clear()
+        return iSaved
+
+    # Profiles
+
+    def open(self, profile: str, path: str, worker: int=None, options: dict=None) -> ToxProxy:
+        """Load the profile from path, or make a new one saved there, on the
+        worker with the fewest profiles or the one given, and return its proxy."""
+        if profile in self._dPlacement:
+            raise ValueError(f"profile {profile} is already open")
+        if worker is None:
+            oWorker = min(self._lWorkers, key=lambda oWorker: len(oWorker.profiles))
+        else:
+            oWorker = self._lWorkers[worker]
+        lOptions = sorted((options or {}).items())
+        self._call_worker(oWorker, 'open', profile, path, lOptions)
+        oWorker.profiles.add(profile)
+        self._dPlacement[profile] = (oWorker, path, lOptions)
+        oProxy = self._dProxies[profile] = ToxProxy(self, profile)
+        return oProxy
+
+    def close(self, profile: str, save: bool=True) -> None:
+        """Save, unless not save, and kill the profile."""
+        self._call(profile, 'close', profile, save)
+        oWorker = self._dPlacement.pop(profile)[0]
+        oWorker.profiles.discard(profile)
+        self._dProxies.pop(profile, None)
+
+    def save(self, profile: str) -> int:
+        """Save the profile to its path now. Returns the bytes written."""
+        return self._call(profile, 'save', profile)
+
+    def __getitem__(self, profile: str) -> ToxProxy:
+        return self._dProxies[profile]
+
+    def placement(self) -> dict:
+        """profile -> the index of its worker."""
+        return {sProfile: t[0].index for sProfile, t in self._dPlacement.items()}
+
+    def move(self, profile: str, worker: int) -> None:
+        """Move the profile to another worker: save and kill it on its worker,
+        then load it and subscribe its callbacks again on the other."""
+        oSource, sPath, lOptions = self._dPlacement[profile]
+        oTarget = self._lWorkers[worker]
+        if oSource is oTarget:
+            return
+        with self._oCondition:
+            while profile in self._lMoving:
+                self._oCondition.wait()
+            self._lMoving.add(profile)
+        try:
+            self._call_worker(oSource, 'close', profile, True)
+            oSource.profiles.discard(profile)
+            self._call_worker(oTarget, 'open', profile, sPath, lOptions)
+            oTarget.profiles.add(profile)
+            self._dPlacement[profile] = (oTarget, sPath, lOptions)
+            oProxy = self._dProxies.get(profile)
+            if oProxy is not None:
+                for sEvent in oProxy._callbacks:
+                    self._call_worker(oTarget, 'subscribe', profile, sEvent)
+        finally:
+            with self._oCondition:
+                self._lMoving.discard(profile)
+                self._oCondition.notify_all()
+
+    def rebalance(self) -> int:
+        """Move profiles from the most to the least loaded workers until
+        their counts differ by one at most. Returns the number moved."""
+        iMoved = 0
+        while True:
+            oMost = max(self._lWorkers, key=lambda oWorker: len(oWorker.profiles))
+            oLeast = min(self._lWorkers, key=lambda oWorker: len(oWorker.profiles))
+            if len(oMost.profiles) - len(oLeast.profiles) <= 1:
+                return iMoved
+            self.move(sorted(oMost.profiles)[0], oLeast.index)
+            iMoved += 1
+
+    # Calls
+
+    def _call(self, profile: str, *tCommand):
+        with self._oCondition:
+            while profile in self._lMoving:
+                self._oCondition.wait()
+        tPlacement = self._dPlacement.get(profile)
+        if tPlacement is None:
+            raise KeyError(f"profile {profile} is not open in the pool")
+        return self._call_worker(tPlacement[0], *tCommand)
+
+    def _call_worker(self, oWorker: WorkerHandle, sCommand: str, *args, timeout: float=None):
+        iSeq = next(self._seq)
+        oReply = self._dPending[iSeq] = PendingReply()
+        try:
+            data = bPack((sCommand, iSeq) + args)
+            with oWorker.lock:
+                oWorker.commands.vPut(data, timeout or self.timeout)
+            if not oReply.event.wait(timeout or self.timeout):
+                if not oWorker.process.is_alive():
+                    raise ToxError(f"pool worker {oWorker.index} died")
+                raise TimeoutError(f"pool worker {oWorker.index} did not answer {sCommand}")
+        finally:
+            self._dPending.pop(iSeq, None)
+        if oReply.ok:
+            return oReply.value
+        sClass, sMessage = oReply.value
+        raise dEXCEPTIONS.get(sClass, ToxError)(sMessage)
+
+    def _vSetCallback(self, oProxy: ToxProxy, sEvent: str, callback) -> None:
+        if callback is None:
+            if oProxy._callbacks.pop(sEvent, None) is not None:
+                self._call(oProxy.profile, 'unsubscribe', oProxy.profile, sEvent)
+            return
+        bNew = sEvent not in oProxy._callbacks
+        oProxy._callbacks[sEvent] = callback
+        if bNew:
+            self._call(oProxy.profile, 'subscribe', oProxy.profile, sEvent)
+
+    def _vPump(self) -> None:
+        fSleep = 0.0001
+        while not self._bStop:
+            bAny = False
+            for oWorker in self._lWorkers:
+                for i in range(256):
+                    data = oWorker.events.oGet()
+                    if data is None:
+                        break
+                    bAny = True
+                    try:
+                        self._vRecord(tUnpack(data))
+                    except Exception as e:
+                        LOG_ERROR(f"pool pump {e}")
+            if bAny:
+                fSleep = 0.0001
+            else:
+                time.sleep(fSleep)
+                fSleep = min(fSleep * 2, 0.002)
+
+    def _vRecord(self, tRecord: tuple) -> None:
+        if tRecord[0] == 'r':
+            oReply = self._dPending.get(tRecord[1])
+            if oReply is None:
+                return
+            oReply.ok = tRecord[2]
+            oReply.value = tRecord[3] if tRecord[2] else tRecord[3:]
+            oReply.event.set()
+        else:
+            self._oEvents.put(tRecord[1:])
+
+    def _vCallbacks(self, oEvents) -> None:
+        while True:
+            tEvent = oEvents.get()
+            if tEvent is None:
+                return
+            sProfile, sEvent = tEvent[0], tEvent[1]
+            oProxy = self._dProxies.get(sProfile)
+            callback = oProxy._callbacks.get(sEvent) if oProxy is not None else None
+            if callback is None:
+                continue
+            try:
+                callback(None, *tEvent[2:], None)
+            except Exception as e:
+                LOG_ERROR(f"pool callback {sEvent} of {sProfile} {e}")
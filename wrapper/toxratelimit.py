@@ -0,0 +1,169 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# Rate limits for what friends, peers and groups send, and for what is
+# sent to them, in bounded memory.
+#
+# A RateLimiter keeps a token bucket per key, refilled at rate tokens a
+# second up to burst. It is kept as one int per key, the monotonic_ns()
+# at which the bucket will be full again (the virtual scheduling form of
+# the token bucket, or GCRA), so a check is a dict lookup, a comparison
+# and a store, under one lock, and is safe from callback and application
+# threads alike. A key whose bucket has refilled is the same as a key
+# never seen, so keys are kept in the order of their last use and the
+# oldest go once there are more than max_keys: a bot throttling abusive
+# friends for weeks holds at most max_keys ints per limiter.
+#
+#   oLimiter = RateLimiter(rate=1.0, burst=5)
+#   def on_message(pTox, friend_number, message_type, message, length, user_data):
+#       ...
+#   tox.callback_friend_message(limited(on_message, oLimiter, key=1))
+#   send = limited(tox.friend_send_message, oLimiter, key=0)
+#
+# oLimiter(sSlot, fSec) is a registry of limiters by slot, a name like
+# 'tox_self_set_status', each allowing one call per fSec seconds per key,
+# and bTooSoon(key, sSlot, fSec) the check tox.py has always used on it.
+# Evicting a key whose bucket is not full yet forgets that it was limited:
+# give max_keys room for the keys that can be limited at once.
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from wrapper import toxlog
+except:
+    import toxlog
+
+toxlog.vRegister(globals())
+
+iNS = 1000000000
+
+class RateStats:
+    """The counters of a RateLimiter; keys is how many it holds now."""
+    __slots__ = ('allowed', 'limited', 'evicted', 'keys')
+
+    def __init__(self):
+        self.allowed = 0
+        self.limited = 0
+        # keys dropped before their bucket had refilled
+        self.evicted = 0
+        self.keys = 0
+
+    def __repr__(self) -> str:
+        return f"RateStats(allowed={self.allowed}, limited={self.limited}, " \
+            f"evicted={self.evicted}, keys={self.keys})"
+
+class RateLimiter:
+    """A token bucket per key, see the top of toxratelimit.py."""
+
+    def __init__(self, rate: float, burst: float=1.0, max_keys: int=4096):
+        """
+        :param rate: the tokens a second each bucket refills by
+        :param burst: the tokens a full bucket holds
+        :param max_keys: the most keys kept; the least recently used go first
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate must be positive and burst at least 1')
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # the nanoseconds one token takes to refill, and a full bucket
+        self._iToken = int(iNS / rate)
+        self._iFull = int(self._iToken * burst)
+        self._oLock = threading.Lock()
+        # key -> monotonic_ns() when its bucket is full again, oldest use first
+        self._dFull = OrderedDict()
+        self._stats = RateStats()
+
+    def allow(self, key, cost: float=1.0, now: int=None) -> bool:
+        """Take cost tokens from the bucket of key, if it has them. Returns
+        False, and takes nothing, if it has not. Any thread."""
+        iNow = time.monotonic_ns() if now is None else now
+        iCost = self._iToken if cost == 1.0 else int(self._iToken * cost)
+        dFull = self._dFull
+        with self._oLock:
+            iFull = dFull.get(key)
+            if iFull is None:
+                iFull = dFull[key] = iNow
+                if len(dFull) > self.max_keys:
+                    # the least recently used, one at a time as they come
+                    if dFull.popitem(last=False)[1] > iNow:
+                        self._stats.evicted += 1
+            else:
+                dFull.move_to_end(key)
+                if iFull < iNow:
+                    iFull = iNow
+            if iFull + iCost - iNow > self._iFull:
+                self._stats.limited += 1
+                return False
+            dFull[key] = iFull + iCost
+            self._stats.allowed += 1
+        return True
+
+    def delay(self, key, cost: float=1.0, now: int=None) -> float:
+        """The seconds until key has cost tokens; 0.0 if it has them now."""
+        iNow = time.monotonic_ns() if now is None else now
+        iFull = self._dFull.get(key, iNow)
+        iWait = max(iFull, iNow) + int(self._iToken * cost) - self._iFull - iNow
+        return iWait / iNS if iWait > 0 else 0.0
+
+    def forget(self, key) -> None:
+        """Fill the bucket of key again, e.g. when a friend is deleted."""
+        with self._oLock:
+            self._dFull.pop(key, None)
+
+    def prune(self, now: int=None) -> int:
+        """Drop the keys whose buckets have refilled; returns how many."""
+        iNow = time.monotonic_ns() if now is None else now
+        with self._oLock:
+            lFull = [key for key, iFull in self._dFull.items() if iFull <= iNow]
+            for key in lFull:
+                del self._dFull[key]
+        return len(lFull)
+
+    def __len__(self) -> int:
+        return len(self._dFull)
+
+    def stats(self) -> RateStats:
+        oStats = self._stats
+        oStats.keys = len(self._dFull)
+        return oStats
+
+def limited(func, limiter: RateLimiter, key=0, default=None):
+    """func, a Tox send method or a callback, limited by limiter: the
+    wrapper calls it only when limiter allows the key of the call, and
+    returns default otherwise. key is the position of the argument that is
+    the key, e.g. 0 for the friend_number of friend_send_message and 1 for
+    that of a callback, after the tox pointer, or a function of the
+    arguments that returns the key."""
+    if isinstance(key, int):
+        iKey = key
+        def wrapper(*args, **kwargs):
+            if limiter.allow(args[iKey]):
+                return func(*args, **kwargs)
+            return default
+    else:
+        def wrapper(*args, **kwargs):
+            if limiter.allow(key(*args)):
+                return func(*args, **kwargs)
+            return default
+    return functools.wraps(func)(wrapper)
+
+dLIMITERS = {}
+oLIMITERS_LOCK = threading.Lock()
+
+def oLimiter(sSlot: str, fSec: float=10.0, max_keys: int=4096) -> RateLimiter:
+    """The limiter of the slot sSlot, made on the first call, allowing one
+    call per fSec seconds per key."""
+    oRateLimiter = dLIMITERS.get(sSlot)
+    if oRateLimiter is None:
+        with oLIMITERS_LOCK:
+            oRateLimiter = dLIMITERS.get(sSlot)
+            if oRateLimiter is None:
+                oRateLimiter = dLIMITERS[sSlot] = RateLimiter(1.0 / fSec, 1.0, max_keys)
+    return oRateLimiter
+
+def bTooSoon(key, sSlot: str, fSec: float=10.0) -> bool:
+    """True if key had a call in sSlot less than fSec seconds ago."""
+    return not oLimiter(sSlot, fSec).allow(key)
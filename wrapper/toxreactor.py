@@ -0,0 +1,232 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# One thread iterating many Tox instances, in place of a ToxIterateThread
+# per instance like in toxygen_echo.py.
+#
+# The reactor keeps a heap of the time each instance is next due, from its
+# own iteration_interval(), and iterates whichever is due first, then
+# sleeps until the next one is. A ToxAV added with its Tox is a separate
+# entry on the heap with the AV interval. Instances can be added and
+# removed from any thread while it runs; a removed entry is dropped from
+# the heap when it comes up, and remove waits for an iterate of it that is
+# in flight, so the instance can be killed once it returns.
+#
+#   oReactor = ToxReactor()
+#   oReactor.add(tox)
+#   oReactor.start()
+#   ...
+#   oReactor.stats(tox).lag_max
+#
+# The lag of an iteration is how late it started after it was due. It
+# grows when the iterations of all the instances take longer than their
+# intervals, which is the sign that the instances need more reactors.
+# All the callbacks run on the reactor thread.
+
+import heapq
+import itertools
+import threading
+import time
+
+try:
+    from wrapper import toxlog
+except:
+    import toxlog
+
+toxlog.vRegister(globals())
+
+class ReactorStats:
+    """The lag and iterate times of one entry of a ToxReactor, in seconds."""
+    __slots__ = ('iterations', 'lag_last', 'lag_max', 'lag_total',
+                 'busy_max', 'busy_total', 'errors')
+
+    def __init__(self):
+        self.iterations = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.busy_max = 0.0
+        self.busy_total = 0.0
+        self.errors = 0
+
+    @property
+    def lag_mean(self) -> float:
+        return self.lag_total / self.iterations if self.iterations else 0.0
+
+    @property
+    def busy_mean(self) -> float:
+        return self.busy_total / self.iterations if self.iterations else 0.0
+
+    def __repr__(self) -> str:
+        return f"ReactorStats(iterations={self.iterations}, lag_mean={self.lag_mean:.6f}, " \
+            f"lag_max={self.lag_max:.6f}, busy_mean={self.busy_mean:.6f}, errors={self.errors})"
+
+class ReactorEntry:
+    """A Tox or ToxAV on the heap of a ToxReactor."""
+    __slots__ = ('instance', 'iterate', 'interval', 'stats', 'removed', 'thread')
+
+    def __init__(self, instance, iterate, interval):
+        self.instance = instance
+        self.iterate = iterate
+        self.interval = interval
+        self.stats = ReactorStats()
+        self.removed = False
+        # the ident of the thread iterating the entry, while it does
+        self.thread = None
+
+class ToxReactor:
+    """Iterates any number of Tox and ToxAV instances on one thread."""
+
+    def __init__(self, user_data=None):
+        self._user_data = user_data
+        self._heap = []
+        # tie breaker, so that entries due at the same time are never compared
+        self._counter = itertools.count()
+        # id(tox) -> [ReactorEntry of the Tox, and of its ToxAV]
+        self._entries = {}
+        self._condition = threading.Condition()
+        self._bStop = False
+        self._thread = None
+
+    def _vPush(self, fDue: float, oEntry: ReactorEntry) -> None:
+        heapq.heappush(self._heap, (fDue, next(self._counter), oEntry))
+
+    def add(self, tox, toxav=None) -> None:
+        """Start iterating tox, and toxav if given, from now. Any thread."""
+        user_data = self._user_data
+        lEntries = [ReactorEntry(tox, lambda: tox.iterate(user_data), tox.iteration_interval)]
+        if toxav is not None:
+            lEntries.append(ReactorEntry(toxav, toxav.iterate, toxav.iteration_interval))
+        with self._condition:
+            if id(tox) in self._entries:
+                raise ValueError('the Tox instance is already in the reactor')
+            self._entries[id(tox)] = lEntries
+            fNow = time.monotonic()
+            for oEntry in lEntries:
+                self._vPush(fNow, oEntry)
+            self._condition.notify()
+
+    def remove(self, tox) -> bool:
+        """Stop iterating tox and its toxav. Any thread, including a callback
+        on the reactor thread; when it returns, tox is not being iterated,
+        waiting for an iterate in flight on another thread, and will not be
+        again, so it can be killed. Called from inside the iterate of tox
+        itself, it cannot wait: kill tox after that iterate returns.
+        Returns False if tox was not in the reactor."""
+        iThread = threading.get_ident()
+        with self._condition:
+            lEntries = self._entries.pop(id(tox), None)
+            if lEntries is None:
+                return False
+            for oEntry in lEntries:
+                oEntry.removed = True
+            while any(oEntry.thread is not None and oEntry.thread != iThread
+                      for oEntry in lEntries):
+                self._condition.wait()
+        return True
+
+    def __contains__(self, tox) -> bool:
+        return id(tox) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self, tox, av: bool=False) -> ReactorStats:
+        """The ReactorStats of tox, or of its toxav if av."""
+        lEntries = self._entries[id(tox)]
+        return lEntries[1 if av else 0].stats
+
+    def dStats(self) -> dict:
+        """tox -> ReactorStats of every Tox in the reactor."""
+        with self._condition:
+            return {lEntries[0].instance: lEntries[0].stats for lEntries in self._entries.values()}
+
+    def run_once(self, timeout: float=None) -> int:
+        """Iterate every entry that is due, waiting up to timeout seconds
+        (for ever if None) for one to be. Returns the number iterated."""
+        iDone = 0
+        with self._condition:
+            while True:
+                while self._heap and self._heap[0][2].removed:
+                    heapq.heappop(self._heap)
+                fNow = time.monotonic()
+                if self._heap and self._heap[0][0] <= fNow:
+                    break
+                fWait = self._heap[0][0] - fNow if self._heap else None
+                if timeout is not None:
+                    if timeout <= 0:
+                        return 0
+                    fWait = timeout if fWait is None else min(fWait, timeout)
+                    fStart = fNow
+                self._condition.wait(fWait)
+                if self._bStop:
+                    return 0
+                if timeout is not None:
+                    timeout -= time.monotonic() - fStart
+            lDue = []
+            while self._heap and self._heap[0][0] <= fNow:
+                fDue, iCount, oEntry = heapq.heappop(self._heap)
+                if not oEntry.removed:
+                    lDue.append((fDue, oEntry))
+        iThread = threading.get_ident()
+        for fDue, oEntry in lDue:
+            with self._condition:
+                # checked and marked at once, for remove to wait on
+                if oEntry.removed:
+                    continue
+                oEntry.thread = iThread
+            oStats = oEntry.stats
+            fStart = time.monotonic()
+            fLag = fStart - fDue
+            try:
+                oEntry.iterate()
+            except Exception as e:
+                oStats.errors += 1
+                LOG_ERROR(f"reactor iterate {e}")
+            fEnd = time.monotonic()
+            oStats.iterations += 1
+            oStats.lag_last = fLag
+            oStats.lag_total += fLag
+            if fLag > oStats.lag_max:
+                oStats.lag_max = fLag
+            fBusy = fEnd - fStart
+            oStats.busy_total += fBusy
+            if fBusy > oStats.busy_max:
+                oStats.busy_max = fBusy
+            iDone += 1
+            fNext = fEnd + oEntry.interval() / 1000.0
+            with self._condition:
+                oEntry.thread = None
+                if not oEntry.removed:
+                    self._vPush(fNext, oEntry)
+                else:
+                    self._condition.notify_all()
+        return iDone
+
+    def _vRun(self) -> None:
+        while not self._bStop:
+            self.run_once()
+
+    def run(self) -> None:
+        """Iterate on this thread until stop()."""
+        self._bStop = False
+        self._vRun()
+
+    def start(self) -> threading.Thread:
+        """Run on a new daemon thread."""
+        if self._thread is not None:
+            raise RuntimeError('the reactor is already started')
+        self._bStop = False
+        self._thread = threading.Thread(target=self._vRun, name='ToxReactor', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: float=None) -> None:
+        """Stop run() after the current iterations; join the thread of start().
+        A run_once() that is waiting returns 0. The instances stay in the
+        reactor and are not killed."""
+        with self._condition:
+            self._bStop = True
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,254 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# Saving the profile of a Tox instance when it changes, debounced, off
+# the iterate thread, atomically, in place of a write_savedata on every
+# change like toxygen_echo.py did.
+#
+# The profile is marked dirty by the Tox methods that change the savedata
+# (friend_add, friend_add_norequest, friends_add_norequest,
+# friend_delete, self_set_name, self_set_status, self_set_status_message,
+# self_set_nospam, group_new, group_join, group_invite_accept,
+# group_leave and the group_founder_set_* methods), by the events that
+# change it (the names and status messages of friends, joining a group,
+# a group's topic, privacy state, peer limit and password), or by
+# mark_dirty(). It is saved once the changes have stopped for debounce
+# seconds, and no later than max_delay seconds after the first of them:
+#
+#   oSaver = tox.get_profile_saver('profile.tox', debounce=2.0)
+#   ...
+#   tox.kill()  # writes what is pending first
+#
+# The savedata is copied with get_savedata_into, into a buffer that is
+# reused, on the thread that iterates, at the end of Tox.iterate, as only
+# that thread may call libtoxcore unless the instance is thread safe. The
+# writer thread encrypts it with toxencryptsave if given a password, and
+# writes it to a temporary file next to the profile that is fsynced and
+# renamed over it, so a crash leaves either the old or the new profile.
+
+import os
+import threading
+import time
+
+try:
+    from wrapper import toxlog
+except:
+    import toxlog
+
+toxlog.vRegister(globals())
+
+# the events after which the savedata has changed
+lSAVE_EVENTS = ['friend_name', 'friend_status_message', 'group_self_join', 'group_topic',
+                'group_privacy_state', 'group_peer_limit', 'group_password']
+
+def vWriteAtomic(filename: str, data, fsync: bool=True) -> None:
+    """Write data to filename through a temporary file, created mode 0600,
+    that is synced and renamed over filename, and sync the directory."""
+    tmpname = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with memoryview(data) as view:
+            iDone = 0
+            while iDone < view.nbytes:
+                iDone += os.write(fd, view[iDone:])
+        if fsync:
+            os.fsync(fd)
+    except:
+        os.close(fd)
+        os.unlink(tmpname)
+        raise
+    os.close(fd)
+    os.replace(tmpname, filename)
+    if fsync and hasattr(os, 'O_DIRECTORY'):
+        dirfd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+
+class SaverStats:
+    """The counters of a ProfileSaver; times in seconds."""
+    __slots__ = ('marks', 'snapshots', 'saves', 'errors', 'bytes', 'write_last', 'write_max')
+
+    def __init__(self):
+        self.marks = 0
+        self.snapshots = 0
+        self.saves = 0
+        self.errors = 0
+        self.bytes = 0
+        self.write_last = 0.0
+        self.write_max = 0.0
+
+    def __repr__(self) -> str:
+        return f"SaverStats(marks={self.marks}, snapshots={self.snapshots}, saves={self.saves}, " \
+            f"errors={self.errors}, bytes={self.bytes}, write_last={self.write_last:.6f}, " \
+            f"write_max={self.write_max:.6f})"
+
+class ProfileSaver:
+    """Saves the profile of a Tox when it has changed, see Tox.get_profile_saver."""
+
+    def __init__(self, tox, filename: str, debounce: float=2.0, max_delay: float=30.0,
+                 password=None, fsync: bool=True):
+        """
+        :param tox: the Tox instance
+        :param filename: the path of the profile
+        :param debounce: the seconds without changes to wait before saving
+        :param max_delay: the most seconds from the first change to the save
+        :param password: encrypt the profile with toxencryptsave, or None
+        :param fsync: fsync the file and its directory; False only for tests
+        """
+        self.tox = tox
+        self.filename = filename
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self._password = password
+        self._oEncrypt = None
+        if password:
+            try:
+                from wrapper.toxencryptsave import ToxEncryptSave
+            except:
+                from toxencryptsave import ToxEncryptSave
+            self._oEncrypt = ToxEncryptSave()
+        self._oCondition = threading.Condition()
+        self._oLock = threading.Lock()
+        # monotonic() of the first and the last change not yet copied, or 0.0
+        self._fFirst = 0.0
+        self._fLast = 0.0
+        # the copy for the writer, and the buffer the next copy goes into
+        self._pending = None
+        self._buffer = bytearray()
+        self._bWriting = False
+        self._bStop = False
+        self._stats = SaverStats()
+        self._lHandlers = []
+        oDispatcher = tox.get_dispatcher()
+        for sEvent in lSAVE_EVENTS:
+            handler = self._vOnEvent
+            oDispatcher.subscribe(sEvent, handler)
+            self._lHandlers.append((sEvent, handler))
+        self._thread = threading.Thread(target=self._vRun, name='ProfileSaver', daemon=True)
+        self._thread.start()
+
+    def _vOnEvent(self, *args) -> None:
+        self.mark_dirty()
+
+    def mark_dirty(self) -> None:
+        """The savedata has changed. Any thread; cheap."""
+        fNow = time.monotonic()
+        with self._oLock:
+            if not self._fFirst:
+                self._fFirst = fNow
+            self._fLast = fNow
+            self._stats.marks += 1
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._fFirst) or self._pending is not None or self._bWriting
+
+    def poll(self) -> bool:
+        """Copy the savedata for the writer if a save is due. Called at the end
+        of Tox.iterate, on the iterate thread. Returns True if it copied."""
+        fFirst = self._fFirst
+        if not fFirst:
+            return False
+        fNow = time.monotonic()
+        if fNow - self._fLast < self.debounce and fNow - fFirst < self.max_delay:
+            return False
+        self._vSnapshot()
+        return True
+
+    def _vSnapshot(self) -> None:
+        # on the thread that may call libtoxcore
+        with self._oCondition:
+            if self._bWriting:
+                # the writer still has the buffer: copy next time round
+                return
+            with self._oLock:
+                self._fFirst = self._fLast = 0.0
+            buffer = self._buffer
+            iSize = self.tox.get_savedata_size()
+            if len(buffer) != iSize:
+                buffer = self._buffer = bytearray(iSize)
+            self.tox.get_savedata_into(buffer)
+            self._pending = buffer
+            self._stats.snapshots += 1
+            self._oCondition.notify()
+
+    def _vRun(self) -> None:
+        oCondition = self._oCondition
+        while True:
+            with oCondition:
+                while self._pending is None and not self._bStop:
+                    oCondition.wait()
+                if self._pending is None:
+                    return
+                data = self._pending
+                self._pending = None
+                self._bWriting = True
+            try:
+                self._vWrite(data)
+            finally:
+                with oCondition:
+                    self._bWriting = False
+                    oCondition.notify_all()
+
+    def _vWrite(self, data) -> None:
+        oStats = self._stats
+        fStart = time.perf_counter()
+        try:
+            if self._oEncrypt is not None:
+                data = self._oEncrypt.pass_encrypt(bytes(data), self._password)
+            vWriteAtomic(self.filename, data, self.fsync)
+        except Exception as e:
+            oStats.errors += 1
+            LOG_ERROR(f"saver {self.filename} {e}")
+            # try again at the next due time
+            self.mark_dirty()
+            return
+        fWrite = time.perf_counter() - fStart
+        oStats.saves += 1
+        oStats.bytes += len(data)
+        oStats.write_last = fWrite
+        if fWrite > oStats.write_max:
+            oStats.write_max = fWrite
+        LOG_DEBUG("saver %s %d bytes %.3fs", self.filename, len(data), fWrite)
+
+    def flush(self, timeout: float=None) -> bool:
+        """Save now what has changed and wait for the write, up to timeout
+        seconds. Call it from the iterate thread, or when nothing iterates.
+        Returns False on timeout, or if a write failed meanwhile, when the
+        profile on disk is not the current one."""
+        iErrors = self._stats.errors
+        if self._fFirst:
+            with self._oCondition:
+                while self._bWriting:
+                    self._oCondition.wait()
+            self._vSnapshot()
+        fEnd = None if timeout is None else time.monotonic() + timeout
+        with self._oCondition:
+            while self._pending is not None or self._bWriting:
+                fLeft = None if fEnd is None else fEnd - time.monotonic()
+                if fLeft is not None and fLeft <= 0:
+                    return False
+                self._oCondition.wait(fLeft)
+        return self._stats.errors == iErrors
+
+    def close(self, timeout: float=None) -> None:
+        """Flush, stop the writer thread and stop following the events.
+        Called by Tox.kill."""
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        with self._oCondition:
+            self._bStop = True
+            self._oCondition.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        oDispatcher = self.tox.get_dispatcher()
+        for sEvent, handler in self._lHandlers:
+            oDispatcher.unsubscribe(sEvent, handler)
+        self._lHandlers = []
+
+    def stats(self) -> SaverStats:
+        return self._stats
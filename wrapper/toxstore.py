@@ -0,0 +1,686 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+# A store of every message a Tox instance sends and receives, for bots
+# that must keep their history, written so that a burst of messages does
+# not hold up iterate.
+#
+# The friend_message, group_message and group_private_message events, and
+# the friend and group send methods of Tox, hand each message to
+# MessageStore.append, which only puts it on a queue. A writer thread
+# takes the queue every flush_interval seconds, or sooner when batch
+# messages are waiting, and writes it with one os.write to the end of the
+# current segment, a log file of records:
+#
+#   length, crc32, timestamp, kind, direction, message_type, peer_id, key  (HEADER)
+#   message, length bytes of UTF-8
+#
+# where key is the public key of the friend, or the chat ID of the group,
+# and timestamp the time.time_ns() of the append. When a segment reaches
+# segment_bytes, or has been written to for rotate_interval seconds, the
+# writer seals it: it writes its index, an .idx file of
+# (key, timestamp, offset) entries sorted by key then timestamp, and starts
+# a new segment. The index of a sealed segment is read through mmap, so
+# the history of a key between two times is two binary searches and the
+# records between, in each segment:
+#
+#   oStore = tox.get_message_store('history')
+#   for oMessage in oStore.history(public_key, since=time.time_ns() - 3600 * 10 ** 9):
+#       print(oMessage.timestamp, oMessage.direction, oMessage.text)
+#
+# The public keys of the friends are read when the store subscribes, and
+# the key of a friend or group otherwise when a message is first sent to
+# it, or received on the iterate thread. A handler on a worker of a
+# deferred dispatcher does not call libtoxcore: a message from a friend
+# or group whose key is not read yet waits for MessageStore.poll, at the
+# end of the next iterate.
+#
+# After sealing, the writer compacts: the sealed segments entirely older
+# than retention seconds are deleted, and runs of small sealed segments,
+# under a quarter of segment_bytes each, are merged into a new segment,
+# less their messages older than retention. A history reading a segment
+# that is merged or deleted goes on reading the old file, which is only
+# freed once nothing maps it. The current segment is indexed in memory; if the
+# process dies, it is read again when the store is opened, up to the last
+# whole record, and the store goes on appending to it.
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from ctypes import string_at
+
+try:
+    from wrapper import toxlog
+    from wrapper.toxcore_enums_and_consts import TOX_GROUP_CHAT_ID_SIZE, TOX_PUBLIC_KEY_SIZE
+    from wrapper.toxcore_errors import ArgumentError, ToxError
+    from wrapper.toxsaver import vWriteAtomic
+except:
+    import toxlog
+    from toxcore_enums_and_consts import TOX_GROUP_CHAT_ID_SIZE, TOX_PUBLIC_KEY_SIZE
+    from toxcore_errors import ArgumentError, ToxError
+    from toxsaver import vWriteAtomic
+
+toxlog.vRegister(globals())
+
+# the kinds of message, and their directions
+dKINDS = {'friend': 0, 'group': 1, 'group_private': 2}
+iRECEIVED = 0
+iSENT = 1
+
+iKEY_SIZE = max(TOX_PUBLIC_KEY_SIZE, TOX_GROUP_CHAT_ID_SIZE)
+HEADER = struct.Struct(f"<IIqBBBxI{iKEY_SIZE}s")
+ENTRY = struct.Struct(f"<{iKEY_SIZE}sqQ")
+CRC = struct.Struct('<I')
+
+def sSegment(directory: str, iNumber: int, sSuffix: str) -> str:
+    return os.path.join(directory, f"{iNumber:08d}{sSuffix}")
+
+class StoredMessage:
+    """A message of a MessageStore: timestamp is in time.time_ns(), key
+    the raw public key or chat ID, kind a value of dKINDS, direction
+    iRECEIVED or iSENT, and message the UTF-8 bytes."""
+    __slots__ = ('timestamp', 'key', 'kind', 'direction', 'message_type', 'peer_id', 'message')
+
+    def __init__(self, timestamp, key, kind, direction, message_type, peer_id, message):
+        self.timestamp = timestamp
+        self.key = key
+        self.kind = kind
+        self.direction = direction
+        self.message_type = message_type
+        self.peer_id = peer_id
+        self.message = message
+
+    @property
+    def text(self) -> str:
+        return str(self.message, 'utf-8', errors='replace')
+
+    def __repr__(self) -> str:
+        return f"StoredMessage({self.timestamp}, {self.key.hex().upper()}, {self.kind}, " \
+            f"{self.direction}, {self.message_type}, {self.peer_id}, {self.message!r})"
+
+class StoreStats:
+    """The counters of a MessageStore; pending is the queue now."""
+    __slots__ = ('appended', 'written', 'batches', 'batch_max', 'bytes', 'rotations',
+                 'compactions', 'deleted', 'errors', 'pending')
+
+    def __init__(self):
+        self.appended = 0
+        self.written = 0
+        self.batches = 0
+        self.batch_max = 0
+        self.bytes = 0
+        self.rotations = 0
+        # segments merged, and segments deleted past retention
+        self.compactions = 0
+        self.deleted = 0
+        self.errors = 0
+        self.pending = 0
+
+    def __repr__(self) -> str:
+        return f"StoreStats(appended={self.appended}, written={self.written}, " \
+            f"batches={self.batches}, batch_max={self.batch_max}, bytes={self.bytes}, " \
+            f"rotations={self.rotations}, compactions={self.compactions}, " \
+            f"deleted={self.deleted}, errors={self.errors}, pending={self.pending})"
+
+class IndexView:
+    """The (key, timestamp) of the entries of a sealed index, in order, as a
+    sequence for bisect."""
+    __slots__ = ('buffer', 'count')
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.count = len(buffer) // ENTRY.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> tuple:
+        return ENTRY.unpack_from(self.buffer, i * ENTRY.size)[:2]
+
+    def offset(self, i: int) -> int:
+        return ENTRY.unpack_from(self.buffer, i * ENTRY.size)[2]
+
+class Segment:
+    """A log file of a MessageStore, sealed with its index or current."""
+
+    def __init__(self, directory: str, iNumber: int):
+        self.number = iNumber
+        self.path = sSegment(directory, iNumber, '.log')
+        self.index_path = sSegment(directory, iNumber, '.idx')
+        self.size = 0
+        self.oldest = 0
+        self.newest = 0
+        # monotonic() of when it became current
+        self.started = time.monotonic()
+        # sealed: the mmaps of the log and of the index
+        self.log = None
+        self.index = None
+        # current: key -> [(timestamp, offset)] in the order written
+        self.entries = None
+
+    @property
+    def sealed(self) -> bool:
+        return self.entries is None
+
+    def vOpenSealed(self) -> None:
+        self.size = os.path.getsize(self.path)
+        self.log = oMap(self.path)
+        self.index = IndexView(oMap(self.index_path))
+        aTimes = [tEntry[1] for tEntry in ENTRY.iter_unpack(self.index.buffer)]
+        if aTimes:
+            self.oldest = min(aTimes)
+            self.newest = max(aTimes)
+
+    def lScan(self) -> list:
+        """Read the records of the log: [(offset, header)] of the whole ones,
+        with their crc checked. Sets size to the end of the last."""
+        lRecords = []
+        with open(self.path, 'rb') as oFd:
+            data = oFd.read()
+        iOffset = 0
+        while iOffset + HEADER.size <= len(data):
+            tHeader = HEADER.unpack_from(data, iOffset)
+            iEnd = iOffset + HEADER.size + tHeader[0]
+            if iEnd > len(data) or \
+               zlib.crc32(data[iOffset + 8:iEnd]) != tHeader[1]:
+                LOG_WARN(f"store {self.path} ends at {iOffset} of {len(data)} bytes")
+                break
+            lRecords.append((iOffset, tHeader))
+            iOffset = iEnd
+        self.size = iOffset
+        return lRecords
+
+    def oRead(self, iOffset: int, fd: int=None) -> StoredMessage:
+        # from the mmap when sealed, and with pread from fd when current
+        if self.log is not None:
+            tHeader = HEADER.unpack_from(self.log, iOffset)
+            iStart = iOffset + HEADER.size
+            message = self.log[iStart:iStart + tHeader[0]]
+        else:
+            tHeader = HEADER.unpack(os.pread(fd, HEADER.size, iOffset))
+            message = os.pread(fd, tHeader[0], iOffset + HEADER.size)
+        iLength, iCrc, iTime, iKind, iDirection, iType, iPeer, key = tHeader
+        return StoredMessage(iTime, key, iKind, iDirection, iType, iPeer, message)
+
+    def vClose(self) -> None:
+        for oMapped in (self.log, self.index.buffer if self.index is not None else None):
+            if isinstance(oMapped, mmap.mmap):
+                oMapped.close()
+        self.log = self.index = None
+
+def oMap(filename: str):
+    """A read only mmap of filename, or b'' if it is empty."""
+    with open(filename, 'rb') as oFd:
+        if not os.fstat(oFd.fileno()).st_size:
+            return b''
+        return mmap.mmap(oFd.fileno(), 0, access=mmap.ACCESS_READ)
+
+def bIndex(lEntries) -> bytes:
+    """The sealed index of [(key, timestamp, offset)]."""
+    lEntries.sort()
+    buffer = bytearray(ENTRY.size * len(lEntries))
+    for i, tEntry in enumerate(lEntries):
+        ENTRY.pack_into(buffer, i * ENTRY.size, *tEntry)
+    return buffer
+
+class MessageStore:
+    """The history of the messages of a Tox, see the top of toxstore.py."""
+
+    def __init__(self, directory: str, segment_bytes: int=16 << 20, rotate_interval: float=3600.0,
+                 flush_interval: float=0.2, batch: int=1024, retention: float=None, fsync: bool=True):
+        """
+        :param directory: where the segments go; made if missing
+        :param segment_bytes: the size at which a segment is sealed and a new one started
+        :param rotate_interval: the most seconds a segment is current
+        :param flush_interval: the most seconds a message waits on the queue
+        :param batch: the messages waiting that wake the writer before flush_interval
+        :param retention: the seconds the messages are kept, or None to keep them all
+        :param fsync: fsync each batch; False only for tests
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.rotate_interval = rotate_interval
+        self.flush_interval = flush_interval
+        self.batch = batch
+        self.retention = retention
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        # (timestamp, kind, direction, message_type, peer_id, key, message); deque
+        # appends and pops are atomic, so append takes no lock
+        self._queue = deque()
+        self._oWake = threading.Event()
+        self._oWritten = threading.Condition()
+        # the segment list is replaced, not changed, under _oLock
+        self._oLock = threading.Lock()
+        self._lSealed = []
+        self._oCurrent = None
+        self._fd = None
+        self._bWriting = False
+        self._bStop = False
+        self._stats = StoreStats()
+        # friend number -> public key, group number -> chat ID, and the
+        # messages received on a deferred worker whose key was not known then
+        self._dFriendKeys = {}
+        self._dChatIds = {}
+        self._unresolved = deque()
+        self._tox = None
+        self._lSubscribed = []
+        self._vOpen()
+        self._thread = threading.Thread(target=self._vRun, name='MessageStore', daemon=True)
+        self._thread.start()
+
+    def _vOpen(self) -> None:
+        lNames = os.listdir(self.directory)
+        lNumbers = sorted(int(sName[:-4]) for sName in lNames
+                          if sName.endswith('.log') and sName[:-4].isdigit())
+        for sName in lNames:
+            if sName.endswith('.idx') and sName[:-4].isdigit() and int(sName[:-4]) not in lNumbers:
+                # the index of a merge that did not finish, or of a deleted segment
+                os.unlink(os.path.join(self.directory, sName))
+        lUnsealed = [iNumber for iNumber in lNumbers
+                     if not os.path.exists(sSegment(self.directory, iNumber, '.idx'))]
+        # the current segment is the newest without an index, and may be
+        # older than a merged one
+        iCurrent = lUnsealed[-1] if lUnsealed else None
+        for iNumber in lNumbers:
+            if iNumber == iCurrent:
+                continue
+            oSegment = Segment(self.directory, iNumber)
+            if iNumber in lUnsealed:
+                # a crash while sealing it
+                self._vSealScanned(oSegment)
+            else:
+                oSegment.vOpenSealed()
+            self._lSealed.append(oSegment)
+        if iCurrent is not None:
+            # go on appending to the segment that was current
+            oSegment = Segment(self.directory, iCurrent)
+            oSegment.entries = {}
+            for iOffset, tHeader in oSegment.lScan():
+                self._vIndex(oSegment, tHeader[7], tHeader[2], iOffset)
+            self._vOpenCurrent(oSegment)
+        else:
+            self._vOpenCurrent(self._oNewSegment())
+
+    def _iNextNumber(self) -> int:
+        return max([oSegment.number for oSegment in self._lSealed] +
+                   ([self._oCurrent.number] if self._oCurrent is not None else [0])) + 1
+
+    def _oNewSegment(self) -> Segment:
+        oSegment = Segment(self.directory, self._iNextNumber())
+        oSegment.entries = {}
+        return oSegment
+
+    def _vOpenCurrent(self, oSegment: Segment) -> None:
+        fd = os.open(oSegment.path, os.O_RDWR | os.O_CREAT, 0o600)
+        # what is past the last whole record goes
+        os.ftruncate(fd, oSegment.size)
+        os.lseek(fd, oSegment.size, os.SEEK_SET)
+        self._oCurrent = oSegment
+        self._fd = fd
+
+    def _vIndex(self, oSegment: Segment, key: bytes, iTime: int, iOffset: int) -> None:
+        lEntries = oSegment.entries.get(key)
+        if lEntries is None:
+            lEntries = oSegment.entries[key] = []
+        lEntries.append((iTime, iOffset))
+        if not oSegment.oldest or iTime < oSegment.oldest:
+            oSegment.oldest = iTime
+        if iTime > oSegment.newest:
+            oSegment.newest = iTime
+
+    # Appends, any thread
+
+    def append(self, kind: int, key, direction: int, message_type: int, peer_id: int,
+               message, timestamp: int=None) -> None:
+        """Queue a message for the writer. key is the raw public key of the
+        friend or chat ID of the group, message a str or UTF-8 bytes."""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        self._queue.append((time.time_ns() if timestamp is None else timestamp,
+                            kind, direction, message_type, peer_id, key, message))
+        if len(self._queue) >= self.batch:
+            self._oWake.set()
+
+    def flush(self, timeout: float=None) -> bool:
+        """Wait until what is queued now is written, up to timeout seconds.
+        Returns False on timeout."""
+        fEnd = None if timeout is None else time.monotonic() + timeout
+        with self._oWritten:
+            while (self._queue or self._bWriting) and self._thread is not None:
+                self._oWake.set()
+                fLeft = None if fEnd is None else fEnd - time.monotonic()
+                if fLeft is not None and fLeft <= 0:
+                    return False
+                self._oWritten.wait(fLeft if fLeft is not None else self.flush_interval)
+        return True
+
+    # The writer thread
+
+    def _vRun(self) -> None:
+        while True:
+            self._oWake.wait(self.flush_interval)
+            self._oWake.clear()
+            # before taking from the queue, so flush sees one or the other
+            self._bWriting = True
+            try:
+                while True:
+                    self._vWriteQueue()
+                    oCurrent = self._oCurrent
+                    if oCurrent.size >= self.segment_bytes or oCurrent.size and \
+                       time.monotonic() - oCurrent.started >= self.rotate_interval:
+                        self._vRotate()
+                        self._vCompact()
+                    if not self._queue:
+                        break
+            except Exception as e:
+                self._stats.errors += 1
+                LOG_ERROR(f"store {self.directory} {e}")
+            with self._oWritten:
+                self._bWriting = False
+                self._oWritten.notify_all()
+            if self._bStop and not self._queue:
+                return
+
+    def _vWriteQueue(self) -> None:
+        queue = self._queue
+        if not queue:
+            return
+        oSegment = self._oCurrent
+        buffer = bytearray()
+        lIndex = []
+        iOffset = oSegment.size
+        iCount = 0
+        while queue:
+            iTime, iKind, iDirection, iType, iPeer, key, message = queue.popleft()
+            iStart = len(buffer)
+            buffer += HEADER.pack(len(message), 0, iTime, iKind, iDirection, iType, iPeer, key)
+            # the crc of the header after it, and of the message
+            CRC.pack_into(buffer, iStart + 4,
+                          zlib.crc32(message, zlib.crc32(buffer[iStart + 8:])))
+            buffer += message
+            lIndex.append((key, iTime, iOffset))
+            iOffset += HEADER.size + len(message)
+            iCount += 1
+            if iOffset - oSegment.size >= self.segment_bytes:
+                break
+        with memoryview(buffer) as view:
+            iDone = 0
+            while iDone < len(buffer):
+                iDone += os.write(self._fd, view[iDone:])
+        if self.fsync:
+            os.fsync(self._fd)
+        with self._oLock:
+            for key, iTime, iRecord in lIndex:
+                self._vIndex(oSegment, key, iTime, iRecord)
+            oSegment.size = iOffset
+        oStats = self._stats
+        oStats.written += iCount
+        oStats.batches += 1
+        oStats.bytes += len(buffer)
+        if iCount > oStats.batch_max:
+            oStats.batch_max = iCount
+
+    def _vSealScanned(self, oSegment: Segment) -> None:
+        # write the index of a segment that is not current, and map it
+        lEntries = [(tHeader[7], tHeader[2], iOffset) for iOffset, tHeader in oSegment.lScan()]
+        vWriteAtomic(oSegment.index_path, bIndex(lEntries), self.fsync)
+        oSegment.entries = None
+        oSegment.vOpenSealed()
+
+    def _vRotate(self) -> None:
+        # seal the current segment and start a new one
+        oSegment = self._oCurrent
+        lEntries = [(key, iTime, iOffset) for key, lTimes in oSegment.entries.items()
+                    for iTime, iOffset in lTimes]
+        vWriteAtomic(oSegment.index_path, bIndex(lEntries), self.fsync)
+        oNew = self._oNewSegment()
+        oSealed = Segment(self.directory, oSegment.number)
+        oSealed.vOpenSealed()
+        fd = self._fd
+        with self._oLock:
+            self._lSealed = self._lSealed + [oSealed]
+            self._vOpenCurrent(oNew)
+        os.close(fd)
+        self._stats.rotations += 1
+
+    def _vCompact(self) -> None:
+        # on the writer thread: retention, then merge the runs of small segments
+        if self.retention is not None:
+            iBefore = time.time_ns() - int(self.retention * 1e9)
+            lOld = [oSegment for oSegment in self._lSealed if oSegment.newest < iBefore]
+            if lOld:
+                with self._oLock:
+                    self._lSealed = [oSegment for oSegment in self._lSealed
+                                     if oSegment not in lOld]
+                for oSegment in lOld:
+                    self._vDelete(oSegment)
+                self._stats.deleted += len(lOld)
+        iSmall = self.segment_bytes // 4
+        lRun = []
+        for oSegment in list(self._lSealed) + [None]:
+            if oSegment is not None and oSegment.size < iSmall and \
+               sum(oRun.size for oRun in lRun) + oSegment.size <= self.segment_bytes:
+                lRun.append(oSegment)
+                continue
+            if len(lRun) > 1:
+                self._vMerge(lRun)
+            lRun = [oSegment] if oSegment is not None and oSegment.size < iSmall else []
+
+    def _vMerge(self, lRun: list) -> None:
+        # write the records of lRun to a new segment, its index before its
+        # log, so that a log is never without its index, then swap it in
+        # for lRun and delete those: a crash before they are all gone leaves
+        # some messages twice, never an index that does not match its log
+        iNumber = self._iNextNumber()
+        iBefore = time.time_ns() - int(self.retention * 1e9) if self.retention is not None else 0
+        buffer = bytearray()
+        lEntries = []
+        for oSegment in lRun:
+            for key, iTime, iOffset in ENTRY.iter_unpack(oSegment.index.buffer):
+                if iTime < iBefore:
+                    continue
+                iLength = HEADER.unpack_from(oSegment.log, iOffset)[0]
+                lEntries.append((key, iTime, len(buffer)))
+                buffer += oSegment.log[iOffset:iOffset + HEADER.size + iLength]
+        vWriteAtomic(sSegment(self.directory, iNumber, '.idx'), bIndex(lEntries), self.fsync)
+        vWriteAtomic(sSegment(self.directory, iNumber, '.log'), buffer, self.fsync)
+        oMerged = Segment(self.directory, iNumber)
+        oMerged.vOpenSealed()
+        oFirst = lRun[0]
+        with self._oLock:
+            lSealed = []
+            for oSegment in self._lSealed:
+                if oSegment is oFirst:
+                    lSealed.append(oMerged)
+                elif oSegment not in lRun:
+                    lSealed.append(oSegment)
+            self._lSealed = lSealed
+        for oSegment in lRun:
+            self._vDelete(oSegment)
+        self._stats.compactions += 1
+
+    def _vDelete(self, oSegment: Segment) -> None:
+        # the log first: an index left without its log goes when the store
+        # is opened again. Its maps close when no history holds the Segment
+        # any more
+        for sPath in (oSegment.path, oSegment.index_path):
+            try:
+                os.unlink(sPath)
+            except FileNotFoundError:
+                pass
+
+    # Reads, any thread
+
+    def history(self, key, since: int=0, until: int=None, limit: int=None) -> list:
+        """The messages of key, raw bytes or hex, with since <= timestamp <
+        until, in time.time_ns(), oldest first, up to limit of them. Only
+        what is written: flush() first to include what is queued."""
+        if isinstance(key, str):
+            key = bytes.fromhex(key)
+        key = key.ljust(iKEY_SIZE, b'\0')
+        iUntil = until if until is not None else 2 ** 63 - 1
+        with self._oLock:
+            lSealed = self._lSealed
+            oCurrent = self._oCurrent
+            lCurrent = [iOffset for iTime, iOffset in oCurrent.entries.get(key, ())
+                        if since <= iTime < iUntil]
+            # its own fd: the writer closes its one when it seals the segment
+            fd = os.open(oCurrent.path, os.O_RDONLY) if lCurrent else None
+        lMessages = []
+        for oSegment in lSealed:
+            if oSegment.newest < since or oSegment.oldest >= iUntil:
+                continue
+            oIndex = oSegment.index
+            iStart = bisect.bisect_left(oIndex, (key, since))
+            iEnd = bisect.bisect_left(oIndex, (key, iUntil), iStart)
+            lMessages.extend(oSegment.oRead(oIndex.offset(i)) for i in range(iStart, iEnd))
+        if fd is not None:
+            try:
+                lMessages.extend(oCurrent.oRead(iOffset, fd) for iOffset in lCurrent)
+            finally:
+                os.close(fd)
+        lMessages.sort(key=lambda oMessage: oMessage.timestamp)
+        return lMessages[:limit] if limit is not None else lMessages
+
+    def segments(self) -> list:
+        """The numbers of the sealed segments and of the current one."""
+        return [oSegment.number for oSegment in self._lSealed] + [self._oCurrent.number]
+
+    def stats(self) -> StoreStats:
+        oStats = self._stats
+        oStats.appended = oStats.written + len(self._queue)
+        oStats.pending = len(self._queue)
+        return oStats
+
+    def close(self, timeout: float=None) -> None:
+        """Write what is queued, stop the writer thread and stop following
+        the events. Called by Tox.kill."""
+        for tox, lHandlers in self._lSubscribed:
+            oDispatcher = tox.get_dispatcher()
+            for sEvent, handler in lHandlers:
+                oDispatcher.unsubscribe(sEvent, handler)
+        self._lSubscribed = []
+        if self._thread is None:
+            return
+        self._bStop = True
+        self._oWake.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        os.close(self._fd)
+        for oSegment in self._lSealed:
+            oSegment.vClose()
+
+    # The messages of a Tox
+
+    def subscribe(self, tox) -> None:
+        """Store the messages tox receives: its friend_message, group_message
+        and group_private_message events. Tox.get_message_store does this,
+        and stores what it sends. Reads the public keys of the friends, so
+        call it from the thread that iterates, or before iterating."""
+        self._tox = tox
+        for friend_number in tox.self_get_friend_list():
+            self.bFriendKey(friend_number, ask=True)
+        lHandlers = [
+            ('friend_message', self._vOnFriendMessage),
+            ('group_message', self._vOnGroupMessage),
+            ('group_private_message', self._vOnGroupPrivateMessage),
+            ]
+        oDispatcher = tox.get_dispatcher()
+        for sEvent, handler in lHandlers:
+            oDispatcher.subscribe(sEvent, handler)
+        self._lSubscribed.append((tox, lHandlers))
+
+    def bFriendKey(self, friend_number: int, ask: bool=False) -> bytes:
+        """The public key of friend_number, from those already read, or from
+        the FriendTable of the Tox if it has one; if ask, from libtoxcore
+        when neither has it. None if it is not known."""
+        key = self._dFriendKeys.get(friend_number)
+        if key is None:
+            oFriends = self._tox._friends
+            oRecord = oFriends.get(friend_number) if oFriends is not None else None
+            if oRecord is not None:
+                key = oRecord.public_key
+            elif ask:
+                key = self._tox.friend_get_public_key_bytes(friend_number)
+            if key is not None:
+                self._dFriendKeys[friend_number] = key
+        return key
+
+    def bChatId(self, group_number: int, ask: bool=False) -> bytes:
+        """The chat ID of group_number, from those already read; if ask, from
+        libtoxcore when it is not. None if it is not known."""
+        chat_id = self._dChatIds.get(group_number)
+        if chat_id is None and ask:
+            chat_id = self._dChatIds[group_number] = bytes.fromhex(self._tox.group_get_chat_id(group_number))
+        return chat_id
+
+    def vForgetFriend(self, friend_number: int) -> None:
+        """friend_number was deleted, and may be reused."""
+        self._dFriendKeys.pop(friend_number, None)
+
+    def vForgetGroup(self, group_number: int) -> None:
+        """group_number was left, and may be reused."""
+        self._dChatIds.pop(group_number, None)
+
+    def bKey(self, kind: int, number: int, ask: bool=False) -> bytes:
+        """The key of the friend or group number, by kind."""
+        if kind == dKINDS['friend']:
+            return self.bFriendKey(number, ask)
+        return self.bChatId(number, ask)
+
+    def vSent(self, kind: int, number: int, peer_id: int, message_type: int, message) -> None:
+        """Store a message sent to the friend or group number. Called by the
+        send methods of Tox, on the thread that called libtoxcore to send."""
+        self.append(kind, self.bKey(kind, number, True), iSENT, message_type, peer_id, message)
+
+    def poll(self) -> None:
+        """Store the messages received on the workers of a deferred
+        dispatcher from a friend or group whose key was not known then.
+        Called at the end of Tox.iterate, on the iterate thread."""
+        unresolved = self._unresolved
+        while unresolved:
+            kind, number, peer_id, message_type, message, iTime = unresolved.popleft()
+            try:
+                key = self.bKey(kind, number, True)
+            except (ArgumentError, ToxError) as e:
+                # deleted or left since
+                LOG_WARN(f"store dropped a message of {number}: {e}")
+                self._stats.errors += 1
+                continue
+            self.append(kind, key, iRECEIVED, message_type, peer_id, message, iTime)
+
+    def _vReceived(self, kind: int, number: int, peer_id: int, message_type: int, message) -> None:
+        # libtoxcore is only asked on the iterate thread: on a worker of a
+        # deferred dispatcher, a key not known yet is left for poll
+        key = self.bKey(kind, number, not self._tox.get_dispatcher().in_worker)
+        if key is None:
+            self._unresolved.append((kind, number, peer_id, message_type, message, time.time_ns()))
+            return
+        self.append(kind, key, iRECEIVED, message_type, peer_id, message)
+
+    # Handlers, (tox pointer, callback args..., user_data)
+
+    def _vOnFriendMessage(self, pTox, friend_number, message_type, message, length, user_data) -> None:
+        self._vReceived(dKINDS['friend'], friend_number, 0, message_type, bMessage(message, length))
+
+    def _vOnGroupMessage(self, pTox, group_number, peer_id, message_type, message, length,
+                         user_data) -> None:
+        self._vReceived(dKINDS['group'], group_number, peer_id, message_type,
+                        bMessage(message, length))
+
+    def _vOnGroupPrivateMessage(self, pTox, group_number, peer_id, message_type, message, length,
+                                user_data) -> None:
+        self._vReceived(dKINDS['group_private'], group_number, peer_id, message_type,
+                        bMessage(message, length))
+
+def bMessage(message, length: int) -> bytes:
+    # a c_char_p argument arrives as bytes, and a pointer as an int
+    if isinstance(message, bytes):
+        return message[:length]
+    return string_at(message, length) if length else b''
@@ -119,9 +119,7 @@ else:
 
 
 def save_to_file(tox, fname):
-    data = tox.get_savedata()
-    with open(fname, 'wb') as f:
-        f.write(data)
+    tox.write_savedata(fname)
 
 def load_from_file(fname):
     assert os.path.exists(fname)
@@ -136,6 +134,8 @@ class EchoBot():
         self.files = {}
         self.av = None
         self.on_connection_status = None
+        # the public keys of the friend requests since the last iterate
+        self._lRequests = []
 
     def start(self) -> None:
         self.connect()
@@ -267,14 +267,26 @@ class EchoBot():
         interval = self._tox.iteration_interval()
         for i in range(n):
             self._tox.iterate()
+            self.accept_friend_requests()
             sleep(interval / 1000.0)
             self._tox.iterate()
+            self.accept_friend_requests()
+
+    def accept_friend_requests(self) -> None:
+        # all the requests of an iterate are added, and saved, at once
+        if not self._lRequests:
+            return
+        lRequests, self._lRequests = self._lRequests, []
+        # saved by the profile saver, see iMain
+        lResults = self._tox.friends_add_norequest(lRequests)
+        for pk, (friend_number, iError) in zip(lRequests, lResults):
+            if friend_number is None:
+                LOG.warn(f"on_friend_request not accepted {pk} err={iError}")
+        LOG.info(f"on_friend_request Accepted {len(lRequests)}.")
 
     def on_friend_request(self, pk, message) -> None:
         LOG.debug('Friend request from %s: %s' % (pk, message))
-        self._tox.friend_add_norequest(pk)
-        LOG.info('on_friend_request Accepted.')
-        save_to_file(self._tox, sDATA_FILE)
+        self._lRequests.append(pk)
 
     def on_friend_message(self, friendId, type, message) -> None:
         name = self._tox.friend_get_name(friendId)
@@ -407,15 +419,20 @@ def iMain(oArgs) -> int:
     else:
         opts.savedata_data = None
 
+    oTox = None
+    oSaver = None
     try:
         oTox = EchobotTox(opts, app=oAPP)
+        oSaver = oTox.get_profile_saver(sDATA_FILE)
+        # the profile is written at least once, as it was on every exit,
+        # even if nothing changes it while the bot runs
+        oSaver.mark_dirty()
         t = EchoBot(oTox)
         t._oargs = oArgs
         t.start()
         t.loop()
-        save_to_file(t._tox, sDATA_FILE)
     except KeyboardInterrupt:
-        save_to_file(t._tox, sDATA_FILE)
+        pass
     except RuntimeError as e:
         LOG.error(f"ERROR  {e}")
         iRet = 1
@@ -424,6 +441,13 @@ def iMain(oArgs) -> int:
         LOG.warn(' iMain(): ' \
                      +'\n' + traceback.format_exc())
         iRet = 1
+    finally:
+        # the profile is written by the saver: what changed since its last
+        # save, then the saver stops with the rest
+        if oSaver is not None and not oSaver.flush():
+            LOG.error(f"the profile {sDATA_FILE} could not be saved")
+        if oTox is not None:
+            oTox.kill()
     return iRet
 
 def main(lArgs=None) -> int:
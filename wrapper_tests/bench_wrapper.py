@@ -0,0 +1,838 @@
+# -*- mode: python; indent-tabs-mode: nil; py-indent-offset: 4; coding: utf-8 -*-
+
+"""Microbenchmarks for the wrapper.
+
+These run against a local Tox instance that is never bootstrapped, so
+they need libtoxcore but no network, except for events, which connects
+two local instances to each other. Each benchmark prints calls/sec:
+
+  python3 wrapper_tests/bench_wrapper.py [--count N] [bench ...]
+
+With no bench arguments all of them are run.
+"""
+
+import argparse
+import ctypes
+import os
+import shutil
+import sys
+import threading
+import time
+from ctypes import (CDLL, CFUNCTYPE, ArgumentError, byref, c_char_p, c_int,
+                    c_size_t, c_uint32, c_void_p)
+
+try:
+    from wrapper import toxlog
+    from wrapper.tox import Tox, bin_to_string
+    from wrapper.toxcore_enums_and_consts import (TOX_ADDRESS_SIZE,
+                                                  TOX_ERR_FRIEND_QUERY,
+                                                  TOX_FILE_CONTROL,
+                                                  TOX_FILE_KIND,
+                                                  TOX_MAX_MESSAGE_LENGTH,
+                                                  TOX_MESSAGE_TYPE,
+                                                  TOX_PUBLIC_KEY_SIZE)
+    from wrapper.toxcore_errors import (dFRIEND_QUERY_ERRORS, oERROR,
+                                        vCheckError)
+    from wrapper.toxlatency import LatencyTracker
+    from wrapper.toxmessages import lFragments
+    from wrapper.toxpacer import ToxPacer
+    from wrapper.toxstore import MessageStore, dKINDS, iRECEIVED
+    from wrapper.toxratelimit import bTooSoon, oLimiter
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                 'wrapper'))
+    import toxlog
+    from tox import Tox, bin_to_string
+    from toxcore_enums_and_consts import (TOX_ADDRESS_SIZE,
+                                          TOX_ERR_FRIEND_QUERY,
+                                          TOX_FILE_CONTROL,
+                                          TOX_FILE_KIND,
+                                          TOX_MAX_MESSAGE_LENGTH,
+                                          TOX_MESSAGE_TYPE,
+                                          TOX_PUBLIC_KEY_SIZE)
+    from toxcore_errors import dFRIEND_QUERY_ERRORS, oERROR, vCheckError
+    from toxlatency import LatencyTracker
+    from toxmessages import lFragments
+    from toxpacer import ToxPacer
+    from toxstore import MessageStore, dKINDS, iRECEIVED
+    from toxratelimit import bTooSoon, oLimiter
+
+def LOG_INFO(a: str) -> None: print('INFO> '+a)
+
+def iRate(func, iCount: int) -> int:
+    """Return the calls/sec of func() over iCount calls."""
+    start = time.perf_counter()
+    for i in range(iCount):
+        func()
+    elapsed = time.perf_counter() - start
+    return int(iCount / elapsed) if elapsed else 0
+
+def vReport(sName: str, iBefore: int, iAfter: int) -> None:
+    if iBefore:
+        LOG_INFO(f"{sName:32} before {iBefore:>10}/s  after {iAfter:>10}/s"
+                 f"  x{iAfter / iBefore:.2f}")
+    else:
+        LOG_INFO(f"{sName:32} {iAfter:>10}/s")
+
+def bench_prototypes(oTox: Tox, iCount: int) -> None:
+    """Calls through the unprototyped CDLL with explicit ctypes wrappers
+    (before) versus the pre-bound prototypes and the Tox methods (after)."""
+    # a second handle on the same library, without any argtypes/restype,
+    # reached through __getattr__ and called the way tox.py used to call it
+    class Unbound:
+        def __init__(self):
+            self._lib = CDLL(Tox.libtoxcore._libtoxcore._name)
+        def __getattr__(self, item):
+            return self._lib.__getattr__(item)
+    oRaw = Unbound()
+    pTox = oTox._tox_pointer
+    oLib = Tox.libtoxcore
+    error = c_int()
+
+    def before_exists():
+        oRaw.tox_friend_exists(pTox, c_uint32(0))
+    def after_exists():
+        oLib.tox_friend_exists(pTox, 0)
+    vReport('tox_friend_exists', iRate(before_exists, iCount),
+            iRate(after_exists, iCount))
+    vReport('Tox.friend_exists', 0,
+            iRate(lambda: oTox.friend_exists(0), iCount))
+
+    def before_interval():
+        int(oRaw.tox_iteration_interval(pTox))
+    def after_interval():
+        oLib.tox_iteration_interval(pTox)
+    vReport('tox_iteration_interval', iRate(before_interval, iCount),
+            iRate(after_interval, iCount))
+
+    message = b'x' * 64
+    def before_send():
+        oRaw.tox_friend_send_message(pTox, c_uint32(0), c_int(0),
+                                     c_char_p(message), c_size_t(len(message)),
+                                     byref(error))
+    def after_send():
+        oLib.tox_friend_send_message(pTox, 0, 0, message, len(message),
+                                     byref(error))
+    vReport('tox_friend_send_message', iRate(before_send, iCount),
+            iRate(after_send, iCount))
+
+    key = ctypes.create_string_buffer(TOX_PUBLIC_KEY_SIZE)
+    def before_key():
+        oRaw.tox_self_get_public_key(pTox, key)
+    def after_key():
+        oLib.tox_self_get_public_key(pTox, key)
+    vReport('tox_self_get_public_key', iRate(before_key, iCount),
+            iRate(after_key, iCount))
+
+def bench_errors(oTox: Tox, iCount: int) -> None:
+    """A fresh c_int per call decoded by an if/elif chain (before) versus
+    the per-thread error cell decoded by vCheckError (after)."""
+    pTox = oTox._tox_pointer
+    oLib = Tox.libtoxcore
+
+    def before():
+        tox_err_friend_query = c_int()
+        result = oLib.tox_friend_get_status(pTox, 0, byref(tox_err_friend_query))
+        tox_err_friend_query = tox_err_friend_query.value
+        if tox_err_friend_query == TOX_ERR_FRIEND_QUERY['OK']:
+            return int(result)
+        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['NULL']:
+            raise ArgumentError('NULL')
+        elif tox_err_friend_query == TOX_ERR_FRIEND_QUERY['FRIEND_NOT_FOUND']:
+            raise ArgumentError('FRIEND_NOT_FOUND')
+        raise RuntimeError('The function did not return OK')
+    def after():
+        perror = oERROR.pointer
+        result = oLib.tox_friend_get_status(pTox, 0, perror)
+        vCheckError(perror[0], dFRIEND_QUERY_ERRORS)
+        return int(result)
+    try:
+        vReport('tox_friend_get_status error', iRate(before, iCount),
+                iRate(after, iCount))
+    except (ArgumentError, RuntimeError) as e:
+        # no friend 0 on a real library: time the failing path instead
+        LOG_INFO(f"friend 0 not found, timing the error path ({e})")
+        def raising(func):
+            def inner():
+                try:
+                    func()
+                except (ArgumentError, RuntimeError):
+                    pass
+            return inner
+        vReport('tox_friend_get_status error', iRate(raising(before), iCount),
+                iRate(raising(after), iCount))
+
+def bench_keys(oTox: Tox, iCount: int) -> None:
+    """The per byte hex join of the old bin_to_string (before) versus the
+    bytes.hex() path, and the raw bytes variants that skip hex (after)."""
+    def old_bin_to_string(raw_id, length):
+        res = ''.join('{:02x}'.format(ord(raw_id[i])) for i in range(length))
+        return res.upper()
+    key = ctypes.create_string_buffer(TOX_PUBLIC_KEY_SIZE)
+    Tox.libtoxcore.tox_self_get_public_key(oTox._tox_pointer, key)
+    vReport('bin_to_string', iRate(lambda: old_bin_to_string(key, TOX_PUBLIC_KEY_SIZE), iCount),
+            iRate(lambda: bin_to_string(key, TOX_PUBLIC_KEY_SIZE), iCount))
+    def before():
+        oLib = Tox.libtoxcore
+        address = ctypes.create_string_buffer(TOX_ADDRESS_SIZE)
+        oLib.tox_self_get_address(oTox._tox_pointer, address)
+        return old_bin_to_string(address, TOX_ADDRESS_SIZE)
+    vReport('self_get_address', iRate(before, iCount),
+            iRate(oTox.self_get_address, iCount))
+    vReport('self_get_address_bytes', 0,
+            iRate(oTox.self_get_address_bytes, iCount))
+
+def bench_logging(oTox: Tox, iCount: int) -> None:
+    """iterate() with logging off: the old per call level test of LOG_TRACE
+    (before) versus the no-op bound by toxlog (after)."""
+    def LOG_TRACE(a) -> None:
+        bVERBOSE = hasattr(__builtins__, 'app') and app.oArgs.loglevel < 10
+        if bVERBOSE: print('TRAC> '+a)
+    dGlobals = vars(sys.modules[Tox.__module__])
+    iLevel = toxlog.iGetLevel()
+    toxlog.vSetLevel(toxlog.WARN)
+    try:
+        dGlobals['LOG_TRACE'] = LOG_TRACE
+        iBefore = iRate(oTox.iterate, iCount)
+        toxlog.vSetLevel(toxlog.WARN)
+        vReport('iterate', iBefore, iRate(oTox.iterate, iCount))
+    finally:
+        toxlog.vSetLevel(iLevel)
+
+def bench_dispatch(oTox: Tox, iCount: int) -> None:
+    """A friend_message event fanned out to three handlers: closures
+    chained by hand in one CFUNCTYPE (before) versus the dispatcher
+    trampoline (after). Both are called through ctypes as libtoxcore would."""
+    lSeen = []
+    def metrics(*args): lSeen.append(1)
+    def persist(*args): lSeen.append(2)
+    def logic(*args): lSeen.append(3)
+    def chained(*args):
+        metrics(*args)
+        persist(*args)
+        logic(*args)
+    oChained = CFUNCTYPE(None, c_void_p, c_uint32, c_int, c_char_p, c_size_t, c_void_p)(chained)
+    oDispatcher = oTox.get_dispatcher()
+    for handler in (metrics, persist, logic):
+        oDispatcher.subscribe('friend_message', handler)
+    oTrampoline = oDispatcher._slots['friend_message'].trampoline
+    message = b'x' * 64
+    try:
+        vReport('friend_message x3 handlers',
+                iRate(lambda: oChained(None, 0, 0, message, len(message), None), iCount),
+                iRate(lambda: oTrampoline(None, 0, 0, message, len(message), None), iCount))
+    finally:
+        for handler in (metrics, persist, logic):
+            oDispatcher.unsubscribe('friend_message', handler)
+
+def bench_deferred(oTox: Tox, iCount: int) -> None:
+    """friend_message events from 16 friends to a handler that waits 0.5ms,
+    as on a database: the time the trampoline takes on the iterate thread
+    inline (before) versus deferred to 4 workers (after), in events/sec."""
+    iCount = max(min(iCount, 2000), 10)
+    def handler(*args): time.sleep(0.0005)
+    oDispatcher = oTox.get_dispatcher()
+    oDispatcher.subscribe('friend_message', handler)
+    oTrampoline = oDispatcher._slots['friend_message'].trampoline
+    message = b'x' * 64
+    lCount = [0]
+    def event():
+        oTrampoline(None, lCount[0] % 16, 0, message, len(message), None)
+        lCount[0] += 1
+    try:
+        iBefore = iRate(event, iCount)
+        oDispatcher.defer(workers=4, size=iCount)
+        start = time.perf_counter()
+        iAfter = iRate(event, iCount)
+        oDispatcher.undefer()
+        elapsed = time.perf_counter() - start
+        vReport('friend_message slow handler', iBefore, iAfter)
+        LOG_INFO(f"deferred: handled in {elapsed:.3f}s {oDispatcher.stats()}")
+    finally:
+        oDispatcher.unsubscribe('friend_message', handler)
+
+def bench_coalesce(oTox: Tox, iCount: int) -> None:
+    """A reconnect storm of friend_connection_status and friend_status events
+    from 100 friends, to a handler that waits 0.1ms, as redrawing a contact
+    list: the events/sec through the trampolines called inline (before)
+    versus coalesced in a 50ms window (after), and the handler calls saved."""
+    iCount = max(min(iCount, 20000), 10)
+    lCalls = [0]
+    def handler(*args):
+        lCalls[0] += 1
+        time.sleep(0.0001)
+    oDispatcher = oTox.get_dispatcher()
+    oDispatcher.subscribe('friend_connection_status', handler)
+    oDispatcher.subscribe('friend_status', handler)
+    oConnection = oDispatcher._slots['friend_connection_status'].trampoline
+    oStatus = oDispatcher._slots['friend_status'].trampoline
+    lCount = [0]
+    def event():
+        i = lCount[0]
+        if i % 2:
+            oStatus(None, i % 100, i % 3, None)
+        else:
+            oConnection(None, i % 100, i % 3, None)
+        lCount[0] += 1
+    try:
+        iBefore = iRate(event, iCount)
+        lCalls[0] = 0
+        oDispatcher.coalesce(window=0.05)
+        iAfter = iRate(event, iCount)
+        oDispatcher.uncoalesce()
+        vReport('friend status storm', iBefore, iAfter)
+        LOG_INFO(f"coalesce: {iCount} events, {lCalls[0]} handler calls {oDispatcher.coalesce_stats}")
+    finally:
+        oDispatcher.unsubscribe('friend_connection_status', handler)
+        oDispatcher.unsubscribe('friend_status', handler)
+
+def bench_friend_info(oTox: Tox, iCount: int) -> None:
+    """Reading a friend's name and status message by asking for the size
+    and allocating a buffer each time (before) versus the per thread
+    buffers, and friend_get_info (after)."""
+    pTox = oTox._tox_pointer
+    oLib = Tox.libtoxcore
+    error = c_int()
+    def before_name():
+        size = oLib.tox_friend_get_name_size(pTox, 0, byref(error))
+        name = ctypes.create_string_buffer(size)
+        oLib.tox_friend_get_name(pTox, 0, name, byref(error))
+        return str(name.value, 'utf-8', errors='ignore')
+    vReport('friend_get_name', iRate(before_name, iCount),
+            iRate(lambda: oTox.friend_get_name(0), iCount))
+    def before_info():
+        size = oLib.tox_friend_get_name_size(pTox, 0, byref(error))
+        name = ctypes.create_string_buffer(size)
+        oLib.tox_friend_get_name(pTox, 0, name, byref(error))
+        size = oLib.tox_friend_get_status_message_size(pTox, 0, byref(error))
+        status_message = ctypes.create_string_buffer(size)
+        oLib.tox_friend_get_status_message(pTox, 0, status_message, byref(error))
+        return (str(name.value, 'utf-8', errors='ignore'),
+                str(status_message.value, 'utf-8', errors='ignore'),
+                oTox.friend_get_status(0),
+                oTox.friend_get_connection_status(0),
+                oTox.friend_get_last_online(0))
+    vReport('friend_get_info', iRate(before_info, iCount),
+            iRate(lambda: oTox.friend_get_info(0), iCount))
+
+def bench_friend_table(oTox: Tox, iCount: int) -> None:
+    """A routing path over 100 friends: finding a friend by public key and
+    reading the name and connection status through libtoxcore (before)
+    versus from the FriendTable (after)."""
+    oFriends = Tox(Tox.options_new())
+    try:
+        lKeys = [os.urandom(TOX_PUBLIC_KEY_SIZE).hex().upper() for i in range(100)]
+        for sKey in lKeys:
+            oFriends.friend_add_norequest(sKey)
+        oTable = oFriends.get_friend_table()
+        lBytes = [bytes.fromhex(sKey) for sKey in lKeys]
+        lCount = [0]
+        def before():
+            i = oFriends.friend_by_public_key(lKeys[lCount[0] % 100])
+            lCount[0] += 1
+            return (oFriends.friend_get_name(i), oFriends.friend_get_connection_status(i))
+        def after():
+            oRecord = oTable[oTable.by_public_key(lBytes[lCount[0] % 100])]
+            lCount[0] += 1
+            return (oRecord.name, oRecord.connection_status)
+        vReport('friend by key, name, connection', iRate(before, iCount), iRate(after, iCount))
+    finally:
+        oFriends.kill()
+
+def bench_friends_snapshot(oTox: Tox, iCount: int) -> None:
+    """Collecting the connection status, user status, last online time and
+    public key of 1k, 10k and 50k friends: walking self_get_friend_list with
+    the friend_get_* methods (before) versus friends_snapshot() from
+    libtoxcore (after), in friends/sec; then friends_snapshot() from the
+    FriendTable."""
+    for iFriends in (1000, 10000, 50000):
+        oFriends = Tox(Tox.options_new())
+        try:
+            for i in range(iFriends):
+                oFriends.friend_add_norequest(os.urandom(TOX_PUBLIC_KEY_SIZE).hex())
+            def before():
+                return [(oFriends.friend_get_connection_status(friend_number),
+                         oFriends.friend_get_status(friend_number),
+                         oFriends.friend_get_last_online(friend_number),
+                         oFriends.friend_get_public_key_bytes(friend_number))
+                        for friend_number in oFriends.self_get_friend_list()]
+            iRepeat = max(min(iCount // iFriends, 10), 1)
+            vReport(f"{iFriends} friends", iFriends * iRate(before, iRepeat),
+                    iFriends * iRate(oFriends.friends_snapshot, iRepeat))
+            oFriends.get_friend_table()
+            vReport(f"{iFriends} friends from the table", 0,
+                    iFriends * iRate(oFriends.friends_snapshot, iRepeat))
+        finally:
+            oFriends.kill()
+
+def bench_savedata(oTox: Tox, iCount: int) -> None:
+    """Saving the profile: get_savedata() and writing the copy (before)
+    versus get_savedata_into() a reused buffer and write_savedata() (after).
+    Without fsync, so this times the copies rather than the disk."""
+    iCount = max(iCount // 100, 1)
+    sFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_savedata.tox')
+    def before():
+        data = oTox.get_savedata()
+        with open(sFile + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(sFile + '.tmp', sFile)
+    oBuffer = bytearray(oTox.get_savedata_size())
+    try:
+        vReport('get_savedata', iRate(oTox.get_savedata, iCount),
+                iRate(lambda: oTox.get_savedata_into(oBuffer), iCount))
+        vReport('save to file', iRate(before, iCount),
+                iRate(lambda: oTox.write_savedata(sFile, fsync=False), iCount))
+    finally:
+        if os.path.exists(sFile):
+            os.unlink(sFile)
+
+def bench_onboarding(oTox: Tox, iCount: int) -> None:
+    """Accepting a flood of friend requests as the echo bot did, with
+    friend_add_norequest and write_savedata for each (before), versus
+    friends_add_norequest of them all and one write_savedata (after), in
+    friends/sec. Each measurement adds to a fresh instance."""
+    iFriends = max(min(iCount // 100, 2000), 10)
+    sFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_onboarding.tox')
+    def iRun(bBatch: bool) -> int:
+        lKeys = [os.urandom(TOX_PUBLIC_KEY_SIZE).hex() for i in range(iFriends)]
+        oFriends = Tox(Tox.options_new())
+        try:
+            start = time.perf_counter()
+            if bBatch:
+                oFriends.friends_add_norequest(lKeys, save=lambda: oFriends.write_savedata(sFile))
+            else:
+                for sKey in lKeys:
+                    oFriends.friend_add_norequest(sKey)
+                    oFriends.write_savedata(sFile)
+            elapsed = time.perf_counter() - start
+        finally:
+            oFriends.kill()
+        return int(iFriends / elapsed) if elapsed else 0
+    try:
+        vReport(f"{iFriends} friend requests", iRun(False), iRun(True))
+    finally:
+        if os.path.exists(sFile):
+            os.unlink(sFile)
+
+def bench_saver(oTox: Tox, iCount: int) -> None:
+    """Profile changes under churn, a name change each iterate: writing the
+    savedata after each with fsync (before) versus the ProfileSaver with a
+    debounce of 0.1s (after), in changes/sec, and the writes each made."""
+    iChanges = max(min(iCount // 100, 1000), 10)
+    sFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_saver.tox')
+    oChurn = Tox(Tox.options_new())
+    try:
+        def before():
+            oChurn.self_set_name(f"bench {time.perf_counter()}")
+            oChurn.iterate()
+            oChurn.write_savedata(sFile)
+        iBefore = iRate(before, iChanges)
+        oSaver = oChurn.get_profile_saver(sFile, debounce=0.1, max_delay=1.0)
+        def after():
+            oChurn.self_set_name(f"bench {time.perf_counter()}")
+            oChurn.iterate()
+        iAfter = iRate(after, iChanges)
+        oSaver.flush()
+        vReport(f"{iChanges} profile changes", iBefore, iAfter)
+        LOG_INFO(f"saver: {iChanges} writes before, {oSaver.stats().saves} after {oSaver.stats()}")
+    finally:
+        oChurn.kill()
+        if os.path.exists(sFile):
+            os.unlink(sFile)
+
+def bench_long_message(oTox: Tox, iCount: int) -> None:
+    """Splitting a 64KB report in mixed scripts into messages of at most
+    TOX_MAX_MESSAGE_LENGTH bytes: trimming characters off each fragment and
+    re-encoding it until it fits (before) versus encoding once and cutting
+    with lFragments (after), in reports/sec."""
+    iCount = max(min(iCount // 1000, 200), 5)
+    sReport = ('status ok 42 – température 21°C, 東京 ✓ 😀\n' * 2000)[:65536]
+    def before():
+        lParts = []
+        sLeft = sReport
+        while sLeft:
+            sPart = sLeft[:TOX_MAX_MESSAGE_LENGTH]
+            while len(sPart.encode('utf-8')) > TOX_MAX_MESSAGE_LENGTH:
+                sPart = sPart[:-1]
+            lParts.append(sPart.encode('utf-8'))
+            sLeft = sLeft[len(sPart):]
+        return lParts
+    def after():
+        data = sReport.encode('utf-8')
+        return [data[iStart:iEnd] for iStart, iEnd in lFragments(data)]
+    assert b''.join(before()) == b''.join(after())
+    vReport('split 64KB report', iRate(before, iCount), iRate(after, iCount))
+
+def bench_outbox(oTox: Tox, iCount: int) -> None:
+    """Sending to a friend that is offline: friend_send_message raising
+    and the caller catching it to try later (before) versus the ToxOutbox
+    holding the message for when the friend connects (after), in
+    sends/sec."""
+    iCount = max(min(iCount, 100000), 100)
+    oOffline = Tox(Tox.options_new())
+    try:
+        friend_number = oOffline.friend_add_norequest(os.urandom(TOX_PUBLIC_KEY_SIZE).hex())
+        lHeld = []
+        def before():
+            try:
+                oOffline.friend_send_message(friend_number, TOX_MESSAGE_TYPE['NORMAL'], 'bench')
+            except (ArgumentError, MemoryError):
+                lHeld.append('bench')
+        oOutbox = oOffline.get_outbox(max_messages=iCount + 1, max_bytes=iCount * 16)
+        oOffline.iterate()
+        def after():
+            oOutbox.send(friend_number, TOX_MESSAGE_TYPE['NORMAL'], 'bench')
+        vReport('send to offline friend', iRate(before, iCount), iRate(after, iCount))
+        LOG_INFO(f"outbox: {oOutbox.stats()}")
+    finally:
+        oOffline.kill()
+
+def bench_rate_limit(oTox: Tox, iCount: int) -> None:
+    """Rate limit checks of a churn of friend numbers, with the bTooSoon
+    of a dict of datetime.now() per slot (before) versus the monotonic
+    token buckets of toxratelimit (after), in checks/sec, and the keys each
+    holds afterwards. The lock of the buckets costs some checks/sec; what
+    it buys is that the keys stay within max_keys and that callback and
+    application threads can check at once."""
+    from datetime import datetime
+    dTimes = {}
+    def bTooSoonBefore(key, sSlot, fSec=10.0) -> bool:
+        OTIME = dTimes.setdefault(sSlot, dict())
+        now = datetime.now()
+        if key not in OTIME:
+            OTIME[key] = now
+            return False
+        delta = now - OTIME[key]
+        OTIME[key] = now
+        if delta.total_seconds() < fSec: return True
+        return False
+    # a thousand friends, and a churn of new ones past max_keys
+    lKeys = [i % 1000 if i % 4 else 1000 + i for i in range(iCount)]
+    def iRun(bTooSoon) -> int:
+        start = time.perf_counter()
+        for key in lKeys:
+            bTooSoon(key, 'bench_rate_limit', 10.0)
+        elapsed = time.perf_counter() - start
+        return int(iCount / elapsed) if elapsed else 0
+    vReport('rate limit checks', iRun(bTooSoonBefore), iRun(bTooSoon))
+    LOG_INFO(f"rate limit: {len(dTimes['bench_rate_limit'])} keys before, "
+             f"{len(oLimiter('bench_rate_limit'))} after")
+
+def bench_latency(oTox: Tox, iCount: int) -> None:
+    """Noting the send of a message and taking its latency at the receipt,
+    for 100 friends with 10 messages in flight each: a dict of
+    (friend, message ID) to time.monotonic() and a list of the latencies
+    (before) versus the ring and histograms of LatencyTracker (after), in
+    messages/sec, and the latencies each holds afterwards. The tracker
+    costs more per message, for its lock, expiry and two histograms; what
+    it buys is memory bounded by capacity however long it runs."""
+    lMessages = [(i % 100, i) for i in range(iCount)]
+    dSent = {}
+    lLatencies = []
+    def iRun(sent, acked) -> int:
+        start = time.perf_counter()
+        for i, tMessage in enumerate(lMessages):
+            sent(*tMessage)
+            if i >= 1000:
+                acked(*lMessages[i - 1000])
+        elapsed = time.perf_counter() - start
+        return int(iCount / elapsed) if elapsed else 0
+    def vSentBefore(friend_number, message_id):
+        dSent[(friend_number, message_id)] = time.monotonic()
+    def vAckedBefore(friend_number, message_id):
+        fSent = dSent.pop((friend_number, message_id), None)
+        if fSent is not None:
+            lLatencies.append(time.monotonic() - fSent)
+    iBefore = iRun(vSentBefore, vAckedBefore)
+    oTracker = LatencyTracker(oTox, capacity=4096)
+    try:
+        iAfter = iRun(oTracker.sent, oTracker.acked)
+    finally:
+        oTracker.close()
+    vReport('send and receipt', iBefore, iAfter)
+    LOG_INFO(f"latency: {len(lLatencies)} floats before, {oTracker.histogram()} after")
+
+def bench_store(oTox: Tox, iCount: int) -> None:
+    """Persisting a burst of received messages from 100 friends: a write
+    to a file per friend, opened and closed for each message (before),
+    versus MessageStore.append on the iterate thread and the writer
+    thread's batches (after), in messages/sec, the flush of all of them
+    included. Neither fsyncs."""
+    iCount = max(min(iCount, 100000), 100)
+    sDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_store')
+    lKeys = [os.urandom(TOX_PUBLIC_KEY_SIZE) for i in range(100)]
+    lMessages = [(lKeys[i % 100], f"bench message {i} " * 4) for i in range(iCount)]
+    try:
+        os.makedirs(sDir, exist_ok=True)
+        start = time.perf_counter()
+        for key, sMessage in lMessages:
+            with open(os.path.join(sDir, key.hex()), 'ab') as oFd:
+                oFd.write(f"{time.time_ns()} {sMessage}\n".encode('utf-8'))
+        elapsed = time.perf_counter() - start
+        iBefore = int(iCount / elapsed) if elapsed else 0
+        shutil.rmtree(sDir)
+        oStore = MessageStore(sDir, fsync=False)
+        try:
+            start = time.perf_counter()
+            for key, sMessage in lMessages:
+                oStore.append(dKINDS['friend'], key, iRECEIVED, TOX_MESSAGE_TYPE['NORMAL'], 0, sMessage)
+            fAppended = time.perf_counter() - start
+            oStore.flush()
+            elapsed = time.perf_counter() - start
+        finally:
+            oStore.close()
+        vReport(f"store {iCount} messages", iBefore, int(iCount / elapsed) if elapsed else 0)
+        LOG_INFO(f"store: iterate thread {iCount / fAppended:.0f} appends/sec {oStore.stats()}")
+    finally:
+        shutil.rmtree(sDir, ignore_errors=True)
+
+def bench_threads(oTox: Tox, iCount: int) -> None:
+    """Throughput of 1, 2, 4 and 8 sender threads calling into one thread
+    safe instance while another thread runs iterate, in calls/sec summed
+    over the senders. Each sender sets the status message, which takes
+    the lock of the instance in libtoxcore like the send functions do."""
+    oOptions = Tox.options_new()
+    oOptions.contents.experimental_thread_safety = True
+    oSafe = Tox(oOptions)
+    assert oSafe.is_thread_safe()
+    oStop = threading.Event()
+    def vIterate():
+        while not oStop.is_set():
+            oSafe.iterate()
+            oStop.wait(oSafe.iteration_interval() / 1000.0)
+    oIterate = threading.Thread(target=vIterate, name='bench_iterate')
+    oIterate.start()
+    try:
+        for iThreads in (1, 2, 4, 8):
+            def vSend(i):
+                sMessage = f"bench sender {i}"
+                for j in range(iCount):
+                    oSafe.self_set_status_message(sMessage)
+            lThreads = [threading.Thread(target=vSend, args=(i,)) for i in range(iThreads)]
+            start = time.perf_counter()
+            for oThread in lThreads:
+                oThread.start()
+            for oThread in lThreads:
+                oThread.join()
+            elapsed = time.perf_counter() - start
+            vReport(f"{iThreads} sender threads", 0,
+                    int(iThreads * iCount / elapsed) if elapsed else 0)
+    finally:
+        oStop.set()
+        oIterate.join()
+        oSafe.kill()
+
+def bench_commands(oTox: Tox, iCount: int) -> None:
+    """Throughput of 4 sender threads setting the status message of one
+    instance while another thread runs iterate: calling a thread safe
+    instance directly (before) versus submitting to the command queue of
+    an instance that is not thread safe (after), in calls/sec summed over
+    the senders. Prints the batch sizes and queue latency of the queue."""
+    iCount = max(min(iCount, 20000), 10)
+    iThreads = 4
+    def iRun(oInstance, bQueue: bool) -> int:
+        oWake = threading.Event()
+        oQueue = oInstance.get_command_queue(wake=oWake.set) if bQueue else None
+        oStop = threading.Event()
+        def vIterate():
+            while not oStop.is_set():
+                oInstance.iterate()
+                if oWake.wait(oInstance.iteration_interval() / 1000.0):
+                    oWake.clear()
+        def vSend(i):
+            sMessage = f"bench sender {i}"
+            if oQueue is None:
+                for j in range(iCount):
+                    oInstance.self_set_status_message(sMessage)
+            else:
+                lFutures = [oQueue.submit(oInstance.self_set_status_message, sMessage)
+                            for j in range(iCount)]
+                for oFuture in lFutures:
+                    oFuture.result()
+        oIterate = threading.Thread(target=vIterate, name='bench_iterate')
+        oIterate.start()
+        lThreads = [threading.Thread(target=vSend, args=(i,)) for i in range(iThreads)]
+        start = time.perf_counter()
+        for oThread in lThreads:
+            oThread.start()
+        for oThread in lThreads:
+            oThread.join()
+        elapsed = time.perf_counter() - start
+        oStop.set()
+        oWake.set()
+        oIterate.join()
+        if oQueue is not None:
+            LOG_INFO(f"commands: {oQueue.stats()}")
+        return int(iThreads * iCount / elapsed) if elapsed else 0
+    oOptions = Tox.options_new()
+    oOptions.contents.experimental_thread_safety = True
+    oSafe = Tox(oOptions)
+    oQueued = Tox(Tox.options_new())
+    try:
+        vReport(f"{iThreads} sender threads", iRun(oSafe, False), iRun(oQueued, True))
+    finally:
+        oSafe.kill()
+        oQueued.kill()
+
+def bench_pacer(oTox: Tox, iCount: int) -> None:
+    """Send-to-flush latency of a ToxPacer sleeping iteration_interval()
+    (before) versus waking for the sends (after), with a sender thread
+    sending every 7ms to a thread safe instance. Prints the p50 and p99 in
+    ms and the CPU share of the iterations; the rate is sends/sec."""
+    iSends = max(min(iCount // 100, 500), 10)
+    oOptions = Tox.options_new()
+    oOptions.contents.experimental_thread_safety = True
+    oSafe = Tox(oOptions)
+    def iRun(bAdaptive: bool) -> int:
+        oPacer = ToxPacer(oSafe, adaptive=bAdaptive)
+        oPacer.start()
+        start = time.perf_counter()
+        try:
+            for i in range(iSends):
+                oPacer.send(oSafe.self_set_status_message, f"bench {i}")
+                time.sleep(0.007)
+            time.sleep(oSafe.iteration_interval() / 1000.0 * 2)
+        finally:
+            oPacer.stop()
+        elapsed = time.perf_counter() - start
+        oStats = oPacer.stats()
+        LOG_INFO(f"pacer {'adaptive' if bAdaptive else 'fixed':8} p50 {oStats.send_p50 * 1000:.3f}ms"
+                 f" p99 {oStats.send_p99 * 1000:.3f}ms iterations {oStats.iterations}"
+                 f" cpu {oStats.cpu_share * 100:.2f}%")
+        return int(iSends / elapsed) if elapsed else 0
+    try:
+        vReport('pacer sends', iRun(False), iRun(True))
+    finally:
+        oSafe.kill()
+
+def lConnectedPair(fTimeout: float=60.0) -> list:
+    """Two local instances that are friends and connected, as
+    [oAlice, oBob, alice's number for bob, bob's number for alice],
+    or [] after killing them if they do not connect within fTimeout."""
+    oAlice = Tox(Tox.options_new())
+    oBob = Tox(Tox.options_new())
+    oBob.bootstrap('127.0.0.1', oAlice.self_get_udp_port(), oAlice.self_get_dht_id())
+    iBob = oAlice.friend_add_norequest(oBob.self_get_public_key())
+    iAlice = oBob.friend_add_norequest(oAlice.self_get_public_key())
+    fEnd = time.monotonic() + fTimeout
+    while time.monotonic() < fEnd:
+        oAlice.iterate()
+        oBob.iterate()
+        if oAlice.friend_get_connection_status(iBob) and \
+           oBob.friend_get_connection_status(iAlice):
+            return [oAlice, oBob, iBob, iAlice]
+        time.sleep(oAlice.iteration_interval() / 1000.0)
+    oAlice.kill()
+    oBob.kill()
+    return []
+
+def bench_events(oTox: Tox, iCount: int) -> None:
+    """Alice receiving friend messages and a file from Bob over localhost,
+    in callback mode (before) versus events mode (after), in events/sec of
+    the time spent in alice's iterate. Needs two instances to connect."""
+    iMessages = min(iCount, 20000)
+    iFileSize = 4 * 1024 * 1024
+    lPair = lConnectedPair()
+    if not lPair:
+        LOG_INFO('events: the two instances did not connect - skipped')
+        return
+    oAlice, oBob, iBob, iAlice = lPair
+    def on_chunk_request(iTox, friend_number, file_number, position, length, *largs):
+        if length:
+            oBob.file_send_chunk(friend_number, file_number, position, b'x' * length)
+    oBob.callback_file_chunk_request(on_chunk_request)
+
+    def iRun(bEvents: bool) -> int:
+        lCounts = [0, 0]
+        def on_message(iTox, friend_number, message_type, message, size, *largs):
+            lCounts[0] += 1
+        def on_file_recv(iTox, friend_number, file_number, kind, size, filename, name_size, *largs):
+            oAlice.file_control(friend_number, file_number, TOX_FILE_CONTROL['RESUME'])
+        def on_chunk(iTox, friend_number, file_number, position, data, size, *largs):
+            lCounts[1] += size
+        oAlice.callback_friend_message(on_message)
+        oAlice.callback_file_recv(on_file_recv)
+        oAlice.callback_file_recv_chunk(on_chunk)
+        iterate = oAlice.events_iterate if bEvents else oAlice.iterate
+        oBob.file_send(iAlice, TOX_FILE_KIND['DATA'], iFileSize, None, 'bench')
+        iSent = 0
+        fSpent = 0.0
+        fEnd = time.monotonic() + 300
+        while (lCounts[0] < iMessages or lCounts[1] < iFileSize) and time.monotonic() < fEnd:
+            for i in range(100):
+                if iSent >= iMessages:
+                    break
+                try:
+                    oBob.friend_send_message(iAlice, TOX_MESSAGE_TYPE['NORMAL'], b'm' * 128)
+                except Exception:
+                    # SENDQ
+                    break
+                iSent += 1
+            oBob.iterate()
+            start = time.perf_counter()
+            iterate()
+            fSpent += time.perf_counter() - start
+        iEvents = lCounts[0] + lCounts[1] // 1024
+        LOG_INFO(f"events: {'events' if bEvents else 'callback'} mode {lCounts[0]} messages"
+                 f" {lCounts[1]} file bytes in {fSpent:.2f}s of alice iterate")
+        return int(iEvents / fSpent) if fSpent else 0
+    try:
+        # events mode cannot be turned off again, so callback mode first
+        vReport('alice iterate events', iRun(False), iRun(True))
+    finally:
+        oAlice.kill()
+        oBob.kill()
+
+lBENCHMARKS = {
+    'prototypes': bench_prototypes,
+    'errors': bench_errors,
+    'keys': bench_keys,
+    'logging': bench_logging,
+    'dispatch': bench_dispatch,
+    'friend_info': bench_friend_info,
+    'savedata': bench_savedata,
+    'events': bench_events,
+    'threads': bench_threads,
+    'pacer': bench_pacer,
+    'deferred': bench_deferred,
+    'coalesce': bench_coalesce,
+    'commands': bench_commands,
+    'friend_table': bench_friend_table,
+    'friends_snapshot': bench_friends_snapshot,
+    'onboarding': bench_onboarding,
+    'saver': bench_saver,
+    'long_message': bench_long_message,
+    'outbox': bench_outbox,
+    'rate_limit': bench_rate_limit,
+    'latency': bench_latency,
+    'store': bench_store,
+    }
+
+def oArgparse(lArgv):
+    parser = argparse.ArgumentParser(description='Wrapper microbenchmarks')
+    parser.add_argument('--count', type=int, default=100000,
+                        help='Calls per measurement - default 100000')
+    parser.add_argument('benchmarks', nargs='*', default=[],
+                        help='Benchmarks to run, from: ' +
+                        ' '.join(lBENCHMARKS.keys()) + ' - default all')
+    oArgs = parser.parse_args(lArgv)
+    for sName in oArgs.benchmarks:
+        if sName not in lBENCHMARKS:
+            parser.error(f"unknown benchmark {sName}")
+    return oArgs
+
+def main(lArgs=None) -> int:
+    if lArgs is None:
+        lArgs = sys.argv[1:]
+    oArgs = oArgparse(lArgs)
+    oTox = Tox(Tox.options_new())
+    try:
+        for sName in oArgs.benchmarks or lBENCHMARKS.keys():
+            LOG_INFO(f"{sName}: {oArgs.count} calls per measurement")
+            lBENCHMARKS[sName](oTox, oArgs.count)
+    finally:
+        oTox.kill()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
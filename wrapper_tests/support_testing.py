@@ -97,7 +97,8 @@ lBOOLEANS = [
         'hole_punching_enabled',
         'dht_announcements_enabled',
         'save_history',
-        'download_nodes_list'
+        'download_nodes_list',
+        'experimental_thread_safety',
         'core_logging',
         ]
 
@@ -302,7 +303,9 @@ def oToxygenToxOptions(oArgs):
 
     # overrides
     tox_options.contents.local_discovery_enabled = False
-    tox_options.contents.experimental_thread_safety = False
+    # see Tox.is_thread_safe
+    tox_options.contents.experimental_thread_safety = \
+        getattr(oArgs, 'experimental_thread_safety', False) in [True, 'True']
     # REQUIRED!!
     if oArgs.ipv6_enabled and not os.path.exists('/proc/sys/net/ipv6'):
         LOG.warning('Disabling IPV6 because /proc/sys/net/ipv6 does not exist' + repr(oArgs.ipv6_enabled))
@@ -388,6 +391,9 @@ def oMainArgparser(_=None, iMode=0):
     parser.add_argument('--dht_announcements_enabled',type=str,
                         default='True', choices=['True','False'],
                         help='En/Disable DHT announcements')
+    parser.add_argument('--experimental_thread_safety',type=str,
+                        default='False', choices=['True','False'],
+                        help='En/Disable the thread safe mode of libtoxcore and the wrapper')
 # argparse.ArgumentError: argument --save_history: conflicting option string: --save_history
 #    parser.add_argument('--save_history', type=str, default='True',
 #                        choices=['True', 'False'],
@@ -27,6 +27,8 @@ which itself was forked from https://github.com/aitjcize/PyTox/
 Modified to work with
 """
 
+import asyncio
+import contextlib
 import ctypes
 import faulthandler
 import hashlib
@@ -34,8 +36,10 @@ import logging
 import os
 import random
 import re
+import shutil
 import sys
 import threading
+import tempfile
 import traceback
 import unittest
 from ctypes import *
@@ -70,9 +74,19 @@ except ImportError as e:
 import wrapper
 import wrapper.toxcore_enums_and_consts as enums
 from wrapper.tox import Tox, UINT32_MAX, ToxError
+from wrapper.toxasync import AsyncTox
+from wrapper.toxmessages import MessageReassembler, lFragments
+from wrapper.toxoutbox import ToxOutbox
+from wrapper.toxpacer import ToxPacer
+from wrapper.toxpool import ToxPool
+from wrapper.toxratelimit import RateLimiter, limited
+from wrapper.toxstore import MessageStore, dKINDS, iRECEIVED, iSENT
+from wrapper.toxreactor import ToxReactor
 
 from wrapper.toxcore_enums_and_consts import (TOX_ADDRESS_SIZE, TOX_CONNECTION,
+                                              TOX_ERR_FRIEND_ADD,
                                               TOX_FILE_CONTROL,
+                                              TOX_MAX_MESSAGE_LENGTH,
                                               TOX_MESSAGE_TYPE,
                                               TOX_SECRET_KEY_SIZE,
                                               TOX_USER_STATUS)
@@ -974,6 +988,20 @@ class ToxSuite(unittest.TestCase):
           getattr(self.bob, sSlot+'_cb'):
             LOG.warning(f"self.bob.{sSlot}_cb EXIST")
 
+    @contextlib.contextmanager
+    def fresh_tox(self, thread_safe: bool=False):
+        """A Tox of its own, with the options of the tests, for a test that
+        changes the modes or the state of an instance, so not alice or bob.
+        It is killed when the with block ends."""
+        opts = oToxygenToxOptions(oTOX_OARGS)
+        if thread_safe:
+            opts.contents.experimental_thread_safety = True
+        oTox = Tox(opts, app=oAPP)
+        try:
+            yield oTox
+        finally:
+            oTox.kill()
+
     # tests are executed in order
     def test_notice_log(self): # works
         notice = '/var/lib/tor/.SelekTOR/3xx/cache/9050/notice.log'
@@ -1210,6 +1238,648 @@ class ToxSuite(unittest.TestCase):
         o2 = self.bob.self_get_dht_id()
         assert len(o2) == 64
 
+    def test_self_get_keys_bytes(self): # works
+        """
+        t:self_get_address_bytes
+        t:self_get_public_key_bytes
+        t:self_get_dht_id_bytes
+        t:hash_bytes
+        """
+        o1 = self.alice.self_get_address_bytes()
+        assert len(o1) == ADDR_SIZE // 2
+        assert o1.hex().upper() == self.alice.self_get_address()
+        o2 = self.alice.self_get_public_key_bytes()
+        assert o2 == o1[:len(o2)]
+        o3 = self.alice.self_get_dht_id_bytes()
+        assert o3.hex().upper() == self.alice.self_get_dht_id()
+        assert Tox.hash_bytes(b'x').hex().upper() == Tox.hash(b'x')
+
+    def test_dispatcher(self): # works
+        """
+        t:get_dispatcher
+        """
+        oDispatcher = self.alice.get_dispatcher()
+        def on_message(*largs): pass
+        def on_message2(*largs): pass
+        assert oDispatcher.subscribe('friend_message', on_message) is on_message
+        oDispatcher.subscribe('friend_message', on_message2)
+        assert oDispatcher.handlers('friend_message') == (on_message, on_message2)
+        assert oDispatcher.unsubscribe('friend_message', on_message)
+        assert not oDispatcher.unsubscribe('friend_message', on_message)
+        assert oDispatcher.handlers('friend_message') == (on_message2,)
+        oDispatcher.unsubscribe('friend_message', on_message2)
+
+    def test_events_iterate(self): # works
+        """
+        t:events_iterate
+        """
+        # events mode is for the life of an instance, so not alice or bob
+        with self.fresh_tox() as oTox:
+            try:
+                lRecords = oTox.events_iterate()
+            except ToxError as e:
+                # a libtoxcore before 0.2.19
+                LOG.warning(f"test_events_iterate {e}")
+                return
+            assert oTox.get_dispatcher().events_mode
+            for tRecord in lRecords:
+                assert type(tRecord) == tuple and type(tRecord[0]) == str
+
+    def test_deferred_dispatch(self): # works
+        """
+        t:get_dispatcher
+        """
+        with self.fresh_tox() as oTox:
+            oDispatcher = oTox.get_dispatcher()
+            lSeen = []
+            def on_message(iTox, friend_number, message_type, message, size, *largs):
+                lSeen.append((friend_number, message))
+            oDispatcher.subscribe('friend_message', on_message)
+            oDispatcher.defer(workers=2, size=64)
+            assert oDispatcher.deferred
+            for i in range(30):
+                oDispatcher.fire('friend_message', None, i % 3, 0, b'%d' % i, 2, None)
+            oDispatcher.undefer()
+            assert not oDispatcher.deferred
+            for friend_number in range(3):
+                assert [m for f, m in lSeen if f == friend_number] == \
+                    [b'%d' % i for i in range(30) if i % 3 == friend_number]
+            oStats = oDispatcher.stats()
+            assert oStats.handled == 30 and oStats.dropped == 0 and oStats.depth == 0
+
+    def test_dispatch_pointer_args(self): # works
+        """
+        t:get_dispatcher
+        """
+        with self.fresh_tox() as oTox:
+            oDispatcher = oTox.get_dispatcher()
+            lSeen = []
+            def on_packet(iTox, friend_number, data, length, *largs):
+                lSeen.append((type(data), ctypes.string_at(data, length)))
+            oDispatcher.subscribe('friend_lossless_packet', on_packet)
+            aData = (ctypes.c_uint8 * 4)(160, 1, 2, 3)
+            pData = ctypes.cast(aData, ctypes.POINTER(ctypes.c_uint8))
+            # inline: the pointer
+            oDispatcher.fire('friend_lossless_packet', None, 0, pData, 4, None)
+            # deferred: the bytes, copied before the trampoline returns
+            oDispatcher.defer()
+            oDispatcher.fire('friend_lossless_packet', None, 0, pData, 4, None)
+            oDispatcher.undefer()
+            assert lSeen[0][0] is not bytes and lSeen[1][0] is bytes
+            assert lSeen[0][1] == lSeen[1][1] == bytes([160, 1, 2, 3])
+
+    def test_coalesce_dispatch(self): # works
+        """
+        t:get_dispatcher
+        """
+        with self.fresh_tox() as oTox:
+            oDispatcher = oTox.get_dispatcher()
+            lSeen = []
+            lBatches = []
+            def on_status(iTox, friend_number, connection_status, *largs):
+                lSeen.append((friend_number, connection_status))
+            def on_message(iTox, friend_number, message_type, message, size, *largs):
+                lSeen.append((friend_number, message))
+            oDispatcher.subscribe('friend_connection_status', on_status)
+            oDispatcher.subscribe('friend_message', on_message)
+            oDispatcher.subscribe_batch(lBatches.append)
+            with self.assertRaises(ValueError):
+                oDispatcher.coalesce(events=['friend_message'])
+            oDispatcher.coalesce(window=60.0)
+            assert oDispatcher.coalescing
+            for i in range(30):
+                oDispatcher.fire('friend_connection_status', None, i % 3, i % 2, None)
+            # messages are never held
+            oDispatcher.fire('friend_message', None, 0, 0, b'hi', 2, None)
+            assert lSeen == [(0, b'hi')]
+            oTox.iterate()
+            assert len(lSeen) == 1
+            oDispatcher.uncoalesce()
+            assert not oDispatcher.coalescing
+            assert lSeen[1:] == [(0, 1), (1, 0), (2, 1)]
+            assert lBatches == [[('friend_connection_status', 0, 1),
+                                 ('friend_connection_status', 1, 0),
+                                 ('friend_connection_status', 2, 1)]]
+            oStats = oDispatcher.coalesce_stats
+            assert oStats.received == 30 and oStats.delivered == 3 and oStats.batches == 1
+
+    def test_dispatch_callback(self): # works
+        """
+        t:callback_friend_message
+        """
+        with self.fresh_tox() as oTox:
+            oDispatcher = oTox.get_dispatcher()
+            lSeen = []
+            def on_callback(iTox, friend_number, message_type, message, size, *largs):
+                lSeen.append(('callback', message))
+            def on_message(iTox, friend_number, message_type, message, size, *largs):
+                lSeen.append(('handler', message))
+            # the callback before the handler: with no handler it is
+            # left registered directly, the subscribe hands it back
+            oTox.callback_friend_message(on_callback)
+            assert not oDispatcher.registered('friend_message')
+            oDispatcher.subscribe('friend_message', on_message)
+            assert oDispatcher.registered('friend_message')
+            oDispatcher.fire('friend_message', None, 0, 0, b'a', 1, None)
+            assert lSeen == [('handler', b'a'), ('callback', b'a')]
+            # and after it
+            oTox.callback_friend_message(on_callback)
+            oDispatcher.fire('friend_message', None, 0, 0, b'b', 1, None)
+            assert lSeen[2:] == [('handler', b'b'), ('callback', b'b')]
+            # unsetting the callback leaves the handler
+            oTox.callback_friend_message(None)
+            oDispatcher.fire('friend_message', None, 0, 0, b'c', 1, None)
+            assert lSeen[4:] == [('handler', b'c')]
+
+    def test_events_callback(self): # works
+        """
+        t:callback_friend_message
+        """
+        with self.fresh_tox() as oTox:
+            oDispatcher = oTox.get_dispatcher()
+            # as ToxEvents does, without needing tox_events_iterate
+            oDispatcher.events_mode = True
+            lSeen = []
+            def on_callback(iTox, friend_number, message_type, message, size, *largs):
+                lSeen.append(message)
+            oTox.callback_friend_message(on_callback)
+            assert oTox.friend_message_cb is not None
+            # nothing registered with libtoxcore
+            assert not oDispatcher.registered('friend_message')
+            oDispatcher.fire('friend_message', None, 0, 0, b'hi', 2, None)
+            assert lSeen == [b'hi']
+            oTox.callback_friend_message(None)
+            assert oTox.friend_message_cb is None
+            assert not oDispatcher.registered('friend_message')
+            oDispatcher.fire('friend_message', None, 0, 0, b'hi', 2, None)
+            assert lSeen == [b'hi']
+
+    def test_command_queue(self): # works
+        """
+        t:get_command_queue
+        """
+        with self.fresh_tox() as oTox:
+            oQueue = oTox.get_command_queue()
+            assert oTox.get_command_queue() is oQueue
+            sName = 'command queue'
+            lFutures = []
+            def vSubmit():
+                lFutures.append(oQueue.submit(oTox.self_set_name, sName))
+                lFutures.append(oQueue.submit(oTox.self_get_name))
+                # not a friend: the future gets the exception
+                lFutures.append(oQueue.friend_send_message(
+                    1234, TOX_MESSAGE_TYPE['NORMAL'], 'hi'))
+            oThread = threading.Thread(target=vSubmit)
+            oThread.start()
+            oThread.join()
+            assert len(oQueue) == 3 and not lFutures[0].done()
+            oTox.iterate()
+            assert len(oQueue) == 0
+            assert lFutures[1].result(0) == sName
+            assert lFutures[2].exception(0) is not None
+            oStats = oQueue.stats()
+            assert oStats.submitted == 3 and oStats.executed == 3
+            assert oStats.errors == 1 and oStats.batches == 1
+            assert oQueue.call(oTox.self_get_name) == sName
+
+    def test_command_queue_kill(self): # works
+        """
+        t:get_command_queue
+        """
+        with self.fresh_tox() as oTox:
+            oQueue = oTox.get_command_queue()
+            oFuture = oQueue.submit(oTox.self_get_name)
+        # kill cancels what is queued, and refuses any more
+        assert oFuture.cancelled() and len(oQueue) == 0
+        assert oQueue.closed
+        try:
+            oQueue.submit(oTox.self_get_name)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('submit after kill')
+
+    def test_friend_table(self): # works
+        """
+        t:get_friend_table
+        """
+        with self.fresh_tox() as oTox:
+            oTable = oTox.get_friend_table()
+            assert len(oTable) == 0
+            sKey = self.alice.self_get_public_key()
+            friend_number = oTox.friend_add_norequest(sKey)
+            assert oTable.by_public_key(sKey) == friend_number
+            assert oTable.by_public_key(bytes.fromhex(sKey)) == friend_number
+            assert oTable[friend_number].public_key == bytes.fromhex(sKey)
+            assert oTable[friend_number].connection_status == TOX_CONNECTION['NONE']
+            # the handlers the dispatcher calls
+            oDispatcher = oTox.get_dispatcher()
+            oDispatcher.fire('friend_name', None, friend_number, b'alice', 5, None)
+            oDispatcher.fire('friend_connection_status', None, friend_number,
+                             TOX_CONNECTION['UDP'], None)
+            assert oTable[friend_number].name == 'alice'
+            assert oTable.online() == [friend_number]
+            oTox.friend_delete(friend_number)
+            assert friend_number not in oTable
+            assert oTable.by_public_key(sKey) is None
+
+    def test_friends_snapshot(self): # works
+        """
+        t:friends_snapshot
+        """
+        with self.fresh_tox() as oTox:
+            assert len(oTox.friends_snapshot()) == 0
+            lKeys = [self.alice.self_get_public_key(), self.bob.self_get_public_key()]
+            lNumbers = [oTox.friend_add_norequest(sKey) for sKey in lKeys]
+            oSnapshot = oTox.friends_snapshot()
+            assert list(oSnapshot.friend_numbers) == lNumbers
+            assert oSnapshot.public_keys == b''.join(bytes.fromhex(sKey) for sKey in lKeys)
+            assert oSnapshot.public_key(1) == bytes.fromhex(lKeys[1])
+            assert list(oSnapshot.connection_status) == [TOX_CONNECTION['NONE']] * 2
+            assert len(oSnapshot.online()) == 0
+            # the same from the friend table
+            oTox.get_friend_table()
+            oTable = oTox.friends_snapshot()
+            assert oTable.friend_numbers == oSnapshot.friend_numbers
+            assert oTable.public_keys == oSnapshot.public_keys
+            assert oTable.last_online == oSnapshot.last_online
+
+    def test_friends_add_norequest(self): # works
+        """
+        t:friends_add_norequest
+        """
+        with self.fresh_tox() as oTox:
+            with self.assertRaises(ArgumentError):
+                oTox.friends_add_norequest([self.alice.self_get_public_key(), b'short'])
+            # exact lengths only, in hex as in bytes
+            with self.assertRaises(ArgumentError):
+                oTox.friends_add_norequest([self.alice.self_get_public_key() + '00'])
+            with self.assertRaises(ArgumentError):
+                oTox.friends_add_norequest([bytes.fromhex(self.alice.self_get_public_key()) + b'\0'])
+            assert oTox.self_get_friend_list_size() == 0
+            lSaves = []
+            lKeys = [self.alice.self_get_public_key(),
+                     bytes.fromhex(self.bob.self_get_public_key()),
+                     oTox.self_get_public_key()]
+            # an address, in bytes, is its public key
+            lResults = oTox.friends_add_norequest(lKeys + [oTox.self_get_address_bytes()],
+                                                  save=lambda: lSaves.append(1))
+            assert lResults[0][1] == TOX_ERR_FRIEND_ADD['OK']
+            assert lResults[1][1] == TOX_ERR_FRIEND_ADD['OK']
+            assert lResults[2] == (None, TOX_ERR_FRIEND_ADD['OWN_KEY'])
+            assert lResults[3] == (None, TOX_ERR_FRIEND_ADD['OWN_KEY'])
+            assert oTox.friend_by_public_key(lKeys[0]) == lResults[0][0]
+            assert lSaves == [1]
+            # all already friends: nothing added, nothing saved
+            lResults = oTox.friends_add_norequest(lKeys[:2], save=lambda: lSaves.append(1))
+            assert [iError for friend_number, iError in lResults] == \
+                [TOX_ERR_FRIEND_ADD['ALREADY_SENT']] * 2
+            assert lSaves == [1]
+
+    def test_profile_saver(self): # works
+        """
+        t:get_profile_saver
+        """
+        sFile = os.path.join(tempfile.mkdtemp(), 'profile.tox')
+        with self.fresh_tox() as oTox:
+            oSaver = oTox.get_profile_saver(sFile, debounce=60.0, max_delay=60.0)
+            for i in range(10):
+                oTox.self_set_name(f"saver {i}")
+            oTox.iterate()
+            # within the debounce window: nothing written yet
+            assert oSaver.dirty and not os.path.exists(sFile)
+            assert oSaver.flush(10.0)
+            assert not oSaver.dirty
+            assert os.path.getsize(sFile) == oTox.get_savedata_size()
+            assert oSaver.stats().saves == 1 and oSaver.stats().marks == 10
+            oTox.self_set_status_message('saved by kill')
+        try:
+            assert oSaver.stats().saves == 2
+            with open(sFile, 'rb') as oFd:
+                assert b'saved by kill' in oFd.read()
+        finally:
+            os.unlink(sFile)
+            os.rmdir(os.path.dirname(sFile))
+
+    def test_profile_saver_error(self): # works
+        """
+        t:get_profile_saver
+        """
+        # the directory does not exist: every write fails
+        sFile = os.path.join(tempfile.mkdtemp(), 'missing', 'profile.tox')
+        try:
+            with self.fresh_tox() as oTox:
+                oSaver = oTox.get_profile_saver(sFile, debounce=60.0, max_delay=60.0)
+                oTox.self_set_name('not saved')
+                assert not oSaver.flush(10.0)
+                assert oSaver.stats().errors == 1 and oSaver.dirty
+        finally:
+            os.rmdir(os.path.dirname(os.path.dirname(sFile)))
+
+    def test_long_message(self): # works
+        """
+        t:friend_send_long_message
+        """
+        sMessage = 'long é€😀 ' * 1000
+        data = sMessage.encode('utf-8')
+        lParts = [data[iStart:iEnd] for iStart, iEnd in lFragments(data)]
+        assert b''.join(lParts) == data and len(lParts) > 1
+        for part in lParts:
+            assert len(part) <= TOX_MAX_MESSAGE_LENGTH
+            part.decode('utf-8')
+        oReassembler = MessageReassembler()
+        lResults = [oReassembler.feed(0, TOX_MESSAGE_TYPE['NORMAL'], part) for part in lParts]
+        assert lResults[:-1] == [None] * (len(lParts) - 1)
+        assert lResults[-1] == (TOX_MESSAGE_TYPE['NORMAL'], data)
+        # not a friend: the first fragment fails, and none was queued
+        with self.assertRaises(ArgumentError) as oContext:
+            self.bob.friend_send_long_message(1234, TOX_MESSAGE_TYPE['NORMAL'], sMessage)
+        assert oContext.exception.results == []
+
+    def test_reassembler_instances(self): # works
+        """
+        t:friend_send_long_message
+        """
+        # friend 0 of alice and friend 0 of bob are two senders
+        oReassembler = MessageReassembler(window=0.0)
+        dSeen = {'alice': [], 'bob': []}
+        oReassembler.subscribe(self.alice, lambda *args: dSeen['alice'].append(args))
+        oReassembler.subscribe(self.bob, lambda *args: dSeen['bob'].append(args))
+        try:
+            sPart = 'a' * TOX_MAX_MESSAGE_LENGTH
+            fThen = time.monotonic() - 1.0
+            iNormal = TOX_MESSAGE_TYPE['NORMAL']
+            assert oReassembler.feed((self.alice, 0), iNormal, sPart.encode(), fThen) is None
+            assert oReassembler.feed((self.bob, 0), iNormal, b'b' * len(sPart), fThen) is None
+            assert len(oReassembler) == 2
+            oReassembler.deliver_expired()
+            assert dSeen['alice'] == [(0, iNormal, sPart)]
+            assert dSeen['bob'] == [(0, iNormal, 'b' * len(sPart))]
+        finally:
+            oReassembler.unsubscribe(self.alice)
+            oReassembler.unsubscribe(self.bob)
+
+    def test_group_send_message_argtypes(self): # works
+        """
+        t:group_send_message
+        """
+        # a message_id of the wrong type is refused by the prototype of
+        # tox_group_send_message with ctypes.ArgumentError
+        try:
+            self.bob.group_send_message(1234, TOX_MESSAGE_TYPE['NORMAL'], 'argtypes')
+        except ToxError:
+            # not in that group
+            pass
+
+    def test_outbox(self): # works
+        """
+        t:get_outbox
+        """
+        with self.fresh_tox() as oTox:
+            lDropped = []
+            oOutbox = oTox.get_outbox(max_messages=2, policy='drop_newest', on_drop=lDropped.append)
+            assert oTox.get_outbox() is oOutbox
+            with self.assertRaises(ArgumentError):
+                oOutbox.send(1234, TOX_MESSAGE_TYPE['NORMAL'], '')
+            # before the first iterate nothing is sent: queued
+            lMessages = [oOutbox.send(1234, TOX_MESSAGE_TYPE['NORMAL'], f"outbox {i}") for i in range(3)]
+            assert [oMessage.state for oMessage in lMessages[:2]] == ['queued', 'queued']
+            assert lMessages[2] is None
+            # not a friend: dropped by the iterate, without raising
+            oTox.iterate()
+            assert len(oOutbox) == 0 and len(lDropped) == 2
+            oStats = oOutbox.stats()
+            assert oStats.queued == 2 and oStats.dropped == 3 and oStats.sent == 0 and oStats.bytes == 0
+            with self.assertRaises(ArgumentError):
+                ToxOutbox(oTox, policy='drop_all')
+
+    def test_rate_limiter(self): # works
+        """
+        t:RateLimiter
+        """
+        iSec = 1000000000
+        oLimiter = RateLimiter(rate=2.0, burst=3, max_keys=4)
+        # a burst of 3, then one every half second
+        assert [oLimiter.allow(0, now=0) for i in range(4)] == [True, True, True, False]
+        assert oLimiter.delay(0, now=0) == 0.5
+        assert not oLimiter.allow(0, now=iSec // 4)
+        assert oLimiter.allow(0, now=iSec // 2)
+        assert oLimiter.allow(1, now=iSec // 2)
+        # the least recently used go past max_keys
+        for key in range(2, 10):
+            oLimiter.allow(key, now=iSec)
+        assert len(oLimiter) == 4 and oLimiter.stats().evicted > 0
+        assert oLimiter.prune(now=100 * iSec) == 4
+        lCalls = []
+        callback = limited(lambda pTox, friend_number: lCalls.append(friend_number),
+                           RateLimiter(rate=0.001), key=1, default='limited')
+        assert callback(None, 7) is None and callback(None, 7) == 'limited'
+        callback(None, 8)
+        assert lCalls == [7, 8]
+
+    def test_latency_tracker(self): # works
+        """
+        t:get_latency_tracker
+        """
+        with self.fresh_tox() as oTox:
+            iSec = 1000000000
+            oTracker = oTox.get_latency_tracker(capacity=4, max_age=10.0)
+            assert oTox.get_latency_tracker() is oTracker
+            # the message IDs of a friend wrap round from UINT32_MAX to 0
+            oTracker.sent(1, UINT32_MAX, now=0)
+            oTracker.sent(1, 0, now=iSec)
+            assert oTracker.acked(1, UINT32_MAX, now=iSec // 2) == 0.5
+            assert oTracker.acked(1, 0, now=3 * iSec) == 2.0
+            assert oTracker.acked(1, 0) is None
+            assert oTracker.histogram(1).count == 2 and oTracker.histogram().max == 2.0
+            # past capacity the oldest go, and past max_age the rest
+            for message_id in range(6):
+                oTracker.sent(2, message_id, now=4 * iSec)
+            assert len(oTracker) == 4
+            oTracker.expire(now=20 * iSec)
+            oStats = oTracker.stats()
+            assert oStats.sent == 8 and oStats.acked == 2 and oStats.expired == 6
+            assert oStats.unknown == 1 and oStats.pending == 0
+
+    def test_message_store(self): # works
+        """
+        t:get_message_store
+        """
+        sDir = tempfile.mkdtemp()
+        try:
+            with self.fresh_tox() as oTox:
+                oStore = oTox.get_message_store(sDir, segment_bytes=4096, fsync=False)
+                assert oTox.get_message_store() is oStore
+                key = bytes(range(32))
+                for i in range(200):
+                    oStore.append(dKINDS['friend'], key if i % 2 else bytes(32),
+                                  iSENT if i % 3 else iRECEIVED, TOX_MESSAGE_TYPE['NORMAL'], 0,
+                                  f"stored {i}", timestamp=1000 + i)
+                assert oStore.flush(10.0)
+                # sealed segments, and the current one
+                assert len(oStore.segments()) > 1 and oStore.stats().written == 200
+                lMessages = oStore.history(key, since=1050, until=1060)
+                assert [oMessage.text for oMessage in lMessages] == [f"stored {i}" for i in range(51, 60, 2)]
+                assert len(oStore.history(key.hex())) == 100
+            # opened again: the current segment is read back
+            oStore = MessageStore(sDir, segment_bytes=4096, fsync=False)
+            assert len(oStore.history(key)) == 100
+            oStore.close()
+        finally:
+            shutil.rmtree(sDir)
+
+    def test_message_store_keys(self): # works
+        """
+        t:get_message_store
+        """
+        sDir = tempfile.mkdtemp()
+        try:
+            with self.fresh_tox() as oTox:
+                oStore = oTox.get_message_store(sDir, fsync=False)
+                oDispatcher = oTox.get_dispatcher()
+                oDispatcher.defer()
+                # not a friend: the worker leaves it for the next iterate
+                oDispatcher.fire('friend_message', None, 1234, 0, b'hi', 2, None)
+                oDispatcher.undefer()
+                assert len(oStore._unresolved) == 1
+                # no FriendTable made on the way
+                assert oTox._friends is None
+                # and the iterate drops it, without raising
+                oTox.iterate()
+                assert len(oStore._unresolved) == 0
+        finally:
+            shutil.rmtree(sDir)
+
+    def test_message_store_merge(self): # works
+        """
+        t:MessageStore
+        """
+        sDir = tempfile.mkdtemp()
+        try:
+            oStore = MessageStore(sDir, segment_bytes=4096, rotate_interval=0.05,
+                                  flush_interval=0.01, fsync=False)
+            key = bytes(range(32))
+            for i in range(6):
+                oStore.append(dKINDS['friend'], key, iSENT, TOX_MESSAGE_TYPE['NORMAL'], 0,
+                              f"merged {i}", timestamp=1000 + i)
+                assert oStore.flush(10.0)
+                time.sleep(0.1)
+            # the small sealed segments were merged into new ones
+            assert oStore.stats().compactions > 0
+            assert len(oStore.history(key)) == 6
+            oStore.close()
+            # the index of a merge that a crash stopped before its log
+            sOrphan = os.path.join(sDir, '00009999.idx')
+            with open(sOrphan, 'wb') as oFd:
+                oFd.write(bytes(48))
+            oStore = MessageStore(sDir, segment_bytes=4096, fsync=False)
+            assert not os.path.exists(sOrphan)
+            assert [oMessage.text for oMessage in oStore.history(key)] == \
+                [f"merged {i}" for i in range(6)]
+            oStore.close()
+        finally:
+            shutil.rmtree(sDir)
+
+    def test_async_tox(self): # works
+        """
+        t:AsyncTox
+        """
+        # the streams subscribe to the dispatcher, so not alice or bob
+        async def aRun(oTox):
+            oAsync = AsyncTox(oTox)
+            oStream = oAsync.messages()
+            oAsync.start()
+            await oAsync.wait_iterate()
+            await oAsync.wait_iterate()
+            assert oAsync.iterations >= 2
+            oAsync.stop()
+            assert not oAsync.is_running()
+            assert [tRecord async for tRecord in oStream] == []
+        with self.fresh_tox() as oTox:
+            asyncio.run(aRun(oTox))
+
+    def test_thread_safe(self): # works
+        """
+        t:is_thread_safe
+        """
+        assert not self.alice.is_thread_safe()
+        with self.fresh_tox(thread_safe=True) as oTox:
+            assert oTox.is_thread_safe()
+            def on_message(*largs): pass
+            def vWork():
+                for i in range(100):
+                    oTox.callback_friend_message(on_message)
+                    oTox.self_set_status_message(f"{threading.get_ident()} {i}")
+            lThreads = [threading.Thread(target=vWork) for i in range(4)]
+            for oThread in lThreads:
+                oThread.start()
+            while any(oThread.is_alive() for oThread in lThreads):
+                oTox.iterate()
+            for oThread in lThreads:
+                oThread.join()
+            assert oTox.friend_message_cb is not None
+
+    def test_reactor(self): # works
+        """
+        t:ToxReactor
+        """
+        oReactor = ToxReactor()
+        oReactor.add(self.alice)
+        oReactor.add(self.bob)
+        assert len(oReactor) == 2 and self.alice in oReactor
+        oReactor.start()
+        try:
+            time.sleep(1.0)
+            assert oReactor.remove(self.bob)
+            assert not oReactor.remove(self.bob)
+            assert oReactor.stats(self.alice).iterations > 0
+            assert oReactor.stats(self.alice).lag_max >= 0.0
+        finally:
+            oReactor.stop()
+            oReactor.remove(self.alice)
+
+    def test_pacer(self): # works
+        """
+        t:ToxPacer
+        """
+        # sending from this thread while the pacer iterates needs a thread safe instance
+        with self.fresh_tox(thread_safe=True) as oTox:
+            oPacer = ToxPacer(oTox)
+            oPacer.start()
+            try:
+                for i in range(10):
+                    oPacer.send(oTox.self_set_status_message, f"test_pacer {i}")
+                    time.sleep(0.01)
+                time.sleep(oTox.iteration_interval() / 1000.0 * 2)
+                oStats = oPacer.stats()
+                assert oStats.sends == 10
+                assert oStats.iterations > 0
+                assert 0.0 < oStats.send_p50 <= oStats.send_p99
+            finally:
+                oPacer.stop()
+
+    def test_pool(self): # works
+        """
+        t:ToxPool
+        """
+        sDir = tempfile.mkdtemp()
+        oPool = ToxPool(workers=2, options={'local_discovery_enabled': False})
+        oPool.start()
+        try:
+            lProxies = [oPool.open(f"test_pool{i}", os.path.join(sDir, f"test_pool{i}.tox"), worker=0)
+                        for i in range(3)]
+            sAddress = lProxies[0].self_get_address()
+            assert len(sAddress) == 2 * TOX_ADDRESS_SIZE
+            assert lProxies[1].self_get_friend_list() == []
+            def on_message(*largs): pass
+            lProxies[2].callback_friend_message(on_message)
+            assert oPool.rebalance() == 1
+            assert sorted(oPool.placement().values()) == [0, 0, 1]
+            assert lProxies[0].self_get_address() == sAddress
+        finally:
+            assert oPool.shutdown() == 3
+        assert sorted(os.listdir(sDir)) == [f"test_pool{i}.tox" for i in range(3)]
+
     def test_bob_add_alice_as_friend_norequest(self): # works
         """
         t:friend_delete
@@ -1641,6 +2311,7 @@ class ToxSuite(unittest.TestCase):
         t:self_set_name
         t:friend_get_name
         t:friend_get_name_size
+        t:friend_get_info
         t:on_friend_name
         """
 
@@ -1678,6 +2349,9 @@ class ToxSuite(unittest.TestCase):
               f"{self.bob.friend_get_name(self.baid)} != {NEWNAME}"
             assert self.bob.friend_get_name_size(self.baid) == len(NEWNAME), \
               f"{self.bob.friend_get_name_size(self.baid)} != {len(NEWNAME)}"
+            oInfo = self.bob.friend_get_info(self.baid)
+            assert oInfo.name == NEWNAME, f"{oInfo.name} != {NEWNAME}"
+            assert oInfo.status_message == self.bob.friend_get_status_message(self.baid)
 
         except AssertionError as e:
             LOG.error(f"test_friend_name Failed test {e}")
@@ -2080,6 +2754,26 @@ class ToxSuite(unittest.TestCase):
 
         LOG_INFO(f"test_file_transfer:: self.wait_objs_attr completed")
 
+    def test_get_savedata_into(self): # works
+        """
+        t:get_savedata_into
+        t:write_savedata
+        """
+        iSize = self.alice.get_savedata_size()
+        oBuffer = bytearray(iSize + 16)
+        assert self.alice.get_savedata_into(oBuffer) == iSize
+        try:
+            self.alice.get_savedata_into(bytearray(iSize - 1))
+        except ArgumentError:
+            pass
+        else:
+            assert False, 'get_savedata_into accepted a short buffer'
+        sFile = os.path.join(tempfile.mkdtemp(), 'alice.tox')
+        assert self.alice.write_savedata(sFile) == iSize
+        assert os.path.getsize(sFile) == iSize
+        os.unlink(sFile)
+        os.rmdir(os.path.dirname(sFile))
+
 #?    @unittest.skip('crashes')
     def test_tox_savedata(self): # works sorta
         """